@@ -0,0 +1,103 @@
+import sqlite3
+from os import makedirs, remove
+from os.path import isfile, dirname
+from pathlib import Path
+from threading import Lock
+from .logger import logger
+
+
+class SizeIndex():
+    '''
+    Persistent cache of folder sizes.
+
+    Keys are absolute folder paths, values are sizes in bytes. The index is
+    kept up to date by the writes of the storage object that owns it:
+    changes made by other processes are not seen.
+
+    The index is a SQLite table: a write updates the rows of the folders
+    containing the file, its cost does not grow with the size of the index.
+    '''
+
+
+    def __init__(self, path_index):
+        self.__path_index = Path(str(path_index)).resolve()
+        makedirs(dirname(str(self.__path_index)), exist_ok=True)
+        self.__lock = Lock()
+        try:
+            self.__db = self.__open()
+        except Exception as e:
+            logger.warning("Size index not readable, reset. " + str(e))
+            if isfile(self.__path_index):
+                remove(self.__path_index)
+            self.__db = self.__open()
+
+
+    def __open(self):
+        db = sqlite3.connect(
+            str(self.__path_index), timeout=30.0, check_same_thread=False)
+        try:
+            with db:
+                # The index is a cache: a crash may lose the last writes,
+                # it never leaves it corrupted.
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute("PRAGMA synchronous=NORMAL")
+                db.execute("CREATE TABLE IF NOT EXISTS sizes (path TEXT "
+                    "PRIMARY KEY, size INTEGER) WITHOUT ROWID")
+        except Exception:
+            db.close()
+            raise
+        return db
+
+
+    def __ancestors(self, path):
+        # The path and the folders containing it.
+        output = [path]
+        while path not in ("/", ""):
+            path = dirname(path)
+            output.append(path)
+        return output
+
+
+    def __execute(self, query, args):
+        with self.__lock:
+            try:
+                with self.__db:
+                    return self.__db.execute(query, args).fetchone()
+            except Exception as e:
+                logger.warning("Failed to update the size index. " + str(e))
+
+
+    def get(self, path_full):
+        with self.__lock:
+            row = self.__db.execute("SELECT size FROM sizes WHERE path = ?",
+                (str(path_full),)).fetchone()
+        return None if row is None else row[0]
+
+
+    def set(self, path_full, size):
+        self.__execute("INSERT OR REPLACE INTO sizes VALUES (?, ?)",
+            (str(path_full), int(size)))
+
+
+    def add(self, path_full, delta):
+        # A file of the given path changed by delta bytes: update all the
+        # cached folders that contain it.
+        keys = self.__ancestors(str(path_full))
+        self.__execute("UPDATE sizes SET size = size + ? WHERE path IN (" \
+            + ", ".join(["?"] * len(keys)) + ")", (int(delta),) + tuple(keys))
+
+
+    def invalidate(self, path_full):
+        # Drop every cached folder containing or contained in the path.
+        path_full = str(path_full)
+        keys = self.__ancestors(path_full)
+        prefix = path_full.rstrip("/") + "/"
+        # The paths inside the folder are the ones in [prefix, prefix end).
+        end = prefix[:-1] + chr(ord("/") + 1)
+        self.__execute("DELETE FROM sizes WHERE path IN (" \
+            + ", ".join(["?"] * len(keys)) + ") OR (path >= ? AND path < ?)",
+            tuple(keys) + (prefix, end))
+
+
+    def clear(self):
+        self.__execute("DELETE FROM sizes", ())
@@ -1,11 +1,22 @@
 from abc import ABC, abstractmethod
 import pickle
+import mmap
 from pathlib import Path
-from os import makedirs, chmod, remove, walk, rename
-from os.path import isdir, isfile, getsize, join, islink
-from shutil import copyfile, move, copytree, rmtree
-from re import sub
+from os import makedirs, chmod, remove, scandir, rename, fsync, \
+    open as os_open, close as os_close, O_RDONLY
+from os.path import isdir, isfile, getsize
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from shutil import copyfile, copyfileobj, move, copytree, rmtree
+from contextlib import contextmanager
+from contextvars import ContextVar
+from uuid import uuid4
+from re import sub, fullmatch
+from time import time
+from numpy import load as np_load
 from .logger import logger
+from .size_index import SizeIndex
+from ..utils.glob_pattern import glob_to_regex, glob_literal_prefix
+from ..utils.metrics import Metrics, measured
 from ..storage.storage import Storage
 
 
@@ -28,32 +39,128 @@ def safe_file_path_str(path):
     return path
 
 
-def get_folder_size(start_path = '.'):
-    # This function is copied from:
-    # https://stackoverflow.com/questions/1392413/
-    total_size = 0
-    for dirpath, dirnames, filenames in walk(start_path):
-        for f in filenames:
-            fp = join(dirpath, f)
-            # skip if it is symbolic link
-            if not islink(fp):
-                total_size += getsize(fp)
+def temporary_path(path_full):
+    # The file written before the rename to path_full, in the same folder.
+    return path_full.parent / ("." + path_full.name + ".tmp-" + uuid4().hex)
+
+
+def is_temporary(name):
+    # The files being written by temporary_path, or left by a crash: not
+    # part of the storage.
+    return fullmatch(r"\..+\.tmp-[0-9a-f]{32}", name) is not None
+
+
+def scan_folder(path):
+    # DirEntry caches the file type from the readdir call and the lstat
+    # result after the first call: one syscall per file at most.
+    size = 0
+    folders = []
+    with scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                folders.append(entry.path)
+            elif entry.is_file(follow_symlinks=False) \
+                and not is_temporary(entry.name):
+                size += entry.stat(follow_symlinks=False).st_size
+    return size, folders
+
+
+def remove_temporary(path, float_age):
+    # Remove the temporary files older than float_age seconds below the
+    # folder, recursively: the younger ones may still be written. The
+    # folders not readable are skipped. Returns the files removed.
+    now = time()
+    output = 0
+    folders = [str(path)]
+    while len(folders) > 0:
+        try:
+            with scandir(folders.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        folders.append(entry.path)
+                    elif is_temporary(entry.name) and (now - entry.stat(
+                        follow_symlinks=False).st_mtime > float_age):
+                        remove(entry.path)
+                        output += 1
+        except OSError as e:
+            logger.warning("Failed to clean " + str(path) + ". " + str(e))
+    return output
+
+
+def get_folder_size(start_path='.', int_workers=8):
+    # Symbolic links are skipped. Subfolders are scanned in parallel by a
+    # thread pool, scandir releases the GIL while waiting on the disk.
+    total_size, folders = scan_folder(start_path)
+    if int_workers <= 1:
+        while len(folders) > 0:
+            size, subfolders = scan_folder(folders.pop())
+            total_size += size
+            folders.extend(subfolders)
+        return total_size
+    with ThreadPoolExecutor(max_workers=int_workers) as executor:
+        futures = set([executor.submit(scan_folder, x) for x in folders])
+        while len(futures) > 0:
+            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                size, subfolders = future.result()
+                total_size += size
+                futures.update(
+                    [executor.submit(scan_folder, x) for x in subfolders])
     return total_size
 
 
+def fsync_path(path):
+    fd = os_open(str(path), O_RDONLY)
+    try:
+        fsync(fd)
+    finally:
+        os_close(fd)
+
+
 class StorageDisk(Storage):
 
 
-    def __init__(self, root_path="/"):
+    def __init__(
+        self, 
+        root_path="/", 
+        bool_fsync=True, 
+        path_size_index=None, 
+        int_size_workers=8,
+        float_tmp_age=3600.0
+    ):
+        self.__metrics = Metrics()
         try:
+            self.__config = {
+                "root_path": str(root_path),
+                "bool_fsync": bool(bool_fsync),
+                "path_size_index": None if path_size_index is None \
+                    else str(path_size_index),
+                "int_size_workers": int(int_size_workers),
+                "float_tmp_age": None if float_tmp_age is None \
+                    else float(float_tmp_age)
+            }
             self.__storage_type = "DISK"
             root_path = str(root_path)
             assert root_path[0] == "/", "Root path should start with /."
             root_path = Path(root_path).resolve()
             assert isdir(root_path), "Root folder not found."
             self.__root_path_full = root_path
-            self.__cd_full = root_path
-            self.__cd = Path("/")
+            self.__cwd = (Path("/"), root_path)
+            self.__cwd_var = ContextVar("sdaab_disk_cwd", default=None)
+            self.__bool_fsync = bool(bool_fsync)
+            # Pending writes of the batch of the context, None outside.
+            self.__batch_var = ContextVar("sdaab_disk_batch", default=None)
+            self.__int_size_workers = int(int_size_workers)
+            if path_size_index is None:
+                self.__size_index = None
+            else:
+                self.__size_index = SizeIndex(path_size_index)
+            if float_tmp_age is not None:
+                # The temporary files of the writes cut by a crash.
+                int_removed = remove_temporary(root_path, float(float_tmp_age))
+                if int_removed > 0:
+                    logger.info("Removed " + str(int_removed) \
+                        + " temporary files.")
             self.__initialized = True
             logger.debug("Storage DISK initialized.")
         except Exception as e:
@@ -62,18 +169,35 @@ class StorageDisk(Storage):
             raise ValueError("init failed!")
 
 
+    def __getstate__(self):
+        # Only the configuration and the current directory are pickled, 
+        # the object is initialized again when unpickled.
+        return {"config": self.__config, "cwd": self.__get_cwd()}
+
+
+    def __setstate__(self, state):
+        # The root folder was already cleaned by the pickled object.
+        self.__init__(**dict(state["config"], float_tmp_age=None))
+        self.__config = state["config"]
+        self.__cwd = state["cwd"]
+
+
     def initialized(self):
         return self.__initialized
 
 
+    def metrics(self):
+        return self.__metrics
+
+
     def __path_expand(self, path):
         path = str(path)
         if len(path) == 0:
-            path_full = self.__cd_full
+            path_full = self.__get_cwd()[1]
         elif path[0] == "/":
             path_full = Path(str(self.__root_path_full) + path).resolve()
         else:
-            path_full = (self.__cd_full / path).resolve()
+            path_full = (self.__get_cwd()[1] / path).resolve()
         return path_full
     
 
@@ -83,6 +207,104 @@ class StorageDisk(Storage):
             "Impossible to go beyond the root path."
 
 
+    def __is_pending(self, path_full):
+        pending = self.__batch_var.get()
+        return pending is not None and any(x[1] == path_full for x in pending)
+
+
+    def __write_atomic(self, path_full, writer):
+        # Write to a temporary file in the destination folder, then rename
+        # it: readers never see a partially written file. Inside a batch
+        # the fsync and the rename are deferred to the batch commit.
+        path_full = Path(path_full)
+        assert not self.__is_pending(path_full), \
+            "File already pending in the current batch."
+        pending = self.__batch_var.get()
+        path_tmp = temporary_path(path_full)
+        try:
+            with open(path_tmp, "wb") as f:
+                writer(f)
+                self.__metrics.add_bytes(int_written=f.tell())
+                if self.__bool_fsync and pending is None:
+                    f.flush()
+                    fsync(f.fileno())
+            chmod(path_tmp, 0o777)
+            if pending is not None:
+                pending.append((path_tmp, path_full))
+            else:
+                rename(path_tmp, path_full)
+                if self.__bool_fsync:
+                    fsync_path(path_full.parent)
+                self.__size_index_add(path_full, getsize(path_full))
+        except Exception:
+            if isfile(path_tmp):
+                remove(path_tmp)
+            raise
+
+
+    def __size_index_add(self, path_full, delta):
+        if self.__size_index is not None:
+            self.__size_index.add(path_full, delta)
+
+
+    def __size_index_invalidate(self, path_full):
+        if self.__size_index is not None:
+            self.__size_index.invalidate(path_full)
+
+
+    def __batch_commit(self, pending):
+        if self.__bool_fsync:
+            for path_tmp, _ in pending:
+                fsync_path(path_tmp)
+        folders = set()
+        for path_tmp, path_full in pending:
+            rename(path_tmp, path_full)
+            folders.add(path_full.parent)
+            self.__size_index_add(path_full, getsize(path_full))
+        if self.__bool_fsync:
+            for folder in folders:
+                fsync_path(folder)
+        logger.debug("batch committed: " + str(len(pending)) + " files")
+
+
+    def __batch_rollback(self, pending):
+        for path_tmp, _ in pending:
+            if isfile(path_tmp):
+                remove(path_tmp)
+        logger.debug("batch rolled back: " + str(len(pending)) + " files")
+
+
+    @contextmanager
+    def batch(self):
+        '''
+        Group commit: the writes made inside the context are flushed with 
+        one fsync per file and one fsync per folder, and become visible 
+        together when the context exits. If the context raises, the pending 
+        writes are discarded. Nested batches commit with the outermost one.
+        Only the writes of the context (thread or asyncio task) are part of
+        the batch, the other users of the instance are not affected.
+        '''
+        assert self.__initialized, "Storage not initialized."
+        if self.__batch_var.get() is not None:
+            yield self
+            return
+        pending = []
+        token = self.__batch_var.set(pending)
+        try:
+            yield self
+        except Exception:
+            self.__batch_var.reset(token)
+            self.__batch_rollback(pending)
+            raise
+        self.__batch_var.reset(token)
+        try:
+            self.__batch_commit(pending)
+        except Exception as e:
+            self.__batch_rollback(pending)
+            logger.error("Failed to commit the batch. " + str(e))
+            raise ValueError("batch failed!")
+
+
     def get_type(self):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -93,35 +315,72 @@ class StorageDisk(Storage):
             raise ValueError("get_type failed!")
 
 
+    def __get_cwd(self):
+        # (current directory, full path): the one of the context if set by 
+        # cwd(), otherwise the one of the instance.
+        output = self.__cwd_var.get()
+        return self.__cwd if output is None else output
+
+
+    def __cd_resolve(self, path):
+        path = str(path)
+        path_full = self.__path_expand(path)
+        self.__check_path_full(path_full)
+        assert isdir(path_full), "Current directory not found."
+        if path[0] == "/":
+            path_cd = Path(path).resolve()
+        else:
+            path_cd = Path(str(self.__get_cwd()[0]) + "/" + path).resolve()
+        return (path_cd, path_full)
+
+
+    @measured
     def cd(self, path):
         try:
             assert self.__initialized, "Storage not initialized."
-            path = str(path)
-            path_full = self.__path_expand(path)
-            self.__check_path_full(path_full)
-            assert isdir(path_full), "Current directory not found."
-            self.__cd_full = path_full
-            if path[0] == "/":
-                self.__cd = Path(path).resolve()
+            cwd = self.__cd_resolve(path)
+            if self.__cwd_var.get() is None:
+                self.__cwd = cwd
             else:
-                self.__cd = Path(str(self.__cd) + "/" + path).resolve()
+                self.__cwd_var.set(cwd)
             logger.debug("cd " + str(path) + ": True")
         except Exception as e:
             logger.error("cd failed. " + str(e))
             raise ValueError('cd failed!')
+
+
+    @contextmanager
+    def cwd(self, path):
+        '''
+        Change the current directory only inside the context (thread or 
+        asyncio task), the other users of the instance are not affected.
+        '''
+        try:
+            assert self.__initialized, "Storage not initialized."
+            cwd = self.__cd_resolve(path)
+            logger.debug("cwd " + str(path) + ": True")
+        except Exception as e:
+            logger.error("cwd failed. " + str(e))
+            raise ValueError('cwd failed!')
+        token = self.__cwd_var.set(cwd)
+        try:
+            yield self
+        finally:
+            self.__cwd_var.reset(token)
     
 
     def pwd(self):
         try:
             assert self.__initialized, "Storage not initialized."
-            #logger.debug("pwd full path: " + str(self.__cd_full))
-            logger.debug("pwd: " + str(self.__cd))
-            return str(self.__cd)
+            path_cd = self.__get_cwd()[0]
+            logger.debug("pwd: " + str(path_cd))
+            return str(path_cd)
         except Exception as e:
             logger.error("pwd failed. " + str(e))
             raise ValueError('pwd failed!')
 
 
+    @measured
     def ls(self, path=""):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -129,7 +388,8 @@ class StorageDisk(Storage):
             path_full = self.__path_expand(path)
             self.__check_path_full(path_full)
             assert isdir(path_full), "Folder not found."
-            output = [x.name for x in path_full.iterdir()]
+            output = [x.name for x in path_full.iterdir() \
+                if not is_temporary(x.name)]
             logger.debug("ls " + str(path) + ": " + " ".join(output))
             return output
         except Exception as e:
@@ -137,6 +397,115 @@ class StorageDisk(Storage):
             raise ValueError('ls failed!')
 
 
+    def __ls_iter(self, path_full, bool_details):
+        with scandir(path_full) as it:
+            for entry in it:
+                if is_temporary(entry.name):
+                    continue
+                if not bool_details:
+                    yield entry.name
+                elif entry.is_dir():
+                    yield (entry.name, None, entry.stat().st_mtime)
+                else:
+                    st = entry.stat()
+                    yield (entry.name, st.st_size, st.st_mtime)
+
+
+    @measured
+    def ls_iter(self, path="", page_size=1000, bool_details=False):
+        '''
+        Generator version of ls. With bool_details it yields 
+        (name, size, mtime) tuples, size is None for folders. The page size 
+        is not used: scandir already streams the folder.
+        '''
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path = str(path)
+            path_full = self.__path_expand(path)
+            self.__check_path_full(path_full)
+            assert isdir(path_full), "Folder not found."
+            logger.debug("ls_iter " + str(path) + ": True")
+        except Exception as e:
+            logger.error("Failed to list objects inside the folder. " + str(e))
+            raise ValueError('ls_iter failed!')
+        return self.__ls_iter(path_full, bool_details)
+
+
+    def __path_storage(self, path_full):
+        # From the full path on disk to the path seen by the storage user.
+        root = str(self.__root_path_full)
+        path_full = str(path_full)
+        if root == "/":
+            return path_full
+        output = path_full[len(root):]
+        return output if len(output) > 0 else "/"
+
+
+    def __walk(self, path_full):
+        folders = [str(path_full)]
+        while len(folders) > 0:
+            with scandir(folders.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        folders.append(entry.path)
+                    elif not is_temporary(entry.name):
+                        yield self.__path_storage(entry.path)
+
+
+    @measured
+    def walk(self, path=""):
+        '''
+        Generator of the paths of all the files inside the folder, 
+        recursively. The paths are absolute with respect to the root path.
+        '''
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path = str(path)
+            path_full = self.__path_expand(path)
+            self.__check_path_full(path_full)
+            assert isdir(path_full), "Folder not found."
+            logger.debug("walk " + str(path) + ": True")
+        except Exception as e:
+            logger.error("Failed to walk the folder. " + str(e))
+            raise ValueError('walk failed!')
+        return self.__walk(path_full)
+
+
+    def __glob(self, path_full, regex):
+        for path in self.__walk(path_full):
+            if regex.match(path):
+                yield path
+
+
+    @measured
+    def glob(self, pattern):
+        '''
+        Generator of the paths of the files matching the glob pattern, 
+        see sdaab.utils.glob_pattern. Relative patterns start from the 
+        current directory.
+        '''
+        try:
+            assert self.__initialized, "Storage not initialized."
+            pattern = str(pattern)
+            assert len(pattern) > 0, "Empty pattern."
+            if pattern[0] != "/":
+                pattern = str(self.__get_cwd()[0]) + "/" + pattern
+            pattern = sub('[/]+', '/', pattern)
+            assert ".." not in pattern.split("/"), "Invalid pattern."
+            regex = glob_to_regex(pattern)
+            prefix = glob_literal_prefix(pattern)
+            path_full = self.__path_expand(prefix[:prefix.rfind("/") + 1])
+            self.__check_path_full(path_full)
+            logger.debug("glob " + pattern + ": True")
+        except Exception as e:
+            logger.error("Failed to glob. " + str(e))
+            raise ValueError('glob failed!')
+        if not isdir(path_full):
+            return iter([])
+        return self.__glob(path_full, regex)
+
+
+    @measured
     def exists(self, path):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -151,6 +520,7 @@ class StorageDisk(Storage):
             raise ValueError('exists failed!')
 
 
+    @measured
     def mkdir(self, path):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -168,6 +538,7 @@ class StorageDisk(Storage):
             raise ValueError('mkdir failed!')
 
 
+    @measured
     def upload(self, path_source, path_dest):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -179,15 +550,16 @@ class StorageDisk(Storage):
             assert isfile(path_source), "Source file not found."
             assert not isfile(path_full), "Destination file already exists."
             assert not isdir(path_full), "Destination folder already exists."
-            copyfile(path_source, path_full)
-            assert isfile(path_full), "Destination file check failed."
-            chmod(path_full, 0o777)
+            with open(path_source, "rb") as f_source:
+                self.__write_atomic(
+                    path_full, lambda f: copyfileobj(f_source, f))
             logger.debug("upload " + str(path_dest) + ": True")
         except Exception as e:
             logger.error("Failed to upload. " + str(e))  
             raise ValueError('upload failed!')
 
 
+    @measured
     def download(self, path_source, path_dest):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -202,12 +574,14 @@ class StorageDisk(Storage):
             copyfile(path_full, path_dest)
             assert isfile(path_dest), "Destination file check failed."
             chmod(path_dest, 0o777)
+            self.__metrics.add_bytes(int_read=getsize(path_dest))
             logger.debug("download " + str(path_source) + ": True")
         except Exception as e:
             logger.error("Failed to download. " + str(e)) 
             raise ValueError('download failed!')
 
 
+    @measured
     def rm(self, path):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -218,9 +592,12 @@ class StorageDisk(Storage):
             assert (isdir(path_full) or isfile(path_full)), \
                 "File/folder not found."
             if isfile(path_full):
+                size = getsize(path_full)
                 remove(path_full)
+                self.__size_index_add(path_full, -size)
             else:
                 rmtree(path_full, ignore_errors=True)
+                self.__size_index_invalidate(path_full)
             assert ((not isdir(path_full)) and (not isfile(path_full))), \
                 "File/folder still exists."
             logger.debug("rm " + str(path) + ": True")
@@ -229,6 +606,7 @@ class StorageDisk(Storage):
             raise ValueError('rm failed!')
 
 
+    @measured
     def size(self, path):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -240,8 +618,15 @@ class StorageDisk(Storage):
                 "File/folder not found."
             if isfile(path_full):
                 output = getsize(path_full)
+            elif self.__size_index is None:
+                output = get_folder_size(
+                    path_full, int_workers=self.__int_size_workers)
             else:
-                output = get_folder_size(path_full)
+                output = self.__size_index.get(path_full)
+                if output is None:
+                    output = get_folder_size(
+                        path_full, int_workers=self.__int_size_workers)
+                    self.__size_index.set(path_full, output)
             logger.debug("size " + str(path) + ": " + str(output))
             return output
         except Exception as e:
@@ -249,7 +634,8 @@ class StorageDisk(Storage):
             raise ValueError('size failed!')
 
 
-    def upload_from_memory(self, variable, path):
+    @measured
+    def upload_from_memory(self, variable, path, bool_bin=False):
         try:
             assert self.__initialized, "Storage not initialized."
             path = str(path)
@@ -258,30 +644,59 @@ class StorageDisk(Storage):
             self.__check_path_full(path_full)
             assert not isfile(path_full), "File already exists."
             assert not isdir(path_full), "Folder already exists."
-            pickle.dump(obj=variable, file=open(path_full, "wb"))
-            assert isfile(path_full), "File check failed."
-            chmod(path_full, 0o777)
+            if bool_bin:
+                self.__write_atomic(path_full, lambda f: f.write(variable))
+            else:
+                self.__write_atomic(
+                    path_full, lambda f: pickle.dump(obj=variable, file=f))
             logger.debug("upload_from_memory " + str(path) + ": True")
         except Exception as e:
             logger.error("Failed to upload. " + str(e))  
             raise ValueError('upload_from_memory failed!')
 
 
-    def download_to_memory(self, path):
+    @measured
+    def download_to_memory(self, path, bool_bin=False, mmap_mode=None):
+        '''
+        mmap_mode can be None (read the whole file), "bytes" (return a 
+        read-only memoryview backed by mmap) or "numpy" (return a read-only 
+        numpy.memmap of a .npy payload). With mmap the pages are loaded 
+        lazily and shared through the page cache.
+        '''
         try:
             assert self.__initialized, "Storage not initialized."
+            assert mmap_mode in (None, "bytes", "numpy"), \
+                "Unknown mmap mode."
             path = str(path)
             path = safe_file_path_str(path)
             path_full = self.__path_expand(path)
             self.__check_path_full(path_full)
             assert isfile(path_full), "File not found."
+            if mmap_mode == "numpy":
+                output = np_load(path_full, mmap_mode="r", allow_pickle=False)
+            elif mmap_mode == "bytes":
+                with open(path_full, "rb") as f:
+                    if getsize(path_full) == 0:
+                        output = memoryview(b"")
+                    else:
+                        output = memoryview(
+                            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                        )
+            else:
+                with open(path_full, "rb") as f:
+                    if bool_bin:
+                        output = f.read()
+                    else:
+                        output = pickle.load(file=f)
+            self.__metrics.add_bytes(int_read=getsize(path_full))
             logger.debug("download_to_memory " + str(path) + ": True")
-            return pickle.load(file=open(path_full, "rb"))
+            return output
         except Exception as e:
             logger.error("Failed to download. " + str(e))  
             raise ValueError('download_to_memory failed!')
 
 
+    @measured
     def rename(self, path_source, path_dest):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -299,6 +714,8 @@ class StorageDisk(Storage):
             assert not (isfile(path_dest_full) or isdir(path_dest_full)), \
                 "Destination already exists."
             rename(path_source_full, path_dest_full)
+            self.__size_index_invalidate(path_source_full)
+            self.__size_index_invalidate(path_dest_full)
             assert (isfile(path_dest_full) or isdir(path_dest_full)), \
                 "Destination check failed."
             assert not (isfile(path_source_full) or isdir(path_source_full)), \
@@ -310,6 +727,7 @@ class StorageDisk(Storage):
             raise ValueError('rename failed!')
 
 
+    @measured
     def mv(self, path_source, path_dest):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -325,6 +743,8 @@ class StorageDisk(Storage):
             assert not (isfile(path_dest_full) or isdir(path_dest_full)), \
                 "Destination already exists."
             move(path_source_full, path_dest_full)
+            self.__size_index_invalidate(path_source_full)
+            self.__size_index_invalidate(path_dest_full)
             assert (isfile(path_dest_full) or isdir(path_dest_full)), \
                 "Destination check failed."
             assert not (isfile(path_source_full) or isdir(path_source_full)), \
@@ -336,6 +756,7 @@ class StorageDisk(Storage):
             raise ValueError('mv failed!')
 
 
+    @measured
     def cp(self, path_source, path_dest):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -351,11 +772,13 @@ class StorageDisk(Storage):
             assert not (isfile(path_dest_full) or isdir(path_dest_full)), \
                 "Destination already exists."
             if isfile(path_source_full):
-                copyfile(path_source_full, path_dest_full)
+                with open(path_source_full, "rb") as f_source:
+                    self.__write_atomic(
+                        path_dest_full, lambda f: copyfileobj(f_source, f))
             else:
                 copytree(path_source_full, path_dest_full)
-            assert (isfile(path_dest_full) or isdir(path_dest_full)), \
-                "Destination check failed."
+                self.__size_index_invalidate(path_dest_full)
+                assert isdir(path_dest_full), "Destination check failed."
             assert (isfile(path_source_full) or isdir(path_source_full)), \
                 "Source check failed."
             logger.debug("cp " + str(path_source) + \
@@ -365,6 +788,7 @@ class StorageDisk(Storage):
             raise ValueError('cp failed!')
 
 
+    @measured
     def append(self, path, content):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -373,8 +797,10 @@ class StorageDisk(Storage):
             path_full = self.__path_expand(path)
             self.__check_path_full(path_full)
             assert isfile(path_full), "File not found."
+            size = getsize(path_full)
             with open(path_full, "a") as f:
                 f.write(content)
+            self.__size_index_add(path_full, getsize(path_full) - size)
             logger.debug("append " + str(path) + ": " + str(content))
         except Exception as e:
             logger.error("Failed to append. " + str(e)) 
@@ -0,0 +1,783 @@
+import pickle
+from pathlib import Path
+from os import chmod
+from os.path import isdir, isfile
+from io import BytesIO
+from time import time
+from threading import Lock
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from re import sub
+from numpy import frombuffer, prod
+from numpy.lib.format import read_magic, read_array_header_1_0, \
+    read_array_header_2_0
+from .logger import logger
+from ..utils.glob_pattern import glob_to_regex, glob_literal_prefix
+from ..utils.metrics import Metrics, measured
+from ..storage.storage import Storage
+
+
+def safe_folder_path_str(path):
+    path = str(path)
+    path = sub('[^a-zA-Z0-9-_./]+', '', path)
+    if len(path) > 0:
+        path = path + "/"
+        path = sub('[/]+', '/', path)
+    return path
+
+
+def safe_file_path_str(path):
+    path = Path(path)
+    path_folder = path.parent
+    file_name = path.name
+    path_folder = safe_folder_path_str(path_folder)
+    file_name = sub('[^a-zA-Z0-9-_.]+', '', file_name)
+    path = path_folder + file_name
+    return path
+
+
+def npy_view(data):
+    # Read-only array over the bytes of a .npy payload, without a copy.
+    fp = BytesIO(data)
+    version = read_magic(fp)
+    if version == (1, 0):
+        shape, bool_fortran, dtype = read_array_header_1_0(fp)
+    else:
+        shape, bool_fortran, dtype = read_array_header_2_0(fp)
+    assert not dtype.hasobject, "Object arrays not supported."
+    output = frombuffer(
+        data, dtype=dtype, count=int(prod(shape)), offset=fp.tell())
+    return output.reshape(shape, order="F" if bool_fortran else "C")
+
+
+def parent_name(path_full):
+    # "/a/b" -> ("/a", "b"), "/a" -> ("/", "a").
+    i = path_full.rfind("/")
+    return (path_full[:i] if i > 0 else "/", path_full[i + 1:])
+
+
+def join(path_full, name):
+    return path_full.rstrip("/") + "/" + name
+
+
+class StorageMemory(Storage):
+    '''
+    Storage in the memory of the process, with the paths and the errors
+    of StorageDisk: a scratch tier for intermediate objects and a storage
+    for tests without I/O.
+
+    The files are immutable bytes objects: cp shares them (copy-on-write,
+    an append or an upload writes a new object), download_to_memory with
+    mmap_mode returns read-only views of them. All the methods take the
+    lock of the instance, the generators iterate over a snapshot.
+
+    With int_capacity the bytes stored (a shared object counted once) are
+    bounded: the least recently used files are evicted to make room, or
+    with bool_evict=False the write fails. The folders are never evicted.
+    '''
+
+
+    def __init__(self, int_capacity=None, bool_evict=True):
+        self.__metrics = Metrics()
+        try:
+            self.__storage_type = "MEMORY"
+            assert (int_capacity is None) or (int(int_capacity) > 0), \
+                "Capacity should be positive."
+            self.__int_capacity = None if int_capacity is None \
+                else int(int_capacity)
+            self.__bool_evict = bool(bool_evict)
+            self.__lock = Lock()
+            # Full path of a folder -> mtime, and -> names of its children.
+            self.__folders = {"/": time()}
+            self.__children = {"/": set()}
+            # Full path of a file -> [bytes, mtime], least recently used
+            # first. id of the bytes -> number of files sharing them.
+            self.__files = OrderedDict()
+            self.__refs = {}
+            self.__int_used = 0
+            self.__int_evictions = 0
+            self.__cwd = "/"
+            self.__cwd_var = ContextVar("sdaab_memory_cwd", default=None)
+            self.__initialized = True
+            logger.debug("Storage MEMORY initialized.")
+        except Exception as e:
+            self.__initialized = False
+            logger.error("Initialization failed. " + str(e))
+            raise ValueError("init failed!")
+
+
+    def __getstate__(self):
+        # The content only lives in this process: a copy in a worker
+        # process would silently drop its writes.
+        raise TypeError("StorageMemory cannot be pickled.")
+
+
+    def initialized(self):
+        return self.__initialized
+
+
+    def metrics(self):
+        return self.__metrics
+
+
+    def usage(self):
+        '''
+        Occupation of the storage.
+
+        Returns
+        -------
+        dict
+            {"files", "folders", "bytes" (shared bytes counted once),
+            "capacity" (None if unbounded), "evictions"}.
+        '''
+        with self.__lock:
+            return {
+                "files": len(self.__files),
+                "folders": len(self.__folders),
+                "bytes": self.__int_used,
+                "capacity": self.__int_capacity,
+                "evictions": self.__int_evictions
+            }
+
+
+    def __path_expand(self, path):
+        # The normalized full path. Going beyond the root fails, as on disk.
+        path = str(path)
+        if len(path) == 0:
+            return self.__get_cwd()
+        if path[0] != "/":
+            path = self.__get_cwd() + "/" + path
+        parts = []
+        for x in path.split("/"):
+            if x in ("", "."):
+                continue
+            if x == "..":
+                assert len(parts) > 0, "Impossible to go beyond the root path."
+                parts.pop()
+            else:
+                parts.append(x)
+        return "/" + "/".join(parts)
+
+
+    def __isdir(self, path_full):
+        return path_full in self.__folders
+
+
+    def __isfile(self, path_full):
+        return path_full in self.__files
+
+
+    def __blob_add(self, data):
+        key = id(data)
+        if key in self.__refs:
+            self.__refs[key] += 1
+        else:
+            self.__refs[key] = 1
+            self.__int_used += len(data)
+
+
+    def __blob_remove(self, data):
+        key = id(data)
+        self.__refs[key] -= 1
+        if self.__refs[key] == 0:
+            del self.__refs[key]
+            self.__int_used -= len(data)
+
+
+    def __check_room(self, path_full, data):
+        # Fail before any change if data cannot be stored at path_full.
+        if (self.__int_capacity is None) or (id(data) in self.__refs):
+            return
+        assert len(data) <= self.__int_capacity, \
+            "File larger than the capacity."
+        if self.__bool_evict:
+            return
+        int_freed = 0
+        if path_full in self.__files:
+            data_old = self.__files[path_full][0]
+            if self.__refs[id(data_old)] == 1:
+                int_freed = len(data_old)
+        assert self.__int_used - int_freed + len(data) \
+            <= self.__int_capacity, "Capacity exceeded."
+
+
+    def __make_room(self, data):
+        # Evict the least recently used files until data fits.
+        if (self.__int_capacity is None) or (id(data) in self.__refs):
+            return
+        while self.__int_used + len(data) > self.__int_capacity:
+            path_full = next(iter(self.__files))
+            self.__file_remove(path_full)
+            self.__int_evictions += 1
+            logger.debug("evicted " + path_full)
+
+
+    def __file_put(self, path_full, data):
+        # The path is not a folder. A file at the path is replaced.
+        parent, name = parent_name(path_full)
+        assert parent in self.__folders, "Parent folder not found."
+        self.__check_room(path_full, data)
+        if path_full in self.__files:
+            self.__file_remove(path_full)
+        self.__make_room(data)
+        self.__blob_add(data)
+        self.__files[path_full] = [data, time()]
+        self.__children[parent].add(name)
+
+
+    def __file_get(self, path_full):
+        # The bytes of the file, now the most recently used.
+        self.__files.move_to_end(path_full)
+        return self.__files[path_full][0]
+
+
+    def __file_remove(self, path_full):
+        data = self.__files.pop(path_full)[0]
+        self.__blob_remove(data)
+        parent, name = parent_name(path_full)
+        self.__children[parent].discard(name)
+
+
+    def __makedirs(self, path_full):
+        # Returns the folders made, parents first.
+        output = []
+        parts = [x for x in path_full.split("/") if len(x) > 0]
+        folder = "/"
+        for x in parts:
+            path = join(folder, x)
+            assert path not in self.__files, "A file has the same path."
+            if path not in self.__folders:
+                self.__folders[path] = time()
+                self.__children[path] = set()
+                self.__children[folder].add(x)
+                output.append(path)
+            folder = path
+        return output
+
+
+    def __subtree(self, path_full):
+        # The folders (path_full included) and the files inside a folder.
+        folders = []
+        files = []
+        stack = [path_full]
+        while len(stack) > 0:
+            folder = stack.pop()
+            folders.append(folder)
+            for name in self.__children[folder]:
+                path = join(folder, name)
+                if path in self.__folders:
+                    stack.append(path)
+                else:
+                    files.append(path)
+        return folders, files
+
+
+    def __remove(self, path_full):
+        if path_full in self.__files:
+            self.__file_remove(path_full)
+            return
+        folders, files = self.__subtree(path_full)
+        for path in files:
+            self.__file_remove(path)
+        for path in folders:
+            del self.__folders[path]
+            del self.__children[path]
+        parent, name = parent_name(path_full)
+        self.__children[parent].discard(name)
+
+
+    def __move(self, path_source_full, path_dest_full):
+        # Re-key the file or the folder tree, no data is copied.
+        parent_dest, name_dest = parent_name(path_dest_full)
+        assert parent_dest in self.__folders, "Parent folder not found."
+        if path_source_full in self.__files:
+            entry = self.__files.pop(path_source_full)
+            self.__files[path_dest_full] = entry
+        else:
+            assert not (path_dest_full + "/").startswith(
+                path_source_full + "/"), "Cannot move a folder into itself."
+            folders, files = self.__subtree(path_source_full)
+            n = len(path_source_full)
+            for path in files:
+                self.__files[path_dest_full + path[n:]] = \
+                    self.__files.pop(path)
+            for path in folders:
+                self.__folders[path_dest_full + path[n:]] = \
+                    self.__folders.pop(path)
+                self.__children[path_dest_full + path[n:]] = \
+                    self.__children.pop(path)
+        parent_source, name_source = parent_name(path_source_full)
+        self.__children[parent_source].discard(name_source)
+        self.__children[parent_dest].add(name_dest)
+
+
+    def __copy(self, path_source_full, path_dest_full):
+        # Files share the bytes of the source. A folder is copied whole or
+        # not at all: the room is checked first, the folders made are
+        # removed on failure.
+        if path_source_full in self.__files:
+            self.__file_put(path_dest_full, self.__file_get(path_source_full))
+            return
+        assert not (path_dest_full + "/").startswith(
+            path_source_full + "/"), "Cannot copy a folder into itself."
+        folders, files = self.__subtree(path_source_full)
+        n = len(path_source_full)
+        entries = [(path_dest_full + path[n:], self.__files[path][0]) \
+            for path in files]
+        self.__check_room_all([x[1] for x in entries])
+        made = []
+        try:
+            made.extend(self.__makedirs(path_dest_full))
+            for path in sorted(folders):
+                made.extend(self.__makedirs(path_dest_full + path[n:]))
+            for path, data in entries:
+                self.__file_put(path, data)
+        except Exception:
+            for path in reversed(made):
+                self.__remove(path)
+            raise
+
+
+    def __check_room_all(self, blobs):
+        # The bytes not shared yet fit together, without evicting: the
+        # files of a copy cannot evict each other.
+        if self.__int_capacity is None:
+            return
+        added = dict([(id(x), len(x)) for x in blobs \
+            if id(x) not in self.__refs])
+        int_free = self.__int_capacity if self.__bool_evict \
+            else self.__int_capacity - self.__int_used
+        assert sum(added.values()) <= int_free, "Capacity exceeded."
+
+
+    def get_type(self):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            logger.debug("Storage type: " + self.__storage_type)
+            return self.__storage_type
+        except Exception as e:
+            logger.error("Failed to get the storage type. " + str(e))
+            raise ValueError("get_type failed!")
+
+
+    def __get_cwd(self):
+        # The current directory of the context if set by cwd(), otherwise
+        # the one of the instance.
+        output = self.__cwd_var.get()
+        return self.__cwd if output is None else output
+
+
+    def __cd_resolve(self, path):
+        path_full = self.__path_expand(path)
+        with self.__lock:
+            assert self.__isdir(path_full), "Current directory not found."
+        return path_full
+
+
+    @measured
+    def cd(self, path):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            cwd = self.__cd_resolve(path)
+            if self.__cwd_var.get() is None:
+                self.__cwd = cwd
+            else:
+                self.__cwd_var.set(cwd)
+            logger.debug("cd " + str(path) + ": True")
+        except Exception as e:
+            logger.error("cd failed. " + str(e))
+            raise ValueError('cd failed!')
+
+
+    @contextmanager
+    def cwd(self, path):
+        '''
+        Change the current directory only inside the context (thread or
+        asyncio task), the other users of the instance are not affected.
+        '''
+        try:
+            assert self.__initialized, "Storage not initialized."
+            cwd = self.__cd_resolve(path)
+            logger.debug("cwd " + str(path) + ": True")
+        except Exception as e:
+            logger.error("cwd failed. " + str(e))
+            raise ValueError('cwd failed!')
+        token = self.__cwd_var.set(cwd)
+        try:
+            yield self
+        finally:
+            self.__cwd_var.reset(token)
+
+
+    def pwd(self):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            output = self.__get_cwd()
+            logger.debug("pwd: " + output)
+            return output
+        except Exception as e:
+            logger.error("pwd failed. " + str(e))
+            raise ValueError('pwd failed!')
+
+
+    @measured
+    def ls(self, path=""):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path = str(path)
+            path_full = self.__path_expand(path)
+            with self.__lock:
+                assert self.__isdir(path_full), "Folder not found."
+                output = sorted(self.__children[path_full])
+            logger.debug("ls " + str(path) + ": " + " ".join(output))
+            return output
+        except Exception as e:
+            logger.error("Failed to list objects inside the folder. " + str(e))
+            raise ValueError('ls failed!')
+
+
+    @measured
+    def ls_iter(self, path="", page_size=1000, bool_details=False):
+        '''
+        Generator version of ls, over a snapshot of the folder. With
+        bool_details it yields (name, size, mtime) tuples, size is None for
+        folders. The page size is not used.
+        '''
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path = str(path)
+            path_full = self.__path_expand(path)
+            with self.__lock:
+                assert self.__isdir(path_full), "Folder not found."
+                output = []
+                for name in sorted(self.__children[path_full]):
+                    path_child = join(path_full, name)
+                    if not bool_details:
+                        output.append(name)
+                    elif path_child in self.__folders:
+                        output.append(
+                            (name, None, self.__folders[path_child]))
+                    else:
+                        data, mtime = self.__files[path_child]
+                        output.append((name, len(data), mtime))
+            logger.debug("ls_iter " + str(path) + ": True")
+        except Exception as e:
+            logger.error("Failed to list objects inside the folder. " + str(e))
+            raise ValueError('ls_iter failed!')
+        return iter(output)
+
+
+    @measured
+    def walk(self, path=""):
+        '''
+        Generator of the paths of all the files inside the folder,
+        recursively, over a snapshot. The paths are absolute.
+        '''
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path = str(path)
+            path_full = self.__path_expand(path)
+            with self.__lock:
+                assert self.__isdir(path_full), "Folder not found."
+                output = self.__subtree(path_full)[1]
+            logger.debug("walk " + str(path) + ": True")
+        except Exception as e:
+            logger.error("Failed to walk the folder. " + str(e))
+            raise ValueError('walk failed!')
+        return iter(output)
+
+
+    @measured
+    def glob(self, pattern):
+        '''
+        Generator of the paths of the files matching the glob pattern,
+        see sdaab.utils.glob_pattern. Relative patterns start from the
+        current directory.
+        '''
+        try:
+            assert self.__initialized, "Storage not initialized."
+            pattern = str(pattern)
+            assert len(pattern) > 0, "Empty pattern."
+            if pattern[0] != "/":
+                pattern = self.__get_cwd() + "/" + pattern
+            pattern = sub('[/]+', '/', pattern)
+            assert ".." not in pattern.split("/"), "Invalid pattern."
+            regex = glob_to_regex(pattern)
+            prefix = glob_literal_prefix(pattern)
+            path_full = self.__path_expand(prefix[:prefix.rfind("/") + 1])
+            with self.__lock:
+                files = self.__subtree(path_full)[1] \
+                    if self.__isdir(path_full) else []
+            logger.debug("glob " + pattern + ": True")
+        except Exception as e:
+            logger.error("Failed to glob. " + str(e))
+            raise ValueError('glob failed!')
+        return iter([x for x in files if regex.match(x)])
+
+
+    @measured
+    def exists(self, path):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path = str(path)
+            path_full = self.__path_expand(path)
+            with self.__lock:
+                output = self.__isdir(path_full) or self.__isfile(path_full)
+            logger.debug("exists " + str(path) + ": " + str(output))
+            return output
+        except Exception as e:
+            logger.error("Failed to check the existence. " + str(e))
+            raise ValueError('exists failed!')
+
+
+    @measured
+    def mkdir(self, path):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path = str(path)
+            path = safe_folder_path_str(path)
+            path_full = self.__path_expand(path)
+            with self.__lock:
+                assert not self.__isdir(path_full), \
+                    "Directory already exists."
+                self.__makedirs(path_full)
+            logger.debug("mkdir " + str(path) + ": True")
+        except Exception as e:
+            logger.error("Failed to create the directory. " + str(e))
+            raise ValueError('mkdir failed!')
+
+
+    def __write(self, path_full, data):
+        with self.__lock:
+            assert not self.__isfile(path_full), "File already exists."
+            assert not self.__isdir(path_full), "Folder already exists."
+            self.__file_put(path_full, data)
+        self.__metrics.add_bytes(int_written=len(data))
+
+
+    @measured
+    def upload(self, path_source, path_dest):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path_source = str(path_source)
+            path_dest = str(path_dest)
+            path_dest = safe_file_path_str(path_dest)
+            path_full = self.__path_expand(path_dest)
+            assert isfile(path_source), "Source file not found."
+            with open(path_source, "rb") as f:
+                self.__write(path_full, f.read())
+            logger.debug("upload " + str(path_dest) + ": True")
+        except Exception as e:
+            logger.error("Failed to upload. " + str(e))
+            raise ValueError('upload failed!')
+
+
+    @measured
+    def download(self, path_source, path_dest):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path_source = str(path_source)
+            path_dest = str(path_dest)
+            path_source = safe_file_path_str(path_source)
+            path_full = self.__path_expand(path_source)
+            with self.__lock:
+                assert self.__isfile(path_full), "Source file not found."
+                data = self.__file_get(path_full)
+            assert not isfile(path_dest), "Destination file already exists."
+            assert not isdir(path_dest), "Destination folder already exists."
+            with open(path_dest, "wb") as f:
+                f.write(data)
+            chmod(path_dest, 0o777)
+            self.__metrics.add_bytes(int_read=len(data))
+            logger.debug("download " + str(path_source) + ": True")
+        except Exception as e:
+            logger.error("Failed to download. " + str(e))
+            raise ValueError('download failed!')
+
+
+    @measured
+    def rm(self, path):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path = str(path)
+            path = safe_folder_path_str(path)
+            path_full = self.__path_expand(path)
+            assert path_full != "/", "Impossible to remove the root."
+            with self.__lock:
+                assert self.__isdir(path_full) or self.__isfile(path_full), \
+                    "File/folder not found."
+                self.__remove(path_full)
+            logger.debug("rm " + str(path) + ": True")
+        except Exception as e:
+            logger.error("Failed to remove the file/folder. " + str(e))
+            raise ValueError('rm failed!')
+
+
+    @measured
+    def size(self, path):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path = str(path)
+            path = safe_file_path_str(path)
+            path_full = self.__path_expand(path)
+            with self.__lock:
+                assert self.__isdir(path_full) or self.__isfile(path_full), \
+                    "File/folder not found."
+                if self.__isfile(path_full):
+                    output = len(self.__files[path_full][0])
+                else:
+                    output = sum([len(self.__files[x][0]) for x in \
+                        self.__subtree(path_full)[1]])
+            logger.debug("size " + str(path) + ": " + str(output))
+            return output
+        except Exception as e:
+            logger.error("Failed to get the size. " + str(e))
+            raise ValueError('size failed!')
+
+
+    @measured
+    def upload_from_memory(self, variable, path, bool_bin=False):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path = str(path)
+            path = safe_file_path_str(path)
+            path_full = self.__path_expand(path)
+            if bool_bin:
+                # bytes(x) is x itself for bytes, a copy for mutable buffers.
+                data = bytes(variable)
+            else:
+                data = pickle.dumps(variable)
+            self.__write(path_full, data)
+            logger.debug("upload_from_memory " + str(path) + ": True")
+        except Exception as e:
+            logger.error("Failed to upload. " + str(e))
+            raise ValueError('upload_from_memory failed!')
+
+
+    @measured
+    def download_to_memory(self, path, bool_bin=False, mmap_mode=None):
+        '''
+        mmap_mode can be None (a copy of the content), "bytes" (a read-only
+        memoryview of the stored bytes) or "numpy" (a read-only array over
+        a .npy payload): the views share the memory of the storage, as the
+        mmap of StorageDisk shares the page cache.
+        '''
+        try:
+            assert self.__initialized, "Storage not initialized."
+            assert mmap_mode in (None, "bytes", "numpy"), \
+                "Unknown mmap mode."
+            path = str(path)
+            path = safe_file_path_str(path)
+            path_full = self.__path_expand(path)
+            with self.__lock:
+                assert self.__isfile(path_full), "File not found."
+                data = self.__file_get(path_full)
+            if mmap_mode == "numpy":
+                output = npy_view(data)
+            elif mmap_mode == "bytes":
+                output = memoryview(data)
+            elif bool_bin:
+                output = data
+            else:
+                output = pickle.loads(data)
+            self.__metrics.add_bytes(int_read=len(data))
+            logger.debug("download_to_memory " + str(path) + ": True")
+            return output
+        except Exception as e:
+            logger.error("Failed to download. " + str(e))
+            raise ValueError('download_to_memory failed!')
+
+
+    @measured
+    def rename(self, path_source, path_dest):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path_source = str(path_source)
+            path_dest = str(path_dest)
+            path_source_full = self.__path_expand(path_source)
+            path_dest = safe_file_path_str(path_dest)
+            path_dest_full = self.__path_expand(path_dest)
+            assert parent_name(path_source_full)[0] == \
+                parent_name(path_dest_full)[0], \
+                "Different parent directories."
+            with self.__lock:
+                assert self.__isfile(path_source_full) or \
+                    self.__isdir(path_source_full), \
+                    "Source file/folder not found."
+                assert not (self.__isfile(path_dest_full) or \
+                    self.__isdir(path_dest_full)), \
+                    "Destination already exists."
+                self.__move(path_source_full, path_dest_full)
+            logger.debug("rename " + str(path_source) + \
+                " --> " + str(path_dest))
+        except Exception as e:
+            logger.error("Failed to rename. " + str(e))
+            raise ValueError('rename failed!')
+
+
+    @measured
+    def mv(self, path_source, path_dest):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path_source = str(path_source)
+            path_dest = str(path_dest)
+            path_source_full = self.__path_expand(path_source)
+            path_dest = safe_file_path_str(path_dest)
+            path_dest_full = self.__path_expand(path_dest)
+            assert path_source_full != "/", "Impossible to move the root."
+            with self.__lock:
+                assert self.__isfile(path_source_full) or \
+                    self.__isdir(path_source_full), \
+                    "Source file/folder not found."
+                assert not (self.__isfile(path_dest_full) or \
+                    self.__isdir(path_dest_full)), \
+                    "Destination already exists."
+                self.__move(path_source_full, path_dest_full)
+            logger.debug("mv " + str(path_source) + \
+                " --> " + str(path_dest))
+        except Exception as e:
+            logger.error("Failed to move. " + str(e))
+            raise ValueError('mv failed!')
+
+
+    @measured
+    def cp(self, path_source, path_dest):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path_source = str(path_source)
+            path_dest = str(path_dest)
+            path_source_full = self.__path_expand(path_source)
+            path_dest = safe_file_path_str(path_dest)
+            path_dest_full = self.__path_expand(path_dest)
+            with self.__lock:
+                assert self.__isfile(path_source_full) or \
+                    self.__isdir(path_source_full), \
+                    "Source file/folder not found."
+                assert not (self.__isfile(path_dest_full) or \
+                    self.__isdir(path_dest_full)), \
+                    "Destination already exists."
+                self.__copy(path_source_full, path_dest_full)
+            logger.debug("cp " + str(path_source) + \
+                " --> " + str(path_dest))
+        except Exception as e:
+            logger.error("Failed to copy. " + str(e))
+            raise ValueError('cp failed!')
+
+
+    @measured
+    def append(self, path, content):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path = str(path)
+            path = safe_file_path_str(path)
+            path_full = self.__path_expand(path)
+            content = content.encode("utf-8")
+            with self.__lock:
+                assert self.__isfile(path_full), "File not found."
+                self.__file_put(
+                    path_full, self.__file_get(path_full) + content)
+            logger.debug("append " + str(path) + ": " + str(content))
+        except Exception as e:
+            logger.error("Failed to append. " + str(e))
+            raise ValueError('append failed!')
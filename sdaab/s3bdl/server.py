@@ -0,0 +1,694 @@
+'''
+Reference server of the S3BDL HTTP protocol, backed by a local folder: a
+key is a path relative to the folder, a key ending with / a folder.
+
+Every endpoint is a POST of a form with the secret_key; the answers are
+the texts StorageS3BDL expects ("OK!", "True"/"False", sizes, JSON
+listings). The bodies are streamed: an upload goes to a temporary file
+next to the destination while hashed, then replaces it; a download is
+sent in chunks. Client errors answer 4xx, not retried by the client.
+
+Latency and failures can be injected to exercise the retries, hedging
+and deadlines of the client: a fixed latency plus a random jitter per
+request, a rate of 503 answers (before any side effect) and a rate of
+downloads cut in the middle of the body.
+
+In-process (tests, benchmarks):
+
+    with BDLServer(path_root, secret_key="testing") as server:
+        s = StorageS3BDL(url=server.url(), secret_key="testing")
+
+As a process:
+
+    python -m sdaab.s3bdl.server /data --port 8080 --secret-key testing
+'''
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock
+from urllib.parse import parse_qs
+from argparse import ArgumentParser
+from random import Random
+from time import sleep
+from hashlib import sha256
+from json import dumps
+from pathlib import Path
+from re import compile as re_compile
+from uuid import uuid4
+from os import makedirs, walk, scandir, remove, replace, stat
+from os.path import isdir, isfile, getsize
+from shutil import rmtree, copyfile, copytree, move
+from .logger import logger
+
+
+endpoints = ("exists", "mkdir", "upload", "download", "rm", "size", "ls", \
+    "walk", "rename", "mv", "cp")
+
+int_chunk = 1048576
+
+pattern_tmp = re_compile(r"^\..*\.sdaab-tmp-[0-9a-f]{32}$")
+'''
+Names of the temporary files of the uploads in progress, never listed.
+'''
+
+
+class RequestError(Exception):
+    '''
+    An error of the client: answered with its status, not retried.
+    '''
+
+
+    def __init__(self, message, int_status=400):
+        super().__init__(message)
+        self.int_status = int(int_status)
+
+
+class MultipartReader():
+    '''
+    Streaming parser of a multipart/form-data body. The fields are kept in
+    memory, the file parts are written to fn_file(name, fields) while
+    read: it gets the fields parsed so far (StorageS3BDL sends them before
+    the file) and returns a file object.
+    '''
+
+
+    def __init__(self, rfile, int_length, boundary, fn_file):
+        self.__rfile = rfile
+        self.__int_left = int(int_length)
+        self.__delimiter = b"\r\n--" + boundary
+        self.__fn_file = fn_file
+        # The first boundary has no leading CRLF.
+        self.__buffer = bytearray(b"\r\n")
+
+
+    def __fill(self):
+        if self.__int_left <= 0:
+            raise RequestError("Truncated multipart body.")
+        data = self.__rfile.read(min(int_chunk, self.__int_left))
+        if len(data) == 0:
+            raise RequestError("Truncated multipart body.")
+        self.__int_left -= len(data)
+        self.__buffer += data
+
+
+    def __take(self, int_bytes):
+        while len(self.__buffer) < int_bytes:
+            self.__fill()
+        output = bytes(self.__buffer[:int_bytes])
+        del self.__buffer[:int_bytes]
+        return output
+
+
+    def __headers(self):
+        while True:
+            i = self.__buffer.find(b"\r\n\r\n")
+            if i >= 0:
+                break
+            if len(self.__buffer) > 16384:
+                raise RequestError("Part headers too long.")
+            self.__fill()
+        lines = bytes(self.__buffer[:i]).decode("utf-8").split("\r\n")
+        del self.__buffer[:i + 4]
+        output = {}
+        for line in lines:
+            if ":" in line:
+                k, v = line.split(":", 1)
+                output[k.strip().lower()] = v.strip()
+        return output
+
+
+    def __body(self, fp):
+        # Copy up to the next delimiter, keeping in the buffer the tail
+        # that could be its beginning.
+        int_delimiter = len(self.__delimiter)
+        while True:
+            i = self.__buffer.find(self.__delimiter)
+            if i >= 0:
+                fp.write(bytes(self.__buffer[:i]))
+                del self.__buffer[:i + int_delimiter]
+                return
+            int_safe = len(self.__buffer) - int_delimiter + 1
+            if int_safe > 0:
+                fp.write(bytes(self.__buffer[:int_safe]))
+                del self.__buffer[:int_safe]
+            self.__fill()
+
+
+    def read(self):
+        '''
+        Parse the whole body.
+
+        Returns
+        -------
+        dict
+            The fields, {name: str}; the file parts are not included.
+        '''
+        fields = {}
+        self.__body(Sink())
+        while True:
+            if self.__take(2) == b"--":
+                break
+            headers = self.__headers()
+            disposition = headers.get("content-disposition", "")
+            params = dict([(k.strip(), v.strip().strip('"')) for k, _, v in \
+                [x.partition("=") for x in disposition.split(";")[1:]]])
+            if "name" not in params:
+                raise RequestError("Part without name.")
+            if "filename" in params:
+                self.__body(self.__fn_file(params["name"], fields))
+            else:
+                value = Sink(int_max=65536)
+                self.__body(value)
+                fields[params["name"]] = value.getvalue().decode("utf-8")
+        # The epilogue, if any, is drained for the keep-alive connection.
+        while self.__int_left > 0:
+            self.__int_left -= len(
+                self.__rfile.read(min(int_chunk, self.__int_left)))
+        return fields
+
+
+class Sink():
+    # Bytes written to memory, at most int_max (None: discarded).
+
+
+    def __init__(self, int_max=None):
+        self.__int_max = int_max
+        self.__parts = []
+        self.__int_size = 0
+
+
+    def write(self, data):
+        if self.__int_max is None:
+            return
+        self.__int_size += len(data)
+        if self.__int_size > self.__int_max:
+            raise RequestError("Field too long.")
+        self.__parts.append(data)
+
+
+    def getvalue(self):
+        return b"".join(self.__parts)
+
+
+class Upload():
+    # The temporary file of an upload, hashed while written.
+
+
+    def __init__(self, path):
+        self.path = path
+        self.path_tmp = path.parent / \
+            ("." + path.name + ".sdaab-tmp-" + uuid4().hex)
+        makedirs(path.parent, exist_ok=True)
+        self.__fp = open(self.path_tmp, "wb")
+        self.__sha256 = sha256()
+
+
+    def write(self, data):
+        self.__sha256.update(data)
+        self.__fp.write(data)
+
+
+    def hexdigest(self):
+        return self.__sha256.hexdigest()
+
+
+    def close(self):
+        self.__fp.close()
+
+
+    def discard(self):
+        self.__fp.close()
+        if isfile(self.path_tmp):
+            remove(self.path_tmp)
+
+
+class BDLHandler(BaseHTTPRequestHandler):
+    '''
+    The endpoints, over the folder and the settings of the server.
+    '''
+
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately: without TCP_NODELAY each
+    # keep-alive response waits for the delayed ACK of the client.
+    disable_nagle_algorithm = True
+
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s" % (self.address_string(), format % args))
+
+
+    def __send(self, int_status, body, headers=None):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(int_status)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def __path(self, key):
+        output = (self.server.path_root / str(key).lstrip("/")).resolve()
+        if (output != self.server.path_root) and \
+            (self.server.path_root not in output.parents):
+            raise RequestError("Key beyond the root.")
+        return output
+
+
+    def __form(self):
+        # The fields of the body; the file of an upload is streamed to a
+        # temporary file next to its destination.
+        int_length = int(self.headers.get("Content-Length", 0))
+        content_type = self.headers.get("Content-Type", "")
+        if not content_type.startswith("multipart/form-data"):
+            body = self.rfile.read(int_length)
+            return (dict([(k, v[0]) for k, v in parse_qs(
+                body.decode("utf-8"), keep_blank_values=True).items()]), None)
+        boundary = dict([x.strip().partition("=")[::2] for x in \
+            content_type.split(";")[1:]]).get("boundary", "").strip('"')
+        if len(boundary) == 0:
+            raise RequestError("No multipart boundary.")
+        uploads = []
+
+        def fn_file(name, fields):
+            if (name != "file") or (len(uploads) > 0) or ("key" not in fields):
+                raise RequestError("Unexpected file part.")
+            uploads.append(Upload(self.__path(fields["key"])))
+            return uploads[0]
+
+        try:
+            fields = MultipartReader(
+                self.rfile, int_length, boundary.encode("latin-1"), fn_file
+            ).read()
+        except Exception:
+            for x in uploads:
+                x.discard()
+            raise
+        return (fields, uploads[0] if len(uploads) > 0 else None)
+
+
+    def do_POST(self):
+        endpoint = self.path.strip("/")
+        settings = self.server.settings
+        upload = None
+        try:
+            if settings.draw("float_failure_rate"):
+                # No side effect: the body is not even read.
+                self.close_connection = True
+                return self.__send(503, "Injected failure.",
+                    {"Connection": "close"})
+            settings.wait()
+            form, upload = self.__form()
+            if endpoint == "status":
+                return self.__send(200, "200")
+            if form.get("secret_key") != settings.secret_key:
+                raise RequestError("Forbidden.", 403)
+            if endpoint not in endpoints:
+                raise RequestError("Unknown endpoint.", 404)
+            if endpoint == "upload":
+                return self.__upload(form, upload)
+            getattr(self, "_BDLHandler__" + endpoint)(form)
+        except RequestError as e:
+            self.__send(e.int_status, str(e))
+        except KeyError as e:
+            self.__send(400, "Missing field " + str(e) + ".")
+        except FileNotFoundError:
+            self.__send(404, "Not found.")
+        except (FileExistsError, IsADirectoryError, NotADirectoryError) as e:
+            self.__send(409, "Conflict. " + str(e))
+        except (ConnectionError, TimeoutError):
+            self.close_connection = True
+        except Exception as e:
+            logger.error(endpoint + " failed. " + str(e))
+            self.__send(500, "Internal error.")
+        finally:
+            if upload is not None:
+                upload.discard()
+
+
+    def __exists(self, form):
+        # A key ending with / only matches a folder, otherwise either.
+        path = self.__path(form["key"])
+        output = isdir(path)
+        if not form["key"].endswith("/"):
+            output = output or isfile(path)
+        self.__send(200, str(output))
+
+
+    def __mkdir(self, form):
+        makedirs(self.__path(form["key"]), exist_ok=True)
+        self.__send(200, "OK!")
+
+
+    def __upload(self, form, upload):
+        # A mismatch answers the SHA-256 received: the client sends again.
+        if upload is None:
+            raise RequestError("No file.")
+        upload.close()
+        digest = upload.hexdigest()
+        headers = {"X-Sdaab-Sha256": digest}
+        if form.get("sha256", digest) != digest:
+            return self.__send(400, "Checksum mismatch.", headers)
+        if isdir(upload.path):
+            raise RequestError("Folder already exists.", 409)
+        replace(upload.path_tmp, upload.path)
+        self.server.settings.digests.set(upload.path, digest)
+        self.__send(200, "OK!", headers)
+
+
+    def __download(self, form):
+        path = self.__path(form["key"])
+        with open(path, "rb") as f:
+            int_size = stat(f.fileno()).st_size
+            headers = {}
+            digest = self.server.settings.digests.get(path)
+            if digest is not None:
+                headers["X-Sdaab-Sha256"] = digest
+            self.send_response(200)
+            self.send_header("Content-Length", str(int_size))
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.end_headers()
+            int_cut = None
+            if self.server.settings.draw("float_truncate_rate"):
+                int_cut = int_size // 2
+                self.close_connection = True
+            int_sent = 0
+            while True:
+                n = int_chunk if int_cut is None \
+                    else min(int_chunk, int_cut - int_sent)
+                data = f.read(n) if n > 0 else b""
+                if len(data) == 0:
+                    return
+                self.wfile.write(data)
+                int_sent += len(data)
+
+
+    def __rm(self, form):
+        path = self.__path(form["key"])
+        if path == self.server.path_root:
+            raise RequestError("Impossible to remove the root.")
+        if isfile(path):
+            remove(path)
+        elif isdir(path):
+            rmtree(path)
+        self.__send(200, "OK!")
+
+
+    def __size(self, form):
+        path = self.__path(form["key"])
+        if isfile(path):
+            return self.__send(200, str(getsize(path)))
+        if not isdir(path):
+            raise FileNotFoundError(form["key"])
+        output = 0
+        for folder, _, files in walk(path):
+            output += sum([getsize(Path(folder) / x) for x in files \
+                if not pattern_tmp.match(x)])
+        self.__send(200, str(output))
+
+
+    def __ls(self, form):
+        # One page of the names in the folder, after marker.
+        path = self.__path(form["key"])
+        marker = form.get("marker", "")
+        entries = sorted([x for x in scandir(path) if (x.name > marker) \
+            and not pattern_tmp.match(x.name)], key=lambda x: x.name)
+        int_max_keys = int(form.get("max_keys", 1000))
+        page = entries[:int_max_keys]
+        self.__send(200, dumps({
+            "ls": [x.name for x in page],
+            "sizes": [None if x.is_dir() else x.stat().st_size for x in page],
+            "mtimes": [int(x.stat().st_mtime) for x in page],
+            "next_marker": page[-1].name if len(entries) > int_max_keys \
+                else None
+        }))
+
+
+    def __walk(self, form):
+        # One page of all the keys starting with the prefix, folders
+        # included, sorted, after marker.
+        prefix = form["key"]
+        path = self.__path(prefix[:prefix.rfind("/") + 1])
+        marker = form.get("marker", "")
+        keys = []
+        for folder, folders, files in walk(path):
+            relative = str(Path(folder).relative_to(self.server.path_root))
+            relative = "" if relative == "." else relative + "/"
+            keys += [[relative + x + "/", None, None] for x in folders]
+            for x in files:
+                if pattern_tmp.match(x):
+                    continue
+                s = stat(Path(folder) / x)
+                keys.append([relative + x, s.st_size, int(s.st_mtime)])
+        keys = sorted([x for x in keys \
+            if x[0].startswith(prefix) and (x[0] > marker)])
+        int_max_keys = int(form.get("max_keys", 1000))
+        page = keys[:int_max_keys]
+        self.__send(200, dumps({
+            "keys": page,
+            "next_marker": page[-1][0] if len(keys) > int_max_keys else None
+        }))
+
+
+    def __rename(self, form):
+        path_old = self.__path(form["key_old"])
+        path_new = self.__path(form["key_new"])
+        if not (isfile(path_old) or isdir(path_old)):
+            raise FileNotFoundError(form["key_old"])
+        makedirs(path_new.parent, exist_ok=True)
+        move(path_old, path_new)
+        self.__send(200, "OK!")
+
+
+    def __mv(self, form):
+        self.__rename(form)
+
+
+    def __cp(self, form):
+        path_old = self.__path(form["key_old"])
+        path_new = self.__path(form["key_new"])
+        makedirs(path_new.parent, exist_ok=True)
+        if isdir(path_old):
+            copytree(path_old, path_new)
+        else:
+            copyfile(path_old, path_new)
+        self.__send(200, "OK!")
+
+
+class Digests():
+    # SHA-256 of the uploaded files, valid while their size and mtime do
+    # not change: a file written otherwise is served without it.
+
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.__digests = {}
+
+
+    def set(self, path, digest):
+        s = stat(path)
+        with self.__lock:
+            self.__digests[str(path)] = (s.st_size, s.st_mtime_ns, digest)
+
+
+    def get(self, path):
+        with self.__lock:
+            item = self.__digests.get(str(path))
+        if item is None:
+            return None
+        s = stat(path)
+        if (s.st_size, s.st_mtime_ns) != item[:2]:
+            return None
+        return item[2]
+
+
+class Settings():
+    # Secret key and fault injection of a server, shared by its handlers.
+
+
+    def __init__(
+        self,
+        secret_key,
+        float_latency,
+        float_jitter,
+        float_failure_rate,
+        float_truncate_rate,
+        int_seed
+    ):
+        self.secret_key = str(secret_key)
+        self.float_latency = float(float_latency)
+        self.float_jitter = float(float_jitter)
+        self.float_failure_rate = float(float_failure_rate)
+        self.float_truncate_rate = float(float_truncate_rate)
+        self.digests = Digests()
+        self.__random = Random(int_seed)
+        self.__lock = Lock()
+
+
+    def draw(self, str_rate):
+        float_rate = getattr(self, str_rate)
+        if float_rate <= 0:
+            return False
+        with self.__lock:
+            return self.__random.random() < float_rate
+
+
+    def wait(self):
+        float_seconds = self.float_latency
+        if self.float_jitter > 0:
+            with self.__lock:
+                float_seconds += self.__random.uniform(0, self.float_jitter)
+        if float_seconds > 0:
+            sleep(float_seconds)
+
+
+class BDLServer():
+    '''
+    A BDL server over path_root, one thread per connection.
+
+    Parameters
+    ----------
+    path_root : str
+        The folder served, created if missing.
+    secret_key : str, optional
+        The key the clients send, by default "testing"
+    host : str, optional
+        The address to bind, by default "127.0.0.1"
+    port : int, optional
+        The port, by default 0 (a free one, see url())
+    float_latency : float, optional
+        Seconds added to each request, by default 0.0
+    float_jitter : float, optional
+        Maximum random seconds added on top, by default 0.0
+    float_failure_rate : float, optional
+        Fraction of the requests answered 503, by default 0.0
+    float_truncate_rate : float, optional
+        Fraction of the downloads cut in the middle, by default 0.0
+    int_seed : int, optional
+        Seed of the fault injection, by default None
+    '''
+
+
+    def __init__(
+        self,
+        path_root,
+        secret_key="testing",
+        host="127.0.0.1",
+        port=0,
+        float_latency=0.0,
+        float_jitter=0.0,
+        float_failure_rate=0.0,
+        float_truncate_rate=0.0,
+        int_seed=None
+    ):
+        try:
+            assert 0 <= float(float_failure_rate) < 1, \
+                "Failure rate out of range."
+            assert 0 <= float(float_truncate_rate) < 1, \
+                "Truncate rate out of range."
+            assert (float(float_latency) >= 0) and (float(float_jitter) >= 0), \
+                "Latency out of range."
+            path_root = Path(str(path_root))
+            makedirs(path_root, exist_ok=True)
+            self.__server = ThreadingHTTPServer((host, int(port)), BDLHandler)
+            self.__server.daemon_threads = True
+            self.__server.path_root = path_root.resolve()
+            self.__server.settings = Settings(
+                secret_key,
+                float_latency,
+                float_jitter,
+                float_failure_rate,
+                float_truncate_rate,
+                int_seed
+            )
+            self.__thread = None
+            logger.debug("BDL server on " + str(path_root) + " initialized.")
+        except Exception as e:
+            logger.error("Initialization failed. " + str(e))
+            raise ValueError("init failed!")
+
+
+    def __enter__(self):
+        return self.start()
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def settings(self):
+        '''
+        The fault injection settings, can be changed while serving
+        (float_latency, float_jitter, float_failure_rate,
+        float_truncate_rate).
+        '''
+        return self.__server.settings
+
+
+    def url(self):
+        host, port = self.__server.server_address[:2]
+        return "http://" + host + ":" + str(port) + "/"
+
+
+    def start(self):
+        # Serve from a thread of the calling process.
+        if self.__thread is None:
+            self.__thread = Thread(
+                target=self.__server.serve_forever, daemon=True)
+            self.__thread.start()
+        return self
+
+
+    def serve_forever(self):
+        self.__server.serve_forever()
+
+
+    def close(self):
+        if self.__thread is not None:
+            self.__server.shutdown()
+            self.__thread.join()
+            self.__thread = None
+        self.__server.server_close()
+
+
+def main(args=None):
+    parser = ArgumentParser(
+        prog="python -m sdaab.s3bdl.server",
+        description="Reference S3BDL server over a local folder.")
+    parser.add_argument("path_root", help="the folder served")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--secret-key", default="testing")
+    parser.add_argument("--latency", type=float, default=0.0,
+        help="seconds added to each request")
+    parser.add_argument("--jitter", type=float, default=0.0,
+        help="maximum random seconds added on top")
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+        help="fraction of the requests answered 503")
+    parser.add_argument("--truncate-rate", type=float, default=0.0,
+        help="fraction of the downloads cut in the middle")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(args)
+    server = BDLServer(
+        args.path_root,
+        secret_key=args.secret_key,
+        host=args.host,
+        port=args.port,
+        float_latency=args.latency,
+        float_jitter=args.jitter,
+        float_failure_rate=args.failure_rate,
+        float_truncate_rate=args.truncate_rate,
+        int_seed=args.seed
+    )
+    print("Serving " + args.path_root + " on " + server.url())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
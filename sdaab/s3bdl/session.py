@@ -0,0 +1,28 @@
+from threading import local
+from requests import Session
+
+
+sessions = local()
+
+
+def get_session(url):
+    '''
+    The HTTP session of the calling thread for the given endpoint. All the 
+    storage objects of the thread pointing at the same endpoint share it, 
+    and with it the keep-alive connections.
+
+    Parameters
+    ----------
+    url : str
+        The endpoint URL.
+
+    Returns
+    -------
+    requests.Session
+        The shared session, only to be used by the calling thread.
+    '''
+    if not hasattr(sessions, "by_url"):
+        sessions.by_url = {}
+    if url not in sessions.by_url:
+        sessions.by_url[url] = Session()
+    return sessions.by_url[url]
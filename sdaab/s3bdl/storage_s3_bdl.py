@@ -2,16 +2,33 @@ from abc import ABC, abstractmethod
 import pickle
 from pathlib import Path
 from os.path import isdir, isfile
-from os import stat
+from os import stat, remove
 from re import sub
+from contextlib import contextmanager
+from contextvars import ContextVar
 from io import BytesIO
+from hashlib import sha256
 from filechunkio import FileChunkIO
 from numpy import unique
 from math import ceil
-from requests import post
 from json import loads as jloads
+from functools import wraps
+from threading import Lock
+from requests.exceptions import ConnectionError as RequestsConnectionError
+from requests.exceptions import Timeout as RequestsTimeout
+from requests.exceptions import ChunkedEncodingError
+from requests.exceptions import ConnectTimeout as RequestsConnectTimeout
+from urllib3.exceptions import NewConnectionError
 from .logger import logger
-from ..storage.storage import Storage
+from .session import get_session
+from ..utils.glob_pattern import glob_to_regex, glob_literal_prefix
+from ..utils.retry import RetryPolicy, RetryableError, Hedger
+from ..utils.retry import statuses_retryable
+from ..utils.deadline import deadline, request_timeout
+from ..utils.metrics import Metrics, measured
+from ..utils.write_behind import path_argument
+from ..utils.caches import RemoteCaches
+from ..storage.remote import RemoteStorage
 
 
 def safe_folder_path_str(path):
@@ -33,16 +50,76 @@ def safe_file_path_str(path):
     return path
 
 
-class StorageS3BDL(Storage):
+def request_unsent(e):
+    # The connection failed before the request was sent: even a request
+    # that is not idempotent can be sent again.
+    if isinstance(e, RequestsConnectTimeout):
+        return True
+    reason = getattr(e.args[0] if len(e.args) > 0 else None, "reason", None)
+    return isinstance(reason, NewConnectionError)
+
+
+class StorageS3BDL(RemoteStorage):
+
+
+    def __bounded(method):
+        # Run the method within the default deadline of the instance.
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with deadline(self.__float_deadline):
+                return method(self, *args, **kwargs)
+        return wrapper
+
+
+    def __settled(method):
+        # With write-behind, wait for the queued writes below the path 
+        # (first argument) before the method.
+        fn_path = path_argument(method)
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            self.__settle(fn_path(self, *args, **kwargs))
+            return method(self, *args, **kwargs)
+        return wrapper
 
 
     def __init__(
         self, 
         url,
         secret_key,
-        root_path="/"
+        root_path="/",
+        bool_implicit_dirs=False,
+        bool_lazy=False,
+        retry_policy=None,
+        float_hedge_percentile=None,
+        float_timeout=60.0,
+        float_deadline=None,
+        int_write_behind=None,
+        int_write_behind_workers=4,
+        int_prefetch_depth=None,
+        int_prefetch_bytes=67108864,
+        path_prefetch=None,
+        path_inventory=None,
+        float_inventory_age=3600.0
     ):
+        self.__metrics = Metrics()
         try:
+            self.__config = {
+                "url": url,
+                "secret_key": secret_key,
+                "root_path": root_path,
+                "bool_implicit_dirs": bool_implicit_dirs,
+                "retry_policy": retry_policy,
+                "float_hedge_percentile": float_hedge_percentile,
+                "float_timeout": float_timeout,
+                "float_deadline": float_deadline,
+                "int_write_behind": int_write_behind,
+                "int_write_behind_workers": int_write_behind_workers,
+                "int_prefetch_depth": int_prefetch_depth,
+                "int_prefetch_bytes": int_prefetch_bytes,
+                "path_prefetch": path_prefetch,
+                "path_inventory": path_inventory,
+                "float_inventory_age": float_inventory_age
+            }
             self.__storage_type = "S3BDL"
             root_path = str(root_path)
             assert len(root_path) > 0, "No root path provided."
@@ -51,13 +128,55 @@ class StorageS3BDL(Storage):
             if root_path[-1] != "/":
                 root_path = root_path + "/"
             self.__root_path_full = root_path
-            self.__cd_full = root_path
-            self.__cd = "/"
+            self.__cwd = ("/", root_path)
+            self.__cwd_var = ContextVar("sdaab_s3bdl_cwd", default=None)
             self.__url = str(url)
             if self.__url[-1] != "/":
-                self.__url  = self.__url[-1] + "/"
+                self.__url  = self.__url + "/"
             self.__secret_key = str(secret_key)
-            assert post(self.__url+"status/").text == '200'
+            self.__bool_implicit_dirs = bool(bool_implicit_dirs)
+            # Guarded by the lock: ls, exists and the writes may run in
+            # several threads.
+            self.__dirs_known = set()
+            self.__dirs_lock = Lock()
+            if retry_policy is None:
+                retry_policy = RetryPolicy()
+            self.__retry = retry_policy
+            if float_hedge_percentile is None:
+                self.__hedger = None
+            else:
+                self.__hedger = Hedger(float_percentile=float_hedge_percentile)
+            self.__float_timeout = None if float_timeout is None \
+                else float(float_timeout)
+            self.__float_deadline = None if float_deadline is None \
+                else float(float_deadline)
+            self.__validated = False
+            if not bool_lazy:
+                self.__validate()
+            self.__dirs_add(self.__rm_lead_slash(self.__root_path_full))
+            # With int_write_behind (bytes) upload_from_memory only queues
+            # the write, see flush. With int_prefetch_depth 
+            # download_to_memory is served by the reads done ahead, see 
+            # prefetch and warm. The misses of exists are answered 
+            # locally, see build_negative_cache. With path_inventory (a 
+            # SQLite file) the calls on the keys scanned less than 
+            # float_inventory_age seconds ago are answered by a local index, 
+            # see refresh_inventory.
+            self.__caches = RemoteCaches(
+                self.__put_behind,
+                lambda key: self.__get_bounded(key, False),
+                self.__list_bounded,
+                self.__keys_iter,
+                int_write_behind=int_write_behind,
+                int_write_behind_workers=int_write_behind_workers,
+                int_prefetch_depth=int_prefetch_depth,
+                int_prefetch_bytes=int_prefetch_bytes,
+                path_prefetch=path_prefetch,
+                path_inventory=path_inventory,
+                float_inventory_age=float_inventory_age
+            )
+            RemoteStorage.__init__(self, self.__caches, self.__key, 
+                self.__check_folder, self.__float_deadline)
             self.__initialized = True
             logger.debug("Storage S3BDL initialized.")
         except Exception as e:
@@ -66,21 +185,163 @@ class StorageS3BDL(Storage):
             raise ValueError("init failed!")
 
 
+    def __getstate__(self):
+        # Only the configuration and the current directory are pickled, 
+        # the unpickled object connects lazily (e.g. in a worker process).
+        return {"config": self.__config, "cwd": self.__get_cwd()}
+
+
+    def __setstate__(self, state):
+        self.__init__(**state["config"], bool_lazy=True)
+        self.__cwd = state["cwd"]
+
+
+    def __validate(self):
+        # With bool_lazy the status check happens at the first call.
+        assert self.__post("status/").text == '200', "Status check failed."
+        self.__validated = True
+
+
+    def __post(
+        self, 
+        endpoint, 
+        data=None, 
+        files=None, 
+        bool_hedged=False, 
+        fn_read=None,
+        bool_idempotent=True
+    ):
+        # One request, retried by the policy on connection errors and 
+        # retryable statuses. Files are rewound before each attempt. The 
+        # timeout is cut to the remaining budget of the deadline. Only 
+        # idempotent reads can be hedged. With fn_read the body is 
+        # streamed to fn_read(response) within the attempt, and its output 
+        # returned. Without bool_idempotent (mv, rename, cp) only the
+        # requests never sent are retried: a timeout or a 5xx may come
+        # after the server did the move.
+        if (not self.__validated) and (endpoint != "status/"):
+            self.__validate()
+
+        def attempt():
+            self.__metrics.request(endpoint)
+            for f in (files or {}).values():
+                if hasattr(f, "seek"):
+                    f.seek(0)
+            try:
+                response = get_session(self.__url).post(
+                    url=self.__url+endpoint, 
+                    data=data,
+                    files=files,
+                    timeout=request_timeout(self.__float_timeout),
+                    stream=fn_read is not None
+                )
+            except (RequestsConnectionError, RequestsTimeout) as e:
+                if bool_idempotent or request_unsent(e):
+                    raise RetryableError(str(e))
+                raise
+            if bool_idempotent \
+                and (response.status_code in statuses_retryable):
+                response.close()
+                raise RetryableError(
+                    endpoint + " status " + str(response.status_code) + ".", 
+                    response.status_code
+                )
+            if fn_read is None:
+                return response
+            try:
+                return fn_read(response)
+            except (RequestsConnectionError, RequestsTimeout, \
+                ChunkedEncodingError) as e:
+                raise RetryableError(str(e))
+            finally:
+                response.close()
+
+        if bool_hedged and (self.__hedger is not None):
+            return self.__retry.call(
+                lambda: self.__hedger.call(attempt, endpoint), endpoint)
+        return self.__retry.call(attempt, endpoint)
+
+
+    def __upload(self, key, content):
+        # content is bytes or a binary file, hashed in chunks and sent from 
+        # the file (rewound at each attempt), not from a copy in memory. 
+        # The SHA-256 of the content is sent with it: a server verifying 
+        # it answers with the one it computed, a mismatch is sent again.
+        if hasattr(content, "read"):
+            h = sha256()
+            for chunk in iter(lambda: content.read(1048576), b""):
+                h.update(chunk)
+            digest = h.hexdigest()
+        else:
+            digest = sha256(content).hexdigest()
+
+        def read(response):
+            received = response.headers.get("X-Sdaab-Sha256")
+            if (received is not None) and (received != digest):
+                raise RetryableError("Checksum mismatch of " + key + ".")
+            return response.text
+
+        output = self.__post(
+            "upload/", 
+            data={
+                "key": key, 
+                "secret_key": self.__secret_key, 
+                "sha256": digest
+            },
+            files={'file': content},
+            fn_read=read
+        )
+        assert output == "OK!", "Post call failed."
+
+
+    def __download(self, key, fp=None):
+        # The body is hashed while streamed, into fp if given (rewound at 
+        # each attempt), otherwise returned. The SHA-256 stored by the 
+        # server, if any, must match: a mismatch is downloaded again.
+        def read(response):
+            if fp is not None:
+                fp.seek(0)
+                fp.truncate()
+            h = sha256()
+            chunks = []
+            for chunk in response.iter_content(chunk_size=1048576):
+                h.update(chunk)
+                if fp is None:
+                    chunks.append(chunk)
+                else:
+                    fp.write(chunk)
+            expected = response.headers.get("X-Sdaab-Sha256")
+            if (expected is not None) and (expected != h.hexdigest()):
+                raise RetryableError("Checksum mismatch of " + key + ".")
+            return b"".join(chunks)
+
+        return self.__post(
+            "download/", 
+            data={"key": key, "secret_key": self.__secret_key},
+            bool_hedged=fp is None,
+            fn_read=read
+        )
+
+
     def initialized(self):
         return self.__initialized
 
 
+    def metrics(self):
+        return self.__metrics
+
+
     def __path_expand(self, path, bool_file=True):
         path = str(path)
         if len(path) == 0:
             assert not bool_file, "Not a file."
-            path_full = self.__cd_full
+            path_full = self.__get_cwd()[1]
         elif path[0] == "/":
             path_full = str(Path(self.__root_path_full + path).resolve())
             if not bool_file:
                 path_full = path_full + "/"
         else:
-            path_full = str((Path(self.__cd_full) / path).resolve())
+            path_full = str((Path(self.__get_cwd()[1]) / path).resolve())
             if not bool_file:
                 path_full = path_full + "/"
         assert path_full.startswith(str(self.__root_path_full)), \
@@ -88,6 +349,15 @@ class StorageS3BDL(Storage):
         return path_full
     
 
+    def __key(self, path, bool_file=True):
+        # The key of a file or a folder of the storage.
+        path = str(path)
+        if bool_file:
+            path = safe_file_path_str(path)
+        return self.__rm_lead_slash(
+            self.__path_expand(path, bool_file=bool_file))
+
+
     def __rm_lead_slash(self, path):
         if path[0] == "/":
             return path[1:]
@@ -96,15 +366,74 @@ class StorageS3BDL(Storage):
     
 
     def __exists(self, key):
-        return post(
-            url=self.__url+"exists/",
+        return self.__post(
+            "exists/",
             data={
                 "secret_key": self.__secret_key,
                 "key": key
-            }
+            },
+            bool_hedged=True
         ).text == 'True'
 
     
+    def __dirs_add(self, key):
+        # Cache the folders containing the key (the key itself if it ends 
+        # with /), only used with implicit directories.
+        if not self.__bool_implicit_dirs:
+            return
+        folders = []
+        i = key.find("/")
+        while i >= 0:
+            folders.append(key[:i+1])
+            i = key.find("/", i + 1)
+        with self.__dirs_lock:
+            self.__dirs_known.update(folders)
+
+
+    def __dirs_forget(self, prefix):
+        if not self.__bool_implicit_dirs:
+            return
+        with self.__dirs_lock:
+            self.__dirs_known.difference_update(
+                [x for x in self.__dirs_known if x.startswith(prefix)])
+
+
+    def __dirs_knows(self, key):
+        with self.__dirs_lock:
+            return key in self.__dirs_known
+
+
+    def __exists_folder(self, key):
+        # The key ends with /. With implicit directories a folder exists 
+        # if any key starts with it: the answer comes from the cache of 
+        # known folders or from a walk/ page of one key.
+        if not self.__bool_implicit_dirs:
+            return self.__exists(key)
+        key = self.__rm_lead_slash(key) if len(key) > 0 else key
+        if (key == "") or self.__dirs_knows(key):
+            return True
+        post_data = {
+            "key": key, 
+            "secret_key": self.__secret_key,
+            "marker": "",
+            "max_keys": 1
+        }
+        output = len(jloads(self.__post(
+            "walk/", 
+            data=post_data
+        ).text)["keys"]) > 0
+        if output:
+            self.__dirs_add(key)
+        return output
+
+    
+    @__bounded
+    def __check_folder(self, key):
+        # A folder to scan, "" for the whole bucket.
+        if len(key) > 0:
+            assert self.__exists_folder(key), "Folder not found."
+
+
     def __exists_parent(self, key):
         if (key == "/") or (key == ""):
             return True
@@ -112,7 +441,20 @@ class StorageS3BDL(Storage):
         if key_parent[-1] != "/":
             key_parent = key_parent + "/"
         key_parent = key_parent[1:]
-        return self.__exists(key_parent)
+        return self.__exists_folder(key_parent)
+
+
+    def __indexed_folder(self, key):
+        # A folder exists on the server if a key starts with it.
+        return (key == "") or self.__caches.inventory.any_below(key)
+
+
+    def __size_indexed(self, key):
+        item = self.__caches.inventory.get(key)
+        if item is not None:
+            return item[0]
+        assert self.__indexed_folder(key + "/"), "File/folder not found."
+        return self.__caches.inventory.total_size(key + "/")
 
 
     def get_type(self):
@@ -125,24 +467,62 @@ class StorageS3BDL(Storage):
             raise ValueError("get_type failed!")
 
 
+    def __get_cwd(self):
+        # (current directory, full path): the one of the context if set by 
+        # cwd(), otherwise the one of the instance.
+        output = self.__cwd_var.get()
+        return self.__cwd if output is None else output
+
+
+    def __cd_resolve(self, path):
+        path = str(path)
+        path_full = self.__path_expand(path, bool_file=False)
+        assert self.__exists_folder(path_full), \
+            "Current directory not found."
+        return ("/" + sub(self.__root_path_full, "", path_full), path_full)
+
+
+    @measured
+    @__bounded
     def cd(self, path):
         try:
             assert self.__initialized, "Storage not initialized."
-            path = str(path)
-            path_full = self.__path_expand(path, bool_file=False)
-            assert self.__exists(path_full), "Current directory not found."
-            self.__cd_full = path_full
-            self.__cd = "/" + sub(self.__root_path_full, "", self.__cd_full)
+            cwd = self.__cd_resolve(path)
+            if self.__cwd_var.get() is None:
+                self.__cwd = cwd
+            else:
+                self.__cwd_var.set(cwd)
             logger.debug("cd " + str(path) + ": True")
         except Exception as e:
             logger.error("cd failed. " + str(e))
             raise ValueError("cd failed!")
+
+
+    @__bounded
+    def __cwd_enter(self, path):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            cwd = self.__cd_resolve(path)
+            logger.debug("cwd " + str(path) + ": True")
+        except Exception as e:
+            logger.error("cwd failed. " + str(e))
+            raise ValueError("cwd failed!")
+        return self.__cwd_var.set(cwd)
+
+
+    @contextmanager
+    def cwd(self, path):
+        token = self.__cwd_enter(path)
+        try:
+            yield self
+        finally:
+            self.__cwd_var.reset(token)
     
 
     def pwd(self):
         try:
             assert self.__initialized, "Storage not initialized."
-            output = self.__cd
+            output = self.__get_cwd()[0]
             if output != "/" and output[-1] == "/":
                 output = output[:-1]
             logger.debug("pwd: " + output)
@@ -152,20 +532,65 @@ class StorageS3BDL(Storage):
             raise ValueError("pwd failed!")
 
 
+    def __ls_iter(self, prefix, page_size, bool_details):
+        # The ls/ endpoint accepts marker and max_keys and returns the next 
+        # marker, with optional sizes and mtimes. A gateway without paging 
+        # returns the whole listing and no next marker.
+        marker = ""
+        names = set()
+        while marker is not None:
+            post_data = {
+                "key": prefix, 
+                "secret_key": self.__secret_key,
+                "marker": marker,
+                "max_keys": page_size
+            }
+            page = jloads(self.__post(
+                "ls/", 
+                data=post_data
+            ).text)
+            sizes = page.get("sizes")
+            mtimes = page.get("mtimes")
+            for i, name in enumerate(page["ls"]):
+                if name in names:
+                    continue
+                names.add(name)
+                if bool_details:
+                    yield (
+                        name, 
+                        None if sizes is None else sizes[i], 
+                        None if mtimes is None else mtimes[i]
+                    )
+                else:
+                    yield name
+            marker = page.get("next_marker")
+
+
+    def __ls_indexed(self, prefix, page_size, bool_details):
+        # As __ls_iter, from the inventory.
+        for name, size, mtime in self.__caches.inventory.children(prefix):
+            yield (name, size, mtime) if bool_details else name
+
+
+    def __ls_source(self, prefix):
+        # The listing of the folder, from the inventory if it answers for it.
+        if not self.__caches.indexed(prefix):
+            return self.__ls_iter
+        assert self.__indexed_folder(prefix), "Folder not found."
+        return self.__ls_indexed
+
+
+    @measured
+    @__settled
+    @__bounded
     def ls(self, path=""):
         try:
             assert self.__initialized, "Storage not initialized."
             path = str(path)
             path_full = self.__path_expand(path, bool_file=False)
             path_full_4_s3 = self.__rm_lead_slash(path_full) 
-            post_data = {
-                "key": path_full_4_s3, 
-                "secret_key": self.__secret_key
-            }
-            output = jloads(post(
-                url=self.__url+"ls/", 
-                data=post_data
-            ).text)["ls"]
+            fn_ls = self.__ls_source(path_full_4_s3)
+            output = list(fn_ls(path_full_4_s3, 1000, False))
             logger.debug("ls " + str(path) + ": " + " ".join(output))
             return unique(output)
         except Exception as e:
@@ -173,13 +598,129 @@ class StorageS3BDL(Storage):
             raise ValueError("ls failed!")
 
 
+    @measured
+    @__settled
+    @__bounded
+    def ls_iter(self, path="", page_size=1000, bool_details=False):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path = str(path)
+            page_size = int(page_size)
+            assert page_size > 0, "Page size out of range."
+            path_full = self.__path_expand(path, bool_file=False)
+            path_full_4_s3 = self.__rm_lead_slash(path_full) 
+            fn_ls = self.__ls_source(path_full_4_s3)
+            logger.debug("ls_iter " + str(path) + ": True")
+        except Exception as e:
+            logger.error("Failed to list objects inside the folder. " + str(e))
+            raise ValueError("ls_iter failed!")
+        return fn_ls(path_full_4_s3, page_size, bool_details)
+
+
+    def __path_storage(self, key):
+        # From the S3 key to the path seen by the storage user.
+        return "/" + key[len(self.__rm_lead_slash(self.__root_path_full)):]
+
+
+    def __keys_iter(self, prefix, int_page_size=1000, bool_details=False):
+        # The walk/ endpoint lists all the keys starting with the prefix, 
+        # folder markers included, one page at a time: {"keys": [[key, 
+        # size, mtime], ...], "next_marker": key or null}. With bool_details
+        # as (key, size, mtime, etag), no etag from the endpoint.
+        marker = ""
+        while marker is not None:
+            post_data = {
+                "key": prefix, 
+                "secret_key": self.__secret_key,
+                "marker": marker,
+                "max_keys": int_page_size
+            }
+            page = jloads(self.__post(
+                "walk/", 
+                data=post_data
+            ).text)
+            for item in page["keys"]:
+                if bool_details:
+                    yield (item[0], item[1], item[2], None)
+                else:
+                    yield item[0]
+            marker = page["next_marker"]
+
+
+    def __walk(
+        self, prefix, regex=None, int_page_size=1000, bool_indexed=False):
+        if bool_indexed:
+            keys = self.__caches.inventory.keys(prefix, int_page_size)
+        else:
+            keys = self.__keys_iter(prefix, int_page_size)
+        for key in keys:
+            if key[-1] == "/":
+                continue
+            path = self.__path_storage(key)
+            if (regex is None) or regex.match(path):
+                yield path
+
+
+    @measured
+    @__settled
+    @__bounded
+    def walk(self, path=""):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path = str(path)
+            path_full = self.__path_expand(path, bool_file=False)
+            path_full_4_s3 = self.__rm_lead_slash(path_full)
+            bool_indexed = self.__caches.indexed(path_full_4_s3)
+            if len(path_full_4_s3) > 0:
+                assert self.__indexed_folder(path_full_4_s3) if bool_indexed \
+                    else self.__exists_folder(path_full_4_s3), \
+                    "Folder not found."
+            logger.debug("walk " + str(path) + ": True")
+        except Exception as e:
+            logger.error("Failed to walk the folder. " + str(e))
+            raise ValueError("walk failed!")
+        return self.__walk(path_full_4_s3, bool_indexed=bool_indexed)
+
+
+    @measured
+    @__bounded
+    def glob(self, pattern):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            pattern = str(pattern)
+            assert len(pattern) > 0, "Empty pattern."
+            if pattern[0] != "/":
+                pattern = self.__get_cwd()[0] + "/" + pattern
+            pattern = sub('[/]+', '/', pattern)
+            assert ".." not in pattern.split("/"), "Invalid pattern."
+            regex = glob_to_regex(pattern)
+            prefix = self.__rm_lead_slash(self.__root_path_full) \
+                + glob_literal_prefix(pattern)[1:]
+            self.__caches.settle(prefix, bool_literal=True)
+            logger.debug("glob " + pattern + ": True")
+        except Exception as e:
+            logger.error("Failed to glob. " + str(e))
+            raise ValueError("glob failed!")
+        return self.__walk(
+            prefix, regex, bool_indexed=self.__caches.indexed(prefix))
+
+
+    @measured
+    @__bounded
     def exists(self, path):
         try:
             assert self.__initialized, "Storage not initialized."
             path = str(path)
             path_full = self.__path_expand(path, bool_file=True)
             path_full = self.__rm_lead_slash(path_full)
-            output = self.__exists(key=path_full)
+            if self.__caches.queued(path_full) is not None:
+                output = True
+            elif self.__caches.indexed(path_full):
+                output = (self.__caches.inventory.get(path_full) is not None) \
+                    or self.__indexed_folder(path_full + "/")
+            else:
+                output = (not self.__caches.negative.is_absent(path_full)) \
+                    and self.__exists(key=path_full)
             logger.debug("exists " + str(path) + ": " + str(output))
             return output
         except Exception as e:
@@ -187,6 +728,8 @@ class StorageS3BDL(Storage):
             raise ValueError("exists failed!")
 
 
+    @measured
+    @__bounded
     def mkdir(self, path):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -194,26 +737,32 @@ class StorageS3BDL(Storage):
             path = safe_folder_path_str(path)
             path_full = self.__path_expand(path, bool_file=False)
             path_full_4_s3 = self.__rm_lead_slash(path_full)
-            assert not self.__exists(path_full_4_s3), \
-                "Directory already exists. "
-            assert self.__exists_parent(path_full_4_s3), \
-                "Parent folder not found"
+            if not self.__bool_implicit_dirs:
+                assert not self.__exists(path_full_4_s3), \
+                    "Directory already exists. "
+                assert self.__exists_parent(path_full_4_s3), \
+                    "Parent folder not found"
             post_data = {
                 "key": path_full_4_s3, 
                 "secret_key": self.__secret_key
             }
-            output = post(
-                url=self.__url+"mkdir/", 
+            output = self.__post(
+                "mkdir/", 
                 data=post_data
             ).text
             assert output == "OK!", "Post call failed."
-            assert self.__exists(path_full_4_s3), "Directory check failed."
+            if self.__bool_implicit_dirs:
+                # mkdir -p: one POST, no existence checks.
+                self.__dirs_add(path_full_4_s3)
+            self.__caches.put(path_full_4_s3, None)
             logger.debug("mkdir " + str(path) + ": True")
         except Exception as e:
             logger.error("Failed to create the directory. " + str(e))  
             raise ValueError("mkdir failed!")
 
 
+    @measured
+    @__bounded
     def upload(self, path_source, path_dest):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -222,32 +771,29 @@ class StorageS3BDL(Storage):
             path_dest = safe_file_path_str(path_dest)
             path_full = self.__path_expand(path_dest, bool_file=True)
             path_full_4_s3 = self.__rm_lead_slash(path_full)
+            # A queued write of the destination ends before the checks.
+            self.__caches.settle(path_full_4_s3)
             assert self.__exists_parent(path_full_4_s3), \
                 "Parent folder not found."
             assert isfile(path_source), "Source file not found."
             assert not self.__exists(path_full_4_s3), \
                 "Destination file already exists."
-            assert not self.__exists(path_full_4_s3 + "/"), \
+            assert not self.__exists_folder(path_full_4_s3 + "/"), \
                 "Destination folder already exists."
-            post_data = {
-                "key": path_full_4_s3, 
-                "secret_key": self.__secret_key,
-            }
-            post_files = {'file': open(path_source,'rb')}
-            output = post(
-                url=self.__url+"upload/", 
-                data=post_data,
-                files=post_files
-            ).text
-            assert output == "OK!", "Post call failed."
-            assert self.__exists(path_full_4_s3), \
-                "Destination file check failed."
+            int_written = stat(path_source).st_size
+            with open(path_source, 'rb') as fp:
+                self.__upload(path_full_4_s3, fp)
+            self.__metrics.add_bytes(int_written=int_written)
+            self.__dirs_add(path_full_4_s3)
+            self.__caches.put(path_full_4_s3, int_written)
             logger.debug("upload " + str(path_dest) + ": True")
         except Exception as e:
             logger.error("Failed to upload. " + str(e))  
             raise ValueError("upload failed!")
 
 
+    @measured
+    @__bounded
     def download(self, path_source, path_dest):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -256,26 +802,31 @@ class StorageS3BDL(Storage):
             path_source = safe_file_path_str(path_source)
             path_full = self.__path_expand(path_source, bool_file=True)
             path_full_4_s3 = self.__rm_lead_slash(path_full)
-            assert self.__exists(path_full_4_s3), "Source file not found."
+            content = self.__caches.queued(path_full_4_s3)
+            assert (content is not None) or self.__exists(path_full_4_s3), \
+                "Source file not found."
             assert not isfile(path_dest), "Destination file already exists."
             assert not isdir(path_dest), "Destination folder already exists."
-            post_data = {
-                "key": path_full_4_s3, 
-                "secret_key": self.__secret_key,
-            }
-            content = post(
-                url=self.__url+"download/", 
-                data=post_data,
-            ).content
-            with open(path_dest, 'wb') as s:
-                s.write(content)
-            assert isfile(path_dest), "Destination file check failed."
+            try:
+                with open(path_dest, 'wb') as fp:
+                    if content is not None:
+                        fp.write(content)
+                    else:
+                        self.__download(path_full_4_s3, fp)
+            except Exception:
+                if isfile(path_dest):
+                    remove(path_dest)
+                raise
+            self.__metrics.add_bytes(int_read=stat(path_dest).st_size)
             logger.debug("download " + str(path_source) + ": True")
         except Exception as e:
             logger.error("Failed to download. " + str(e)) 
             raise ValueError("download failed!")
 
 
+    @measured
+    @__settled
+    @__bounded
     def rm(self, path):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -288,17 +839,22 @@ class StorageS3BDL(Storage):
                 "key": path_full_4_s3, 
                 "secret_key": self.__secret_key
             }
-            output = post(
-                url=self.__url+"rm/", 
+            output = self.__post(
+                "rm/", 
                 data=post_data
             ).text
             assert output == "OK!", "Post call failed."
+            self.__dirs_forget(path_full_4_s3 + "/")
+            self.__caches.remove(path_full_4_s3)
             logger.debug("rm " + str(path) + ": True")
         except Exception as e:
             logger.error("Failed to remove the file/folder. " + str(e))
             raise ValueError("rm failed!") 
 
 
+    @measured
+    @__settled
+    @__bounded
     def size(self, path):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -306,14 +862,18 @@ class StorageS3BDL(Storage):
             path = safe_file_path_str(path)
             path_full = self.__path_expand(path, bool_file=True)
             path_full_4_s3 = self.__rm_lead_slash(path_full)
-            post_data = {
-                "key": path_full_4_s3, 
-                "secret_key": self.__secret_key
-            }
-            output = post(
-                url=self.__url+"size/", 
-                data=post_data
-            ).text
+            if self.__caches.indexed(path_full_4_s3):
+                output = self.__size_indexed(path_full_4_s3)
+            else:
+                post_data = {
+                    "key": path_full_4_s3, 
+                    "secret_key": self.__secret_key
+                }
+                output = self.__post(
+                    "size/", 
+                    data=post_data,
+                    bool_hedged=True
+                ).text
             output = int(output)
             assert output >= 0, "Wrong output size."
             logger.debug("size " + str(path) + ": " + str(output))
@@ -323,37 +883,81 @@ class StorageS3BDL(Storage):
             raise ValueError("size failed!")
 
 
+    @__bounded
+    def __put_bounded(self, key, content):
+        assert not self.__exists(key), "File already exists."
+        assert not self.__exists_folder(key + "/"), "Folder already exists."
+        self.__upload(key, content)
+        self.__metrics.add_bytes(int_written=len(content))
+        self.__dirs_add(key)
+        self.__caches.put(key, len(content))
+
+
+    def __put_behind(self, key, content):
+        # Run by the write-behind workers, the error ends in the future.
+        try:
+            self.__put_bounded(key, content)
+        except Exception as e:
+            logger.error("Failed to upload. " + str(e))
+            raise ValueError("upload_from_memory failed!")
+
+
+    @__bounded
+    def __get_bounded(self, key, bool_check=True):
+        # Also run by the prefetch workers, without the check.
+        if bool_check:
+            assert self.__exists(key), "File not found."
+        return self.__download(key)
+
+
+    @__bounded
+    def __list_bounded(self, folder):
+        # The files of a folder, for the sequential-read detector.
+        return [folder + x[0] for x in self.__ls_iter(folder, 1000, True) \
+            if x[1] is not None]
+
+
+    def __settle(self, path):
+        try:
+            key = self.__key(path, bool_file=False)
+        except Exception:
+            # The method reports the error, wait for all the writes.
+            key = ""
+        self.__caches.settle(key)
+
+
+    @measured
     def upload_from_memory(self, variable, path, bool_bin=False):
+        '''
+        With int_write_behind the write is only queued: the returned 
+        concurrent.futures.Future resolves once it is uploaded, flush 
+        waits for all of them. Until then the reads of the path return 
+        the queued content. Otherwise the upload ends before returning.
+        '''
         try:
             assert self.__initialized, "Storage not initialized."
             path = str(path)
             path = safe_file_path_str(path)
             path_full = self.__path_expand(path, bool_file=True)
             path_full_4_s3 = self.__rm_lead_slash(path_full)
-            assert not self.__exists(path_full_4_s3), "File already exists."
-            assert not self.__exists(path_full_4_s3 + "/"), "Folder already exists."
             if bool_bin:
                 content=variable
             else:
                 content = pickle.dumps(variable)
-            post_data = {
-                "key": path_full_4_s3, 
-                "secret_key": self.__secret_key,
-            }
-            post_files = {'file': content}
-            output = post(
-                url=self.__url+"upload/", 
-                data=post_data,
-                files=post_files
-            ).text
-            assert output == "OK!", "Post call failed."
-            assert self.__exists(path_full_4_s3), "File check failed."
+            # With write-behind the checks and the upload run in a worker,
+            # the errors end in the future and in flush.
+            output = self.__caches.submit(path_full_4_s3, content)
+            if output is not None:
+                logger.debug("upload_from_memory " + str(path) + ": queued")
+                return output
+            self.__put_bounded(path_full_4_s3, content)
             logger.debug("upload_from_memory " + str(path) + ": True")
         except Exception as e:
             logger.error("Failed to upload. " + str(e))  
             raise ValueError("upload_from_memory failed!")
 
 
+    @measured
     def download_to_memory(self, path, bool_bin=False):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -361,19 +965,16 @@ class StorageS3BDL(Storage):
             path = safe_file_path_str(path)
             path_full = self.__path_expand(path, bool_file=True)
             path_full_4_s3 = self.__rm_lead_slash(path_full)
-            assert self.__exists(path_full_4_s3), "File not found."
-            post_data = {
-                "key": path_full_4_s3, 
-                "secret_key": self.__secret_key,
-            }
-            content = post(
-                url=self.__url+"download/", 
-                data=post_data,
-            ).content
+            content = self.__caches.queued(path_full_4_s3)
+            if content is None:
+                content = self.__caches.take(path_full_4_s3)
+            if content is None:
+                content = self.__get_bounded(path_full_4_s3)
             if bool_bin:
                 output = content
             else:
                 output = pickle.loads(content)
+            self.__metrics.add_bytes(int_read=len(content))
             logger.debug("download_to_memory " + str(path) + ": True")
             return output
         except Exception as e:
@@ -381,6 +982,9 @@ class StorageS3BDL(Storage):
             raise ValueError("download_to_memory failed!")
 
 
+    @measured
+    @__settled
+    @__bounded
     def rename(self, path_source, path_dest):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -399,11 +1003,16 @@ class StorageS3BDL(Storage):
                 "key_new": path_dest_full_4_s3,
                 "secret_key": self.__secret_key
             }
-            output = post(
-                url=self.__url+"rename/", 
-                data=post_data
+            output = self.__post(
+                "rename/", 
+                data=post_data,
+                bool_idempotent=False
             ).text
             assert output == "OK!", "Post call failed."
+            self.__dirs_forget(path_source_full_4_s3 + "/")
+            self.__dirs_add(path_dest_full_4_s3)
+            self.__caches.copy(
+                path_source_full_4_s3, path_dest_full_4_s3, bool_remove=True)
             logger.debug("rename " + str(path_source) + \
                 " --> " + str(path_dest))
         except Exception as e:
@@ -411,6 +1020,9 @@ class StorageS3BDL(Storage):
             raise ValueError("rename failed!")
 
 
+    @measured
+    @__settled
+    @__bounded
     def mv(self, path_source, path_dest):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -426,11 +1038,16 @@ class StorageS3BDL(Storage):
                 "key_new": path_dest_full_4_s3,
                 "secret_key": self.__secret_key
             }
-            output = post(
-                url=self.__url+"mv/", 
-                data=post_data
+            output = self.__post(
+                "mv/", 
+                data=post_data,
+                bool_idempotent=False
             ).text
             assert output == "OK!", "Post call failed."
+            self.__dirs_forget(path_source_full_4_s3 + "/")
+            self.__dirs_add(path_dest_full_4_s3)
+            self.__caches.copy(
+                path_source_full_4_s3, path_dest_full_4_s3, bool_remove=True)
             logger.debug("mv " + str(path_source) + \
                 " --> " + str(path_dest))
         except Exception as e:
@@ -438,6 +1055,9 @@ class StorageS3BDL(Storage):
             raise ValueError("mv failed!")
 
 
+    @measured
+    @__settled
+    @__bounded
     def cp(self, path_source, path_dest):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -453,11 +1073,14 @@ class StorageS3BDL(Storage):
                 "key_new": path_dest_full_4_s3,
                 "secret_key": self.__secret_key
             }
-            output = post(
-                url=self.__url+"cp/", 
-                data=post_data
+            output = self.__post(
+                "cp/", 
+                data=post_data,
+                bool_idempotent=False
             ).text
             assert output == "OK!", "Post call failed."
+            self.__dirs_add(path_dest_full_4_s3)
+            self.__caches.copy(path_source_full_4_s3, path_dest_full_4_s3)
             logger.debug("cp " + str(path_source) + \
                 " --> " + str(path_dest))
         except Exception as e:
@@ -465,6 +1088,7 @@ class StorageS3BDL(Storage):
             raise ValueError("cp failed!")
 
 
+    @measured
     def append(self, path, content):
         # TODO: implement it!
         raise ValueError("append method not implemented yet!")
@@ -0,0 +1,240 @@
+from threading import Condition, Lock, local
+from contextlib import contextmanager
+from time import monotonic
+from boto.s3.connection import S3Connection
+from boto.s3.key import Key
+from .logger import logger
+from ..utils.deadline import request_timeout
+from ..utils.checksum import etag_is_md5
+
+
+class TimeoutS3Connection(S3Connection):
+    '''
+    S3 connection with a socket timeout settable before each request.
+
+    The connection is used by one thread at a time (the one leasing it), 
+    which sets float_timeout before sending a request: it applies to the 
+    new and the reused keep-alive HTTP connections.
+    '''
+
+
+    float_timeout = None
+
+
+    def get_http_connection(self, host, port, is_secure):
+        output = super().get_http_connection(host, port, is_secure)
+        if self.float_timeout is not None:
+            output.timeout = self.float_timeout
+            if getattr(output, "sock", None) is not None:
+                output.sock.settimeout(self.float_timeout)
+        return output
+
+
+class ResponseKey(Key):
+    '''
+    Key keeping the headers of its last response, e.g. to tell if its ETag
+    is the MD5 of the content.
+
+    boto compares the ETag of a PUT with the MD5 of the body except for 
+    SSE-C: it is also skipped for SSE-KMS, the server already checked the 
+    Content-MD5.
+    '''
+
+
+    response_headers = ()
+
+
+    def handle_addl_headers(self, headers):
+        self.response_headers = list(headers)
+
+
+    def should_retry(self, response, chunked_transfer=False):
+        if (200 <= response.status <= 299) \
+            and not etag_is_md5(response.getheaders()):
+            self.etag = response.getheader("etag")
+            return True
+        return super().should_retry(response, chunked_transfer)
+
+
+class ConnectionPool():
+    '''
+    Bounded pool of boto connections.
+
+    A boto connection is not thread safe: a thread leases a connection (and 
+    its bucket handle) for the duration of a request, nested leases of the 
+    same thread share it. A lease is never held while waiting for another 
+    thread, which may need a connection too. Connections are created on 
+    demand, at most int_max_connections of them, and a thread waits up to 
+    the timeout of its lease (or until the deadline of the context) for a 
+    free one. The bucket is validated only by the first connection.
+    '''
+
+
+    def __init__(
+        self,
+        host,
+        port,
+        access_key,
+        secret_key,
+        bucket,
+        calling_format,
+        secure,
+        int_max_connections=16
+    ):
+        self.__host = str(host)
+        self.__port = int(port)
+        self.__access_key = str(access_key)
+        self.__secret_key = str(secret_key)
+        self.__bucket = str(bucket)
+        self.__calling_format = str(calling_format)
+        self.__secure = bool(secure)
+        assert int(int_max_connections) > 0, "At least one connection."
+        self.__int_max_connections = int(int_max_connections)
+        self.__condition = Condition()
+        self.__idle = []
+        self.__count = 0
+        self.__validated = False
+        self.__local = local()
+
+
+    def __new_bucket(self):
+        connection = TimeoutS3Connection(
+            host=self.__host,
+            port=self.__port,
+            aws_access_key_id=self.__access_key,
+            aws_secret_access_key=self.__secret_key,
+            calling_format=self.__calling_format,
+            is_secure=self.__secure
+        )
+        # The storage objects retry each request with their own policy.
+        connection.num_retries = 0
+        if not self.__validated:
+            assert connection.lookup(self.__bucket) is not None, \
+                "The bucket specified doesn't exists!"
+            self.__validated = True
+        output = connection.get_bucket(self.__bucket, validate=False)
+        output.key_class = ResponseKey
+        return output
+
+
+    def __acquire(self, float_timeout):
+        float_timeout = request_timeout(float_timeout)
+        end = None if float_timeout is None else monotonic() + float_timeout
+        with self.__condition:
+            while len(self.__idle) == 0 \
+                and self.__count >= self.__int_max_connections:
+                if end is None:
+                    self.__condition.wait()
+                    continue
+                remaining = end - monotonic()
+                assert remaining > 0, "No connection available in the pool."
+                self.__condition.wait(remaining)
+            if len(self.__idle) > 0:
+                return self.__idle.pop()
+            self.__count += 1
+        try:
+            output = self.__new_bucket()
+            logger.debug("New connection to " + self.__host + ".")
+            return output
+        except Exception:
+            with self.__condition:
+                self.__count -= 1
+                self.__condition.notify()
+            raise
+
+
+    def __release(self, bucket):
+        with self.__condition:
+            self.__idle.append(bucket)
+            self.__condition.notify()
+
+
+    @contextmanager
+    def lease(self, float_timeout=None):
+        '''
+        Lease a connection for the block.
+
+        Parameters
+        ----------
+        float_timeout : float
+            Seconds to wait for a free connection, shortened to the deadline
+            of the context. None waits until one is released.
+
+        Returns
+        -------
+        boto.s3.bucket.Bucket
+            Bucket handle, only to be used by the calling thread.
+        '''
+        depth = getattr(self.__local, "depth", 0)
+        if depth == 0:
+            self.__local.bucket = self.__acquire(float_timeout)
+        self.__local.depth = depth + 1
+        try:
+            yield self.__local.bucket
+        finally:
+            self.__local.depth -= 1
+            if self.__local.depth == 0:
+                bucket = self.__local.bucket
+                self.__local.bucket = None
+                self.__release(bucket)
+
+
+    def bucket(self):
+        '''
+        The bucket handle leased by the calling thread.
+
+        Returns
+        -------
+        boto.s3.bucket.Bucket
+            Bucket handle, only to be used by the calling thread.
+        '''
+        output = getattr(self.__local, "bucket", None)
+        assert output is not None, "No connection leased by this thread."
+        return output
+
+
+    def size(self):
+        with self.__condition:
+            return self.__count
+
+
+pools = {}
+pools_lock = Lock()
+
+
+def get_connection_pool(
+    host,
+    port,
+    access_key,
+    secret_key,
+    bucket,
+    calling_format,
+    secure,
+    int_max_connections=16
+):
+    '''
+    The connection pool shared by all the storage objects pointing at the 
+    same endpoint, credentials and bucket with the same maximum number of 
+    connections (e.g. parent and child roots).
+
+    Returns
+    -------
+    ConnectionPool
+        The shared connection pool.
+    '''
+    key = (str(host), int(port), str(access_key), str(secret_key), \
+        str(bucket), str(calling_format), bool(secure), 
+        int(int_max_connections))
+    with pools_lock:
+        if key not in pools:
+            pools[key] = ConnectionPool(
+                host=host,
+                port=port,
+                access_key=access_key,
+                secret_key=secret_key,
+                bucket=bucket,
+                calling_format=calling_format,
+                secure=secure,
+                int_max_connections=int_max_connections
+            )
+        return pools[key]
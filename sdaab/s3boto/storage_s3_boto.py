@@ -1,17 +1,40 @@
 from abc import ABC, abstractmethod
 import pickle
 from pathlib import Path
-from os.path import isdir, isfile
-from os import stat
+from os.path import isdir, isfile, abspath
+from os import stat, replace, makedirs, remove
 from re import sub
-from boto.s3.connection import S3Connection
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
 from boto.s3.key import Key
+from boto.s3.multipart import MultiPartUpload
+from boto.s3.prefix import Prefix
+from boto.utils import parse_ts
+from calendar import timegm
 from io import BytesIO
-from filechunkio import FileChunkIO
+from hashlib import md5
 from numpy import unique
 from math import ceil
+from functools import wraps
+from threading import Lock
+from time import monotonic, time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from .logger import logger
-from ..storage.storage import Storage
+from .connection_pool import get_connection_pool
+from ..utils.glob_pattern import glob_to_regex, glob_literal_prefix
+from ..utils.retry import RetryPolicy, Hedger, RetryableError
+from ..utils.autotune import TransferTuner
+from ..utils.deadline import deadline, remaining, check, request_timeout
+from ..utils.deadline import shielded
+from ..utils.checkpoint import Checkpoint, checkpoint_id
+from ..utils.checksum import md5_pair, etag_strip, composite_etag
+from ..utils.checksum import etag_is_md5
+from ..utils.checksum import ETagHasher, HashingWriter
+from ..utils.metrics import Metrics, measured
+from ..utils.write_behind import path_argument
+from ..utils.caches import RemoteCaches
+from ..utils.inventory import unique_sorted
+from ..storage.remote import RemoteStorage
 
 
 def safe_folder_path_str(path):
@@ -33,7 +56,63 @@ def safe_file_path_str(path):
     return path
 
 
-class StorageS3boto(Storage):
+def read_at(fp, offset, int_bytes):
+    fp.seek(offset)
+    return fp.read(int_bytes)
+
+
+def merge_ranges(ranges):
+    # Sorted union of [start, end) byte ranges.
+    output = []
+    for start, end in sorted(ranges):
+        if (len(output) > 0) and (start <= output[-1][1]):
+            output[-1][1] = max(output[-1][1], end)
+        else:
+            output.append([start, end])
+    return output
+
+
+def missing_ranges(ranges, int_size, int_chunk):
+    # The [start, end) chunks of at most int_chunk bytes not covered by 
+    # the ranges.
+    output = []
+    start = 0
+    for a, b in merge_ranges(ranges) + [[int_size, int_size]]:
+        while start < min(a, int_size):
+            end = min(start + int_chunk, a, int_size)
+            output.append([start, end])
+            start = end
+        start = max(start, b)
+    return output
+
+
+class StorageS3boto(RemoteStorage):
+
+
+    def __remote(method):
+        # Run a method sending requests within the default deadline of the 
+        # instance. No connection is held by the method: each request 
+        # leases one (see __request), so the method can wait for worker 
+        # threads (multipart parts, hedged reads, write-behind) leasing 
+        # their own.
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not self.__validated:
+                self.__validate(method.__name__)
+            with deadline(self.__float_deadline):
+                return method(self, *args, **kwargs)
+        return wrapper
+
+
+    def __settled(method):
+        # With write-behind, wait for the queued writes below the path 
+        # (first argument) before the method reads it.
+        fn_path = path_argument(method)
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            self.__settle(fn_path(self, *args, **kwargs))
+            return method(self, *args, **kwargs)
+        return wrapper
 
 
     def __init__(
@@ -46,8 +125,52 @@ class StorageS3boto(Storage):
         calling_format,
         secure,
         root_path="/",
+        bool_implicit_dirs=False,
+        int_max_connections=16,
+        bool_lazy=False,
+        retry_policy=None,
+        float_hedge_percentile=None,
+        dict_tuning=None,
+        float_timeout=60.0,
+        float_deadline=None,
+        path_checkpoints=None,
+        int_write_behind=None,
+        int_write_behind_workers=4,
+        int_prefetch_depth=None,
+        int_prefetch_bytes=67108864,
+        path_prefetch=None,
+        path_inventory=None,
+        float_inventory_age=3600.0,
+        bool_verify_etag=False
     ):
+        self.__metrics = Metrics()
         try:
+            self.__config = {
+                "host": host,
+                "port": port,
+                "access_key": access_key,
+                "secret_key": secret_key,
+                "bucket": bucket,
+                "calling_format": calling_format,
+                "secure": secure,
+                "root_path": root_path,
+                "bool_implicit_dirs": bool_implicit_dirs,
+                "int_max_connections": int_max_connections,
+                "retry_policy": retry_policy,
+                "float_hedge_percentile": float_hedge_percentile,
+                "dict_tuning": dict_tuning,
+                "float_timeout": float_timeout,
+                "float_deadline": float_deadline,
+                "path_checkpoints": path_checkpoints,
+                "int_write_behind": int_write_behind,
+                "int_write_behind_workers": int_write_behind_workers,
+                "int_prefetch_depth": int_prefetch_depth,
+                "int_prefetch_bytes": int_prefetch_bytes,
+                "path_prefetch": path_prefetch,
+                "path_inventory": path_inventory,
+                "float_inventory_age": float_inventory_age,
+                "bool_verify_etag": bool_verify_etag
+            }
             self.__storage_type = "S3boto"
             root_path = str(root_path)
             assert len(root_path) > 0, "No root path provided."
@@ -56,8 +179,8 @@ class StorageS3boto(Storage):
             if root_path[-1] != "/":
                 root_path = root_path + "/"
             self.__root_path_full = root_path
-            self.__cd_full = root_path
-            self.__cd = "/"
+            self.__cwd = ("/", root_path)
+            self.__cwd_var = ContextVar("sdaab_s3boto_cwd", default=None)
             self.__host = str(host)
             self.__port = int(port)
             self.__access_key = str(access_key)
@@ -68,29 +191,74 @@ class StorageS3boto(Storage):
                 self.__secure = secure 
             else:
                 self.__secure = secure == "True" 
+            self.__bool_implicit_dirs = bool(bool_implicit_dirs)
+            # Guarded by the lock: ls, exists and the writes may run in
+            # several threads.
+            self.__dirs_known = set()
+            self.__dirs_lock = Lock()
+            if retry_policy is None:
+                retry_policy = RetryPolicy()
+            self.__retry = retry_policy
+            if float_hedge_percentile is None:
+                self.__hedger = None
+            else:
+                self.__hedger = Hedger(float_percentile=float_hedge_percentile)
+            self.__tuner = TransferTuner()
+            self.__float_timeout = None if float_timeout is None \
+                else float(float_timeout)
+            self.__float_deadline = None if float_deadline is None \
+                else float(float_deadline)
+            self.__path_checkpoints = None if path_checkpoints is None \
+                else abspath(str(path_checkpoints))
+            if self.__path_checkpoints is not None:
+                makedirs(self.__path_checkpoints, exist_ok=True)
+            if dict_tuning is not None:
+                self.__tuner.set_state(dict_tuning)
+            # The server checks the Content-MD5 of the writes. With 
+            # bool_verify_etag the ETags are also compared with the MD5 of 
+            # the content, where the server tells they are MD5s (not with 
+            # SSE-KMS or SSE-C).
+            self.__bool_verify_etag = bool(bool_verify_etag)
 
-            self.__connection = S3Connection(
+            self.__pool = get_connection_pool(
                 host=self.__host,
                 port=self.__port,
-                aws_access_key_id=self.__access_key,
-                aws_secret_access_key=self.__secret_key,
+                access_key=self.__access_key,
+                secret_key=self.__secret_key,
+                bucket=self.__bucket,
                 calling_format=self.__calling_format,
-                is_secure=self.__secure
+                secure=self.__secure,
+                int_max_connections=int_max_connections
             )
-
-            assert self.__connection.lookup(self.__bucket) is not None, \
-                "The bucket specified doesn't exists!"
-            
-            self.__connection_bucket = self.__connection\
-                .get_bucket(self.__bucket)
-
-            if len(self.__root_path_full) > 0: 
-                k = Key(self.__connection_bucket)
-                k.key = self.__rm_lead_slash(self.__root_path_full)
-                assert k.exists(), "Root folder not found!"
+            self.__validated = False
+            if not bool_lazy:
+                self.__validate_root()
+            # With int_write_behind (bytes) upload_from_memory only queues
+            # the write, see flush. With int_prefetch_depth 
+            # download_to_memory is served by the reads done ahead, see 
+            # prefetch and warm. The misses of exists are answered 
+            # locally, see build_negative_cache. With path_inventory (a 
+            # SQLite file) the calls on the keys scanned less than 
+            # float_inventory_age seconds ago are answered by a local index, 
+            # see refresh_inventory.
+            self.__caches = RemoteCaches(
+                self.__put_behind,
+                lambda key: self.__get_key(key, False),
+                self.__list_files,
+                self.__keys_iter,
+                int_write_behind=int_write_behind,
+                int_write_behind_workers=int_write_behind_workers,
+                int_prefetch_depth=int_prefetch_depth,
+                int_prefetch_bytes=int_prefetch_bytes,
+                path_prefetch=path_prefetch,
+                path_inventory=path_inventory,
+                float_inventory_age=float_inventory_age
+            )
+            RemoteStorage.__init__(self, self.__caches, self.__key, 
+                self.__check_folder, self.__float_deadline)
 
             self.__initialized = True
-            logger.debug("Storage DISK initialized.")
+            logger.debug("Storage S3boto initialized.")
 
         except Exception as e:
             self.__initialized = False
@@ -98,21 +266,56 @@ class StorageS3boto(Storage):
             raise ValueError("init failed!")
 
 
+    def __getstate__(self):
+        # Only the configuration and the current directory are pickled, 
+        # the unpickled object connects lazily (e.g. in a worker process).
+        config = dict(self.__config)
+        config["dict_tuning"] = self.__tuner.get_state()
+        return {"config": config, "cwd": self.__get_cwd()}
+
+
+    def __setstate__(self, state):
+        self.__init__(**state["config"], bool_lazy=True)
+        self.__cwd = state["cwd"]
+
+
+    def __validate_root(self):
+        # The connection pool validates the bucket, here only the root 
+        # folder is checked. With bool_lazy it happens at the first call.
+        if len(self.__root_path_full) > 0: 
+            key = self.__rm_lead_slash(self.__root_path_full)
+            assert self.__exists(key), "Root folder not found!"
+            self.__dirs_add(key)
+        self.__validated = True
+
+
+    def __validate(self, method_name):
+        try:
+            self.__validate_root()
+        except Exception as e:
+            logger.error("Initialization failed. " + str(e))
+            raise ValueError(method_name + " failed!")
+
+
     def initialized(self):
         return self.__initialized
 
 
+    def metrics(self):
+        return self.__metrics
+
+
     def __path_expand(self, path, bool_file=True):
         path = str(path)
         if len(path) == 0:
             assert not bool_file, "Not a file."
-            path_full = self.__cd_full
+            path_full = self.__get_cwd()[1]
         elif path[0] == "/":
             path_full = str(Path(self.__root_path_full + path).resolve())
             if not bool_file:
                 path_full = path_full + "/"
         else:
-            path_full = str((Path(self.__cd_full) / path).resolve())
+            path_full = str((Path(self.__get_cwd()[1]) / path).resolve())
             if not bool_file:
                 path_full = path_full + "/"
         assert path_full.startswith(str(self.__root_path_full)), \
@@ -120,6 +323,15 @@ class StorageS3boto(Storage):
         return path_full
     
 
+    def __key(self, path, bool_file=True):
+        # The key of a file or a folder of the storage.
+        path = str(path)
+        if bool_file:
+            path = safe_file_path_str(path)
+        return self.__rm_lead_slash(
+            self.__path_expand(path, bool_file=bool_file))
+
+
     def __rm_lead_slash(self, path):
         if path[0] == "/":
             return path[1:]
@@ -127,12 +339,386 @@ class StorageS3boto(Storage):
             return path
     
 
+    def __request(self, str_name, fn, bool_hedged=False, fn_on_retry=None):
+        # One request, retried by the policy: fn gets the bucket of the 
+        # connection leased for the attempt. Only idempotent reads can be 
+        # hedged, the duplicate leases its own connection.
+        def attempt():
+            self.__metrics.request(str_name)
+            with self.__pool.lease(self.__float_timeout) as bucket:
+                bucket.connection.float_timeout = \
+                    request_timeout(self.__float_timeout)
+                return fn(bucket)
+        if bool_hedged and (self.__hedger is not None):
+            return self.__retry.call(
+                lambda: self.__hedger.call(attempt, str_name), 
+                str_name, 
+                fn_on_retry
+            )
+        return self.__retry.call(attempt, str_name, fn_on_retry)
+
+
+    def __checkpoint(self, *args):
+        if self.__path_checkpoints is None:
+            return None
+        return Checkpoint(self.__path_checkpoints, checkpoint_id(*args))
+
+
+    def __upload_part(self, mp, int_part, data, digests):
+        # Run by a worker thread, with its own connection.
+        start = monotonic()
+        etag, bool_verified = self.__request(
+            "PUT", 
+            lambda b: self.__put_part(b, mp, data, int_part, digests),
+            fn_on_retry=lambda e: self.__tuner.record_throttle()
+        )
+        self.__tuner.record(len(data), monotonic() - start)
+        return (int_part, etag, bool_verified)
+
+
+    def __wait_parts(self, pending, fn_done):
+        # Wait for a part, at most until the deadline.
+        done, pending = wait(
+            pending, timeout=remaining(), return_when=FIRST_COMPLETED)
+        check()
+        for future in done:
+            fn_done(future.result())
+        return pending
+
+
+    def __list_parts(self, bucket, mp):
+        # {part number: ETag} of the parts received by the server, None if 
+        # the upload does not exist anymore.
+        mp = self.__multipart(bucket, mp)
+        output = {}
+        marker = None
+        while True:
+            parts = mp.get_all_parts(part_number_marker=marker)
+            if parts is None:
+                return None
+            for part in parts:
+                output[int(part.part_number)] = part.etag
+            if not mp.is_truncated:
+                return output
+            marker = mp.next_part_number_marker
+
+
+    def __resume_upload(self, key, checkpoint):
+        # The state of the checkpoint if its upload still exists, with 
+        # only the parts the server holds with the same ETag.
+        if (checkpoint is None) or (len(checkpoint.state) == 0):
+            return None
+        try:
+            state = checkpoint.state
+            mp = MultiPartUpload(None)
+            mp.key_name = key
+            mp.id = state["upload_id"]
+            parts = self.__request("LIST", lambda b: self.__list_parts(b, mp))
+            assert parts is not None, "Upload not found."
+            state["etags"] = dict([(k, v) for k, v in state["etags"].items() \
+                if parts.get(int(k)) == v])
+            logger.debug("Upload " + key + " resumed, " + \
+                str(len(state["etags"])) + " parts already done.")
+            return state
+        except Exception as e:
+            logger.warning("Upload " + key + " not resumable. " + str(e))
+            return None
+
+
+    def __abort(self, mp):
+        try:
+            self.__request("DELETE", \
+                lambda b: self.__multipart(b, mp).cancel_upload())
+        except Exception as e:
+            logger.warning("Failed to abort the upload of " + mp.key_name \
+                + ". " + str(e))
+
+
+    def __upload_multipart(self, key, int_size, fn_chunk, checkpoint=None):
+        # The parts are uploaded in parallel: the tuner sets their size 
+        # and how many are in flight. fn_chunk(offset, int_bytes) returns 
+        # the content of a part, read once: its MD5 is sent as Content-MD5.
+        # With bool_verify_etag it is compared with the ETag of the part, 
+        # the composite ETag with the one of the object. The part size is 
+        # kept as metadata, to verify the ETag on read. With a checkpoint 
+        # the upload id and the ETags of the parts are persisted, and a 
+        # failed upload is kept to be resumed; without, it is aborted.
+        state = self.__resume_upload(key, checkpoint)
+        if state is None:
+            part_size = self.__tuner.part_size(int_size)
+            mp = self.__request("POST", lambda b: b.initiate_multipart_upload(
+                key, metadata={"sdaab-part-size": str(part_size)}))
+            state = {"upload_id": mp.id, "part_size": part_size, "etags": {}}
+            if checkpoint is not None:
+                checkpoint.state = state
+                checkpoint.save(bool_force=True)
+        else:
+            mp = MultiPartUpload(None)
+            mp.key_name = key
+            mp.id = state["upload_id"]
+        part_size = state["part_size"]
+        part_count = int(ceil(int_size / float(part_size)))
+        etags = state["etags"]
+        # False once a part is not verifiable.
+        verified = [self.__bool_verify_etag]
+
+        def done(output):
+            etags[str(output[0])] = output[1]
+            verified[0] = verified[0] and output[2]
+            if checkpoint is not None:
+                checkpoint.save()
+
+        pending = set()
+        executor = ThreadPoolExecutor(
+            max_workers=self.__tuner.max_concurrency())
+        try:
+            try:
+                for i in range(part_count):
+                    if str(i + 1) in etags:
+                        continue
+                    while len(pending) >= self.__tuner.concurrency():
+                        pending = self.__wait_parts(pending, done)
+                    offset = part_size * i
+                    data = fn_chunk(offset, min(part_size, int_size - offset))
+                    pending.add(executor.submit(
+                        copy_context().run,
+                        self.__upload_part, 
+                        mp, 
+                        i + 1, 
+                        data, 
+                        md5_pair(data)
+                    ))
+                while len(pending) > 0:
+                    pending = self.__wait_parts(pending, done)
+            finally:
+                # On error or deadline the queued parts are cancelled, the 
+                # running ones end within their socket timeout.
+                executor.shutdown(wait=False, cancel_futures=True)
+            xml = "<CompleteMultipartUpload>" + "".join([
+                "<Part><PartNumber>%d</PartNumber><ETag>%s</ETag></Part>" \
+                % (i + 1, etags[str(i + 1)]) for i in range(part_count)
+            ]) + "</CompleteMultipartUpload>"
+            completed = self.__request("POST", \
+                lambda b: b.complete_multipart_upload(key, mp.id, xml))
+        except Exception:
+            with shielded():
+                if checkpoint is None:
+                    self.__abort(mp)
+                else:
+                    checkpoint.save(bool_force=True)
+            raise
+        if checkpoint is not None:
+            checkpoint.remove()
+        if verified[0] and not str(completed.encrypted).startswith("aws:kms") \
+            and etag_strip(completed.etag) != composite_etag(
+            [etags[str(i + 1)] for i in range(part_count)]):
+            with shielded():
+                self.__request("DELETE", lambda b: b.delete_key(key))
+            raise ValueError("Checksum mismatch of " + key + ".")
+        logger.debug("Multipart " + key + ": " + str(part_count) + \
+            " parts of " + str(part_size) + " bytes.")
+
+
+    def __download_ranges(self, key, path_dest, checkpoint):
+        # Ranged GETs into a partial file next to the destination, renamed 
+        # at the end. The checkpoint holds the ETag of the object, the 
+        # byte ranges already written and their MD5s: if the object 
+        # changed, it restarts. With bool_verify_etag, for a multipart 
+        # object the ranges are its parts and the ETag is verified even 
+        # across resumes; the MD5 of a single part object only if the 
+        # download is not resumed.
+        k = self.__request("HEAD", lambda b: b.get_key(key), bool_hedged=True)
+        etag = etag_strip(k.etag)
+        bool_verify = self.__etag_verifiable(k)
+        part_size = self.__part_size(k) if bool_verify else None
+        path_part = str(path_dest) + ".part"
+        state = checkpoint.state
+        if (state.get("etag") != k.etag) or (state.get("size") != k.size) \
+            or ("md5s" not in state) or not isfile(path_part):
+            state = {"etag": k.etag, "size": k.size, "ranges": [], "md5s": {}}
+            checkpoint.state = state
+            open(path_part, "wb").close()
+        else:
+            logger.debug("Download " + key + " resumed.")
+        hasher = None
+        if bool_verify and ("-" not in etag) and (len(state["ranges"]) == 0):
+            hasher = md5()
+        range_size = part_size or self.__tuner.part_size(k.size)
+        with open(path_part, "r+b") as fp:
+            try:
+                for start, end in missing_ranges(state["ranges"], k.size, \
+                    range_size):
+                    data = self.__request("GET", \
+                        lambda b: self.__get_range(b, key, start, end))
+                    fp.seek(start)
+                    fp.write(data)
+                    fp.flush()
+                    if hasher is not None:
+                        hasher.update(data)
+                    if part_size is not None:
+                        state["md5s"][str(start)] = md5(data).hexdigest()
+                    state["ranges"] = merge_ranges(
+                        state["ranges"] + [[start, end]])
+                    checkpoint.save()
+            except Exception:
+                fp.flush()
+                checkpoint.save(bool_force=True)
+                raise
+        if part_size is not None:
+            computed = composite_etag([state["md5s"][str(start)] \
+                for start in range(0, k.size, part_size)])
+        elif hasher is not None:
+            computed = hasher.hexdigest()
+        else:
+            computed = etag
+        if computed != etag:
+            checkpoint.remove()
+            remove(path_part)
+            raise ValueError("Checksum mismatch of " + key + ".")
+        replace(path_part, path_dest)
+        checkpoint.remove()
+
+
+    def __multipart(self, bucket, mp):
+        # The multipart upload bound to the given connection.
+        output = MultiPartUpload(bucket)
+        output.key_name = mp.key_name
+        output.id = mp.id
+        return output
+
+
+    def __put_file(self, bucket, key, fp):
+        fp.seek(0)
+        bucket.new_key(key).set_contents_from_file(fp)
+
+
+    def __put_part(self, bucket, mp, data, int_part, digests):
+        # The server checks the Content-MD5. With bool_verify_etag the ETag 
+        # is checked here too: a mismatch is sent again. Returns the ETag 
+        # and if it was verified.
+        k = self.__multipart(bucket, mp).upload_part_from_file(
+            BytesIO(data), part_num=int_part, md5=digests)
+        if not self.__etag_verifiable(k):
+            return (k.etag, False)
+        if etag_strip(k.etag) != digests[0]:
+            raise RetryableError("Checksum mismatch of part " + \
+                str(int_part) + ".")
+        return (k.etag, True)
+
+
+    def __etag_verifiable(self, k):
+        # The ETag of the response of the key is compared with the MD5.
+        return self.__bool_verify_etag and etag_is_md5(k.response_headers)
+
+
+    def __get_range(self, bucket, key, start, end):
+        with BytesIO() as b:
+            bucket.new_key(key).get_contents_to_file(
+                b, headers={"Range": "bytes=%d-%d" % (start, end - 1)})
+            return b.getvalue()
+
+
+    def __part_size(self, k):
+        # The part size of a multipart object, None for a single part one 
+        # or if unknown (not uploaded by sdaab).
+        if "-" not in etag_strip(k.etag):
+            return None
+        output = k.get_metadata("sdaab-part-size")
+        return None if output is None else int(output)
+
+
+    def __get_verified(self, bucket, key, fp):
+        # GET with, if bool_verify_etag, the ETag rebuilt while the body is 
+        # written: a mismatch is downloaded again. The ETag and the metadata
+        # come with the headers of the GET, no HEAD before.
+        k = bucket.new_key(key)
+        k.open_read()
+        etag = etag_strip(k.etag)
+        part_size = self.__part_size(k)
+        if not self.__etag_verifiable(k) \
+            or (("-" in etag) and (part_size is None)):
+            k.get_file(fp)
+            return
+        hasher = ETagHasher(part_size)
+        k.get_file(HashingWriter(fp, [hasher]))
+        if hasher.hexdigest() != etag:
+            raise RetryableError("Checksum mismatch of " + key + ".")
+
+
+    def __get_file(self, bucket, key, fp):
+        # The file is rewound: a failed attempt leaves no partial content.
+        fp.seek(0)
+        fp.truncate()
+        self.__get_verified(bucket, key, fp)
+
+
+    def __get_bytes(self, bucket, key):
+        with BytesIO() as b:
+            self.__get_verified(bucket, key, b)
+            return b.getvalue()
+
+
+    def __list_keys(self, prefix):
+        return self.__request(
+            "LIST", lambda b: [x for x in b.list(prefix=prefix)])
+
+
     def __exists(self, key):
-        k = Key(self.__connection_bucket)
-        k.key = key
-        return k.exists()
+        return self.__request(
+            "HEAD", lambda b: Key(b, key).exists(), bool_hedged=True)
 
     
+    def __dirs_add(self, key):
+        # Cache the folders containing the key (the key itself if it ends 
+        # with /), only used with implicit directories.
+        if not self.__bool_implicit_dirs:
+            return
+        folders = []
+        i = key.find("/")
+        while i >= 0:
+            folders.append(key[:i+1])
+            i = key.find("/", i + 1)
+        with self.__dirs_lock:
+            self.__dirs_known.update(folders)
+
+
+    def __dirs_forget(self, prefix):
+        if not self.__bool_implicit_dirs:
+            return
+        with self.__dirs_lock:
+            self.__dirs_known.difference_update(
+                [x for x in self.__dirs_known if x.startswith(prefix)])
+
+
+    def __dirs_knows(self, key):
+        with self.__dirs_lock:
+            return key in self.__dirs_known
+
+
+    def __exists_folder(self, key):
+        # The key ends with /. With implicit directories a folder exists 
+        # if any key starts with it: the answer comes from the cache of 
+        # known folders or from a listing of one key.
+        if key == "":
+            return True
+        if not self.__bool_implicit_dirs:
+            return self.__exists(key)
+        if self.__dirs_knows(key):
+            return True
+        output = len(self.__request(
+            "LIST", lambda b: b.get_all_keys(prefix=key, max_keys=1))) > 0
+        if output:
+            self.__dirs_add(key)
+        return output
+
+    
+    @__remote
+    def __check_folder(self, key):
+        # A folder to scan, "" for the whole bucket.
+        if len(key) > 0:
+            assert self.__exists_folder(key), "Folder not found."
+
+
     def __exists_parent(self, key):
         if (key == "/") or (key == ""):
             return True
@@ -140,9 +726,24 @@ class StorageS3boto(Storage):
         if key_parent[-1] != "/":
             key_parent = key_parent + "/"
         key_parent = key_parent[1:]
-        k = Key(self.__connection_bucket)
-        k.key = key_parent
-        return self.__exists(key_parent)
+        return self.__exists_folder(key_parent)
+
+
+    def __indexed_folder(self, key):
+        # As __exists_folder, from the inventory.
+        if key == "":
+            return True
+        if self.__bool_implicit_dirs:
+            return self.__caches.inventory.any_below(key)
+        return self.__caches.inventory.get(key) is not None
+
+
+    def __size_indexed(self, key):
+        item = self.__caches.inventory.get(key)
+        if item is not None:
+            return item[0]
+        assert self.__indexed_folder(key + "/"), "File/folder not found."
+        return self.__caches.inventory.total_size(key + "/")
 
 
     def get_type(self):
@@ -155,24 +756,83 @@ class StorageS3boto(Storage):
             raise ValueError("get_type failed!")
 
 
+    def get_tuning(self):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            output = self.__tuner.get_state()
+            logger.debug("get_tuning: " + str(output))
+            return output
+        except Exception as e:
+            logger.error("Failed to get the tuning. " + str(e))
+            raise ValueError("get_tuning failed!")
+
+
+    def set_tuning(self, state):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            self.__tuner.set_state(state)
+            logger.debug("set_tuning: " + str(state))
+        except Exception as e:
+            logger.error("Failed to set the tuning. " + str(e))
+            raise ValueError("set_tuning failed!")
+
+
+    def __get_cwd(self):
+        # (current directory, full path): the one of the context if set by 
+        # cwd(), otherwise the one of the instance.
+        output = self.__cwd_var.get()
+        return self.__cwd if output is None else output
+
+
+    def __cd_resolve(self, path):
+        path = str(path)
+        path_full = self.__path_expand(path, bool_file=False)
+        assert self.__exists_folder(self.__rm_lead_slash(path_full)), \
+            "Current directory not found."
+        return ("/" + sub(self.__root_path_full, "", path_full), path_full)
+
+
+    @measured
+    @__remote
     def cd(self, path):
         try:
             assert self.__initialized, "Storage not initialized."
-            path = str(path)
-            path_full = self.__path_expand(path, bool_file=False)
-            assert self.__exists(path_full), "Current directory not found."
-            self.__cd_full = path_full
-            self.__cd = "/" + sub(self.__root_path_full, "", self.__cd_full)
+            cwd = self.__cd_resolve(path)
+            if self.__cwd_var.get() is None:
+                self.__cwd = cwd
+            else:
+                self.__cwd_var.set(cwd)
             logger.debug("cd " + str(path) + ": True")
         except Exception as e:
             logger.error("cd failed. " + str(e))
             raise ValueError("cd failed!")
+
+
+    @__remote
+    def __cwd_enter(self, path):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            cwd = self.__cd_resolve(path)
+            logger.debug("cwd " + str(path) + ": True")
+        except Exception as e:
+            logger.error("cwd failed. " + str(e))
+            raise ValueError("cwd failed!")
+        return self.__cwd_var.set(cwd)
+
+
+    @contextmanager
+    def cwd(self, path):
+        token = self.__cwd_enter(path)
+        try:
+            yield self
+        finally:
+            self.__cwd_var.reset(token)
     
 
     def pwd(self):
         try:
             assert self.__initialized, "Storage not initialized."
-            output = self.__cd
+            output = self.__get_cwd()[0]
             if output != "/" and output[-1] == "/":
                 output = output[:-1]
             logger.debug("pwd: " + output)
@@ -182,22 +842,84 @@ class StorageS3boto(Storage):
             raise ValueError("pwd failed!")
 
 
+    def __ls_iter(self, prefix, page_size, bool_details):
+        # A file and a folder can share the same name: the server lists
+        # them in key order, see unique_sorted.
+        for name, size, mtime in unique_sorted(
+            self.__ls_pages(prefix, page_size)):
+            yield (name, size, mtime) if bool_details else name
+
+
+    def __ls_pages(self, prefix, page_size):
+        # With the delimiter the server returns each subfolder once as a 
+        # common prefix: the content of the subfolders is never listed. 
+        # A page holds its keys, then its common prefixes: merged in key
+        # order up to the end of the page (the next marker, or the last
+        # key if the marker is opaque), the later prefixes wait for the
+        # next page, the ones already passed (listed again) are dropped.
+        marker = ""
+        previous = prefix
+        folders = set()
+        while marker is not None:
+            iterable = self.__request("LIST", lambda b: b.get_all_keys(
+                prefix=prefix, 
+                delimiter="/", 
+                marker=marker, 
+                max_keys=page_size
+            ))
+            last = iterable[-1].name if len(iterable) > 0 else None
+            keys = [x for x in iterable if not isinstance(x, Prefix)]
+            folders.update([x.name for x in iterable if isinstance(x, Prefix)])
+            end = None
+            if iterable.is_truncated and last is not None:
+                marker = iterable.next_marker or last
+                end = marker if marker.startswith(prefix) \
+                    else (keys[-1].name if len(keys) > 0 else None)
+            else:
+                marker = None
+            ready = [x for x in folders if (end is None) or (x <= end)]
+            folders.difference_update(ready)
+            for x in sorted(keys + [Prefix(name=x) for x in ready],
+                key=lambda x: x.name):
+                if x.name <= previous:
+                    continue
+                previous = x.name
+                if isinstance(x, Prefix):
+                    self.__dirs_add(x.name)
+                    yield (x.name[len(prefix):-1], None, None)
+                else:
+                    yield (x.name[len(prefix):], x.size,
+                        timegm(parse_ts(x.last_modified).timetuple()))
+
+
+    def __ls_indexed(self, prefix, page_size, bool_details):
+        # As __ls_iter, from the inventory.
+        for name, size, mtime in self.__caches.inventory.children(prefix):
+            yield (name, size, mtime) if bool_details else name
+
+
+    def __ls_prefix(self, path):
+        # The key of the folder, checked, and whether the inventory answers 
+        # for its content.
+        path_full = self.__path_expand(path, bool_file=False)
+        path_full_4_s3 = self.__rm_lead_slash(path_full) 
+        bool_indexed = self.__caches.indexed(path_full_4_s3)
+        if len(path_full_4_s3) > 0:
+            assert self.__indexed_folder(path_full_4_s3) if bool_indexed \
+                else self.__exists_folder(path_full_4_s3), "Folder not found."
+        return path_full_4_s3, bool_indexed
+
+
+    @measured
+    @__settled
+    @__remote
     def ls(self, path=""):
         try:
             assert self.__initialized, "Storage not initialized."
             path = str(path)
-            path_full = self.__path_expand(path, bool_file=False)
-            path_full_4_s3 = self.__rm_lead_slash(path_full) 
-            if len(path_full_4_s3) > 0:
-                assert self.__exists(path_full_4_s3), "Folder not found."
-                iterable = self.__connection_bucket.list(prefix=path_full_4_s3)
-                output = [x.name for x in iterable]
-                output = [x.name for x in iterable if x.name != path_full_4_s3]
-                output = [sub("^"+path_full_4_s3+"|/.*$", "", x) for x in output]
-            else:
-                iterable = self.__connection_bucket.list()
-                output = [x.name for x in iterable]
-                output = [sub("/.*$", "", x) for x in output]
+            path_full_4_s3, bool_indexed = self.__ls_prefix(path)
+            fn_ls = self.__ls_indexed if bool_indexed else self.__ls_iter
+            output = list(fn_ls(path_full_4_s3, 1000, False))
             logger.debug("ls " + str(path) + ": " + " ".join(output))
             return unique(output)
         except Exception as e:
@@ -205,19 +927,126 @@ class StorageS3boto(Storage):
             raise ValueError("ls failed!")
 
 
+    @measured
+    @__settled
+    @__remote
+    def ls_iter(self, path="", page_size=1000, bool_details=False):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path = str(path)
+            page_size = int(page_size)
+            assert 0 < page_size <= 1000, "Page size out of range."
+            path_full_4_s3, bool_indexed = self.__ls_prefix(path)
+            fn_ls = self.__ls_indexed if bool_indexed else self.__ls_iter
+            logger.debug("ls_iter " + str(path) + ": True")
+        except Exception as e:
+            logger.error("Failed to list objects inside the folder. " + str(e))
+            raise ValueError("ls_iter failed!")
+        return fn_ls(path_full_4_s3, page_size, bool_details)
+
+
+    def __path_storage(self, key):
+        # From the S3 key to the path seen by the storage user.
+        return "/" + key[len(self.__rm_lead_slash(self.__root_path_full)):]
+
+
+    def __keys_iter(self, prefix, page_size=1000, bool_details=False):
+        # All the keys starting with the prefix, folder markers included, 
+        # with bool_details as (key, size, mtime, etag).
+        # One listing page at a time, each page is a request: the 
+        # generator can be resumed later or by another thread.
+        marker = ""
+        while marker is not None:
+            iterable = self.__request("LIST", lambda b: b.get_all_keys(
+                prefix=prefix, 
+                marker=marker, 
+                max_keys=page_size
+            ))
+            last = None
+            for x in iterable:
+                last = x.name
+                if bool_details:
+                    yield (x.name, x.size, 
+                        timegm(parse_ts(x.last_modified).timetuple()), 
+                        etag_strip(x.etag))
+                else:
+                    yield x.name
+            if iterable.is_truncated and last is not None:
+                marker = last
+            else:
+                marker = None
+
+
+    def __walk(self, prefix, regex=None, page_size=1000, bool_indexed=False):
+        if bool_indexed:
+            keys = self.__caches.inventory.keys(prefix, page_size)
+        else:
+            keys = self.__keys_iter(prefix, page_size)
+        for key in keys:
+            if key[-1] == "/":
+                continue
+            path = self.__path_storage(key)
+            if (regex is None) or regex.match(path):
+                yield path
+
+
+    @measured
+    @__settled
+    @__remote
+    def walk(self, path=""):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path = str(path)
+            path_full_4_s3, bool_indexed = self.__ls_prefix(path)
+            logger.debug("walk " + str(path) + ": True")
+        except Exception as e:
+            logger.error("Failed to walk the folder. " + str(e))
+            raise ValueError("walk failed!")
+        return self.__walk(path_full_4_s3, bool_indexed=bool_indexed)
+
+
+    @measured
+    @__remote
+    def glob(self, pattern):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            pattern = str(pattern)
+            assert len(pattern) > 0, "Empty pattern."
+            if pattern[0] != "/":
+                pattern = self.__get_cwd()[0] + "/" + pattern
+            pattern = sub('[/]+', '/', pattern)
+            assert ".." not in pattern.split("/"), "Invalid pattern."
+            regex = glob_to_regex(pattern)
+            prefix = self.__rm_lead_slash(self.__root_path_full) \
+                + glob_literal_prefix(pattern)[1:]
+            self.__caches.settle(prefix, bool_literal=True)
+            logger.debug("glob " + pattern + ": True")
+        except Exception as e:
+            logger.error("Failed to glob. " + str(e))
+            raise ValueError("glob failed!")
+        return self.__walk(
+            prefix, regex, bool_indexed=self.__caches.indexed(prefix))
+
+
+    @measured
+    @__remote
     def exists(self, path):
         try:
             assert self.__initialized, "Storage not initialized."
             path = str(path)
             path_full = self.__path_expand(path, bool_file=True)
             path_full = self.__rm_lead_slash(path_full)
-            k = Key(self.__connection_bucket)
-            k.key = path_full
-            if k.exists():
+            if self.__caches.queued(path_full) is not None:
+                output = True
+            elif self.__caches.indexed(path_full):
+                output = (self.__caches.inventory.get(path_full) is not None) \
+                    or self.__indexed_folder(path_full + "/")
+            elif self.__caches.negative.is_absent(path_full):
+                output = False
+            elif self.__exists(path_full):
                 output = True
             else:
-                k.key = path_full + "/"
-                output = k.exists()
+                output = self.__exists_folder(path_full + "/")
             logger.debug("exists " + str(path) + ": " + str(output))
             return output
         except Exception as e:
@@ -225,6 +1054,8 @@ class StorageS3boto(Storage):
             raise ValueError("exists failed!")
 
 
+    @measured
+    @__remote
     def mkdir(self, path):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -232,19 +1063,27 @@ class StorageS3boto(Storage):
             path = safe_folder_path_str(path)
             path_full = self.__path_expand(path, bool_file=False)
             path_full_4_s3 = self.__rm_lead_slash(path_full)
-            assert not self.__exists(path_full_4_s3), \
-                "Directory already exists."
-            assert self.__exists_parent(path_full_4_s3), \
-                "Parent folder not found"
-            k = self.__connection_bucket.new_key(path_full_4_s3)
-            k.set_contents_from_string('')
-            assert self.__exists(path_full_4_s3), "Directory check failed."
+            if self.__bool_implicit_dirs:
+                # mkdir -p: one PUT of the marker, kept for empty folders.
+                self.__request("PUT", lambda b: b.new_key(path_full_4_s3)\
+                    .set_contents_from_string(''))
+                self.__dirs_add(path_full_4_s3)
+            else:
+                assert not self.__exists(path_full_4_s3), \
+                    "Directory already exists."
+                assert self.__exists_parent(path_full_4_s3), \
+                    "Parent folder not found"
+                self.__request("PUT", lambda b: b.new_key(path_full_4_s3)\
+                    .set_contents_from_string(''))
+            self.__caches.put(path_full_4_s3, 0)
             logger.debug("mkdir " + str(path) + ": True")
         except Exception as e:
             logger.error("Failed to create the directory. " + str(e))  
             raise ValueError("mkdir failed!")
 
 
+    @measured
+    @__remote
     def upload(self, path_source, path_dest):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -253,42 +1092,46 @@ class StorageS3boto(Storage):
             path_dest = safe_file_path_str(path_dest)
             path_full = self.__path_expand(path_dest, bool_file=True)
             path_full_4_s3 = self.__rm_lead_slash(path_full)
+            # A queued write of the destination ends before the checks.
+            self.__caches.settle(path_full_4_s3)
             assert self.__exists_parent(path_full_4_s3), \
                 "Parent folder not found."
             assert isfile(path_source), "Source file not found."
             assert not self.__exists(path_full_4_s3), \
                 "Destination file already exists."
-            assert not self.__exists(path_full_4_s3 + "/"), \
+            assert not self.__exists_folder(path_full_4_s3 + "/"), \
                 "Destination folder already exists."
             source_size = stat(path_source).st_size
-            if source_size == 0:
-                k = self.__connection_bucket.new_key(path_full_4_s3)
-                with open(path_source, "rb") as fp:
-                    k.set_contents_from_file(fp)
-            else:
-                chunk_size = 5242880
-                mp = self.__connection_bucket\
-                    .initiate_multipart_upload(path_full_4_s3)
-                chunk_count = int(ceil(source_size / float(chunk_size)))
-                for i in range(chunk_count):
-                    offset = chunk_size * i
-                    int_bytes = min(chunk_size, source_size - offset)
-                    with FileChunkIO(
-                        path_source, 
-                        'r', 
-                        offset=offset, 
-                        bytes=int_bytes
-                    ) as fp:
-                        mp.upload_part_from_file(fp, part_num=i + 1)
-                mp.complete_upload()
-            assert self.__exists(path_full_4_s3), \
-                "Destination file check failed."
+            with open(path_source, "rb") as fp:
+                if source_size == 0:
+                    self.__request("PUT", \
+                        lambda b: self.__put_file(b, path_full_4_s3, fp))
+                else:
+                    self.__upload_multipart(
+                        path_full_4_s3, 
+                        source_size, 
+                        lambda offset, int_bytes: \
+                            read_at(fp, offset, int_bytes),
+                        self.__checkpoint(
+                            "upload", 
+                            self.__bucket, 
+                            path_full_4_s3, 
+                            abspath(path_source), 
+                            source_size, 
+                            stat(path_source).st_mtime_ns
+                        )
+                    )
+            self.__metrics.add_bytes(int_written=source_size)
+            self.__dirs_add(path_full_4_s3)
+            self.__caches.put(path_full_4_s3, source_size)
             logger.debug("upload " + str(path_dest) + ": True")
         except Exception as e:
             logger.error("Failed to upload. " + str(e))  
             raise ValueError("upload failed!")
 
 
+    @measured
+    @__remote
     def download(self, path_source, path_dest):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -297,20 +1140,33 @@ class StorageS3boto(Storage):
             path_source = safe_file_path_str(path_source)
             path_full = self.__path_expand(path_source, bool_file=True)
             path_full_4_s3 = self.__rm_lead_slash(path_full)
-            assert self.__exists(path_full_4_s3), "Source file not found."
+            content = self.__caches.queued(path_full_4_s3)
+            assert (content is not None) or self.__exists(path_full_4_s3), \
+                "Source file not found."
             assert not isfile(path_dest), "Destination file already exists."
             assert not isdir(path_dest), "Destination folder already exists."
-            with open(path_dest, "wb") as fp:
-                self.__connection_bucket\
-                    .get_key(path_full_4_s3)\
-                    .get_contents_to_file(fp)
+            checkpoint = self.__checkpoint(
+                "download", self.__bucket, path_full_4_s3, abspath(path_dest))
+            if content is not None:
+                with open(path_dest, "wb") as fp:
+                    fp.write(content)
+            elif checkpoint is None:
+                with open(path_dest, "wb") as fp:
+                    self.__request("GET", \
+                        lambda b: self.__get_file(b, path_full_4_s3, fp))
+            else:
+                self.__download_ranges(path_full_4_s3, path_dest, checkpoint)
             assert isfile(path_dest), "Destination file check failed."
+            self.__metrics.add_bytes(int_read=stat(path_dest).st_size)
             logger.debug("download " + str(path_source) + ": True")
         except Exception as e:
             logger.error("Failed to download. " + str(e)) 
             raise ValueError("download failed!")
 
 
+    @measured
+    @__settled
+    @__remote
     def rm(self, path):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -320,21 +1176,23 @@ class StorageS3boto(Storage):
             path_full_4_s3 = self.__rm_lead_slash(path_full)
             assert len(path_full_4_s3) > 0, "Nothing to remove."
             if self.__exists(path_full_4_s3):
-                self.__connection_bucket.delete_key(path_full_4_s3)
-                assert not self.__exists(path_full_4_s3), \
-                    "File/folder still exists."
-            iterable = self.__connection_bucket\
-                .list(prefix=path_full_4_s3+"/")
+                self.__request("DELETE", \
+                    lambda b: b.delete_key(path_full_4_s3))
+            iterable = self.__list_keys(path_full_4_s3 + "/")
             output = [x.name for x in iterable]
             for k in output:
-                self.__connection_bucket.delete_key(k)
-                assert not self.__exists(k), "File/folder still exists."
+                self.__request("DELETE", lambda b: b.delete_key(k))
+            self.__dirs_forget(path_full_4_s3 + "/")
+            self.__caches.remove(path_full_4_s3)
             logger.debug("rm " + str(path) + ": True")
         except Exception as e:
             logger.error("Failed to remove the file/folder. " + str(e))
             raise ValueError("rm failed!") 
 
 
+    @measured
+    @__settled
+    @__remote
     def size(self, path):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -342,14 +1200,18 @@ class StorageS3boto(Storage):
             path = safe_file_path_str(path)
             path_full = self.__path_expand(path, bool_file=True)
             path_full_4_s3 = self.__rm_lead_slash(path_full)
-            if self.__exists(path_full_4_s3):
-                output = self.__connection_bucket.get_key(path_full_4_s3).size
-            elif self.__exists(path_full_4_s3 + "/"):
-                iterable = self.__connection_bucket\
-                    .list(prefix=path_full_4_s3 + "/")
-                output = sum([x.size for x in iterable])
+            if self.__caches.indexed(path_full_4_s3):
+                output = self.__size_indexed(path_full_4_s3)
             else:
-                raise ValueError( "File/folder not found.")
+                k = self.__request("HEAD", \
+                    lambda b: b.get_key(path_full_4_s3), bool_hedged=True)
+                if k is not None:
+                    output = k.size
+                elif self.__exists_folder(path_full_4_s3 + "/"):
+                    iterable = self.__list_keys(path_full_4_s3 + "/")
+                    output = sum([x.size for x in iterable])
+                else:
+                    raise ValueError( "File/folder not found.")
             logger.debug("size " + str(path) + ": " + str(output))
             return output
         except Exception as e:
@@ -357,40 +1219,91 @@ class StorageS3boto(Storage):
             raise ValueError("size failed!")
 
 
+    @__remote
+    def __put_key(self, key, content):
+        assert not self.__exists(key), "File already exists."
+        assert not self.__exists_folder(key + "/"), "Folder already exists."
+        if len(content) == 0:
+            self.__request("PUT", lambda b: b.new_key(key)\
+                .set_contents_from_string(""))
+        else:
+            self.__upload_multipart(
+                key, 
+                len(content), 
+                lambda offset, int_bytes: \
+                    memoryview(content)[offset:offset+int_bytes]
+            )
+        self.__metrics.add_bytes(int_written=len(content))
+        self.__dirs_add(key)
+        self.__caches.put(key, len(content))
+
+
+    def __put_behind(self, key, content):
+        # Run by the write-behind workers, the error ends in the future.
+        try:
+            self.__put_key(key, content)
+        except Exception as e:
+            logger.error("Failed to upload. " + str(e))
+            raise ValueError("upload_from_memory failed!")
+
+
+    @__remote
+    def __get_key(self, key, bool_check=True):
+        # Also run by the prefetch workers, without the check.
+        if bool_check:
+            assert self.__exists(key), "File not found."
+        return self.__request("GET", \
+            lambda b: self.__get_bytes(b, key), bool_hedged=True)
+
+
+    @__remote
+    def __list_files(self, folder):
+        # The files of a folder, for the sequential-read detector.
+        return [folder + x[0] for x in self.__ls_iter(folder, 1000, True) \
+            if x[1] is not None]
+
+
+    def __settle(self, path):
+        try:
+            key = self.__key(path, bool_file=False)
+        except Exception:
+            # The method reports the error, wait for all the writes.
+            key = ""
+        self.__caches.settle(key)
+
+
+    @measured
     def upload_from_memory(self, variable, path, bool_bin=False):
+        '''
+        With int_write_behind the write is only queued: the returned 
+        concurrent.futures.Future resolves once it is uploaded, flush 
+        waits for all of them. Until then the reads of the path return 
+        the queued content. Otherwise the upload ends before returning.
+        '''
         try:
             assert self.__initialized, "Storage not initialized."
             path = str(path)
             path = safe_file_path_str(path)
             path_full = self.__path_expand(path, bool_file=True)
             path_full_4_s3 = self.__rm_lead_slash(path_full)
-            assert not self.__exists(path_full_4_s3), "File already exists."
-            assert not self.__exists(path_full_4_s3 + "/"), "Folder already exists."
             if bool_bin:
                 content=variable
             else:
                 content = pickle.dumps(variable)
-            if len(content) == 0:
-                k = self.__connection_bucket.new_key(path_full_4_s3)
-                k.set_contents_from_string("")
-            else:
-                mp = self.__connection_bucket.initiate_multipart_upload(path_full_4_s3)
-                chunk_size = 5242880
-                source_size = len(content)
-                chunk_count = int(ceil(source_size / float(chunk_size)))
-                for i in range(chunk_count):
-                    offset = chunk_size * i
-                    int_bytes = min(chunk_size, source_size - offset)
-                    fp = BytesIO(content[offset:offset+int_bytes])
-                    mp.upload_part_from_file(fp, part_num=i+1)
-                mp.complete_upload()
-            assert self.__exists(path_full_4_s3), "File check failed."
+            # With write-behind the checks and the upload run in a worker,
+            # the errors end in the future and in flush.
+            output = self.__caches.submit(path_full_4_s3, content)
+            if output is not None:
+                logger.debug("upload_from_memory " + str(path) + ": queued")
+                return output
+            self.__put_key(path_full_4_s3, content)
             logger.debug("upload_from_memory " + str(path) + ": True")
         except Exception as e:
             logger.error("Failed to upload. " + str(e))  
             raise ValueError("upload_from_memory failed!")
 
 
+    @measured
     def download_to_memory(self, path, bool_bin=False):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -398,15 +1311,16 @@ class StorageS3boto(Storage):
             path = safe_file_path_str(path)
             path_full = self.__path_expand(path, bool_file=True)
             path_full_4_s3 = self.__rm_lead_slash(path_full)
-            assert self.__exists(path_full_4_s3), "File not found."
-            with BytesIO() as b:
-                k = self.__connection_bucket.get_key(path_full_4_s3)
-                k.get_file(b)
-                b.seek(0)
-                if bool_bin:
-                    output = b.read()
-                else:
-                    output = pickle.loads(b.read())
+            content = self.__caches.queued(path_full_4_s3)
+            if content is None:
+                content = self.__caches.take(path_full_4_s3)
+            if content is None:
+                content = self.__get_key(path_full_4_s3)
+            if bool_bin:
+                output = content
+            else:
+                output = pickle.loads(content)
+            self.__metrics.add_bytes(int_read=len(content))
             logger.debug("download_to_memory " + str(path) + ": True")
             return output
         except Exception as e:
@@ -414,6 +1328,41 @@ class StorageS3boto(Storage):
             raise ValueError("download_to_memory failed!")
 
 
+    def __copy_keys(self, key_source, key_dest, bool_remove=False):
+        # Copy (move with bool_remove) a file, or a folder one key at a 
+        # time, and record the keys written.
+        if self.__exists(key_source) and not self.__exists(key_dest):
+            self.__request("COPY", \
+                lambda b: b.copy_key(key_dest, self.__bucket, key_source))
+            if bool_remove:
+                self.__request("DELETE", lambda b: b.delete_key(key_source))
+            keys = [key_dest]
+        else:
+            assert self.__exists_folder(key_source + "/") \
+                and not self.__exists_folder(key_dest + "/"), \
+                "Source not found or destination already exists."
+            iterable = self.__list_keys(key_source + "/")
+            array_sources = [x.name for x in iterable]
+            keys = [sub("^" + key_source, key_dest, x) for x in array_sources]
+            for item_dest in keys:
+                assert not self.__exists(item_dest), \
+                    "Destination already exists."
+            for item_source, item_dest in zip(array_sources, keys):
+                self.__request("COPY", lambda b: \
+                    b.copy_key(item_dest, self.__bucket, item_source))
+                if bool_remove:
+                    self.__request("DELETE", \
+                        lambda b: b.delete_key(item_source))
+        if bool_remove:
+            self.__dirs_forget(key_source + "/")
+        self.__dirs_add(key_dest)
+        self.__caches.copy(
+            key_source, key_dest, keys=keys, bool_remove=bool_remove)
+
+
+    @measured
+    @__settled
+    @__remote
     def rename(self, path_source, path_dest):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -427,38 +1376,8 @@ class StorageS3boto(Storage):
             assert Path(path_dest_full_4_s3).parent \
                 == Path(path_source_full_4_s3).parent, \
                 "Different parent directories."
-            if self.__exists(path_source_full_4_s3) \
-                and not self.__exists(path_dest_full_4_s3):
-                self.__connection_bucket.copy_key(
-                    path_dest_full_4_s3, 
-                    self.__bucket, 
-                    path_source_full_4_s3
-                )
-                self.__connection_bucket.delete_key(path_source_full_4_s3)
-            else:
-                assert self.__exists(path_source_full_4_s3+"/") \
-                    and not self.__exists(path_dest_full_4_s3+"/"), \
-                    "Source not found or destination already exists."
-                iterable = self.__connection_bucket\
-                    .list(prefix=path_source_full_4_s3+"/")
-                array_sources = [x.name for x in iterable]
-                array_dests = [sub("^"+path_source_full_4_s3, \
-                    path_dest_full_4_s3, x) \
-                    for x in array_sources]
-                for item_dest in array_dests:
-                    assert not self.__exists(item_dest), \
-                        "Destination already exists."
-                for j, item_source in enumerate(array_sources):
-                    self.__connection_bucket.copy_key(
-                        array_dests[j], 
-                        self.__bucket, 
-                        item_source
-                    )
-                    self.__connection_bucket.delete_key(item_source)
-                    assert self.__exists(array_dests[j]), \
-                        "Destination check failed."
-                    assert not self.__exists(item_source), \
-                        "Source check failed."
+            self.__copy_keys(
+                path_source_full_4_s3, path_dest_full_4_s3, bool_remove=True)
             logger.debug("rename " + str(path_source) + \
                 " --> " + str(path_dest))
         except Exception as e:
@@ -466,6 +1385,9 @@ class StorageS3boto(Storage):
             raise ValueError("rename failed!")
 
 
+    @measured
+    @__settled
+    @__remote
     def mv(self, path_source, path_dest):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -476,38 +1398,8 @@ class StorageS3boto(Storage):
             path_dest = safe_file_path_str(path_dest)
             path_dest_full = self.__path_expand(path_dest, bool_file=True)
             path_dest_full_4_s3 = self.__rm_lead_slash(path_dest_full)
-            if self.__exists(path_source_full_4_s3) \
-                and not self.__exists(path_dest_full_4_s3):
-                self.__connection_bucket.copy_key(
-                    path_dest_full_4_s3, 
-                    self.__bucket, 
-                    path_source_full_4_s3
-                )
-                self.__connection_bucket.delete_key(path_source_full_4_s3)
-            else:
-                assert self.__exists(path_source_full_4_s3+"/") \
-                    and not self.__exists(path_dest_full_4_s3+"/"), \
-                    "Source not found or destination already exists."
-                iterable = self.__connection_bucket\
-                    .list(prefix=path_source_full_4_s3+"/")
-                array_sources = [x.name for x in iterable]
-                array_dests = [sub("^"+path_source_full_4_s3, \
-                    path_dest_full_4_s3, x) \
-                    for x in array_sources]
-                for item_dest in array_dests:
-                    assert not self.__exists(item_dest), \
-                        "Destination already exists."
-                for j, item_source in enumerate(array_sources):
-                    self.__connection_bucket.copy_key(
-                        array_dests[j], 
-                        self.__bucket, 
-                        item_source
-                    )
-                    self.__connection_bucket.delete_key(item_source)
-                    assert self.__exists(array_dests[j]), \
-                        "Destination check failed."
-                    assert not self.__exists(item_source), \
-                        "Source check failed."
+            self.__copy_keys(
+                path_source_full_4_s3, path_dest_full_4_s3, bool_remove=True)
             logger.debug("mv " + str(path_source) + \
                 " --> " + str(path_dest))
         except Exception as e:
@@ -515,6 +1407,9 @@ class StorageS3boto(Storage):
             raise ValueError("mv failed!")
 
 
+    @measured
+    @__settled
+    @__remote
     def cp(self, path_source, path_dest):
         try:
             assert self.__initialized, "Storage not initialized."
@@ -525,36 +1420,7 @@ class StorageS3boto(Storage):
             path_dest = safe_file_path_str(path_dest)
             path_dest_full = self.__path_expand(path_dest, bool_file=True)
             path_dest_full_4_s3 = self.__rm_lead_slash(path_dest_full)
-            if self.__exists(path_source_full_4_s3) \
-                and not self.__exists(path_dest_full_4_s3):
-                self.__connection_bucket.copy_key(
-                    path_dest_full_4_s3, 
-                    self.__bucket, 
-                    path_source_full_4_s3
-                )
-            else:
-                assert self.__exists(path_source_full_4_s3+"/") \
-                    and not self.__exists(path_dest_full_4_s3+"/"), \
-                    "Source not found or destination already exists."
-                iterable = self.__connection_bucket\
-                    .list(prefix=path_source_full_4_s3+"/")
-                array_sources = [x.name for x in iterable]
-                array_dests = [sub("^"+path_source_full_4_s3, \
-                    path_dest_full_4_s3, x) \
-                    for x in array_sources]
-                for item_dest in array_dests:
-                    assert not self.__exists(item_dest), \
-                        "Destination already exists."
-                for j, item_source in enumerate(array_sources):
-                    self.__connection_bucket.copy_key(
-                        array_dests[j], 
-                        self.__bucket, 
-                        item_source
-                    )
-                    assert self.__exists(array_dests[j]), \
-                        "Destination check failed."
-                    assert self.__exists(item_source), \
-                        "Source check failed."
+            self.__copy_keys(path_source_full_4_s3, path_dest_full_4_s3)
             logger.debug("cp " + str(path_source) + \
                 " --> " + str(path_dest))
         except Exception as e:
@@ -562,6 +1428,42 @@ class StorageS3boto(Storage):
             raise ValueError("cp failed!")
 
 
+    @measured
+    @__remote
+    def sweep_uploads(self, float_age=86400.0):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            float_age = float(float_age)
+            prefix = self.__rm_lead_slash(self.__root_path_full)
+            now = time()
+            output = []
+            markers = {}
+            while True:
+                page = self.__request("LIST", lambda b: \
+                    b.get_all_multipart_uploads(prefix=prefix, **markers))
+                for mp in page:
+                    initiated = timegm(parse_ts(mp.initiated).timetuple())
+                    if now - initiated < float_age:
+                        continue
+                    self.__request("DELETE", lambda b: \
+                        b.cancel_multipart_upload(mp.key_name, mp.id))
+                    output.append(self.__path_storage(mp.key_name))
+                if not page.is_truncated:
+                    break
+                markers = {
+                    "key_marker": page.next_key_marker, 
+                    "upload_id_marker": page.next_upload_id_marker
+                }
+            logger.debug("sweep_uploads: " + " ".join(output))
+            return output
+        except Exception as e:
+            logger.error("Failed to sweep the uploads. " + str(e))
+            raise ValueError("sweep_uploads failed!")
+
+
+    @measured
+    @__settled
+    @__remote
     def append(self, path, content):
         try:
             logger.warning("Not the most efficient implementation, improve it!")
@@ -572,9 +1474,7 @@ class StorageS3boto(Storage):
             path = safe_file_path_str(path)
             path_full = self.__path_expand(path, bool_file=True)
             path_full = self.__rm_lead_slash(path_full)
-            k = Key(self.__connection_bucket)
-            k.key = path_full
-            assert k.exists(), "File not found."
+            assert self.__exists(path_full), "File not found."
             content_old = self.download_to_memory(path=path)
             assert type(content_old) == str, \
                 "It is only possible to append to strings!"
@@ -0,0 +1,99 @@
+from array import array
+
+
+class Listing():
+    '''
+    Compact result of a folder listing.
+
+    The names are packed in one UTF-8 buffer with an array of offsets,
+    sizes and modification times are kept in typed arrays (-1 and nan when
+    unknown, e.g. for folders). A listing of millions of entries costs a
+    few bytes per entry instead of one Python string each.
+    '''
+
+
+    def __init__(self, bool_details=False):
+        self.__names = bytearray()
+        self.__offsets = array("Q", [0])
+        self.__bool_details = bool(bool_details)
+        self.__sizes = array("q")
+        self.__mtimes = array("d")
+
+
+    @classmethod
+    def from_iter(cls, iterable, bool_details=False):
+        '''
+        Build the listing from the output of ls_iter.
+
+        Parameters
+        ----------
+        iterable : iterable
+            Names, or (name, size, mtime) tuples if bool_details is True.
+        bool_details : bool, optional
+            Whether sizes and modification times are provided, by default
+            False
+
+        Returns
+        -------
+        Listing
+            The compact listing.
+        '''
+        output = cls(bool_details=bool_details)
+        for item in iterable:
+            if bool_details:
+                output.append(item[0], item[1], item[2])
+            else:
+                output.append(item)
+        return output
+
+
+    def append(self, name, size=None, mtime=None):
+        self.__names += str(name).encode("utf-8")
+        self.__offsets.append(len(self.__names))
+        if self.__bool_details:
+            self.__sizes.append(-1 if size is None else int(size))
+            self.__mtimes.append(
+                float("nan") if mtime is None else float(mtime))
+
+
+    def __len__(self):
+        return len(self.__offsets) - 1
+
+
+    def __getitem__(self, i):
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("Listing index out of range.")
+        return self.__names[self.__offsets[i]:self.__offsets[i+1]]\
+            .decode("utf-8")
+
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+    def __contains__(self, name):
+        return any(x == name for x in self)
+
+
+    def names(self):
+        return list(self)
+
+
+    def sizes(self):
+        assert self.__bool_details, "Listing without details."
+        return self.__sizes
+
+
+    def mtimes(self):
+        assert self.__bool_details, "Listing without details."
+        return self.__mtimes
+
+
+    def nbytes(self):
+        return len(self.__names) + self.__offsets.itemsize * \
+            len(self.__offsets) + self.__sizes.itemsize * len(self.__sizes) \
+            + self.__mtimes.itemsize * len(self.__mtimes)
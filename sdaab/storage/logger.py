@@ -0,0 +1,7 @@
+from ..utils.get_logger import get_logger
+
+
+logger = get_logger("sdaab_storage")
+'''
+The custom logger for this sub-package.
+'''
\ No newline at end of file
@@ -0,0 +1,186 @@
+from .storage import Storage
+from .logger import logger
+from ..utils.metrics import measured
+from ..utils.deadline import deadline
+
+
+class RemoteStorage(Storage):
+    '''
+    The methods of the local caches shared by the remote backends (S3boto,
+    S3BDL).
+
+    The backend builds its utils.caches.RemoteCaches from its key
+    callables and passes it to RemoteStorage.__init__, it keeps it up to
+    date with its own writes. fn_key(path, bool_file) returns the key of
+    a path of the storage, fn_folder(key) checks that a folder to scan
+    exists ("" for the whole bucket). The scans run within float_deadline.
+    '''
+
+
+    def __init__(self, caches, fn_key, fn_folder, float_deadline=None):
+        self.__caches = caches
+        self.__fn_key = fn_key
+        self.__fn_folder = fn_folder
+        self.__float_deadline = float_deadline
+
+
+    def __keys(self, paths):
+        return [self.__fn_key(x, True) for x in paths]
+
+
+    @measured
+    def prefetch(self, paths):
+        '''
+        Read the files ahead, in order, for the next download_to_memory 
+        calls. Needs int_prefetch_depth: at most that many reads run or 
+        wait to be used, within int_prefetch_bytes.
+        '''
+        try:
+            assert self.initialized(), "Storage not initialized."
+            assert self.__caches.prefetcher is not None, \
+                "Prefetch not enabled."
+            keys = self.__keys(paths)
+            self.__caches.prefetcher.prefetch(keys)
+            logger.debug("prefetch " + str(len(keys)) + " files: True")
+        except Exception as e:
+            logger.error("Failed to prefetch. " + str(e))
+            raise ValueError("prefetch failed!")
+
+
+    @measured
+    def warm(self, path=""):
+        '''
+        prefetch of all the files inside the folder, recursively, in the 
+        order of walk.
+        '''
+        try:
+            assert self.initialized(), "Storage not initialized."
+            assert self.__caches.prefetcher is not None, \
+                "Prefetch not enabled."
+            self.__caches.prefetcher.prefetch(self.__keys(self.walk(path)))
+            logger.debug("warm " + str(path) + ": True")
+        except Exception as e:
+            logger.error("Failed to warm. " + str(e))
+            raise ValueError("warm failed!")
+
+
+    def cancel_prefetch(self, paths=None):
+        '''
+        Drop the reads ahead of the files (all by default), used or not.
+        '''
+        try:
+            assert self.initialized(), "Storage not initialized."
+            if self.__caches.prefetcher is not None:
+                self.__caches.prefetcher.cancel(
+                    None if paths is None else self.__keys(paths))
+            logger.debug("cancel_prefetch: True")
+        except Exception as e:
+            logger.error("Failed to cancel the prefetch. " + str(e))
+            raise ValueError("cancel_prefetch failed!")
+
+
+    def prefetch_stats(self):
+        '''
+        Counters of the reads ahead, see utils.prefetch.Prefetcher.stats, 
+        None without int_prefetch_depth.
+        '''
+        if self.__caches.prefetcher is None:
+            return None
+        return self.__caches.prefetcher.stats()
+
+
+    @measured
+    def build_negative_cache(
+        self, path="", float_ttl=3600.0, float_fp_rate=0.01):
+        '''
+        List the folder, recursively, into a Bloom filter: then exists
+        answers False without requests for the paths inside it missing from
+        the filter. The writes of this instance are added to the filter
+        (below the folders copied by the server everything is checked with
+        requests), the ones of other clients are seen at the rebuild, done
+        in the background after float_ttl seconds (None for never). The
+        deleted files stay in the filter until then and are checked with
+        requests.
+        '''
+        try:
+            assert self.initialized(), "Storage not initialized."
+            key = self.__fn_key(path, False)
+            with deadline(self.__float_deadline):
+                self.__fn_folder(key)
+                self.__caches.negative.build(key, float_ttl, float_fp_rate)
+            logger.debug("build_negative_cache " + str(path) + ": True")
+        except Exception as e:
+            logger.error("Failed to build the negative cache. " + str(e))
+            raise ValueError("build_negative_cache failed!")
+
+
+    def negative_cache_stats(self):
+        '''
+        Counters of the negative cache, see utils.bloom.NegativeCache.stats.
+        '''
+        return self.__caches.negative.stats()
+
+
+    @measured
+    def refresh_inventory(self, path=""):
+        '''
+        Scan the folder, recursively, into the inventory (path_inventory):
+        then ls, ls_iter, size, exists, walk and glob inside it are answered
+        by the index for float_inventory_age seconds, or within the bound of
+        utils.inventory.staleness. The writes of this instance are recorded,
+        the ones of other clients are seen at the next refresh, which only
+        rescans the folder asked.
+        '''
+        try:
+            assert self.initialized(), "Storage not initialized."
+            assert self.__caches.inventory is not None, \
+                "Inventory not enabled."
+            key = self.__fn_key(path, False)
+            # The queued writes below the folder end before the scan.
+            self.__caches.settle(key)
+            with deadline(self.__float_deadline):
+                self.__fn_folder(key)
+                self.__caches.inventory.refresh(key)
+            if (len(key) > 0) and (self.__caches.inventory.get(key) is None):
+                # The folder itself, when the scan does not list it (e.g.
+                # the walk/ endpoint of S3BDL).
+                self.__caches.inventory.put(key, None)
+            logger.debug("refresh_inventory " + str(path) + ": True")
+        except Exception as e:
+            logger.error("Failed to refresh the inventory. " + str(e))
+            raise ValueError("refresh_inventory failed!")
+
+
+    def inventory_stats(self):
+        '''
+        Counters of the inventory, see utils.inventory.Inventory.stats, 
+        None without path_inventory.
+        '''
+        if self.__caches.inventory is None:
+            return None
+        return self.__caches.inventory.stats()
+
+
+    def flush(self):
+        '''
+        Block until the writes queued with int_write_behind are uploaded.
+        Fails if any of them failed since the previous flush.
+        '''
+        try:
+            assert self.initialized(), "Storage not initialized."
+            self.__caches.flush()
+            logger.debug("flush: True")
+        except Exception as e:
+            logger.error("Failed to flush. " + str(e))
+            raise ValueError("flush failed!")
+
+
+    def close(self):
+        '''
+        flush, then stop the write-behind and the prefetch workers and close
+        the inventory.
+        '''
+        try:
+            self.flush()
+        finally:
+            self.__caches.close()
@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from .listing import Listing
 
 
 class Storage(ABC):
@@ -14,6 +15,11 @@ class Storage(ABC):
         pass
 
 
+    @abstractmethod
+    def metrics(self):
+        pass
+
+
     @abstractmethod
     def cd(self):
         pass
@@ -29,6 +35,28 @@ class Storage(ABC):
         pass
 
 
+    @abstractmethod
+    def ls_iter(self):
+        pass
+
+
+    def ls_compact(self, path="", page_size=1000, bool_details=False):
+        return Listing.from_iter(
+            self.ls_iter(path, page_size=page_size, bool_details=bool_details),
+            bool_details=bool_details
+        )
+
+
+    @abstractmethod
+    def walk(self):
+        pass
+
+
+    @abstractmethod
+    def glob(self):
+        pass
+
+
     @abstractmethod
     def exists(self):
         pass
@@ -0,0 +1,98 @@
+from concurrent.futures import ProcessPoolExecutor
+from .logger import logger
+
+
+worker_storage = None
+'''
+The storage object of the worker process, unpickled once by init_worker.
+'''
+
+
+def init_worker(storage):
+    global worker_storage
+    worker_storage = storage
+
+
+def worker_upload(args):
+    try:
+        worker_storage.upload(args[0], args[1])
+        return None
+    except Exception as e:
+        return str(args[1]) + ": " + str(e)
+
+
+def worker_download(args):
+    try:
+        worker_storage.download(args[0], args[1])
+        return None
+    except Exception as e:
+        return str(args[0]) + ": " + str(e)
+
+
+class TransferExecutor():
+    '''
+    Bulk uploads and downloads fanned out across processes.
+
+    The storage object is pickled once per worker process (only its 
+    configuration, it reconnects lazily in the worker), then each task 
+    sends just the two paths. Pickling, hashing and the other CPU bound 
+    work of the transfers are not limited by the GIL of one process.
+    '''
+
+
+    def __init__(self, storage, int_workers=None, int_chunk_size=8):
+        self.__int_chunk_size = int(int_chunk_size)
+        self.__executor = ProcessPoolExecutor(
+            max_workers=int_workers,
+            initializer=init_worker,
+            initargs=(storage,)
+        )
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def close(self):
+        self.__executor.shutdown(wait=True)
+
+
+    def __run(self, fn, name, pairs):
+        errors = [x for x in self.__executor.map(
+            fn, 
+            [(str(x[0]), str(x[1])) for x in pairs], 
+            chunksize=self.__int_chunk_size
+        ) if x is not None]
+        if len(errors) > 0:
+            logger.error(name + ": " + str(len(errors)) + " failed. " \
+                + " ".join(errors))
+            raise ValueError(name + " failed!")
+        logger.debug(name + ": True")
+
+
+    def upload_many(self, pairs):
+        '''
+        Upload local files.
+
+        Parameters
+        ----------
+        pairs : iterable
+            (local source path, storage destination path) pairs.
+        '''
+        self.__run(worker_upload, "upload_many", pairs)
+
+
+    def download_many(self, pairs):
+        '''
+        Download files to the local disk.
+
+        Parameters
+        ----------
+        pairs : iterable
+            (storage source path, local destination path) pairs.
+        '''
+        self.__run(worker_download, "download_many", pairs)
@@ -0,0 +1,70 @@
+import sqlite3
+from os import makedirs
+from os.path import dirname
+from pathlib import Path
+from threading import Lock
+from .logger import logger
+
+
+class FlushJournal():
+    '''
+    Persistent list of the files of the fast tier not yet flushed to the
+    slow one, see StorageTiered.
+
+    The journal is a SQLite table: a write adds a row, a flush removes it,
+    the cost does not grow with the number of files not yet flushed. add
+    returns once the row is synced to the disk.
+    '''
+
+
+    def __init__(self, path_journal):
+        self.__path_journal = Path(str(path_journal)).resolve()
+        makedirs(dirname(str(self.__path_journal)), exist_ok=True)
+        self.__lock = Lock()
+        self.__db = sqlite3.connect(
+            str(self.__path_journal), timeout=30.0, check_same_thread=False)
+        try:
+            with self.__db:
+                # Unlike a cache, the journal must survive a power loss:
+                # every commit is synced.
+                self.__db.execute("PRAGMA journal_mode=WAL")
+                self.__db.execute("PRAGMA synchronous=FULL")
+                self.__db.execute("CREATE TABLE IF NOT EXISTS dirty (path "
+                    "TEXT PRIMARY KEY) WITHOUT ROWID")
+        except Exception:
+            self.__db.close()
+            raise
+
+
+    def paths(self):
+        with self.__lock:
+            return [x[0] for x in \
+                self.__db.execute("SELECT path FROM dirty").fetchall()]
+
+
+    def add(self, path_full):
+        # Fails if the row is not written: the write is not durable.
+        with self.__lock:
+            with self.__db:
+                self.__db.execute("INSERT OR REPLACE INTO dirty VALUES (?)",
+                    (str(path_full),))
+
+
+    def discard(self, paths):
+        # A row left behind only makes the next instance flush the file
+        # again.
+        paths = [(str(x),) for x in paths]
+        if len(paths) == 0:
+            return
+        with self.__lock:
+            try:
+                with self.__db:
+                    self.__db.executemany(
+                        "DELETE FROM dirty WHERE path = ?", paths)
+            except Exception as e:
+                logger.warning("Failed to update the journal. " + str(e))
+
+
+    def close(self):
+        with self.__lock:
+            self.__db.close()
@@ -0,0 +1,993 @@
+import pickle
+from pathlib import Path
+from time import time, sleep
+from threading import Thread, Condition
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from re import sub
+from .logger import logger
+from .journal import FlushJournal
+from ..memory.storage_memory import npy_view
+from ..utils.glob_pattern import glob_to_regex
+from ..utils.metrics import Metrics, measured
+from ..storage.storage import Storage
+
+
+policies = ("write_through", "write_back")
+
+demotions = ("lru", "size")
+
+
+def safe_folder_path_str(path):
+    path = str(path)
+    path = sub('[^a-zA-Z0-9-_./]+', '', path)
+    if len(path) > 0:
+        path = path + "/"
+        path = sub('[/]+', '/', path)
+    return path
+
+
+def safe_file_path_str(path):
+    path = Path(path)
+    path_folder = path.parent
+    file_name = path.name
+    path_folder = safe_folder_path_str(path_folder)
+    file_name = sub('[^a-zA-Z0-9-_.]+', '', file_name)
+    path = path_folder + file_name
+    return path
+
+
+def parent_name(path_full):
+    # "/a/b" -> ("/a", "b"), "/a" -> ("/", "a").
+    i = path_full.rfind("/")
+    return (path_full[:i] if i > 0 else "/", path_full[i + 1:])
+
+
+def is_under(path_full, prefix):
+    return (prefix == "/") or (path_full == prefix) \
+        or path_full.startswith(prefix + "/")
+
+
+class StorageTiered(Storage):
+    '''
+    A fast storage (StorageDisk on local NVMe, StorageMemory) in front of
+    a slow one (StorageS3boto, StorageS3BDL), behind one handle. The slow
+    tier holds every file; the fast tier a copy of the recent ones, under
+    the same paths.
+
+    Writes follow str_policy:
+    - "write_through": the write returns when the slow tier has it, the
+      fast tier keeps a copy.
+    - "write_back": the write returns when the fast tier has it (and the
+      journal, if any, records it); int_flush_workers threads upload it
+      to the slow tier in the background. flush() and close() wait for
+      them. With path_journal the files not yet flushed are uploaded again
+      by the next instance using the same journal and fast tier, after a
+      crash; with StorageMemory as fast tier a crash loses them. A file
+      whose flush failed int_flush_retries times in a row is left to the
+      next flush() (see usage()["failed"]), the threads stop retrying it.
+
+    Reads are served by the fast tier when it has the file, otherwise by
+    the slow one, and with bool_promote copied to the fast tier. With
+    int_capacity (bytes) the fast tier is trimmed after each write or
+    promotion, removing the least recently used files (str_demotion="lru")
+    or the largest ones ("size"); the files not yet flushed stay.
+
+    Folders are made in both tiers. rm, mv, rename, cp, size and append
+    first wait for (or do) the flush of the files below the path, so that
+    the slow tier is up to date, then run on the slow tier; the fast tier
+    follows (mv and rename) or drops its copies.
+    '''
+
+
+    def __init__(
+        self,
+        storage_fast,
+        storage_slow,
+        str_policy="write_through",
+        int_capacity=None,
+        str_demotion="lru",
+        bool_promote=True,
+        int_flush_workers=1,
+        path_journal=None,
+        float_retry_delay=1.0,
+        int_flush_retries=5
+    ):
+        self.__metrics = Metrics()
+        try:
+            self.__storage_type = "TIERED"
+            assert storage_fast.initialized(), "Fast storage not initialized."
+            assert storage_slow.initialized(), "Slow storage not initialized."
+            assert str_policy in policies, "Unknown policy."
+            assert str_demotion in demotions, "Unknown demotion."
+            assert (int_capacity is None) or (int(int_capacity) > 0), \
+                "Capacity should be positive."
+            assert int(int_flush_workers) >= 0, "Negative flush workers."
+            assert int(int_flush_retries) > 0, \
+                "Flush retries should be positive."
+            self.__fast = storage_fast
+            self.__slow = storage_slow
+            self.__str_policy = str_policy
+            self.__int_capacity = None if int_capacity is None \
+                else int(int_capacity)
+            self.__str_demotion = str_demotion
+            self.__bool_promote = bool(bool_promote)
+            self.__float_retry_delay = float(float_retry_delay)
+            self.__int_flush_retries = int(int_flush_retries)
+            self.__cwd = "/"
+            self.__cwd_var = ContextVar("sdaab_tiered_cwd", default=None)
+            # The condition guards all the state below.
+            self.__cond = Condition()
+            # Files of the fast tier: path -> [size, mtime], least recently
+            # used first.
+            self.__hot = OrderedDict()
+            self.__int_hot_bytes = 0
+            # Files to flush, in order, and the ones being flushed.
+            self.__pending = OrderedDict()
+            self.__inflight = set()
+            # Failed flushes in a row, and the files given up by the flush
+            # threads: path -> error.
+            self.__failures = dict()
+            self.__failed = OrderedDict()
+            # Flushes that may find the file in the slow tier already.
+            self.__recovered = set()
+            self.__counters = dict([(x, 0) for x in \
+                ("hits", "misses", "promotions", "demotions", "flushes")])
+            self.__stop = False
+            for path in self.__fast.walk("/"):
+                self.__hot_add(path, self.__fast.size(path))
+            self.__journal = None
+            if path_journal is not None:
+                self.__journal = FlushJournal(
+                    Path(str(path_journal)) / "tiered-journal.db")
+                stale = []
+                for path in self.__journal.paths():
+                    if path in self.__hot:
+                        self.__pending[path] = True
+                        self.__recovered.add(path)
+                    else:
+                        stale.append(path)
+                self.__journal.discard(stale)
+                if len(self.__pending) > 0:
+                    logger.info("Recovered " + str(len(self.__pending)) \
+                        + " files to flush.")
+            self.__workers = []
+            if str_policy == "write_back":
+                for _ in range(int(int_flush_workers)):
+                    thread = Thread(target=self.__flush_worker, daemon=True)
+                    thread.start()
+                    self.__workers.append(thread)
+            self.__initialized = True
+            logger.debug("Storage TIERED initialized.")
+        except Exception as e:
+            self.__initialized = False
+            logger.error("Initialization failed. " + str(e))
+            raise ValueError("init failed!")
+
+
+    def __getstate__(self):
+        # The index, the queue and the flush threads only live in this
+        # process.
+        raise TypeError("StorageTiered cannot be pickled.")
+
+
+    def initialized(self):
+        return self.__initialized
+
+
+    def metrics(self):
+        return self.__metrics
+
+
+    def usage(self):
+        '''
+        State of the tiers.
+
+        Returns
+        -------
+        dict
+            {"hot_files", "hot_bytes", "capacity", "dirty" (files not yet
+            flushed), "failed" (the dirty ones given up by the flush
+            threads), "hits", "misses", "promotions", "demotions",
+            "flushes"}.
+        '''
+        with self.__cond:
+            output = {
+                "hot_files": len(self.__hot),
+                "hot_bytes": self.__int_hot_bytes,
+                "capacity": self.__int_capacity,
+                "dirty": len(self.__pending) + len(self.__inflight) \
+                    + len(self.__failed),
+                "failed": len(self.__failed)
+            }
+            output.update(self.__counters)
+            return output
+
+
+    def __count(self, str_name):
+        with self.__cond:
+            self.__counters[str_name] += 1
+
+
+    def __journal_add(self, path_full):
+        if self.__journal is not None:
+            self.__journal.add(path_full)
+
+
+    def __journal_discard(self, paths):
+        if self.__journal is not None:
+            self.__journal.discard(paths)
+
+
+    def __hot_add(self, path_full, size):
+        # Called with the condition, or before the threads start.
+        self.__hot_remove(path_full)
+        self.__hot[path_full] = [int(size), time()]
+        self.__int_hot_bytes += int(size)
+
+
+    def __hot_remove(self, path_full):
+        item = self.__hot.pop(path_full, None)
+        if item is not None:
+            self.__int_hot_bytes -= item[0]
+
+
+    def __is_dirty(self, path_full):
+        return (path_full in self.__pending) \
+            or (path_full in self.__inflight) or (path_full in self.__failed)
+
+
+    def __dirty_under(self, prefix):
+        # Called with the condition: the files below the prefix not yet in
+        # the slow tier, as {path: [size, mtime]}.
+        return dict([(x, self.__hot[x]) for x in \
+            list(self.__pending) + list(self.__inflight) + list(self.__failed)
+            if is_under(x, prefix) and (x in self.__hot)])
+
+
+    def __path_expand(self, path):
+        # The normalized absolute path, as seen by both tiers.
+        path = str(path)
+        if len(path) == 0:
+            return self.__get_cwd()
+        if path[0] != "/":
+            path = self.__get_cwd() + "/" + path
+        parts = []
+        for x in path.split("/"):
+            if x in ("", "."):
+                continue
+            if x == "..":
+                assert len(parts) > 0, "Impossible to go beyond the root path."
+                parts.pop()
+            else:
+                parts.append(x)
+        return "/" + "/".join(parts)
+
+
+    def __isdir(self, storage, path_full):
+        # cwd checks the folder without changing the current directory.
+        try:
+            with storage.cwd(path_full):
+                return True
+        except ValueError:
+            return False
+
+
+    def __fast_parent(self, path_full):
+        # The folder of the file in the fast tier, if the slow one has it.
+        parent = parent_name(path_full)[0]
+        if (parent == "/") or self.__isdir(self.__fast, parent):
+            return
+        assert self.__isdir(self.__slow, parent), "Parent folder not found."
+        try:
+            self.__fast.mkdir(parent)
+        except ValueError:
+            # Made by another thread meanwhile.
+            assert self.__isdir(self.__fast, parent), \
+                "Parent folder not made."
+
+
+    def __demote(self):
+        # Trim the fast tier to the capacity, never below the files not
+        # yet flushed.
+        if self.__int_capacity is None:
+            return
+        while True:
+            with self.__cond:
+                if self.__int_hot_bytes <= self.__int_capacity:
+                    return
+                candidates = [x for x in self.__hot if not self.__is_dirty(x)]
+                if len(candidates) == 0:
+                    return
+                if self.__str_demotion == "lru":
+                    path_full = candidates[0]
+                else:
+                    path_full = max(candidates, key=lambda x: self.__hot[x][0])
+                self.__hot_remove(path_full)
+                self.__counters["demotions"] += 1
+            try:
+                self.__fast.rm(path_full)
+            except ValueError as e:
+                logger.warning("Failed to demote " + path_full + ". " + str(e))
+
+
+    def __promote(self, path_full, data):
+        # Copy of a file of the slow tier in the fast one, best effort.
+        if (not self.__bool_promote) or ((self.__int_capacity is not None) \
+            and (len(data) > self.__int_capacity)):
+            return False
+        try:
+            self.__fast_parent(path_full)
+            self.__fast.upload_from_memory(data, path_full, bool_bin=True)
+        except Exception as e:
+            logger.warning("Failed to promote " + path_full + ". " + str(e))
+            return False
+        with self.__cond:
+            self.__hot_add(path_full, len(data))
+            self.__counters["promotions"] += 1
+        self.__demote()
+        return True
+
+
+    def __drop(self, prefix):
+        # Forget the copies of the fast tier below the prefix.
+        with self.__cond:
+            for x in [x for x in self.__hot if is_under(x, prefix)]:
+                self.__hot_remove(x)
+        if self.__fast.exists(prefix):
+            self.__fast.rm(prefix)
+
+
+    def __flush_one(self, path_full):
+        # Upload a file of the fast tier to the slow one. The file is in
+        # __inflight: nobody else changes it meanwhile.
+        bool_done = False
+        str_error = None
+        try:
+            data = self.__fast.download_to_memory(path_full, bool_bin=True)
+            with self.__cond:
+                bool_recovered = path_full in self.__recovered
+            if bool_recovered and self.__slow.exists(path_full):
+                # The flush before the crash may have reached the slow tier.
+                self.__slow.rm(path_full)
+            self.__slow.upload_from_memory(data, path_full, bool_bin=True)
+            bool_done = True
+            # Still in __inflight: no new write of the path meanwhile.
+            self.__journal_discard([path_full])
+        except Exception as e:
+            str_error = str(e)
+            logger.warning("Failed to flush " + path_full + ". " + str_error)
+        with self.__cond:
+            self.__inflight.discard(path_full)
+            if bool_done:
+                self.__recovered.discard(path_full)
+                self.__failures.pop(path_full, None)
+                self.__counters["flushes"] += 1
+            else:
+                self.__failures[path_full] = \
+                    self.__failures.get(path_full, 0) + 1
+                if self.__failures[path_full] < self.__int_flush_retries:
+                    self.__pending[path_full] = True
+                else:
+                    # Given up until the next flush().
+                    logger.error("Gave up flushing " + path_full + " after " \
+                        + str(self.__failures[path_full]) + " failures.")
+                    del self.__failures[path_full]
+                    self.__failed[path_full] = str_error
+            self.__cond.notify_all()
+        if bool_done:
+            self.__demote()
+        return bool_done
+
+
+    def __flush_worker(self):
+        while True:
+            with self.__cond:
+                while (len(self.__pending) == 0) and (not self.__stop):
+                    self.__cond.wait()
+                if self.__stop:
+                    return
+                path_full = next(iter(self.__pending))
+                del self.__pending[path_full]
+                self.__inflight.add(path_full)
+            if not self.__flush_one(path_full):
+                sleep(self.__float_retry_delay)
+
+
+    def __flush_under(self, prefix):
+        # Flush in the calling thread the files below the prefix, and wait
+        # for the ones flushed by the workers. Fails at the first failure.
+        # The files given up by the workers are tried again.
+        with self.__cond:
+            for x in [x for x in self.__failed if is_under(x, prefix)]:
+                del self.__failed[x]
+                self.__pending[x] = True
+        while True:
+            with self.__cond:
+                paths = [x for x in self.__pending if is_under(x, prefix)]
+                if len(paths) == 0:
+                    if not any([is_under(x, prefix) for x in self.__inflight]):
+                        return
+                    self.__cond.wait()
+                    continue
+                path_full = paths[0]
+                del self.__pending[path_full]
+                self.__inflight.add(path_full)
+            assert self.__flush_one(path_full), \
+                "Failed to flush " + path_full + "."
+
+
+    def __cancel_under(self, prefix):
+        # Take the flushes below the prefix out of the queue, once the
+        # running ones end. Returns the files taken out, see __requeue.
+        with self.__cond:
+            while any([is_under(x, prefix) for x in self.__inflight]):
+                self.__cond.wait()
+            output = [x for x in list(self.__pending) + list(self.__failed) \
+                if is_under(x, prefix)]
+            for x in output:
+                self.__pending.pop(x, None)
+                self.__failed.pop(x, None)
+            return output
+
+
+    def __requeue(self, paths):
+        # Put back the flushes taken out by __cancel_under.
+        with self.__cond:
+            for x in paths:
+                if x in self.__hot:
+                    self.__pending[x] = True
+            self.__cond.notify_all()
+
+
+    def flush(self):
+        '''
+        Block until every write is in the slow tier.
+        '''
+        try:
+            assert self.__initialized, "Storage not initialized."
+            self.__flush_under("/")
+            logger.debug("flush: True")
+        except Exception as e:
+            logger.error("Failed to flush. " + str(e))
+            raise ValueError("flush failed!")
+
+
+    def close(self):
+        '''
+        Flush, then stop the flush threads, also when the flush fails.
+        '''
+        try:
+            self.flush()
+        finally:
+            with self.__cond:
+                self.__stop = True
+                self.__cond.notify_all()
+            for thread in self.__workers:
+                thread.join()
+            self.__workers = []
+            if self.__journal is not None:
+                self.__journal.close()
+
+
+    def get_type(self):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            logger.debug("Storage type: " + self.__storage_type)
+            return self.__storage_type
+        except Exception as e:
+            logger.error("Failed to get the storage type. " + str(e))
+            raise ValueError("get_type failed!")
+
+
+    def __get_cwd(self):
+        output = self.__cwd_var.get()
+        return self.__cwd if output is None else output
+
+
+    def __cd_resolve(self, path):
+        path_full = self.__path_expand(path)
+        assert self.__isdir(self.__fast, path_full) \
+            or self.__isdir(self.__slow, path_full), \
+            "Current directory not found."
+        return path_full
+
+
+    @measured
+    def cd(self, path):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            cwd = self.__cd_resolve(path)
+            if self.__cwd_var.get() is None:
+                self.__cwd = cwd
+            else:
+                self.__cwd_var.set(cwd)
+            logger.debug("cd " + str(path) + ": True")
+        except Exception as e:
+            logger.error("cd failed. " + str(e))
+            raise ValueError('cd failed!')
+
+
+    @contextmanager
+    def cwd(self, path):
+        '''
+        Change the current directory only inside the context (thread or
+        asyncio task), the other users of the instance are not affected.
+        '''
+        try:
+            assert self.__initialized, "Storage not initialized."
+            cwd = self.__cd_resolve(path)
+            logger.debug("cwd " + str(path) + ": True")
+        except Exception as e:
+            logger.error("cwd failed. " + str(e))
+            raise ValueError('cwd failed!')
+        token = self.__cwd_var.set(cwd)
+        try:
+            yield self
+        finally:
+            self.__cwd_var.reset(token)
+
+
+    def pwd(self):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            output = self.__get_cwd()
+            logger.debug("pwd: " + output)
+            return output
+        except Exception as e:
+            logger.error("pwd failed. " + str(e))
+            raise ValueError('pwd failed!')
+
+
+    def __ls_iter(self, iterator, extra, bool_details):
+        # The listing of the slow tier, then the files not yet flushed.
+        for item in iterator:
+            name = item[0] if bool_details else item
+            if name not in extra:
+                yield item
+        for name, (size, mtime) in sorted(extra.items()):
+            yield (name, size, mtime) if bool_details else name
+
+
+    def __ls_extra(self, path_full):
+        with self.__cond:
+            dirty = self.__dirty_under(path_full)
+        return dict([(parent_name(x)[1], v) for x, v in dirty.items() \
+            if parent_name(x)[0] == path_full])
+
+
+    @measured
+    def ls(self, path=""):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path = str(path)
+            path_full = self.__path_expand(path)
+            extra = self.__ls_extra(path_full)
+            output = sorted(set(self.__slow.ls(path_full)) | set(extra))
+            logger.debug("ls " + str(path) + ": " + " ".join(output))
+            return output
+        except Exception as e:
+            logger.error("Failed to list objects inside the folder. " + str(e))
+            raise ValueError('ls failed!')
+
+
+    @measured
+    def ls_iter(self, path="", page_size=1000, bool_details=False):
+        '''
+        Generator version of ls: the listing of the slow tier, then the
+        files not yet flushed.
+        '''
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path = str(path)
+            path_full = self.__path_expand(path)
+            extra = self.__ls_extra(path_full)
+            iterator = self.__slow.ls_iter(
+                path_full, page_size=page_size, bool_details=bool_details)
+            logger.debug("ls_iter " + str(path) + ": True")
+        except Exception as e:
+            logger.error("Failed to list objects inside the folder. " + str(e))
+            raise ValueError('ls_iter failed!')
+        return self.__ls_iter(iterator, extra, bool_details)
+
+
+    def __walk(self, iterator, extra):
+        for path in iterator:
+            if path not in extra:
+                yield path
+        for path in sorted(extra):
+            yield path
+
+
+    @measured
+    def walk(self, path=""):
+        '''
+        Generator of the paths of all the files inside the folder,
+        recursively, the ones not yet flushed included.
+        '''
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path = str(path)
+            path_full = self.__path_expand(path)
+            with self.__cond:
+                extra = set(self.__dirty_under(path_full))
+            iterator = self.__slow.walk(path_full)
+            logger.debug("walk " + str(path) + ": True")
+        except Exception as e:
+            logger.error("Failed to walk the folder. " + str(e))
+            raise ValueError('walk failed!')
+        return self.__walk(iterator, extra)
+
+
+    @measured
+    def glob(self, pattern):
+        '''
+        Generator of the paths of the files matching the glob pattern,
+        see sdaab.utils.glob_pattern, the ones not yet flushed included.
+        Relative patterns start from the current directory.
+        '''
+        try:
+            assert self.__initialized, "Storage not initialized."
+            pattern = str(pattern)
+            assert len(pattern) > 0, "Empty pattern."
+            if pattern[0] != "/":
+                pattern = self.__get_cwd() + "/" + pattern
+            pattern = sub('[/]+', '/', pattern)
+            regex = glob_to_regex(pattern)
+            with self.__cond:
+                extra = set([x for x in self.__dirty_under("/") \
+                    if regex.match(x)])
+            iterator = self.__slow.glob(pattern)
+            logger.debug("glob " + pattern + ": True")
+        except Exception as e:
+            logger.error("Failed to glob. " + str(e))
+            raise ValueError('glob failed!')
+        return self.__walk(iterator, extra)
+
+
+    @measured
+    def exists(self, path):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path = str(path)
+            path_full = self.__path_expand(path)
+            with self.__cond:
+                output = path_full in self.__hot
+            output = output or self.__slow.exists(path_full)
+            logger.debug("exists " + str(path) + ": " + str(output))
+            return output
+        except Exception as e:
+            logger.error("Failed to check the existence. " + str(e))
+            raise ValueError('exists failed!')
+
+
+    @measured
+    def mkdir(self, path):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path = str(path)
+            path = safe_folder_path_str(path)
+            path_full = self.__path_expand(path)
+            self.__slow.mkdir(path_full)
+            if not self.__isdir(self.__fast, path_full):
+                self.__fast.mkdir(path_full)
+            logger.debug("mkdir " + str(path) + ": True")
+        except Exception as e:
+            logger.error("Failed to create the directory. " + str(e))
+            raise ValueError('mkdir failed!')
+
+
+    def __write(self, path_full, fn_write):
+        # fn_write(storage) writes the file in a tier, returns its size.
+        with self.__cond:
+            assert path_full not in self.__hot, "File already exists."
+        if self.__str_policy == "write_through":
+            size = fn_write(self.__slow)
+            if (self.__int_capacity is None) or (size <= self.__int_capacity):
+                try:
+                    self.__fast_parent(path_full)
+                    fn_write(self.__fast)
+                    with self.__cond:
+                        self.__hot_add(path_full, size)
+                except Exception as e:
+                    logger.warning("Failed to cache " + path_full + ". " \
+                        + str(e))
+        else:
+            assert not self.__slow.exists(path_full), "File already exists."
+            self.__fast_parent(path_full)
+            # The journal first: a crash before the file is in the fast
+            # tier only leaves a row dropped by the next instance.
+            self.__journal_add(path_full)
+            try:
+                size = fn_write(self.__fast)
+            except Exception:
+                self.__journal_discard([path_full])
+                raise
+            with self.__cond:
+                self.__hot_add(path_full, size)
+                self.__pending[path_full] = True
+                self.__cond.notify_all()
+        self.__metrics.add_bytes(int_written=size)
+        self.__demote()
+
+
+    @measured
+    def upload(self, path_source, path_dest):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path_source = str(path_source)
+            path_dest = str(path_dest)
+            path_dest = safe_file_path_str(path_dest)
+            path_full = self.__path_expand(path_dest)
+
+            def fn_write(storage):
+                storage.upload(path_source, path_full)
+                return Path(path_source).stat().st_size
+
+            self.__write(path_full, fn_write)
+            logger.debug("upload " + str(path_dest) + ": True")
+        except Exception as e:
+            logger.error("Failed to upload. " + str(e))
+            raise ValueError('upload failed!')
+
+
+    @measured
+    def upload_from_memory(self, variable, path, bool_bin=False):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path = str(path)
+            path = safe_file_path_str(path)
+            path_full = self.__path_expand(path)
+            data = variable if bool_bin else pickle.dumps(variable)
+
+            def fn_write(storage):
+                storage.upload_from_memory(data, path_full, bool_bin=True)
+                return len(data)
+
+            self.__write(path_full, fn_write)
+            logger.debug("upload_from_memory " + str(path) + ": True")
+        except Exception as e:
+            logger.error("Failed to upload. " + str(e))
+            raise ValueError('upload_from_memory failed!')
+
+
+    def __read_fast(self, path_full, fn_read):
+        # fn_read(storage) from the fast tier if it has the file. None if
+        # not, or if it was demoted meanwhile (and flushed).
+        with self.__cond:
+            if path_full not in self.__hot:
+                return None
+            self.__hot.move_to_end(path_full)
+            bool_dirty = self.__is_dirty(path_full)
+        try:
+            output = fn_read(self.__fast)
+        except ValueError:
+            if bool_dirty:
+                raise
+            return None
+        self.__count("hits")
+        return output
+
+
+    @measured
+    def download(self, path_source, path_dest):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path_source = str(path_source)
+            path_dest = str(path_dest)
+            path_source = safe_file_path_str(path_source)
+            path_full = self.__path_expand(path_source)
+
+            def fn_read(storage):
+                storage.download(path_full, path_dest)
+                return True
+
+            if self.__read_fast(path_full, fn_read) is None:
+                self.__count("misses")
+                self.__slow.download(path_full, path_dest)
+                if self.__bool_promote:
+                    with open(path_dest, "rb") as f:
+                        self.__promote(path_full, f.read())
+            self.__metrics.add_bytes(int_read=Path(path_dest).stat().st_size)
+            logger.debug("download " + str(path_source) + ": True")
+        except Exception as e:
+            logger.error("Failed to download. " + str(e))
+            raise ValueError('download failed!')
+
+
+    @measured
+    def download_to_memory(self, path, bool_bin=False, mmap_mode=None):
+        '''
+        mmap_mode can be None, "bytes" or "numpy", see StorageDisk: the
+        views come from the fast tier when it has the file, otherwise from
+        a copy in memory.
+        '''
+        try:
+            assert self.__initialized, "Storage not initialized."
+            assert mmap_mode in (None, "bytes", "numpy"), \
+                "Unknown mmap mode."
+            path = str(path)
+            path = safe_file_path_str(path)
+            path_full = self.__path_expand(path)
+
+            def fn_read(storage):
+                return (storage.download_to_memory(
+                    path_full, bool_bin=bool_bin, mmap_mode=mmap_mode),)
+
+            output = self.__read_fast(path_full, fn_read)
+            if output is not None:
+                output = output[0]
+            else:
+                self.__count("misses")
+                data = self.__slow.download_to_memory(path_full, bool_bin=True)
+                self.__promote(path_full, data)
+                if mmap_mode == "numpy":
+                    output = npy_view(data)
+                elif mmap_mode == "bytes":
+                    output = memoryview(data)
+                elif bool_bin:
+                    output = data
+                else:
+                    output = pickle.loads(data)
+            logger.debug("download_to_memory " + str(path) + ": True")
+            return output
+        except Exception as e:
+            logger.error("Failed to download. " + str(e))
+            raise ValueError('download_to_memory failed!')
+
+
+    @measured
+    def rm(self, path):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path = str(path)
+            path = safe_folder_path_str(path)
+            path_full = self.__path_expand(path)
+            assert path_full != "/", "Impossible to remove the root."
+            cancelled = self.__cancel_under(path_full)
+            try:
+                with self.__cond:
+                    bool_fast = any(
+                        [is_under(x, path_full) for x in self.__hot])
+                bool_slow = self.__slow.exists(path_full)
+                assert bool_fast or bool_slow, "File/folder not found."
+                if bool_slow:
+                    self.__slow.rm(path_full)
+            except Exception:
+                # The files not yet flushed stay to flush.
+                self.__requeue(cancelled)
+                raise
+            self.__drop(path_full)
+            with self.__cond:
+                for x in cancelled:
+                    self.__failures.pop(x, None)
+            self.__journal_discard(cancelled)
+            logger.debug("rm " + str(path) + ": True")
+        except Exception as e:
+            logger.error("Failed to remove the file/folder. " + str(e))
+            raise ValueError('rm failed!')
+
+
+    @measured
+    def size(self, path):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path = str(path)
+            path = safe_file_path_str(path)
+            path_full = self.__path_expand(path)
+            # The files not yet flushed are not in the slow tier: wait for
+            # the running flushes, add the others.
+            with self.__cond:
+                while any([is_under(x, path_full) for x in self.__inflight]):
+                    self.__cond.wait()
+                dirty = self.__dirty_under(path_full)
+            if path_full in dirty:
+                output = dirty[path_full][0]
+            else:
+                output = self.__slow.size(path_full) \
+                    + sum([x[0] for x in dirty.values()])
+            logger.debug("size " + str(path) + ": " + str(output))
+            return output
+        except Exception as e:
+            logger.error("Failed to get the size. " + str(e))
+            raise ValueError('size failed!')
+
+
+    def __move(self, str_method, path_source_full, path_dest_full):
+        # The slow tier first, then the fast one follows or drops its copies.
+        self.__flush_under(path_source_full)
+        getattr(self.__slow, str_method)(path_source_full, path_dest_full)
+        with self.__cond:
+            moved = [x for x in self.__hot if is_under(x, path_source_full)]
+        if len(moved) == 0:
+            return
+        try:
+            self.__fast_parent(path_dest_full)
+            getattr(self.__fast, str_method)(path_source_full, path_dest_full)
+            n = len(path_source_full)
+            with self.__cond:
+                for x in moved:
+                    item = self.__hot.get(x)
+                    if item is not None:
+                        self.__hot_remove(x)
+                        self.__hot_add(path_dest_full + x[n:], item[0])
+        except Exception as e:
+            logger.warning("Failed to move the copies of " + path_source_full \
+                + ". " + str(e))
+            self.__drop(path_source_full)
+
+
+    @measured
+    def rename(self, path_source, path_dest):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path_source = str(path_source)
+            path_dest = str(path_dest)
+            path_source_full = self.__path_expand(path_source)
+            path_dest = safe_file_path_str(path_dest)
+            path_dest_full = self.__path_expand(path_dest)
+            assert parent_name(path_source_full)[0] == \
+                parent_name(path_dest_full)[0], \
+                "Different parent directories."
+            self.__move("rename", path_source_full, path_dest_full)
+            logger.debug("rename " + str(path_source) + \
+                " --> " + str(path_dest))
+        except Exception as e:
+            logger.error("Failed to rename. " + str(e))
+            raise ValueError('rename failed!')
+
+
+    @measured
+    def mv(self, path_source, path_dest):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path_source = str(path_source)
+            path_dest = str(path_dest)
+            path_source_full = self.__path_expand(path_source)
+            path_dest = safe_file_path_str(path_dest)
+            path_dest_full = self.__path_expand(path_dest)
+            self.__move("mv", path_source_full, path_dest_full)
+            logger.debug("mv " + str(path_source) + \
+                " --> " + str(path_dest))
+        except Exception as e:
+            logger.error("Failed to move. " + str(e))
+            raise ValueError('mv failed!')
+
+
+    @measured
+    def cp(self, path_source, path_dest):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path_source = str(path_source)
+            path_dest = str(path_dest)
+            path_source_full = self.__path_expand(path_source)
+            path_dest = safe_file_path_str(path_dest)
+            path_dest_full = self.__path_expand(path_dest)
+            # The copy is cold: only the slow tier has it.
+            self.__flush_under(path_source_full)
+            self.__slow.cp(path_source_full, path_dest_full)
+            logger.debug("cp " + str(path_source) + \
+                " --> " + str(path_dest))
+        except Exception as e:
+            logger.error("Failed to copy. " + str(e))
+            raise ValueError('cp failed!')
+
+
+    @measured
+    def append(self, path, content):
+        try:
+            assert self.__initialized, "Storage not initialized."
+            path = str(path)
+            path = safe_file_path_str(path)
+            path_full = self.__path_expand(path)
+            self.__flush_under(path_full)
+            self.__slow.append(path_full, content)
+            with self.__cond:
+                bool_hot = path_full in self.__hot
+            if bool_hot:
+                self.__drop(path_full)
+            logger.debug("append " + str(path) + ": " + str(content))
+        except Exception as e:
+            logger.error("Failed to append. " + str(e))
+            raise ValueError('append failed!')
@@ -0,0 +1,151 @@
+from math import ceil
+from threading import Lock
+
+
+int_mib = 1048576
+
+
+class TransferTuner():
+    '''
+    Adaptive concurrency and part size of multipart transfers.
+
+    The concurrency follows AIMD: after each window of parts it grows by
+    one while the estimated throughput keeps improving, and it is halved
+    when a part is throttled or retried. Parts are sized to last about
+    float_part_seconds at the observed rate of one stream. The learned
+    state can be saved with get_state and restored with set_state.
+    '''
+
+
+    def __init__(
+        self,
+        int_concurrency=2,
+        int_min_concurrency=1,
+        int_max_concurrency=8,
+        int_part_size=8*int_mib,
+        int_min_part_size=5*int_mib,
+        int_max_part_size=256*int_mib,
+        int_max_parts=10000,
+        float_part_seconds=2.0,
+        float_min_gain=0.05
+    ):
+        assert 0 < int(int_min_concurrency) <= int(int_max_concurrency), \
+            "Wrong concurrency range."
+        assert 0 < int(int_min_part_size) <= int(int_max_part_size), \
+            "Wrong part size range."
+        self.__int_min_concurrency = int(int_min_concurrency)
+        self.__int_max_concurrency = int(int_max_concurrency)
+        self.__int_part_size = int(int_part_size)
+        self.__int_min_part_size = int(int_min_part_size)
+        self.__int_max_part_size = int(int_max_part_size)
+        self.__int_max_parts = int(int_max_parts)
+        self.__float_part_seconds = float(float_part_seconds)
+        self.__float_min_gain = float(float_min_gain)
+        self.__lock = Lock()
+        self.__concurrency = self.__clamp_concurrency(int_concurrency)
+        self.__rate = None
+        self.__throughput = None
+        self.__count = 0
+
+
+    def __clamp_concurrency(self, int_concurrency):
+        return min(self.__int_max_concurrency, \
+            max(self.__int_min_concurrency, int(int_concurrency)))
+
+
+    def concurrency(self):
+        with self.__lock:
+            return self.__concurrency
+
+
+    def max_concurrency(self):
+        return self.__int_max_concurrency
+
+
+    def part_size(self, int_size):
+        '''
+        The part size of a transfer.
+
+        Parameters
+        ----------
+        int_size : int
+            Size of the whole transfer in bytes.
+
+        Returns
+        -------
+        int
+            Part size in bytes, a multiple of 1 MiB within the limits and
+            large enough to stay below the maximum number of parts.
+        '''
+        with self.__lock:
+            rate = self.__rate
+        if rate is None:
+            output = self.__int_part_size
+        else:
+            output = int(rate * self.__float_part_seconds)
+        output = min(self.__int_max_part_size, \
+            max(self.__int_min_part_size, output))
+        output = max(output, int(ceil(int(int_size) / self.__int_max_parts)))
+        return int(ceil(output / int_mib)) * int_mib
+
+
+    def record(self, int_bytes, float_seconds):
+        '''
+        Account for a part transferred by one stream.
+
+        Parameters
+        ----------
+        int_bytes : int
+            Size of the part.
+        float_seconds : float
+            Time spent on it, retries included.
+        '''
+        rate = int(int_bytes) / max(float(float_seconds), 1e-6)
+        with self.__lock:
+            if self.__rate is None:
+                self.__rate = rate
+            else:
+                self.__rate = 0.8 * self.__rate + 0.2 * rate
+            self.__count += 1
+            if self.__count < self.__concurrency:
+                return
+            # End of a window: additive increase while it pays off.
+            self.__count = 0
+            throughput = self.__rate * self.__concurrency
+            if (self.__throughput is None) or (throughput > \
+                self.__throughput * (1 + self.__float_min_gain)):
+                self.__concurrency = self.__clamp_concurrency(
+                    self.__concurrency + 1)
+            self.__throughput = throughput
+
+
+    def record_throttle(self):
+        # Multiplicative decrease.
+        with self.__lock:
+            self.__concurrency = self.__clamp_concurrency(
+                self.__concurrency // 2)
+            self.__throughput = None
+            self.__count = 0
+
+
+    def get_state(self):
+        '''
+        The learned settings.
+
+        Returns
+        -------
+        dict
+            {"concurrency": int, "rate": bytes per second of one stream or
+            None}, it can be serialized as JSON.
+        '''
+        with self.__lock:
+            return {"concurrency": self.__concurrency, "rate": self.__rate}
+
+
+    def set_state(self, state):
+        with self.__lock:
+            self.__concurrency = self.__clamp_concurrency(state["concurrency"])
+            rate = state.get("rate")
+            self.__rate = None if rate is None else float(rate)
+            self.__throughput = None
+            self.__count = 0
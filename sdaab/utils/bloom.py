@@ -0,0 +1,296 @@
+from math import ceil, log
+from time import monotonic
+from hashlib import blake2b
+from threading import Lock, Thread
+from .logger import logger
+from .write_behind import is_below
+
+
+class BloomFilter():
+    '''
+    Compact set of strings without false negatives: a string added is
+    always found, a string never added is found with probability about
+    float_fp_rate while at most int_capacity strings are added.
+    '''
+
+
+    def __init__(self, int_capacity, float_fp_rate=0.01):
+        assert int(int_capacity) > 0, "The capacity should be positive."
+        assert 0.0 < float(float_fp_rate) < 1.0, "Rate out of range."
+        self.int_capacity = int(int_capacity)
+        self.int_bits = max(8, int(ceil(-self.int_capacity \
+            * log(float(float_fp_rate)) / (log(2) ** 2))))
+        self.int_hashes = max(1, int(round(self.int_bits \
+            / self.int_capacity * log(2))))
+        self.int_items = 0
+        self.__bits = bytearray((self.int_bits + 7) // 8)
+
+
+    def __positions(self, item):
+        # Double hashing: k positions from two 64-bit hashes.
+        digest = blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.int_bits \
+            for i in range(self.int_hashes)]
+
+
+    def add(self, item):
+        for x in self.__positions(item):
+            self.__bits[x >> 3] |= 1 << (x & 7)
+        self.int_items += 1
+
+
+    def __contains__(self, item):
+        for x in self.__positions(item):
+            if not (self.__bits[x >> 3] >> (x & 7)) & 1:
+                return False
+        return True
+
+
+class ScalableBloomFilter():
+    '''
+    BloomFilter without a number of strings known in advance: once
+    int_capacity strings are added a filter twice as large is chained,
+    with half the false positive rate, so that the rate of the chain stays
+    below float_fp_rate (Almeida et al., Scalable Bloom Filters). A string
+    is looked up in every filter of the chain.
+    '''
+
+
+    def __init__(self, int_capacity, float_fp_rate=0.01):
+        assert 0.0 < float(float_fp_rate) < 1.0, "Rate out of range."
+        # The rates of the chain add up to float_fp_rate.
+        self.__float_fp_rate = float(float_fp_rate) / 2
+        self.__filters = [BloomFilter(int_capacity, self.__float_fp_rate)]
+        self.int_filters = 1
+        self.int_items = 0
+
+
+    def add(self, item):
+        last = self.__filters[-1]
+        if last.int_items >= last.int_capacity:
+            self.__float_fp_rate /= 2
+            last = BloomFilter(2 * last.int_capacity, self.__float_fp_rate)
+            self.__filters.append(last)
+            self.int_filters += 1
+        last.add(item)
+        self.int_items += 1
+
+
+    def __contains__(self, item):
+        return any([item in x for x in self.__filters])
+
+def key_and_parents(key):
+    '''
+    A key without the trailing / and the folders containing it.
+
+    Parameters
+    ----------
+    key : str
+        E.g. "a/b/c" or the folder marker "a/b/".
+
+    Returns
+    -------
+    list
+        E.g. ["a/b/c", "a/b", "a"].
+    '''
+    key = key.rstrip("/")
+    output = []
+    while len(key) > 0:
+        output.append(key)
+        key = key[:max(key.rfind("/"), 0)]
+    return output
+
+
+class NegativeCache():
+    '''
+    Definite misses of exists, answered without requests.
+
+    build(prefix) lists every key below the prefix with fn_keys(prefix),
+    folder markers included, into a BloomFilter of the keys and of their
+    folders. Then is_absent(key) is True only for keys below the prefix
+    missing from the filter. add records the writes of the instance.
+
+    The keys are listed once, into a ScalableBloomFilter sized by the
+    previous build of the prefix, if any. The keys written by others after
+    the build are not seen: after float_ttl seconds the next is_absent
+    starts a rebuild in a thread, the old filter answers meanwhile. A
+    failed rebuild drops the filter.
+    '''
+
+
+    def __init__(self, fn_keys):
+        self.__fn_keys = fn_keys
+        self.__lock = Lock()
+        self.__lock_build = Lock()
+        self.__filter = None
+        self.__prefix = None
+        self.__float_ttl = None
+        self.__float_fp_rate = 0.01
+        self.__float_built = None
+        # Items listed by the last build.
+        self.__int_built = None
+        # Prefixes whose content is unknown (e.g. folders copied by the
+        # server): the keys below them are passed to the backend.
+        self.__below = []
+        # (key, bool_below) added during a rebuild, replayed afterwards.
+        self.__added = None
+        self.__counters = {"absent": 0, "passed": 0, "builds": 0}
+
+
+    def __items(self, prefix):
+        # The keys below the prefix and their folders, streamed.
+        last = None
+        for key in self.__fn_keys(prefix):
+            items = key_and_parents(key)
+            # The folders of consecutive keys are often the same.
+            if (last is not None) and (len(items) > 1) \
+                and (items[1] == last):
+                items = items[:1]
+            if len(items) > 1:
+                last = items[1]
+            for x in items:
+                yield x
+
+
+    def __fill(self, prefix, float_fp_rate):
+        # A single pass, the keys are never held in memory: the filter
+        # grows with them. A rebuild starts at the size of the previous
+        # one, with room for the writes of the instance.
+        with self.__lock:
+            int_expected = self.__int_built if prefix == self.__prefix \
+                else 0
+        output = ScalableBloomFilter(
+            max(1024, 2 * int_expected), float_fp_rate)
+        for x in self.__items(prefix):
+            output.add(x)
+        return output
+
+
+    def build(self, prefix, float_ttl=None, float_fp_rate=0.01):
+        '''
+        Build the filter of the keys below the prefix, "" for all.
+
+        Parameters
+        ----------
+        prefix : str
+            Key of a folder, with the trailing /, or "".
+        float_ttl : float
+            Seconds before a rebuild, None for never.
+        float_fp_rate : float
+            Fraction of the missing keys still sent to the backend.
+        '''
+        with self.__lock_build:
+            self.__build(prefix, float_ttl, float_fp_rate)
+
+
+    def __build(self, prefix, float_ttl, float_fp_rate):
+        with self.__lock:
+            # Already started by is_absent, for the rebuild.
+            if self.__added is None:
+                self.__added = []
+        try:
+            output = self.__fill(prefix, float_fp_rate)
+        except Exception:
+            with self.__lock:
+                self.__added = None
+            raise
+        with self.__lock:
+            self.__int_built = output.int_items
+            self.__below = []
+            for key, bool_below in self.__added:
+                for x in key_and_parents(key):
+                    output.add(x)
+                if bool_below:
+                    self.__below.append(key.rstrip("/"))
+            self.__added = None
+            self.__filter = output
+            self.__prefix = prefix
+            self.__float_ttl = None if float_ttl is None \
+                else float(float_ttl)
+            self.__float_fp_rate = float(float_fp_rate)
+            self.__float_built = monotonic()
+            self.__counters["builds"] += 1
+
+
+    def __rebuild(self, prefix, float_ttl, float_fp_rate):
+        try:
+            self.build(prefix, float_ttl, float_fp_rate)
+            logger.debug("Negative cache rebuilt: " + prefix)
+        except Exception as e:
+            logger.warning("Negative cache rebuild failed, dropped. " \
+                + str(e))
+            self.clear()
+
+
+    def clear(self):
+        with self.__lock:
+            self.__filter = None
+            self.__prefix = None
+            self.__below = []
+
+
+    def add(self, key, bool_below=False):
+        '''
+        Record a key written by the instance, and its folders.
+
+        Parameters
+        ----------
+        key : str
+            Key of a file or a folder.
+        bool_below : bool
+            The keys below it may exist too, until the next build (e.g.
+            the key is a folder copied by the server).
+        '''
+        with self.__lock:
+            if self.__added is not None:
+                self.__added.append((key, bool_below))
+            if self.__filter is not None:
+                for x in key_and_parents(key):
+                    self.__filter.add(x)
+                if bool_below:
+                    self.__below.append(key.rstrip("/"))
+
+
+    def is_absent(self, key):
+        '''
+        True if the key is below the prefix of the filter and missing from
+        it: the key does not exist (or was written by others after the
+        build). False if the backend has to be asked.
+        '''
+        bool_rebuild = False
+        with self.__lock:
+            if (self.__filter is None) or (key.rstrip("/") == "") or \
+                not key.startswith(self.__prefix):
+                return False
+            if (self.__added is None) and (self.__float_ttl is not None) \
+                and (monotonic() - self.__float_built > self.__float_ttl):
+                self.__added = []
+                bool_rebuild = True
+            output = (key.rstrip("/") not in self.__filter) and \
+                not any([is_below(key, x) for x in self.__below])
+            self.__counters["absent" if output else "passed"] += 1
+            args = (self.__prefix, self.__float_ttl, self.__float_fp_rate)
+        if bool_rebuild:
+            Thread(target=self.__rebuild, args=args, daemon=True).start()
+        return output
+
+
+    def stats(self):
+        '''
+        Counters of the negative cache.
+
+        Returns
+        -------
+        dict
+            {"prefix" (None without filter), "keys" (in the filter),
+            "absent" (misses answered locally), "passed" (sent to the
+            backend), "builds"}.
+        '''
+        with self.__lock:
+            output = dict(self.__counters)
+            output["prefix"] = self.__prefix
+            output["keys"] = 0 if self.__filter is None \
+                else self.__filter.int_items
+            return output
@@ -0,0 +1,192 @@
+from .write_behind import WriteBehind
+from .prefetch import Prefetcher
+from .bloom import NegativeCache
+from .inventory import Inventory
+
+
+class RemoteCaches():
+    '''
+    The local state of a remote backend (S3boto, S3BDL), see
+    storage.remote.RemoteStorage.
+
+    The backend only supplies its key callables: fn_put(key, content)
+    uploads a file for the write-behind workers, fn_get(key) reads one for
+    the prefetch workers, fn_list(folder) returns the keys of the files
+    of a folder and fn_scan(prefix, bool_details) every key below a
+    prefix. With int_write_behind (bytes) the writes are queued, see
+    utils.write_behind.WriteBehind, with int_prefetch_depth the reads are
+    done ahead, see utils.prefetch.Prefetcher, with path_inventory the
+    scans are kept in a local index, see utils.inventory.Inventory; the
+    parts not enabled are None. negative answers the misses of exists,
+    see utils.bloom.NegativeCache. put, remove and copy record the writes
+    of the instance.
+    '''
+
+
+    def __init__(
+        self,
+        fn_put,
+        fn_get,
+        fn_list,
+        fn_scan,
+        int_write_behind=None,
+        int_write_behind_workers=4,
+        int_prefetch_depth=None,
+        int_prefetch_bytes=67108864,
+        path_prefetch=None,
+        path_inventory=None,
+        float_inventory_age=3600.0
+    ):
+        self.write_behind = None if int_write_behind is None \
+            else WriteBehind(
+                fn_put,
+                int_max_bytes=int_write_behind,
+                int_workers=int_write_behind_workers
+            )
+        self.prefetcher = None if int_prefetch_depth is None \
+            else Prefetcher(
+                fn_get,
+                fn_list=fn_list,
+                int_depth=int_prefetch_depth,
+                int_max_bytes=int_prefetch_bytes,
+                int_workers=int_prefetch_depth,
+                path_buffer=path_prefetch
+            )
+        self.negative = NegativeCache(fn_scan)
+        self.inventory = None if path_inventory is None \
+            else Inventory(
+                path_inventory,
+                lambda prefix: fn_scan(prefix, bool_details=True),
+                float_max_age=float_inventory_age
+            )
+
+
+    def submit(self, key, content):
+        '''
+        Queue the write of a file, see WriteBehind.submit.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Resolved once uploaded, None without write-behind: the caller
+            uploads the file.
+        '''
+        if self.write_behind is None:
+            return None
+        return self.write_behind.submit(key, content)
+
+
+    def queued(self, key):
+        '''
+        Content of the queued write of the key, None if there is none.
+        '''
+        if self.write_behind is None:
+            return None
+        return self.write_behind.get(key)
+
+
+    def settle(self, key, bool_literal=False):
+        '''
+        Block until the queued writes below the key are uploaded, see
+        WriteBehind.wait.
+        '''
+        if self.write_behind is not None:
+            self.write_behind.wait(key, bool_literal=bool_literal)
+
+
+    def take(self, key):
+        '''
+        Content of the key read ahead, see Prefetcher.take, None if there
+        is none: the caller reads the key.
+        '''
+        if self.prefetcher is None:
+            return None
+        return self.prefetcher.take(key)
+
+
+    def indexed(self, key):
+        '''
+        True if the inventory answers for the key, see Inventory.fresh.
+        '''
+        return (self.inventory is not None) and self.inventory.fresh(key)
+
+
+    def put(self, key, int_size):
+        '''
+        Record a file or a folder written by the instance.
+
+        Parameters
+        ----------
+        key : str
+            Key of the file, or of the folder with the trailing /.
+        int_size : int
+            Size of the file, 0 or None for a folder.
+        '''
+        self.__forget(key)
+        self.negative.add(key)
+        if self.inventory is not None:
+            self.inventory.put(key, int_size)
+
+
+    def remove(self, key):
+        '''
+        Record a file or a folder removed by the instance.
+        '''
+        self.__forget(key)
+        if self.inventory is not None:
+            self.inventory.remove(key)
+
+
+    def copy(self, key_source, key_dest, keys=None, bool_remove=False):
+        '''
+        Record a file or a folder copied by the instance.
+
+        Parameters
+        ----------
+        key_source : str
+            Key of the source, without the trailing /.
+        key_dest : str
+            Key of the destination, without the trailing /.
+        keys : list, optional
+            Keys written, by default None: unknown (e.g. copied by the
+            server), the ones below the destination are checked with
+            requests until the next build of the negative cache.
+        bool_remove : bool, optional
+            The source was removed (rename, mv), by default False
+        '''
+        if bool_remove:
+            self.__forget(key_source)
+        self.__forget(key_dest)
+        if keys is None:
+            self.negative.add(key_dest, bool_below=True)
+        for x in keys or []:
+            self.negative.add(x)
+        if self.inventory is not None:
+            self.inventory.copy(key_source, key_dest, bool_remove=bool_remove)
+
+
+    def __forget(self, key):
+        # The reads done ahead below the key are stale.
+        if self.prefetcher is not None:
+            self.prefetcher.invalidate(key)
+
+
+    def flush(self):
+        '''
+        Block until every queued write is uploaded. Fails if any of them
+        failed since the previous flush.
+        '''
+        if self.write_behind is not None:
+            self.write_behind.wait()
+            errors = self.write_behind.pop_errors()
+            assert len(errors) == 0, str(len(errors)) + \
+                " writes failed: " + ", ".join([x[0] for x in errors])
+
+
+    def close(self):
+        if self.write_behind is not None:
+            self.write_behind.close()
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+        if self.inventory is not None:
+            self.inventory.close()
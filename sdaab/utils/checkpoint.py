@@ -0,0 +1,82 @@
+from os import replace, remove, makedirs, fsync, \
+    open as os_open, close as os_close, O_RDONLY
+from os.path import isfile
+from pathlib import Path
+from json import dumps, load, dump
+from hashlib import sha1
+from time import monotonic
+from uuid import uuid4
+from .logger import logger
+
+
+def checkpoint_id(*args):
+    '''
+    Identifier of a transfer, from the values that define it.
+
+    Returns
+    -------
+    str
+        Hex digest of the JSON representation of the arguments.
+    '''
+    return sha1(dumps(args, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class Checkpoint():
+    '''
+    State of a resumable transfer, kept in a small JSON file.
+
+    The state is a dict edited by the owner of the checkpoint. save writes
+    it atomically and syncs it, at most once every float_interval seconds
+    unless forced: a crash loses at most the progress of that interval.
+    '''
+
+
+    def __init__(self, path_folder, str_id, float_interval=1.0):
+        makedirs(str(path_folder), exist_ok=True)
+        self.__path = Path(str(path_folder)) / (str(str_id) + ".json")
+        self.__float_interval = float(float_interval)
+        self.__last_save = None
+        self.state = {}
+        if isfile(self.__path):
+            try:
+                with open(self.__path, "r") as f:
+                    self.state = load(f)
+            except Exception as e:
+                logger.warning("Checkpoint not readable, reset. " + str(e))
+                self.state = {}
+
+
+    def path(self):
+        return self.__path
+
+
+    def save(self, bool_force=False):
+        now = monotonic()
+        if (not bool_force) and (self.__last_save is not None) \
+            and (now - self.__last_save < self.__float_interval):
+            return
+        path_tmp = self.__path.parent / \
+            ("." + self.__path.name + ".tmp-" + uuid4().hex)
+        try:
+            with open(path_tmp, "w") as f:
+                dump(self.state, f)
+                f.flush()
+                fsync(f.fileno())
+            replace(path_tmp, self.__path)
+        except Exception:
+            if isfile(path_tmp):
+                remove(path_tmp)
+            raise
+        # The rename itself survives a crash once the folder is synced.
+        fd = os_open(str(self.__path.parent), O_RDONLY)
+        try:
+            fsync(fd)
+        finally:
+            os_close(fd)
+        self.__last_save = now
+
+
+    def remove(self):
+        self.state = {}
+        if isfile(self.__path):
+            remove(self.__path)
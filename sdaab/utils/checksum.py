@@ -0,0 +1,129 @@
+from hashlib import md5
+from base64 import b64encode
+
+
+def md5_pair(data):
+    '''
+    MD5 of a part, in the form boto sends as Content-MD5.
+
+    Parameters
+    ----------
+    data : bytes
+        The content of the part.
+
+    Returns
+    -------
+    tuple
+        (hex digest, base64 digest).
+    '''
+    h = md5(data)
+    return (h.hexdigest(), b64encode(h.digest()).decode("ascii"))
+
+
+def etag_strip(etag):
+    return str(etag).strip('"')
+
+
+def etag_is_md5(headers):
+    '''
+    False if the headers of a response tell that the ETag of the object is
+    not derived from its MD5: SSE-KMS or SSE-C encryption.
+
+    Parameters
+    ----------
+    headers : list
+        (name, value) pairs of the response headers.
+
+    Returns
+    -------
+    bool
+        True if the ETag can be compared with the MD5.
+    '''
+    headers = dict([(str(k).lower(), str(v)) for k, v in headers])
+    if headers.get("x-amz-server-side-encryption", "").startswith("aws:kms"):
+        return False
+    return "x-amz-server-side-encryption-customer-algorithm" not in headers
+
+
+def composite_etag(md5s):
+    '''
+    ETag of a multipart upload: the MD5 of the concatenated MD5s of the
+    parts, followed by the number of parts.
+
+    Parameters
+    ----------
+    md5s : list
+        Hex MD5s of the parts, in order.
+
+    Returns
+    -------
+    str
+        The ETag, without quotes.
+    '''
+    digest = md5(b"".join([bytes.fromhex(etag_strip(x)) for x in md5s]))
+    return digest.hexdigest() + "-" + str(len(md5s))
+
+
+class ETagHasher():
+    '''
+    Rebuilds the S3 ETag of a stream while it is read or written: the MD5
+    of the content, or with int_part_size the composite ETag of a
+    multipart upload with parts of that size.
+    '''
+
+
+    def __init__(self, int_part_size=None):
+        self.__int_part_size = None if int_part_size is None \
+            else int(int_part_size)
+        assert (self.__int_part_size is None) or (self.__int_part_size > 0), \
+            "Part size should be positive."
+        self.__md5 = md5()
+        self.__filled = 0
+        self.__md5s = []
+
+
+    def update(self, data):
+        if self.__int_part_size is None:
+            self.__md5.update(data)
+            return
+        view = memoryview(data)
+        while len(view) > 0:
+            n = min(len(view), self.__int_part_size - self.__filled)
+            self.__md5.update(view[:n])
+            self.__filled += n
+            view = view[n:]
+            if self.__filled == self.__int_part_size:
+                self.__md5s.append(self.__md5.hexdigest())
+                self.__md5 = md5()
+                self.__filled = 0
+
+
+    def hexdigest(self):
+        if self.__int_part_size is None:
+            return self.__md5.hexdigest()
+        md5s = list(self.__md5s)
+        if (self.__filled > 0) or (len(md5s) == 0):
+            md5s.append(self.__md5.hexdigest())
+        return composite_etag(md5s)
+
+
+class HashingWriter():
+    '''
+    File object wrapper feeding the hashers with what is written through
+    it, e.g. the body of a GET: no second pass over the data.
+    '''
+
+
+    def __init__(self, fp, hashers):
+        self.__fp = fp
+        self.__hashers = list(hashers)
+
+
+    def write(self, data):
+        for h in self.__hashers:
+            h.update(data)
+        return self.__fp.write(data)
+
+
+    def __getattr__(self, name):
+        return getattr(self.__fp, name)
@@ -0,0 +1,100 @@
+from time import monotonic
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+deadline_var = ContextVar("sdaab_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    '''
+    The time budget of the operation is over.
+    '''
+
+
+@contextmanager
+def deadline(float_seconds):
+    '''
+    Bound all the requests made inside the context to a time budget.
+
+    The budget is shared by the whole block (e.g. every request of a
+    folder rm or every part of a multipart upload). A nested deadline can
+    only shorten the current one; None leaves it unchanged. Worker threads
+    see it only if they run in a copy of the context.
+
+    Parameters
+    ----------
+    float_seconds : float
+        The budget in seconds, or None.
+    '''
+    if float_seconds is None:
+        yield
+        return
+    end = monotonic() + float(float_seconds)
+    current = deadline_var.get()
+    if current is not None:
+        end = min(end, current)
+    token = deadline_var.set(end)
+    try:
+        yield
+    finally:
+        deadline_var.reset(token)
+
+
+@contextmanager
+def shielded():
+    '''
+    Run the block without the deadline of the context, e.g. the clean-up
+    of an operation whose deadline is over. The per-request timeouts still
+    apply.
+    '''
+    token = deadline_var.set(None)
+    try:
+        yield
+    finally:
+        deadline_var.reset(token)
+
+
+def remaining():
+    '''
+    Seconds left before the deadline of the current context.
+
+    Returns
+    -------
+    float
+        The remaining budget, None without a deadline.
+    '''
+    end = deadline_var.get()
+    if end is None:
+        return None
+    return end - monotonic()
+
+
+def check():
+    output = remaining()
+    if (output is not None) and (output <= 0):
+        raise DeadlineExceeded("Deadline exceeded.")
+
+
+def request_timeout(float_timeout):
+    '''
+    The timeout of a request: the default one, shortened to the remaining
+    budget.
+
+    Parameters
+    ----------
+    float_timeout : float
+        The default timeout in seconds, or None.
+
+    Returns
+    -------
+    float
+        The timeout to use, None if there is no limit.
+    '''
+    check()
+    output = remaining()
+    if float_timeout is None:
+        return output
+    if output is None:
+        return float(float_timeout)
+    return min(float(float_timeout), output)
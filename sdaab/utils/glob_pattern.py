@@ -0,0 +1,75 @@
+import re
+
+
+def glob_to_regex(pattern):
+    '''
+    Translate a glob pattern into a compiled regular expression.
+
+    The wildcards *, ? and [...] never match the folder separator /, while
+    ** matches any number of folders (also zero when followed by /).
+
+    Parameters
+    ----------
+    pattern : str
+        The glob pattern.
+
+    Returns
+    -------
+    re.compile
+        re.compile object matching the whole path.
+    '''
+    pattern = str(pattern)
+    output = ""
+    i = 0
+    n = len(pattern)
+    while i < n:
+        if pattern.startswith("**/", i):
+            output += "(?:.*/)?"
+            i += 3
+        elif pattern.startswith("**", i):
+            output += ".*"
+            i += 2
+        elif pattern[i] == "*":
+            output += "[^/]*"
+            i += 1
+        elif pattern[i] == "?":
+            output += "[^/]"
+            i += 1
+        elif pattern[i] == "[":
+            j = pattern.find("]", i + 2)
+            if j < 0:
+                output += re.escape("[")
+                i += 1
+            else:
+                content = pattern[i+1:j].replace("\\", "\\\\")
+                if content[0] == "!":
+                    output += "[^/" + content[1:] + "]"
+                else:
+                    # A range like [.-0] would also match /.
+                    output += "(?!/)[" + content + "]"
+                i = j + 1
+        else:
+            output += re.escape(pattern[i])
+            i += 1
+    return re.compile(output + r"\Z", re.DOTALL)
+
+
+def glob_literal_prefix(pattern):
+    '''
+    The longest prefix of the pattern without wildcards.
+
+    Parameters
+    ----------
+    pattern : str
+        The glob pattern.
+
+    Returns
+    -------
+    str
+        The literal prefix, it can be pushed to a server side listing.
+    '''
+    pattern = str(pattern)
+    for i, c in enumerate(pattern):
+        if c in "*?[":
+            return pattern[:i]
+    return pattern
@@ -0,0 +1,353 @@
+import sqlite3
+from os import makedirs
+from os.path import dirname, abspath
+from time import time
+from threading import Lock
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+staleness_var = ContextVar("sdaab_staleness", default=None)
+
+
+@contextmanager
+def staleness(float_seconds):
+    '''
+    Maximum age of the inventory answers inside the context, in place of
+    the default of the storage: the calls on keys scanned longer ago are
+    sent to the backend. 0 never uses the inventory.
+
+    Parameters
+    ----------
+    float_seconds : float
+        Seconds since the last scan covering the key.
+    '''
+    token = staleness_var.set(float(float_seconds))
+    try:
+        yield
+    finally:
+        staleness_var.reset(token)
+
+
+def successor(prefix):
+    '''
+    Smallest string after all the ones starting with the prefix.
+
+    Parameters
+    ----------
+    prefix : str
+        E.g. "a/".
+
+    Returns
+    -------
+    str
+        E.g. "a0", None for the empty prefix.
+    '''
+    if len(prefix) == 0:
+        return None
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def unique_sorted(entries):
+    '''
+    Generator of the entries of a folder listed in key order, without the
+    folders named as a file (a file and a folder can share the same name,
+    the file comes first and is kept) or listed again (e.g. by the next
+    page of a listing). Only the last folder and the files whose name
+    starts the current one are held, e.g. "a" and "a-b" until "a/".
+
+    Parameters
+    ----------
+    entries : iterable
+        (name, size, mtime) sorted by key, size None for the folders.
+    '''
+    files = []
+    folder = None
+    for name, size, mtime in entries:
+        while (len(files) > 0) and not name.startswith(files[-1]):
+            files.pop()
+        if size is not None:
+            files.append(name)
+        elif (name == folder) or ((len(files) > 0) and (files[-1] == name)):
+            continue
+        else:
+            folder = name
+        yield (name, size, mtime)
+
+
+class Inventory():
+    '''
+    Local SQLite index of the keys of a bucket: key, size, mtime, etag.
+
+    fn_scan(prefix) yields (key, size, mtime, etag) for every key starting
+    with the prefix, folder markers included. refresh(prefix) scans the
+    prefix, upserting one page at a time, then drops the keys below it not
+    seen and records the time of the scan. put, remove, move and copy keep
+    the index up to date with the writes of the instance.
+
+    fresh(key) tells if a key is covered by a scan done within the
+    staleness bound: float_max_age, or the one of the staleness context.
+    The database file can be shared by processes, one per bucket.
+    '''
+
+
+    def __init__(self, path_db, fn_scan, float_max_age=3600.0):
+        path_db = abspath(str(path_db))
+        makedirs(dirname(path_db), exist_ok=True)
+        self.__fn_scan = fn_scan
+        self.__float_max_age = float(float_max_age)
+        self.__lock = Lock()
+        self.__db = sqlite3.connect(
+            path_db, timeout=30.0, check_same_thread=False)
+        with self.__lock, self.__db:
+            self.__db.execute("PRAGMA journal_mode=WAL")
+            # scan: time of the scan (or of the write) that saw the key.
+            self.__db.execute("CREATE TABLE IF NOT EXISTS keys (key TEXT "
+                "PRIMARY KEY, size INTEGER, mtime REAL, etag TEXT, "
+                "scan REAL) WITHOUT ROWID")
+            self.__db.execute("CREATE TABLE IF NOT EXISTS scans (prefix "
+                "TEXT PRIMARY KEY, time REAL)")
+        self.__counters = {"hits": 0, "stale": 0}
+
+
+    def __range(self, prefix):
+        # SQL condition and arguments of the keys starting with the prefix.
+        end = successor(prefix)
+        if end is None:
+            return "key >= ?", (prefix,)
+        return "key >= ? AND key < ?", (prefix, end)
+
+
+    def __below(self, key):
+        # The key itself and the keys inside it, seen as a folder.
+        key = key.rstrip("/")
+        condition, args = self.__range(key + "/")
+        return "(key = ? OR (" + condition + "))", (key,) + args
+
+
+    def refresh(self, prefix):
+        '''
+        Scan the keys starting with the prefix into the index.
+
+        Parameters
+        ----------
+        prefix : str
+            Key of a folder, with the trailing /, or "" for the bucket.
+        '''
+        float_start = time()
+        page = []
+
+        def upsert():
+            with self.__lock, self.__db:
+                self.__db.executemany("INSERT OR REPLACE INTO keys VALUES "
+                    "(?, ?, ?, ?, ?)", [x + (float_start,) for x in page])
+            del page[:]
+
+        for item in self.__fn_scan(prefix):
+            page.append(tuple(item))
+            if len(page) >= 1000:
+                upsert()
+        upsert()
+        condition, args = self.__range(prefix)
+        with self.__lock, self.__db:
+            # The writes of the instance during the scan are kept.
+            self.__db.execute("DELETE FROM keys WHERE " + condition \
+                + " AND scan < ?", args + (float_start,))
+            self.__db.execute("INSERT OR REPLACE INTO scans VALUES (?, ?)",
+                (prefix, float_start))
+
+
+    def age(self, key):
+        '''
+        Seconds since the last scan covering the key, None if never.
+        '''
+        with self.__lock:
+            rows = self.__db.execute("SELECT prefix, time FROM scans")\
+                .fetchall()
+        times = [x[1] for x in rows if key.startswith(x[0])]
+        if len(times) == 0:
+            return None
+        return max(0.0, time() - max(times))
+
+
+    def fresh(self, key):
+        '''
+        True if the index can answer for the key: scanned within the
+        staleness bound.
+        '''
+        float_max_age = staleness_var.get()
+        if float_max_age is None:
+            float_max_age = self.__float_max_age
+        age = self.age(key)
+        output = (age is not None) and (age <= float_max_age)
+        with self.__lock:
+            self.__counters["hits" if output else "stale"] += 1
+        return output
+
+
+    def put(self, key, size, mtime=None, etag=None):
+        '''
+        Record a key written by the instance.
+        '''
+        float_now = time()
+        with self.__lock, self.__db:
+            self.__db.execute("INSERT OR REPLACE INTO keys VALUES "
+                "(?, ?, ?, ?, ?)", (key, size,
+                int(float_now) if mtime is None else mtime, etag, float_now))
+
+
+    def remove(self, key):
+        '''
+        Drop the key and the keys inside it, seen as a folder.
+        '''
+        condition, args = self.__below(key)
+        with self.__lock, self.__db:
+            self.__db.execute("DELETE FROM keys WHERE " + condition, args)
+
+
+    def copy(self, key_source, key_dest, bool_remove=False):
+        '''
+        Copy (move with bool_remove) the key and the keys inside it under
+        the new name. The copies get a new mtime and an unknown etag.
+        '''
+        key_source = key_source.rstrip("/")
+        key_dest = key_dest.rstrip("/")
+        condition, args = self.__below(key_source)
+        float_now = time()
+        with self.__lock, self.__db:
+            self.__db.execute("INSERT OR REPLACE INTO keys SELECT ? || "
+                "substr(key, ?), size, ?, NULL, ? FROM keys WHERE " \
+                + condition, (key_dest, len(key_source) + 1, int(float_now),
+                float_now) + args)
+            if bool_remove:
+                self.__db.execute("DELETE FROM keys WHERE " + condition,
+                    args)
+
+
+    def move(self, key_source, key_dest):
+        self.copy(key_source, key_dest, bool_remove=True)
+
+
+    def get(self, key):
+        '''
+        (size, mtime, etag) of the key, None if not in the index.
+        '''
+        with self.__lock:
+            return self.__db.execute("SELECT size, mtime, etag FROM keys "
+                "WHERE key = ?", (key,)).fetchone()
+
+
+    def any_below(self, prefix):
+        '''
+        True if a key starts with the prefix.
+        '''
+        condition, args = self.__range(prefix)
+        with self.__lock:
+            return self.__db.execute("SELECT 1 FROM keys WHERE " \
+                + condition + " LIMIT 1", args).fetchone() is not None
+
+
+    def total_size(self, prefix):
+        '''
+        Sum of the sizes of the keys starting with the prefix.
+        '''
+        condition, args = self.__range(prefix)
+        with self.__lock:
+            output = self.__db.execute("SELECT SUM(size) FROM keys WHERE " \
+                + condition, args).fetchone()[0]
+        return 0 if output is None else output
+
+
+    def children(self, prefix, int_page_size=1000):
+        '''
+        Generator of the content of a folder, as ls_iter: (name, size,
+        mtime) in key order, size and mtime None for the subfolders, see
+        unique_sorted. The index is read one page at a time, the content
+        of the subfolders is skipped, not read.
+        '''
+        return unique_sorted(self.__children(prefix, int_page_size))
+
+
+    def __children(self, prefix, int_page_size):
+        # The keys from start on (after it without bool_equal), one page
+        # at a time: the keys of a subfolder are skipped within the page,
+        # the next page starts after the subfolder.
+        condition, args = self.__range(prefix)
+        start = prefix
+        bool_equal = True
+        while True:
+            with self.__lock:
+                rows = self.__db.execute("SELECT key, size, mtime FROM keys "
+                    "WHERE " + condition + " AND key " \
+                    + (">=" if bool_equal else ">") + " ? ORDER BY key "
+                    "LIMIT ?", args + (start, int_page_size)).fetchall()
+            folder = None
+            for key, size, mtime in rows:
+                if (key == prefix) or \
+                    ((folder is not None) and key.startswith(folder)):
+                    continue
+                name = key[len(prefix):]
+                i = name.find("/")
+                if i < 0:
+                    yield (name, size, mtime)
+                    continue
+                folder = prefix + name[:i+1]
+                yield (name[:i], None, None)
+            if len(rows) < int_page_size:
+                return
+            start = rows[-1][0]
+            bool_equal = False
+            if (folder is not None) and start.startswith(folder):
+                start = successor(folder)
+                bool_equal = True
+
+
+    def keys(self, prefix, int_page_size=1000):
+        '''
+        Generator of the keys starting with the prefix, in order, folder
+        markers included. The index is read one page at a time.
+        '''
+        condition, args = self.__range(prefix)
+        last = None
+        while True:
+            with self.__lock:
+                if last is None:
+                    rows = self.__db.execute("SELECT key FROM keys WHERE " \
+                        + condition + " ORDER BY key LIMIT ?",
+                        args + (int_page_size,)).fetchall()
+                else:
+                    rows = self.__db.execute("SELECT key FROM keys WHERE " \
+                        + condition + " AND key > ? ORDER BY key LIMIT ?",
+                        args + (last, int_page_size)).fetchall()
+            for x in rows:
+                yield x[0]
+            if len(rows) < int_page_size:
+                return
+            last = rows[-1][0]
+
+
+    def stats(self):
+        '''
+        Counters of the inventory.
+
+        Returns
+        -------
+        dict
+            {"keys" (in the index), "scans" ({prefix: seconds since the
+            scan}), "hits" (calls answered by the index), "stale" (sent to
+            the backend)}.
+        '''
+        with self.__lock:
+            output = dict(self.__counters)
+            output["keys"] = self.__db.execute("SELECT COUNT(*) FROM keys")\
+                .fetchone()[0]
+            rows = self.__db.execute("SELECT prefix, time FROM scans")\
+                .fetchall()
+        output["scans"] = dict([(x[0], max(0.0, time() - x[1])) \
+            for x in rows])
+        return output
+
+
+    def close(self):
+        with self.__lock:
+            self.__db.close()
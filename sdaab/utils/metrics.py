@@ -0,0 +1,379 @@
+from time import perf_counter
+from threading import Lock
+from functools import wraps
+from inspect import isgenerator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from json import dumps
+from .logger import logger
+
+
+method_var = ContextVar("sdaab_method", default=None)
+'''
+(metrics, method name) of the storage call running in the context: the
+backend requests and the bytes are attributed to it.
+'''
+
+
+counters_var = ContextVar("sdaab_request_counters", default=())
+'''
+The RequestCounter objects of the count_requests blocks of the context.
+'''
+
+
+latency_bounds = tuple([0.0001 * 2 ** i for i in range(24)])
+'''
+Upper bounds in seconds of the latency buckets, from 0.1 ms to ~14 min.
+'''
+
+
+class Histogram():
+    '''
+    Latencies counted in fixed logarithmic buckets: recording is O(log n)
+    and the memory constant, the percentiles are the upper bounds of the
+    buckets (at most 2x the real value). Not thread safe, the owner locks.
+    '''
+
+
+    def __init__(self):
+        self.counts = [0] * (len(latency_bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+
+    def add(self, float_seconds):
+        lo, hi = 0, len(latency_bounds)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if float_seconds <= latency_bounds[mid]:
+                hi = mid
+            else:
+                lo = mid + 1
+        self.counts[lo] += 1
+        self.count += 1
+        self.sum += float_seconds
+        self.max = max(self.max, float_seconds)
+
+
+    def percentile(self, float_percentile):
+        if self.count == 0:
+            return None
+        target = float(float_percentile) / 100 * self.count
+        total = 0
+        for i, n in enumerate(self.counts):
+            total += n
+            if (total >= target) and (n > 0):
+                if i == len(latency_bounds):
+                    return self.max
+                return min(latency_bounds[i], self.max)
+        return self.max
+
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "buckets": [[b, n] for b, n in \
+                zip(list(latency_bounds) + [None], self.counts) if n > 0]
+        }
+
+
+def new_method_stats():
+    return {
+        "calls": 0,
+        "errors": 0,
+        "bytes_read": 0,
+        "bytes_written": 0,
+        "requests": {},
+        "latency": Histogram()
+    }
+
+
+class Metrics():
+    '''
+    Counters of a storage object: per method the calls, errors, latency
+    histogram, bytes read and written and backend requests (S3 API calls,
+    BDL POSTs), plus the totals.
+
+    Recording only updates a few counters under a lock. snapshot and reset
+    are the pull API; export pushes a snapshot to the exporters, callables
+    taking the snapshot dict (e.g. log_exporter).
+    '''
+
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.__exporters = []
+        self.reset()
+
+
+    def reset(self):
+        with self.__lock:
+            self.__methods = {}
+            self.__requests = {}
+            self.__errors = 0
+            self.__bytes_read = 0
+            self.__bytes_written = 0
+
+
+    def __method(self):
+        # Stats of the method of the context, None outside of a call of
+        # this storage object. Called with the lock.
+        current = method_var.get()
+        if (current is None) or (current[0] is not self):
+            return None
+        if current[1] not in self.__methods:
+            self.__methods[current[1]] = new_method_stats()
+        return self.__methods[current[1]]
+
+
+    def call(self, str_method, float_seconds, bool_error=False):
+        with self.__lock:
+            if str_method not in self.__methods:
+                self.__methods[str_method] = new_method_stats()
+            stats = self.__methods[str_method]
+            stats["calls"] += 1
+            stats["latency"].add(float_seconds)
+            if bool_error:
+                stats["errors"] += 1
+                self.__errors += 1
+
+
+    def request(self, str_name):
+        with self.__lock:
+            self.__requests[str_name] = self.__requests.get(str_name, 0) + 1
+            stats = self.__method()
+            if stats is not None:
+                stats["requests"][str_name] = \
+                    stats["requests"].get(str_name, 0) + 1
+        for counter in counters_var.get():
+            counter.add(str_name)
+
+
+    def add_bytes(self, int_read=0, int_written=0):
+        with self.__lock:
+            self.__bytes_read += int(int_read)
+            self.__bytes_written += int(int_written)
+            stats = self.__method()
+            if stats is not None:
+                stats["bytes_read"] += int(int_read)
+                stats["bytes_written"] += int(int_written)
+
+
+    def snapshot(self):
+        '''
+        Copy of the counters.
+
+        Returns
+        -------
+        dict
+            {"methods": {name: {"calls", "errors", "bytes_read",
+            "bytes_written", "requests", "latency"}}, "requests", "errors",
+            "bytes_read", "bytes_written"}, the latencies in seconds.
+        '''
+        with self.__lock:
+            return {
+                "methods": dict([(name, {
+                    "calls": x["calls"],
+                    "errors": x["errors"],
+                    "bytes_read": x["bytes_read"],
+                    "bytes_written": x["bytes_written"],
+                    "requests": dict(x["requests"]),
+                    "latency": x["latency"].snapshot()
+                }) for name, x in self.__methods.items()]),
+                "requests": dict(self.__requests),
+                "errors": self.__errors,
+                "bytes_read": self.__bytes_read,
+                "bytes_written": self.__bytes_written
+            }
+
+
+    def add_exporter(self, fn_exporter):
+        with self.__lock:
+            self.__exporters.append(fn_exporter)
+
+
+    def remove_exporter(self, fn_exporter):
+        with self.__lock:
+            self.__exporters.remove(fn_exporter)
+
+
+    def export(self, bool_reset=False):
+        '''
+        Push a snapshot to the exporters, an exporter failing is logged
+        and skipped.
+
+        Parameters
+        ----------
+        bool_reset : bool, optional
+            Reset the counters after the snapshot, by default False
+
+        Returns
+        -------
+        dict
+            The snapshot exported.
+        '''
+        output = self.snapshot()
+        if bool_reset:
+            self.reset()
+        with self.__lock:
+            exporters = list(self.__exporters)
+        for fn in exporters:
+            try:
+                fn(output)
+            except Exception as e:
+                logger.warning("Metrics exporter failed. " + str(e))
+        return output
+
+
+def log_exporter(snapshot):
+    logger.info("metrics " + dumps(snapshot, sort_keys=True))
+
+
+def measured_generator(metrics, str_name, generator, start):
+    '''
+    The generator returned by a measured method, measured while it runs:
+    the method of the context is set at each step, and the call recorded
+    when the generator is exhausted, fails or is closed.
+    '''
+    bool_error = True
+    try:
+        while True:
+            current = method_var.get()
+            token = None
+            if (current is None) or (current[0] is not metrics):
+                token = method_var.set((metrics, str_name))
+            try:
+                item = next(generator)
+            except StopIteration:
+                break
+            finally:
+                if token is not None:
+                    method_var.reset(token)
+            yield item
+        bool_error = False
+    except GeneratorExit:
+        bool_error = False
+        raise
+    finally:
+        generator.close()
+        metrics.call(str_name, perf_counter() - start, bool_error)
+
+
+def measured(method):
+    '''
+    Decorator of the storage methods: records the call, its latency and
+    its error if any in self.metrics(). Nested calls of the same storage
+    object (e.g. append calling upload_from_memory) are recorded too, but
+    the requests and bytes go to the outermost one. A method returning a
+    generator (e.g. walk) is measured until the generator is exhausted or
+    closed, the requests of its steps are attributed to it.
+    '''
+    str_name = method.__name__
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        metrics = self.metrics()
+        current = method_var.get()
+        token = None
+        if (current is None) or (current[0] is not metrics):
+            token = method_var.set((metrics, str_name))
+        start = perf_counter()
+        bool_error = True
+        bool_generator = False
+        try:
+            output = method(self, *args, **kwargs)
+            bool_error = False
+            if isgenerator(output):
+                bool_generator = True
+                return measured_generator(metrics, str_name, output, start)
+            return output
+        finally:
+            if not bool_generator:
+                metrics.call(str_name, perf_counter() - start, bool_error)
+            if token is not None:
+                method_var.reset(token)
+    return wrapper
+
+
+class RequestCounter():
+    '''
+    Backend requests counted by type (e.g. HEAD, PUT, upload/).
+    '''
+
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.__counts = {}
+
+
+    def add(self, str_name):
+        with self.__lock:
+            self.__counts[str_name] = self.__counts.get(str_name, 0) + 1
+
+
+    def counts(self):
+        with self.__lock:
+            return dict(self.__counts)
+
+
+    def total(self):
+        with self.__lock:
+            return sum(self.__counts.values())
+
+
+@contextmanager
+def count_requests():
+    '''
+    Count the backend requests sent inside the block, by any storage
+    object. Only the requests of this context are counted (and of the
+    threads running a copy of it, e.g. the parts of an upload): other
+    threads using the same storage objects are not. Retries and hedged
+    duplicates are requests too. Blocks can be nested.
+
+    Yields
+    ------
+    RequestCounter
+        The counter of the block.
+    '''
+    counter = RequestCounter()
+    token = counters_var.set(counters_var.get() + (counter,))
+    try:
+        yield counter
+    finally:
+        counters_var.reset(token)
+
+
+@contextmanager
+def request_budget(int_max=None, dict_max=None):
+    '''
+    Assert that the block sends at most int_max backend requests, and at
+    most dict_max[type] requests of each type listed (0 forbids a type).
+
+    Parameters
+    ----------
+    int_max : int, optional
+        Maximum number of requests, by default None (no limit)
+    dict_max : dict, optional
+        Maximum number of requests by type, by default None
+
+    Yields
+    ------
+    RequestCounter
+        The counter of the block.
+    '''
+    with count_requests() as counter:
+        yield counter
+    counts = counter.counts()
+    if int_max is not None:
+        assert counter.total() <= int(int_max), "Request budget exceeded: " \
+            + str(counter.total()) + " > " + str(int_max) + " " + str(counts)
+    for str_name, n in (dict_max or {}).items():
+        assert counts.get(str_name, 0) <= int(n), "Request budget of " + \
+            str_name + " exceeded: " + str(counts.get(str_name, 0)) + " > " \
+            + str(n) + " " + str(counts)
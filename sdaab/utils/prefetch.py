@@ -0,0 +1,316 @@
+from os import remove, makedirs
+from os.path import isfile, abspath
+from pathlib import Path
+from uuid import uuid4
+from bisect import bisect_right
+from threading import Condition
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from .logger import logger
+from .write_behind import is_below
+
+
+def parent_key(key):
+    '''
+    Folder of a key, with the trailing /, "" for the keys at the top.
+
+    Parameters
+    ----------
+    key : str
+        Key of a file, e.g. "folder/file".
+
+    Returns
+    -------
+    str
+        E.g. "folder/".
+    '''
+    return key[:key.rfind("/") + 1]
+
+
+class Prefetcher():
+    '''
+    Reads done ahead of use by int_workers threads, into a bounded buffer.
+
+    fn_read(key) returns the content of a key. prefetch(keys) schedules
+    explicit reads, kept until taken or cancelled. With fn_list(folder),
+    returning the keys of the files of a folder, a sequential-read
+    detector schedules speculative reads: when a take follows the
+    previous one in the sorted listing of their folder, the next int_depth
+    keys are read ahead. Speculative reads skipped by the reader, or left
+    behind when the reader jumps elsewhere, are cancelled.
+
+    At most int_depth reads are running or waiting to be taken, and no
+    read starts while the buffer holds int_max_bytes or more. The buffer
+    lives in memory, or in files inside path_buffer.
+    '''
+
+
+    def __init__(
+        self,
+        fn_read,
+        fn_list=None,
+        int_depth=8,
+        int_max_bytes=67108864,
+        int_workers=4,
+        path_buffer=None
+    ):
+        assert int(int_depth) > 0, "The depth should be positive."
+        assert int(int_max_bytes) > 0, "The byte limit should be positive."
+        assert int(int_workers) > 0, "At least one worker."
+        self.__fn_read = fn_read
+        self.__fn_list = fn_list
+        self.__int_depth = int(int_depth)
+        self.__int_max_bytes = int(int_max_bytes)
+        self.__int_workers = int(int_workers)
+        self.__path_buffer = None if path_buffer is None \
+            else abspath(str(path_buffer))
+        if self.__path_buffer is not None:
+            makedirs(self.__path_buffer, exist_ok=True)
+        self.__cond = Condition()
+        # key -> entry, a dict: state ("queued", "running", "ready"),
+        # bool_speculative, data (bytes, or the path of the buffer file),
+        # int_size, error. The queued and the speculative entries are also
+        # kept apart, in the order of the requests.
+        self.__entries = {}
+        self.__queue = OrderedDict()
+        self.__speculative = OrderedDict()
+        self.__int_busy = 0
+        self.__int_running = 0
+        self.__int_bytes = 0
+        # Sorted keys of the folders seen by the detector.
+        self.__listings = {}
+        self.__last = None
+        self.__counters = dict([(x, 0) for x in \
+            ("hits", "misses", "fetched", "cancelled")])
+        self.__closed = False
+        self.__executor = ThreadPoolExecutor(
+            max_workers=int(int_workers), thread_name_prefix="sdaab-pf")
+
+
+    def stats(self):
+        '''
+        Counters of the prefetcher.
+
+        Returns
+        -------
+        dict
+            {"hits" (takes served by the buffer), "misses", "fetched"
+            (reads done), "cancelled" (reads started and dropped unused),
+            "pending" (entries not taken yet), "bytes" (in the buffer)}.
+        '''
+        with self.__cond:
+            output = dict(self.__counters)
+            output["pending"] = len(self.__entries)
+            output["bytes"] = self.__int_bytes
+            return output
+
+
+    def __pump(self):
+        # Called with the condition: start the queued reads that fit. A 
+        # read starts only when a worker is free, so that the byte limit 
+        # is checked with the sizes of the reads done.
+        while (len(self.__queue) > 0) and (not self.__closed) \
+            and (self.__int_busy < self.__int_depth) \
+            and (self.__int_running < self.__int_workers) \
+            and (self.__int_bytes < self.__int_max_bytes):
+            key, entry = self.__queue.popitem(last=False)
+            entry["state"] = "running"
+            self.__int_busy += 1
+            self.__int_running += 1
+            self.__executor.submit(self.__fetch, key, entry)
+
+
+    def __pop(self, key):
+        # Called with the condition: the entry leaves the buffer.
+        entry = self.__entries.pop(key)
+        self.__queue.pop(key, None)
+        self.__speculative.pop(key, None)
+        if entry["state"] != "queued":
+            self.__int_busy -= 1
+        if entry["state"] == "ready":
+            self.__int_bytes -= entry["int_size"]
+        return entry
+
+
+    def __drop(self, keys):
+        # Called with the condition: the entries are not needed anymore.
+        for key in keys:
+            entry = self.__pop(key)
+            if entry["state"] != "queued":
+                self.__counters["cancelled"] += 1
+            if (entry["state"] == "ready") and (self.__path_buffer \
+                is not None) and (entry["data"] is not None):
+                remove(entry["data"])
+            entry["state"] = "cancelled"
+        self.__pump()
+
+
+    def __store(self, data):
+        if self.__path_buffer is None:
+            return data
+        path = Path(self.__path_buffer) / ("." + uuid4().hex + ".prefetch")
+        with open(path, "wb") as f:
+            f.write(data)
+        return str(path)
+
+
+    def __fetch(self, key, entry):
+        data = None
+        error = None
+        int_size = 0
+        try:
+            content = self.__fn_read(key)
+            int_size = len(content)
+            data = self.__store(content)
+        except Exception as e:
+            error = e
+        with self.__cond:
+            self.__counters["fetched"] += 1
+            self.__int_running -= 1
+            if entry["state"] == "cancelled":
+                if (self.__path_buffer is not None) and (data is not None) \
+                    and isfile(data):
+                    remove(data)
+            else:
+                entry["state"] = "ready"
+                entry["data"] = data
+                entry["error"] = error
+                entry["int_size"] = int_size
+                self.__int_bytes += int_size
+            self.__pump()
+            self.__cond.notify_all()
+
+
+    def __add(self, keys, bool_speculative):
+        # Called with the condition.
+        for key in keys:
+            entry = self.__entries.get(key)
+            if entry is None:
+                entry = {
+                    "state": "queued",
+                    "bool_speculative": bool_speculative,
+                    "data": None,
+                    "int_size": 0,
+                    "error": None
+                }
+                self.__entries[key] = entry
+                self.__queue[key] = entry
+                if bool_speculative:
+                    self.__speculative[key] = entry
+            elif not bool_speculative:
+                entry["bool_speculative"] = False
+                self.__speculative.pop(key, None)
+        self.__pump()
+
+
+    def prefetch(self, keys):
+        '''
+        Schedule the reads of the keys, in order, kept until taken or
+        cancelled.
+        '''
+        with self.__cond:
+            assert not self.__closed, "Prefetcher closed."
+            self.__add(list(keys), False)
+
+
+    def cancel(self, keys=None):
+        '''
+        Drop the reads of the keys (all by default), running ones included:
+        their results are thrown away.
+        '''
+        with self.__cond:
+            if keys is None:
+                keys = list(self.__entries)
+            self.__drop([x for x in keys if x in self.__entries])
+
+
+    def invalidate(self, prefix):
+        '''
+        Drop the reads of the keys equal to or below the prefix (e.g. after
+        a rm or a mv) and forget the listings of the detector there.
+        '''
+        with self.__cond:
+            self.__drop([x for x in self.__entries if is_below(x, prefix)])
+            for x in [x for x in self.__listings if is_below(x, prefix) \
+                or is_below(prefix, x)]:
+                del self.__listings[x]
+
+
+    def __detect(self, key):
+        # The keys to read ahead if key follows the previous take in the
+        # listing of its folder, None if the reading is not sequential.
+        with self.__cond:
+            last = self.__last
+            self.__last = key
+        folder = parent_key(key)
+        if (self.__fn_list is None) or (last is None) \
+            or (parent_key(last) != folder) or (last >= key):
+            return None
+        with self.__cond:
+            listing = self.__listings.get(folder)
+        if listing is None:
+            try:
+                listing = sorted(self.__fn_list(folder))
+            except Exception as e:
+                logger.warning("Prefetch listing failed. " + str(e))
+                return None
+            with self.__cond:
+                self.__listings[folder] = listing
+        i = bisect_right(listing, last)
+        if (i >= len(listing)) or (listing[i] != key):
+            return None
+        return listing[i + 1:i + 1 + self.__int_depth]
+
+
+    def take(self, key):
+        '''
+        Content of the key from the buffer, waiting for its read if
+        running. None if the key was not scheduled, was still queued or
+        its read failed: the caller reads it itself.
+        '''
+        keys_ahead = self.__detect(key)
+        with self.__cond:
+            if key in self.__speculative:
+                # The speculative reads before the key were skipped.
+                keys_skipped = []
+                for x in self.__speculative:
+                    if x == key:
+                        break
+                    keys_skipped.append(x)
+                self.__drop(keys_skipped)
+            if keys_ahead is None:
+                # Not sequential: the speculative reads are left behind.
+                self.__drop([x for x in self.__speculative if x != key])
+            elif not self.__closed:
+                self.__add(keys_ahead, True)
+            entry = self.__entries.get(key)
+            while (entry is not None) and (entry["state"] == "running"):
+                self.__cond.wait()
+            if (entry is None) or (entry["state"] != "ready"):
+                if (entry is not None) and (entry["state"] == "queued"):
+                    self.__drop([key])
+                self.__counters["misses"] += 1
+                return None
+            self.__pop(key)
+            entry["state"] = "taken"
+            self.__pump()
+            if entry["error"] is not None:
+                self.__counters["misses"] += 1
+                return None
+            self.__counters["hits"] += 1
+        if self.__path_buffer is None:
+            return entry["data"]
+        with open(entry["data"], "rb") as f:
+            output = f.read()
+        remove(entry["data"])
+        return output
+
+
+    def close(self):
+        '''
+        Cancel every read and stop the workers.
+        '''
+        with self.__cond:
+            self.__closed = True
+        self.cancel()
+        self.__executor.shutdown(wait=True)
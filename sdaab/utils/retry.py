@@ -0,0 +1,274 @@
+from random import uniform
+from time import sleep, monotonic
+from collections import deque
+from threading import Lock
+from http.client import HTTPException
+from contextvars import copy_context
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .logger import logger
+from .deadline import DeadlineExceeded, check, remaining
+
+
+statuses_retryable = (408, 429, 500, 502, 503, 504)
+error_codes_retryable = (
+    "SlowDown",
+    "Throttling",
+    "RequestTimeout",
+    "InternalError",
+    "ServiceUnavailable"
+)
+
+
+class RetryableError(Exception):
+    '''
+    A failed request that may succeed if sent again, e.g. a 5xx response.
+    '''
+
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def is_retryable(e):
+    '''
+    Whether the error of a request is transient: connection resets,
+    timeouts, throttling and 5xx responses.
+
+    Parameters
+    ----------
+    e : Exception
+        The error raised by the request.
+
+    Returns
+    -------
+    bool
+        True if the request can be sent again.
+    '''
+    if isinstance(e, (RetryableError, ConnectionError, TimeoutError, \
+        HTTPException)):
+        return True
+    if getattr(e, "error_code", None) in error_codes_retryable:
+        return True
+    status = getattr(e, "status", None)
+    if status is None:
+        status = getattr(getattr(e, "response", None), "status_code", None)
+    try:
+        return int(status) in statuses_retryable
+    except (TypeError, ValueError):
+        return False
+
+
+class RetryPolicy():
+    '''
+    Capped exponential backoff with full jitter.
+
+    The n-th retry waits a random time between 0 and
+    min(float_max_delay, float_base_delay * 2^n) seconds. Only the errors
+    accepted by fn_retryable are retried, at most int_max_attempts
+    attempts are made, and never past the deadline of the context.
+    '''
+
+
+    def __init__(
+        self,
+        int_max_attempts=5,
+        float_base_delay=0.1,
+        float_max_delay=10.0,
+        fn_retryable=is_retryable
+    ):
+        assert int(int_max_attempts) > 0, "At least one attempt."
+        self.int_max_attempts = int(int_max_attempts)
+        self.float_base_delay = float(float_base_delay)
+        self.float_max_delay = float(float_max_delay)
+        self.fn_retryable = fn_retryable
+
+
+    def delay(self, int_retry):
+        return uniform(0, min(self.float_max_delay, \
+            self.float_base_delay * 2 ** int(int_retry)))
+
+
+    def call(self, fn, str_name="request", fn_on_retry=None):
+        '''
+        Call fn until it succeeds or fails with a permanent error.
+
+        Parameters
+        ----------
+        fn : callable
+            The request, without arguments.
+        str_name : str, optional
+            Name of the request in the logs, by default "request"
+        fn_on_retry : callable, optional
+            Called with the error before each retry, by default None
+
+        Returns
+        -------
+        object
+            The output of fn.
+        '''
+        int_retry = 0
+        while True:
+            check()
+            try:
+                return fn()
+            except Exception as e:
+                if (int_retry + 1 >= self.int_max_attempts) \
+                    or not self.fn_retryable(e):
+                    raise
+                if fn_on_retry is not None:
+                    fn_on_retry(e)
+                float_delay = self.delay(int_retry)
+                float_remaining = remaining()
+                if (float_remaining is not None) \
+                    and (float_delay >= float_remaining):
+                    raise DeadlineExceeded(
+                        "Deadline exceeded. " + str(e)) from e
+                int_retry += 1
+                logger.warning(str_name + " failed, retry " + str(int_retry) \
+                    + " in " + "%.3f" % float_delay + "s. " + str(e))
+                sleep(float_delay)
+
+
+class LatencyTracker():
+    '''
+    The latencies of the last int_window requests.
+    '''
+
+
+    def __init__(self, int_window=1000):
+        self.__latencies = deque(maxlen=int(int_window))
+        self.__lock = Lock()
+
+
+    def add(self, float_seconds):
+        with self.__lock:
+            self.__latencies.append(float(float_seconds))
+
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__latencies)
+
+
+    def percentile(self, float_percentile):
+        with self.__lock:
+            latencies = sorted(self.__latencies)
+        if len(latencies) == 0:
+            return None
+        i = int(round(float(float_percentile) / 100 * (len(latencies) - 1)))
+        return latencies[min(max(i, 0), len(latencies) - 1)]
+
+
+class Hedger():
+    '''
+    Hedged requests for idempotent reads.
+
+    When a request takes longer than the float_percentile latency of the
+    previous ones of the same name, a duplicate is sent and the first
+    successful response wins; the loser runs to completion in background
+    and its output is dropped. No request is hedged before int_min_samples
+    latencies are known.
+    '''
+
+
+    def __init__(
+        self,
+        float_percentile=95.0,
+        int_min_samples=20,
+        float_min_delay=0.005,
+        int_workers=8
+    ):
+        assert 0 < float(float_percentile) <= 100, "Percentile out of range."
+        self.__float_percentile = float(float_percentile)
+        self.__int_min_samples = int(int_min_samples)
+        self.__float_min_delay = float(float_min_delay)
+        self.__int_workers = int(int_workers)
+        self.__trackers = {}
+        self.__executor = None
+        self.__lock = Lock()
+
+
+    def __tracker(self, str_name):
+        with self.__lock:
+            if str_name not in self.__trackers:
+                self.__trackers[str_name] = LatencyTracker()
+            return self.__trackers[str_name]
+
+
+    def __get_executor(self):
+        with self.__lock:
+            if self.__executor is None:
+                self.__executor = ThreadPoolExecutor(
+                    max_workers=self.__int_workers,
+                    thread_name_prefix="sdaab_hedge"
+                )
+            return self.__executor
+
+
+    def delay(self, str_name):
+        '''
+        Seconds to wait before sending the duplicate.
+
+        Parameters
+        ----------
+        str_name : str
+            Name of the request, e.g. HEAD or GET.
+
+        Returns
+        -------
+        float
+            The delay, None if the request should not be hedged yet.
+        '''
+        tracker = self.__tracker(str_name)
+        if len(tracker) < self.__int_min_samples:
+            return None
+        return max(self.__float_min_delay, \
+            tracker.percentile(self.__float_percentile))
+
+
+    def call(self, fn, str_name="request"):
+        '''
+        Call fn, hedged if slower than usual.
+
+        Parameters
+        ----------
+        fn : callable
+            The idempotent request, without arguments. It can be run by
+            two threads at the same time.
+        str_name : str, optional
+            Name of the request, by default "request"
+
+        Returns
+        -------
+        object
+            The output of the first successful call.
+        '''
+        tracker = self.__tracker(str_name)
+
+        def timed():
+            start = monotonic()
+            output = fn()
+            tracker.add(monotonic() - start)
+            return output
+
+        float_delay = self.delay(str_name)
+        if float_delay is None:
+            return timed()
+        # The requests run in a copy of the context: same deadline.
+        executor = self.__get_executor()
+        first = executor.submit(copy_context().run, timed)
+        done, _ = wait([first], timeout=float_delay)
+        if first in done:
+            return first.result()
+        logger.debug(str_name + " slower than " + "%.3f" % float_delay \
+            + "s, hedged.")
+        pending = set([first, executor.submit(copy_context().run, timed)])
+        error = None
+        while len(pending) > 0:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
@@ -0,0 +1,195 @@
+from inspect import signature
+from threading import Condition
+from concurrent.futures import ThreadPoolExecutor
+
+
+def is_below(key, prefix):
+    '''
+    Whether the key is the prefix itself or inside it, seen as a folder.
+
+    Parameters
+    ----------
+    key : str
+        Key of a write, e.g. "folder/file".
+    prefix : str
+        Key of a file or a folder, with or without the trailing /. The
+        empty prefix contains every key.
+
+    Returns
+    -------
+    bool
+        True if the key is below the prefix.
+    '''
+    prefix = prefix.rstrip("/")
+    return (prefix == "") or (key == prefix) or key.startswith(prefix + "/")
+
+
+def path_argument(method):
+    '''
+    Getter of the first argument after self in the calls of a method.
+
+    Parameters
+    ----------
+    method : function
+        Method of a storage, e.g. rm(self, path).
+
+    Returns
+    -------
+    function
+        fn(self, *args, **kwargs) returning the argument, positional or
+        keyword, "" if missing.
+    '''
+    sig = signature(method)
+    str_name = list(sig.parameters)[1]
+
+    def fn(self, *args, **kwargs):
+        try:
+            return sig.bind_partial(self, *args, **kwargs)\
+                .arguments.get(str_name, "")
+        except TypeError:
+            return ""
+    return fn
+
+
+class WriteBehind():
+    '''
+    Writes uploaded in the background by int_workers threads.
+
+    submit returns a Future as soon as the write is queued. The queued
+    bytes are bounded by int_max_bytes: above it submit blocks until the
+    workers have uploaded enough (a single larger write is accepted when
+    nothing else is queued). Until its upload ends a write can be read
+    back with get. wait blocks until the writes below a prefix are done,
+    pop_errors returns the ones that failed.
+    '''
+
+
+    def __init__(self, fn_write, int_max_bytes=268435456, int_workers=4):
+        assert int(int_max_bytes) > 0, "The budget should be positive."
+        assert int(int_workers) > 0, "At least one worker."
+        self.__fn_write = fn_write
+        self.__int_max_bytes = int(int_max_bytes)
+        self.__cond = Condition()
+        # key -> (data, future) of the writes queued or running.
+        self.__pending = {}
+        self.__int_bytes = 0
+        # (key, exception) of the failed writes not yet waited for.
+        self.__errors = []
+        self.__closed = False
+        self.__executor = ThreadPoolExecutor(
+            max_workers=int(int_workers), thread_name_prefix="sdaab-wb")
+
+
+    def __run(self, key, data):
+        try:
+            self.__fn_write(key, data)
+        except Exception as e:
+            with self.__cond:
+                self.__errors.append((key, e))
+            raise
+        finally:
+            with self.__cond:
+                del self.__pending[key]
+                self.__int_bytes -= len(data)
+                self.__cond.notify_all()
+
+
+    def submit(self, key, data):
+        '''
+        Queue a write, blocking while the queue is over budget.
+
+        Parameters
+        ----------
+        key : str
+            Key of the write, not already queued.
+        data : bytes-like
+            Content, copied if mutable.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Resolved with the result of fn_write(key, data).
+        '''
+        if not isinstance(data, bytes):
+            data = bytes(data)
+        with self.__cond:
+            assert not self.__closed, "Queue closed."
+            assert key not in self.__pending, "Write already queued."
+            while (self.__int_bytes > 0) and \
+                (self.__int_bytes + len(data) > self.__int_max_bytes):
+                self.__cond.wait()
+                assert not self.__closed, "Queue closed."
+            # Reserved until the write ends, even if another one waits.
+            assert key not in self.__pending, "Write already queued."
+            self.__int_bytes += len(data)
+            future = self.__executor.submit(self.__run, key, data)
+            self.__pending[key] = (data, future)
+            return future
+
+
+    def get(self, key):
+        '''
+        Content of a queued or running write, None if there is none.
+        '''
+        with self.__cond:
+            item = self.__pending.get(key)
+        return None if item is None else item[0]
+
+
+    def keys(self, prefix=""):
+        '''
+        Keys of the queued or running writes below the prefix.
+        '''
+        with self.__cond:
+            return sorted([x for x in self.__pending if is_below(x, prefix)])
+
+
+    def pending_bytes(self):
+        with self.__cond:
+            return self.__int_bytes
+
+
+    def wait(self, prefix="", bool_literal=False):
+        '''
+        Block until the writes below the prefix are done.
+
+        Parameters
+        ----------
+        prefix : str
+            See is_below, by default every write.
+        bool_literal : bool, optional
+            Wait for the keys starting with the prefix as a string (e.g.
+            the literal prefix of a glob), by default False
+        '''
+        if bool_literal:
+            fn_below = lambda x: x.startswith(prefix)
+        else:
+            fn_below = lambda x: is_below(x, prefix)
+        with self.__cond:
+            while any([fn_below(x) for x in self.__pending]):
+                self.__cond.wait()
+
+
+    def pop_errors(self, prefix=""):
+        '''
+        Errors of the writes below the prefix that failed since the last
+        call, as a list of (key, exception).
+        '''
+        with self.__cond:
+            output = [x for x in self.__errors if is_below(x[0], prefix)]
+            self.__errors = [x for x in self.__errors \
+                if not is_below(x[0], prefix)]
+            return output
+
+
+    def close(self):
+        '''
+        Wait for every write, then stop the workers. Returns the errors,
+        see pop_errors.
+        '''
+        self.wait()
+        with self.__cond:
+            self.__closed = True
+            self.__cond.notify_all()
+        self.__executor.shutdown(wait=True)
+        return self.pop_errors()
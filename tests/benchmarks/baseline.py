@@ -0,0 +1,63 @@
+'''
+Benchmark results and their comparison with a baseline.
+
+A results file is a JSON {"meta": {...}, "results": {"<backend>/<case>":
+{"ops", "bytes", "seconds", "ops_per_s", "mb_per_s", "p50", "p99",
+"requests_per_op"}}}. The requests per op are the fewest an op of
+the case needed, deterministic and compared exactly; the timings depend
+on the machine and only a slowdown beyond the tolerance is reported.
+
+    python -m tests.benchmarks.baseline baseline.json results.json [1.5]
+'''
+import sys
+from json import load
+
+
+def compare(baseline, results, float_tolerance=1.5):
+    '''
+    The regressions of the results with respect to the baseline.
+
+    Parameters
+    ----------
+    baseline : dict
+        The results of the reference commit.
+    results : dict
+        The results to check.
+    float_tolerance : float, optional
+        Accepted slowdown factor of the timings, by default 1.5
+
+    Returns
+    -------
+    list
+        One message per regression, empty if none.
+    '''
+    output = []
+    for name, old in sorted(baseline["results"].items()):
+        new = results["results"].get(name)
+        if new is None:
+            output.append(name + ": missing.")
+            continue
+        for k, n in sorted(new["requests_per_op"].items()):
+            if n > old["requests_per_op"].get(k, 0):
+                output.append(name + ": " + k + " requests per op " + \
+                    str(old["requests_per_op"].get(k, 0)) + " -> " + str(n))
+        for k in ("p50", "p99"):
+            if new[k] > old[k] * float_tolerance:
+                output.append(name + ": " + k + " latency " + \
+                    "%.6f -> %.6f s" % (old[k], new[k]))
+        if new["ops_per_s"] * float_tolerance < old["ops_per_s"]:
+            output.append(name + ": throughput " + \
+                "%.1f -> %.1f ops/s" % (old["ops_per_s"], new["ops_per_s"]))
+    return output
+
+
+if __name__ == "__main__":
+    with open(sys.argv[1], "r") as f:
+        baseline = load(f)
+    with open(sys.argv[2], "r") as f:
+        results = load(f)
+    float_tolerance = float(sys.argv[3]) if len(sys.argv) > 3 else 1.5
+    regressions = compare(baseline, results, float_tolerance)
+    for x in regressions:
+        print(x)
+    sys.exit(1 if len(regressions) > 0 else 0)
@@ -0,0 +1,121 @@
+from os import environ, makedirs
+from os.path import isdir
+from json import dump
+from socket import socket
+from shutil import rmtree
+from pathlib import Path
+from platform import python_version
+from datetime import datetime
+from subprocess import run
+from uuid import uuid4
+from pytest import fixture, skip, mark
+from sdaab.disk.storage_disk import StorageDisk
+from sdaab.memory.storage_memory import StorageMemory
+from sdaab.s3bdl.storage_s3_bdl import StorageS3BDL
+from sdaab.s3bdl.server import BDLServer
+
+
+# The suite runs only with SDAAB_BENCHMARKS set, e.g. by bin/run_benchmarks.
+# The results go to SDAAB_BENCHMARKS_OUTPUT, benchmarks.json by default.
+
+
+def pytest_collection_modifyitems(config, items):
+    if environ.get("SDAAB_BENCHMARKS") is None:
+        for item in items:
+            if "benchmarks" in str(item.fspath):
+                item.add_marker(mark.skip(reason="SDAAB_BENCHMARKS not set."))
+
+
+def free_port():
+    with socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@fixture(scope="session")
+def path_bench():
+    # On tmpfs when available: the disk is not what is measured.
+    path_parent = "/dev/shm" if isdir("/dev/shm") else "/tmp"
+    output = Path(path_parent) / ("sdaab-bench-" + uuid4().hex)
+    makedirs(output)
+    yield output
+    rmtree(output, ignore_errors=True)
+
+
+@fixture(scope="session")
+def bench_results():
+    output = {}
+    yield output
+    try:
+        commit = run(["git", "rev-parse", "HEAD"], capture_output=True, \
+            text=True).stdout.strip()
+    except Exception:
+        commit = None
+    with open(environ.get("SDAAB_BENCHMARKS_OUTPUT", "benchmarks.json"), \
+        "w") as f:
+        dump({
+            "meta": {
+                "commit": commit,
+                "python": python_version(),
+                "date": datetime.now().isoformat()
+            },
+            "results": output
+        }, f, indent=1, sort_keys=True)
+
+
+@fixture(scope="session")
+def storage_disk(path_bench):
+    makedirs(path_bench / "disk")
+    return StorageDisk(root_path=str(path_bench / "disk"))
+
+
+@fixture(scope="session")
+def storage_memory():
+    return StorageMemory()
+
+
+@fixture(scope="session")
+def storage_s3boto():
+    try:
+        from moto.server import ThreadedMotoServer
+        from boto.s3.connection import S3Connection
+        from sdaab.s3boto.storage_s3_boto import StorageS3boto
+    except ImportError:
+        skip("moto not installed.")
+    port = free_port()
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port)
+    server.start()
+    kwargs = {
+        "host": "127.0.0.1",
+        "port": port,
+        "calling_format": "boto.s3.connection.OrdinaryCallingFormat"
+    }
+    connection = S3Connection(
+        aws_access_key_id="bench", 
+        aws_secret_access_key="bench", 
+        is_secure=False, 
+        **kwargs
+    )
+    connection.create_bucket("bench").new_key("bench/")\
+        .set_contents_from_string("")
+    yield StorageS3boto(
+        access_key="bench", 
+        secret_key="bench", 
+        bucket="bench", 
+        secure=False, 
+        root_path="/bench/", 
+        **kwargs
+    )
+    server.stop()
+
+
+@fixture(scope="session")
+def storage_s3bdl(path_bench):
+    server = BDLServer(path_bench / "s3bdl", secret_key="bench").start()
+    yield StorageS3BDL(url=server.url(), secret_key="bench", root_path="/")
+    server.close()
+
+
+@fixture(params=["memory", "disk", "s3boto", "s3bdl"])
+def storage(request):
+    return request.param, request.getfixturevalue("storage_" + request.param)
@@ -0,0 +1,115 @@
+from os import urandom, makedirs
+from time import perf_counter
+from uuid import uuid4
+from numpy import percentile
+from pytest import skip
+from sdaab.utils.metrics import count_requests
+
+
+def measure(bench_results, name, int_ops, fn_op, int_bytes_per_op=0):
+    # Run fn_op(i) int_ops times, recording latencies and requests. The 
+    # requests per op are the fewest an op needed: retries (e.g. the 500s 
+    # of moto under concurrent DELETEs) only add some.
+    latencies = []
+    counts = []
+    start = perf_counter()
+    for i in range(int_ops):
+        t = perf_counter()
+        with count_requests() as counter:
+            fn_op(i)
+        latencies.append(perf_counter() - t)
+        counts.append(counter.counts())
+    seconds = perf_counter() - start
+    bench_results[name] = {
+        "ops": int_ops,
+        "bytes": int_ops * int_bytes_per_op,
+        "seconds": seconds,
+        "ops_per_s": int_ops / seconds,
+        "mb_per_s": int_ops * int_bytes_per_op / 1048576.0 / seconds,
+        "p50": float(percentile(latencies, 50)),
+        "p99": float(percentile(latencies, 99)),
+        "requests_per_op": dict([(k, min([x.get(k, 0) for x in counts])) \
+            for k in set().union(*counts)])
+    }
+
+
+def new_folder(s):
+    output = "b" + uuid4().hex[:8]
+    s.mkdir(output)
+    return output
+
+
+def fill(s, folder, int_files, content=b"x"):
+    for i in range(int_files):
+        s.upload_from_memory(content, folder + "/f" + str(i), bool_bin=True)
+
+
+def test_benchmark_small(storage, bench_results):
+    name, s = storage
+    folder = new_folder(s)
+    content = urandom(4096)
+    measure(bench_results, name + "/upload_small", 100, lambda i: \
+        s.upload_from_memory(content, folder + "/s" + str(i), bool_bin=True), 
+        4096)
+    measure(bench_results, name + "/download_small", 100, lambda i: \
+        s.download_to_memory(folder + "/s" + str(i), bool_bin=True), 4096)
+
+
+def test_benchmark_large(storage, bench_results, path_bench):
+    name, s = storage
+    folder = new_folder(s)
+    int_size = 16 * 1048576
+    path_large = path_bench / "large"
+    if not path_large.exists():
+        with open(path_large, "wb") as f:
+            f.write(urandom(int_size))
+    path_dest = path_bench / ("dl-" + name)
+    makedirs(path_dest)
+    measure(bench_results, name + "/upload_large", 2, lambda i: \
+        s.upload(path_large, folder + "/l" + str(i)), int_size)
+    measure(bench_results, name + "/download_large", 2, lambda i: \
+        s.download(folder + "/l" + str(i), path_dest / str(i)), int_size)
+
+
+def test_benchmark_ls(storage, bench_results):
+    name, s = storage
+    folder = new_folder(s)
+    s.mkdir(folder + "/wide")
+    fill(s, folder + "/wide", 300)
+    measure(bench_results, name + "/ls_wide", 5, lambda i: \
+        s.ls(folder + "/wide"))
+    path = folder + "/deep"
+    for i in range(10):
+        s.mkdir(path)
+        fill(s, path, 3)
+        path = path + "/d" + str(i)
+    s.mkdir(path)
+    measure(bench_results, name + "/ls_deep", 5, lambda i: s.ls(path))
+    measure(bench_results, name + "/walk_deep", 5, lambda i: \
+        list(s.walk(folder + "/deep")))
+
+
+def test_benchmark_folders(storage, bench_results):
+    name, s = storage
+    folder = new_folder(s)
+    sources = []
+    for i in range(3):
+        s.mkdir(folder + "/src" + str(i))
+        fill(s, folder + "/src" + str(i), 50)
+        sources.append(folder + "/src" + str(i))
+    measure(bench_results, name + "/cp_folder", 3, lambda i: \
+        s.cp(sources[i], folder + "/cp" + str(i)))
+    measure(bench_results, name + "/mv_folder", 3, lambda i: \
+        s.mv(sources[i], folder + "/mv" + str(i)))
+    measure(bench_results, name + "/rm_folder", 3, lambda i: \
+        s.rm(folder + "/mv" + str(i)))
+
+
+def test_benchmark_append(storage, bench_results):
+    name, s = storage
+    if name == "s3bdl":
+        skip("append not implemented by StorageS3BDL.")
+    folder = new_folder(s)
+    s.upload_from_memory("x", folder + "/a")
+    measure(bench_results, name + "/append", 20, lambda i: \
+        s.append(folder + "/a", "y" * 100), 100)
@@ -0,0 +1,13 @@
+from pytest import fixture
+from sdaab.utils.metrics import request_budget as budget
+
+
+@fixture
+def request_budget():
+    '''
+    Assert the number of backend requests of a block, e.g.
+
+        with request_budget(4, {"HEAD": 3}):
+            storage.upload(path_source, path_dest)
+    '''
+    return budget
@@ -1,11 +1,15 @@
-from os import rmdir, makedirs, remove
+from os import rmdir, makedirs, remove, utime
 from os.path import isdir, isfile, getmtime, getsize
 from shutil import rmtree
 from pathlib import Path 
 from datetime import datetime
 from numpy.random import randint
+from numpy import arange, memmap, save as np_save
+from io import BytesIO
 from pytest import raises
-from sdaab.disk.storage_disk import StorageDisk
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from sdaab.disk.storage_disk import StorageDisk, get_folder_size
 from sdaab.utils.get_config import dict_config
 
 
@@ -99,6 +103,65 @@ def test_storage_disk_get_type():
     remove_folder(root_path)
 
 
+def test_storage_disk_ls_iter():
+
+    root_path = generate_folder_path()
+    assert isdir(root_path)
+    s = StorageDisk(root_path=root_path)
+    assert s.initialized()
+
+    makedirs(root_path / "level1/level2")
+    with open(root_path / "level1/level1.txt", "a") as f:
+        f.write("ciao")
+    assert sorted(s.ls_iter("level1")) == ["level1.txt", "level2"]
+    assert sorted(s.ls_iter("level1", bool_details=True))[0][:2] == \
+        ("level1.txt", 4)
+    assert sorted(s.ls_iter("level1", bool_details=True))[1][:2] == \
+        ("level2", None)
+    listing = s.ls_compact("level1", bool_details=True)
+    assert sorted(listing) == ["level1.txt", "level2"]
+    assert sorted(listing.sizes()) == [-1, 4]
+    with raises(ValueError):
+        s.ls_iter("/folder/that/does/not/exist")
+
+    remove_folder(root_path)
+
+
+def test_storage_disk_walk_glob():
+
+    root_path = generate_folder_path()
+    assert isdir(root_path)
+    s = StorageDisk(root_path=root_path)
+    assert s.initialized()
+
+    makedirs(root_path / "level1/level2/level3")
+    Path(root_path / "level0.txt").touch()
+    Path(root_path / "level1/level1.txt").touch()
+    Path(root_path / "level1/level1.csv").touch()
+    Path(root_path / "level1/level2/level2.txt").touch()
+
+    assert sorted(s.walk()) == ["/level0.txt", "/level1/level1.csv", \
+        "/level1/level1.txt", "/level1/level2/level2.txt"]
+    assert sorted(s.walk("level1/level2")) == ["/level1/level2/level2.txt"]
+    assert list(s.walk("/level1/level2/level3")) == []
+    with raises(ValueError):
+        s.walk("/folder/that/does/not/exist")
+
+    assert sorted(s.glob("*.txt")) == ["/level0.txt"]
+    assert sorted(s.glob("/level1/*")) == \
+        ["/level1/level1.csv", "/level1/level1.txt"]
+    assert sorted(s.glob("**/*.txt")) == ["/level0.txt", \
+        "/level1/level1.txt", "/level1/level2/level2.txt"]
+    s.cd("level1")
+    assert sorted(s.glob("level?.*")) == \
+        ["/level1/level1.csv", "/level1/level1.txt"]
+    assert list(s.glob("/folder/that/does/not/exist/*")) == []
+    with raises(ValueError):
+        s.glob("../*")
+
+    remove_folder(root_path)
+
+
 def test_storage_disk_mkdir_cd_pwd():
 
     root_path = generate_folder_path()
@@ -133,6 +196,42 @@ def test_storage_disk_mkdir_cd_pwd():
     remove_folder(root_path)
 
 
+def test_storage_disk_cwd():
+
+    root_path = generate_folder_path()
+    assert isdir(root_path)
+    s = StorageDisk(root_path=root_path)
+    assert s.initialized()
+
+    for i in range(8):
+        makedirs(root_path / ("level" + str(i)) / "sublevel")
+
+    def job(i):
+        with s.cwd("level" + str(i)):
+            assert s.pwd() == "/level" + str(i)
+            s.upload_from_memory(i, "v")
+            s.cd("sublevel")
+            assert s.pwd() == "/level" + str(i) + "/sublevel"
+            s.upload_from_memory(i, "v")
+        return s.download_to_memory("/level" + str(i) + "/sublevel/v")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert list(executor.map(job, range(8))) == list(range(8))
+    assert s.pwd() == "/"
+    for i in range(8):
+        assert s.download_to_memory("/level" + str(i) + "/v") == i
+
+    s.cd("level0")
+    with s.cwd("/level1"):
+        assert s.pwd() == "/level1"
+    assert s.pwd() == "/level0"
+    with raises(ValueError):
+        with s.cwd("/folder/that/does/not/exist"):
+            pass
+
+    remove_folder(root_path)
+
+
 def test_storage_disk_cd_ls_exists():
 
     root_path = generate_folder_path()
@@ -280,6 +379,49 @@ def test_storage_disk_size_rm():
     remove_folder(root_path)
 
 
+def test_storage_disk_size_index():
+
+    root_path = generate_folder_path()
+    assert isdir(root_path)
+    path_index = root_path / "size.index"
+    makedirs(root_path / "data/folder/subfolder")
+    s = StorageDisk(root_path=root_path / "data", path_size_index=path_index)
+    assert s.initialized()
+
+    with open(root_path / "data/folder/text.txt", "a") as f:
+        f.write("ciao")
+    with open(root_path / "data/folder/subfolder/text.txt", "a") as f:
+        f.write("buongiorno")
+    assert get_folder_size(root_path / "data", int_workers=1) == 14
+    assert get_folder_size(root_path / "data", int_workers=4) == 14
+    assert s.size("folder") == 14
+    assert s.size("/") == 14
+
+    s.upload_from_memory(b"12345", "folder/subfolder/bytes", bool_bin=True)
+    assert s.size("folder") == 19
+    assert s.size("folder/subfolder") == 15
+    s.append("folder/text.txt", "ciao")
+    assert s.size("/") == 23
+    s.rm("folder/subfolder/bytes")
+    assert s.size("folder") == 18
+
+    s = StorageDisk(root_path=root_path / "data", path_size_index=path_index)
+    assert s.size("folder") == 18
+    s.cp("folder", "folder_copy")
+    assert s.size("/") == 36
+    s.rm("folder_copy/subfolder")
+    assert s.size("/") == 26
+
+    # An unreadable index is reset.
+    path_index = root_path / "broken.index"
+    with open(path_index, "w") as f:
+        f.write("not an index")
+    s = StorageDisk(root_path=root_path / "data", path_size_index=path_index)
+    assert s.size("/") == 26
+
+    remove_folder(root_path)
+
+
 def test_storage_disk_upload_download_memory():
 
     root_path = generate_folder_path()
@@ -327,6 +469,141 @@ def test_storage_disk_upload_download_memory():
     remove_folder(root_path)
 
 
+def test_storage_disk_download_memory_mmap():
+
+    root_path = generate_folder_path()
+    assert isdir(root_path)
+    s = StorageDisk(root_path=root_path)
+    assert s.initialized()
+
+    s.upload_from_memory(b"ciao", "raw", bool_bin=True)
+    assert s.download_to_memory("raw", bool_bin=True) == b"ciao"
+    v = s.download_to_memory("raw", mmap_mode="bytes")
+    assert type(v) == memoryview
+    assert bytes(v) == b"ciao"
+
+    s.upload_from_memory(b"", "empty", bool_bin=True)
+    assert bytes(s.download_to_memory("empty", mmap_mode="bytes")) == b""
+
+    array = arange(10)
+    with BytesIO() as b:
+        np_save(b, array)
+        s.upload_from_memory(b.getvalue(), "array.npy", bool_bin=True)
+    v = s.download_to_memory("array.npy", mmap_mode="numpy")
+    assert type(v) == memmap
+    assert (v == array).all()
+
+    with raises(ValueError):
+        s.download_to_memory("raw", mmap_mode="numpy")
+    with raises(ValueError):
+        s.download_to_memory("raw", mmap_mode="unknown")
+
+    remove_folder(root_path)
+
+
+def test_storage_disk_atomic_batch():
+
+    root_path = generate_folder_path()
+    assert isdir(root_path)
+    s = StorageDisk(root_path=root_path)
+    assert s.initialized()
+
+    s.upload_from_memory("ciao", "v0")
+    assert [x.name for x in root_path.iterdir()] == ["v0"]
+
+    with s.batch():
+        s.upload_from_memory("ciao", "v1")
+        s.upload(root_path / "v0", "v2")
+        with s.batch():
+            s.cp("v0", "v3")
+        assert not isfile(root_path / "v1")
+        with raises(ValueError):
+            s.upload_from_memory("ciao", "v1")
+    assert s.download_to_memory("v1") == "ciao"
+    assert s.download_to_memory("v2") == "ciao"
+    assert s.download_to_memory("v3") == "ciao"
+
+    with raises(RuntimeError):
+        with s.batch():
+            s.upload_from_memory("ciao", "v4")
+            raise RuntimeError("abort")
+    assert sorted([x.name for x in root_path.iterdir()]) == \
+        ["v0", "v1", "v2", "v3"]
+
+    s = StorageDisk(root_path=root_path, bool_fsync=False)
+    with s.batch():
+        s.upload_from_memory("ciao", "v5")
+    assert s.download_to_memory("v5") == "ciao"
+
+    remove_folder(root_path)
+
+
+def test_storage_disk_temporary_files():
+
+    root_path = generate_folder_path()
+    s = StorageDisk(root_path=root_path)
+    s.mkdir("folder")
+    s.upload_from_memory("ciao", "folder/v0")
+
+    # The files of the batch not yet committed are not listed.
+    with s.batch():
+        s.upload_from_memory("ciao", "folder/v1")
+        assert s.ls("folder") == ["v0"]
+        assert list(s.ls_iter("folder")) == ["v0"]
+        assert list(s.walk("/")) == ["/folder/v0"]
+        assert list(s.glob("/folder/*")) == ["/folder/v0"]
+        assert s.size("folder") == s.size("folder/v0")
+    assert sorted(s.ls("folder")) == ["v0", "v1"]
+
+    # The ones left by a crash are removed by the next instance, once old.
+    path_stale = root_path / "folder" / (".v2.tmp-" + "0" * 32)
+    path_fresh = root_path / "folder" / (".v3.tmp-" + "1" * 32)
+    for path in (path_stale, path_fresh):
+        with open(path, "w") as f:
+            f.write("ciao")
+    utime(path_stale, (0, 0))
+    s = StorageDisk(root_path=root_path)
+    assert not isfile(path_stale)
+    assert isfile(path_fresh)
+    assert sorted(s.ls("folder")) == ["v0", "v1"]
+    assert s.size("folder") == 2 * s.size("folder/v0")
+
+    remove_folder(root_path)
+
+
+def test_storage_disk_batch_threads():
+
+    root_path = generate_folder_path()
+    assert isdir(root_path)
+    s = StorageDisk(root_path=root_path)
+    assert s.initialized()
+    event_written = Event()
+    event_other = Event()
+
+    def batch_aborted():
+        with raises(RuntimeError):
+            with s.batch():
+                s.upload_from_memory("ciao", "a1")
+                event_written.set()
+                assert event_other.wait(10)
+                raise RuntimeError("abort")
+
+    def write_other():
+        assert event_written.wait(10)
+        s.upload_from_memory("ciao", "b1")
+        event_other.set()
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(batch_aborted), 
+            executor.submit(write_other)]
+        for future in futures:
+            future.result()
+    assert s.download_to_memory("b1") == "ciao"
+    assert sorted([x.name for x in root_path.iterdir()]) == ["b1"]
+
+    remove_folder(root_path)
+
+
 def test_storage_disk_rename():
 
     root_path = generate_folder_path()
@@ -495,6 +772,27 @@ def test_storage_disk_append():
     remove_folder(root_path)
 
 
+def test_storage_disk_metrics():
+
+    root_path = generate_folder_path()
+    s = StorageDisk(root_path=root_path)
+    s.mkdir("a")
+    s.upload_from_memory(b"abc", "a/v", bool_bin=True)
+    assert s.download_to_memory("a/v", bool_bin=True) == b"abc"
+    with raises(ValueError):
+        s.cd("b")
+    snapshot = s.metrics().snapshot()
+    assert snapshot["methods"]["mkdir"]["calls"] == 1
+    assert snapshot["methods"]["upload_from_memory"]["bytes_written"] == 3
+    assert snapshot["methods"]["download_to_memory"]["bytes_read"] == 3
+    assert snapshot["methods"]["cd"]["errors"] == 1
+    assert snapshot["bytes_written"] == 3
+    assert snapshot["requests"] == {}
+    s.metrics().reset()
+    assert s.metrics().snapshot()["methods"] == {}
+    remove_folder(root_path)
+
+
 def test_storage_disk_tmp():
 
     root_path = generate_folder_path()
@@ -0,0 +1,318 @@
+import pickle
+from os import makedirs
+from os.path import isdir, isfile, getsize
+from shutil import rmtree
+from pathlib import Path
+from datetime import datetime
+from numpy.random import randint
+from numpy import arange, save as np_save
+from io import BytesIO
+from pytest import raises
+from concurrent.futures import ThreadPoolExecutor
+from sdaab.memory.storage_memory import StorageMemory
+from sdaab.utils.get_config import dict_config
+
+
+def generate_folder_path(dict_config=dict_config):
+    assert dict_config["ENV"] == "TESTING"
+    root_path = Path(dict_config["DISK"]["ROOT_PATH"] + \
+        "/sdaab-" + datetime.now().strftime("%Y-%m-%d-%H-%M-%S-%f-") + \
+        str(randint(0, 1000)))
+    makedirs(root_path)
+    assert isdir(root_path)
+    return root_path
+
+
+def remove_folder(path):
+    assert isdir(path)
+    rmtree(path)
+
+
+def test_storage_memory_init():
+    s = StorageMemory()
+    assert s.initialized()
+    assert s.get_type() == "MEMORY"
+    assert s.pwd() == "/"
+    assert s.ls() == []
+    with raises(ValueError):
+        StorageMemory(int_capacity=0)
+    with raises(TypeError):
+        pickle.dumps(s)
+
+
+def test_storage_memory_mkdir_cd_ls_exists():
+    s = StorageMemory()
+    s.mkdir("level1/level2")
+    s.mkdir("/level1/level2/level3")
+    assert s.exists("level1/level2/level3")
+    with raises(ValueError):
+        s.mkdir("level1")
+    s.cd("level1")
+    assert s.pwd() == "/level1"
+    s.cd("level2")
+    assert s.pwd() == "/level1/level2"
+    s.cd("../..")
+    assert s.pwd() == "/"
+    with raises(ValueError):
+        s.cd("../..")
+    with raises(ValueError):
+        s.exists("/..")
+    assert s.pwd() == "/"
+    with raises(ValueError):
+        s.cd("level0")
+    s.upload_from_memory("ciao", "level1/v")
+    with raises(ValueError):
+        s.mkdir("level1/v/level2")
+    assert sorted(s.ls("level1")) == ["level2", "v"]
+    assert s.exists("level1/v")
+    assert s.exists("/level1/level2/")
+    assert not s.exists("level1/w")
+    with raises(ValueError):
+        s.ls("level1/v")
+    assert list(s.ls_iter("level1")) == ["level2", "v"]
+    details = list(s.ls_iter("level1", bool_details=True))
+    assert [x[:2] for x in details] == [("level2", None), \
+        ("v", len(pickle.dumps("ciao")))]
+
+    with s.cwd("level1/level2"):
+        assert s.pwd() == "/level1/level2"
+        s.cd("level3")
+        assert s.pwd() == "/level1/level2/level3"
+    assert s.pwd() == "/"
+
+
+def test_storage_memory_walk_glob():
+    s = StorageMemory()
+    s.mkdir("level1/level2/level3")
+    for path in ["level0.txt", "level1/level1.txt", "level1/level1.csv", \
+        "level1/level2/level2.txt"]:
+        s.upload_from_memory(b"", path, bool_bin=True)
+    assert sorted(s.walk()) == ["/level0.txt", "/level1/level1.csv", \
+        "/level1/level1.txt", "/level1/level2/level2.txt"]
+    assert sorted(s.walk("level1/level2")) == ["/level1/level2/level2.txt"]
+    assert list(s.walk("/level1/level2/level3")) == []
+    with raises(ValueError):
+        s.walk("/folder/that/does/not/exist")
+    assert sorted(s.glob("*.txt")) == ["/level0.txt"]
+    assert sorted(s.glob("**/*.txt")) == ["/level0.txt", \
+        "/level1/level1.txt", "/level1/level2/level2.txt"]
+    s.cd("level1")
+    assert sorted(s.glob("level?.*")) == \
+        ["/level1/level1.csv", "/level1/level1.txt"]
+    assert list(s.glob("/folder/that/does/not/exist/*")) == []
+    with raises(ValueError):
+        s.glob("../*")
+
+
+def test_storage_memory_upload_download():
+    path_tmp = generate_folder_path()
+    s = StorageMemory()
+    content = bytes(randint(0, 256, 100000).astype("uint8"))
+    with open(path_tmp / "f", "wb") as f:
+        f.write(content)
+    s.mkdir("folder")
+    s.upload(path_tmp / "f", "folder/f")
+    with raises(ValueError):
+        s.upload(path_tmp / "f", "folder/f")
+    with raises(ValueError):
+        s.upload(path_tmp / "f", "folder")
+    with raises(ValueError):
+        s.upload(path_tmp / "g", "folder/g")
+    with raises(ValueError):
+        s.upload(path_tmp / "f", "no_folder/f")
+    s.download("folder/f", path_tmp / "g")
+    assert getsize(path_tmp / "g") == len(content)
+    with raises(ValueError):
+        s.download("folder/f", path_tmp / "g")
+    with raises(ValueError):
+        s.download("folder/h", path_tmp / "h")
+    assert not isfile(path_tmp / "h")
+    remove_folder(path_tmp)
+
+
+def test_storage_memory_upload_download_memory():
+    s = StorageMemory()
+    s.upload_from_memory({"a": [1, 2]}, "v")
+    assert s.download_to_memory("v") == {"a": [1, 2]}
+    with raises(ValueError):
+        s.upload_from_memory(1, "v")
+    buffer = bytearray(b"abc")
+    s.upload_from_memory(buffer, "b", bool_bin=True)
+    buffer[0] = ord("x")
+    assert s.download_to_memory("b", bool_bin=True) == b"abc"
+    view = s.download_to_memory("b", mmap_mode="bytes")
+    assert view.readonly and (bytes(view) == b"abc")
+    f = BytesIO()
+    np_save(f, arange(12).reshape(3, 4))
+    s.upload_from_memory(f.getvalue(), "a.npy", bool_bin=True)
+    array = s.download_to_memory("a.npy", mmap_mode="numpy")
+    assert (array == arange(12).reshape(3, 4)).all()
+    assert not array.flags.writeable
+    with raises(ValueError):
+        s.download_to_memory("b", mmap_mode="other")
+    with raises(ValueError):
+        s.download_to_memory("w")
+
+
+def test_storage_memory_size_rm():
+    s = StorageMemory()
+    s.mkdir("folder/sub")
+    s.upload_from_memory(b"abc", "folder/a", bool_bin=True)
+    s.upload_from_memory(b"defg", "folder/sub/b", bool_bin=True)
+    assert s.size("folder/a") == 3
+    assert s.size("folder") == 7
+    assert s.size("/") == 7
+    with raises(ValueError):
+        s.size("other")
+    s.rm("folder/a")
+    assert not s.exists("folder/a")
+    s.rm("folder")
+    assert not s.exists("folder/sub/b")
+    assert s.ls() == []
+    assert s.usage()["bytes"] == 0
+    with raises(ValueError):
+        s.rm("folder")
+    with raises(ValueError):
+        s.rm("/")
+
+
+def test_storage_memory_rename_mv_cp():
+    s = StorageMemory()
+    s.mkdir("folder1")
+    s.mkdir("folder2")
+    s.upload_from_memory(b"ciao", "file0", bool_bin=True)
+    s.upload_from_memory(b"", "folder1/file0", bool_bin=True)
+    with raises(ValueError):
+        s.rename("file0", "folder1/file1")
+    s.rename("file0", "new_file0")
+    s.rename("new_file0", "file0")
+    with raises(ValueError):
+        s.mv("file0", "folder1/file0")
+    s.mv("file0", "folder2/file0")
+    assert s.ls("folder2") == ["file0"]
+    s.cd("folder2")
+    s.mv("file0", "/file0")
+    s.cd("/")
+    with raises(ValueError):
+        s.mv("folder1", "folder1/sub")
+    with raises(ValueError):
+        s.mv("file0", "no_folder/file0")
+    s.mv("folder1", "/folder2/folder1111")
+    assert s.exists("folder2/folder1111/file0")
+    assert not s.exists("folder1")
+
+    # cp shares the bytes, the writes do not change the copies.
+    int_used = s.usage()["bytes"]
+    s.cp("file0", "folder2/file1")
+    s.cp("folder2", "folder3")
+    assert sorted(s.walk("folder3")) == \
+        ["/folder3/file1", "/folder3/folder1111/file0"]
+    assert s.usage()["bytes"] == int_used
+    s.append("folder3/file1", "!")
+    assert s.download_to_memory("folder3/file1", bool_bin=True) == b"ciao!"
+    assert s.download_to_memory("file0", bool_bin=True) == b"ciao"
+    assert s.usage()["bytes"] == int_used + 5
+    with raises(ValueError):
+        s.cp("folder2", "folder2/sub")
+    with raises(ValueError):
+        s.cp("file0", "folder3/file1")
+
+
+def test_storage_memory_append():
+    s = StorageMemory()
+    s.mkdir("folder")
+    s.upload_from_memory(b"", "folder/file.txt", bool_bin=True)
+    s.append("/folder/file.txt", "ciao")
+    s.cd("folder")
+    s.append("file.txt", "ciao")
+    assert s.download_to_memory("file.txt", bool_bin=True) == b"ciaociao"
+    with raises(ValueError):
+        s.append("file_not_found", "ciao")
+    assert not s.exists("file_not_found")
+
+
+def test_storage_memory_capacity():
+    s = StorageMemory(int_capacity=10)
+    s.upload_from_memory(b"aaaa", "a", bool_bin=True)
+    s.upload_from_memory(b"bbbb", "b", bool_bin=True)
+    assert s.download_to_memory("a", bool_bin=True) == b"aaaa"
+    s.upload_from_memory(b"cccc", "c", bool_bin=True)
+    assert sorted(s.ls()) == ["a", "c"]
+    assert s.usage()["evictions"] == 1
+    s.cp("a", "d")
+    assert s.usage()["evictions"] == 1
+    with raises(ValueError):
+        s.upload_from_memory(b"x" * 11, "e", bool_bin=True)
+    assert sorted(s.ls()) == ["a", "c", "d"]
+
+    s = StorageMemory(int_capacity=10, bool_evict=False)
+    s.upload_from_memory(b"aaaa", "a", bool_bin=True)
+    s.upload_from_memory(b"bbbb", "b", bool_bin=True)
+    with raises(ValueError):
+        s.upload_from_memory(b"cccc", "c", bool_bin=True)
+    s.append("a", "aa")
+    with raises(ValueError):
+        s.append("a", "a")
+    assert s.download_to_memory("a", bool_bin=True) == b"aaaaaa"
+    assert s.usage()["bytes"] == 10
+
+    # A folder copy shares the bytes: it fits and evicts nothing, even
+    # when the storage is full.
+    for bool_evict in (True, False):
+        s = StorageMemory(int_capacity=8, bool_evict=bool_evict)
+        s.mkdir("f/g")
+        s.upload_from_memory(b"aaaa", "f/a", bool_bin=True)
+        s.upload_from_memory(b"bbbb", "f/g/b", bool_bin=True)
+        s.cp("f", "h")
+        assert sorted(s.walk("/h")) == ["/h/a", "/h/g/b"]
+        assert s.usage()["evictions"] == 0
+        assert s.usage()["bytes"] == 8
+
+
+def test_storage_memory_threads():
+    s = StorageMemory()
+    for i in range(8):
+        s.mkdir("level" + str(i))
+
+    def job(i):
+        with s.cwd("level" + str(i)):
+            for j in range(50):
+                s.upload_from_memory(bytes(1024), "v" + str(j), bool_bin=True)
+                s.cp("v" + str(j), "w" + str(j))
+            s.mv("w0", "/level" + str(i) + "-w0")
+        return len(s.ls("level" + str(i)))
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert list(executor.map(job, range(8))) == [99] * 8
+    assert s.size("/") == 8 * 100 * 1024
+    assert s.usage()["bytes"] == 8 * 50 * 1024
+
+    # Concurrent writes beyond the capacity evict, never overflow.
+    s = StorageMemory(int_capacity=64*1024)
+
+    def job_bounded(i):
+        for j in range(50):
+            s.upload_from_memory(bytes(1024), "v" + str(i) + "-" + str(j), 
+                bool_bin=True)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(job_bounded, range(8)))
+    usage = s.usage()
+    assert usage["files"] == 64
+    assert usage["bytes"] == 64*1024
+    assert usage["evictions"] == 8 * 50 - 64
+
+
+def test_storage_memory_metrics():
+    s = StorageMemory()
+    s.mkdir("a")
+    s.upload_from_memory(b"abc", "a/v", bool_bin=True)
+    assert s.download_to_memory("a/v", bool_bin=True) == b"abc"
+    with raises(ValueError):
+        s.cd("b")
+    snapshot = s.metrics().snapshot()
+    assert snapshot["methods"]["mkdir"]["calls"] == 1
+    assert snapshot["methods"]["upload_from_memory"]["bytes_written"] == 3
+    assert snapshot["methods"]["download_to_memory"]["bytes_read"] == 3
+    assert snapshot["methods"]["cd"]["errors"] == 1
+    assert snapshot["requests"] == {}
@@ -1,13 +1,20 @@
-from os import rmdir, makedirs, remove
+import pickle
+from os import rmdir, makedirs, remove, environ
 from os.path import isdir, isfile, getmtime, getsize
 from shutil import rmtree
 from pathlib import Path 
 from datetime import datetime
 from numpy.random import randint
-from pytest import raises
+from pytest import raises, fixture
+from concurrent.futures import ThreadPoolExecutor
 from sdaab.s3boto.storage_s3_boto import StorageS3boto
 from sdaab.s3bdl.storage_s3_bdl import StorageS3BDL
+from sdaab.s3bdl.server import BDLServer
+from sdaab.disk.storage_disk import StorageDisk
 from sdaab.utils.get_config import dict_config
+from sdaab.utils.retry import RetryPolicy
+from sdaab.utils.deadline import deadline
+from sdaab.utils.inventory import staleness
 
 
 def generate_folder_path(dict_config=dict_config):
@@ -25,13 +32,32 @@ def remove_folder(path):
     rmtree(path)
 
 
-def get_s3_obj(dict_config=dict_config):
-    assert dict_config["ENV"] == "TESTING"
-    root_path = "/sdaab-" \
-        + datetime.now().strftime("%Y-%m-%d-%H-%M-%S-%f-") \
-        + str(randint(0, 1000)) \
-        + "/"
-    s3boto_parent = StorageS3boto(
+local = {}
+
+
+@fixture(scope="module", autouse=True)
+def bdl_server():
+    # Without a BDL gateway (S3_BDL_URL not set) the tests run against the 
+    # reference server, over a temporary folder.
+    if environ.get("S3_BDL_URL") is not None:
+        yield
+        return
+    path_root = generate_folder_path()
+    with BDLServer(path_root) as server:
+        local["server"] = server
+        local["path_root"] = path_root
+        yield server
+    local.clear()
+    remove_folder(path_root)
+
+
+def get_parent(dict_config=dict_config):
+    # The storage over the root of the BDL server, to create and remove 
+    # the root folders of the tests: the gateway is a front of the 
+    # /testing/ folder of the bucket, the reference server of its folder.
+    if "server" in local:
+        return StorageDisk(root_path=local["path_root"])
+    return StorageS3boto(
         host=dict_config["S3"]["HOST"],
         port=dict_config["S3"]["PORT"],
         access_key=dict_config["S3"]["ACCESS_KEY"],
@@ -41,11 +67,23 @@ def get_s3_obj(dict_config=dict_config):
         secure=dict_config["S3"]["SECURE"],
         root_path="/testing/"
     )
+
+
+def get_s3_obj(dict_config=dict_config, **kwargs):
+    assert dict_config["ENV"] == "TESTING"
+    root_path = "/sdaab-" \
+        + datetime.now().strftime("%Y-%m-%d-%H-%M-%S-%f-") \
+        + str(randint(0, 1000)) \
+        + "/"
+    s3boto_parent = get_parent(dict_config)
     s3boto_parent.mkdir(root_path)
+    url = local["server"].url() if "server" in local \
+        else dict_config["S3BDL"]["URL"]
     s3bdl = StorageS3BDL(
-        url=dict_config["S3BDL"]["URL"], 
+        url=url, 
         secret_key="testing", 
-        root_path=root_path)
+        root_path=root_path,
+        **kwargs)
     return s3bdl, root_path, s3boto_parent
 
 
@@ -60,13 +98,28 @@ def test_s3bdl_init():
     assert s3bdl.initialized()
     assert s3bdl.get_type() == "S3BDL"
     assert s3boto_parent.initialized()
-    assert s3boto_parent.get_type() == "S3boto"
+    assert s3boto_parent.get_type() in ("S3boto", "DISK")
     assert type(root_path) == str
     remove_s3_folder(s3boto_parent, root_path)
 
 
 
 
+def test_s3bdl_lazy():
+    s3bdl = StorageS3BDL(
+        url="http://localhost:1/", 
+        secret_key="testing", 
+        root_path="/",
+        bool_lazy=True)
+    assert s3bdl.initialized()
+    with raises(ValueError):
+        s3bdl.exists("v")
+    s3bdl, root_path, s3boto_parent = get_s3_obj(bool_lazy=True)
+    s3bdl.upload_from_memory("ciao", "v")
+    assert s3bdl.download_to_memory("v") == "ciao"
+    remove_s3_folder(s3boto_parent, root_path)
+
+
 def test_s3bdl_mkdir_ls_exists():
     s3bdl, root_path, s3boto_parent = get_s3_obj()
     s3bdl.mkdir("/tmp1")
@@ -87,6 +140,351 @@ def test_s3bdl_mkdir_ls_exists():
     remove_s3_folder(s3boto_parent, root_path)
 
 
+def test_s3bdl_implicit_dirs():
+    s3bdl, root_path, s3boto_parent = get_s3_obj(bool_implicit_dirs=True)
+    s3bdl.mkdir("level1/level2/level3")
+    s3bdl.mkdir("level1/level2/level3")
+    assert s3bdl.exists("level1/level2/")
+    s3bdl.upload_from_memory("ciao", "/level1/level2/level3/v")
+    s3bdl.cd("/level1/level2")
+    assert sorted(s3bdl.ls()) == ["level3"]
+    s3bdl.cd("/")
+    s3bdl.rm("level1")
+    assert not s3bdl.exists("level1/")
+    remove_s3_folder(s3boto_parent, root_path)
+
+
+def test_s3bdl_pickle():
+    s3bdl, root_path, s3boto_parent = get_s3_obj()
+    s3bdl.mkdir("level1")
+    s3bdl.cd("level1")
+    s3bdl.upload_from_memory("ciao", "v")
+    s3bdl_copy = pickle.loads(pickle.dumps(s3bdl))
+    assert s3bdl_copy.pwd() == "/level1"
+    assert s3bdl_copy.download_to_memory("v") == "ciao"
+    remove_s3_folder(s3boto_parent, root_path)
+
+
+def test_s3bdl_retry_hedged():
+    s3bdl, root_path, s3bdl_parent = get_s3_obj(
+        retry_policy=RetryPolicy(int_max_attempts=3, float_base_delay=0.01),
+        float_hedge_percentile=50
+    )
+    s3bdl.upload_from_memory("ciao", "v")
+    for _ in range(30):
+        assert s3bdl.exists("v")
+        assert s3bdl.download_to_memory("v") == "ciao"
+    assert not s3bdl.exists("w")
+    s3bdl_copy = pickle.loads(pickle.dumps(s3bdl))
+    assert s3bdl_copy.download_to_memory("v") == "ciao"
+    remove_s3_folder(s3bdl_parent, root_path)
+
+
+def test_s3bdl_deadline():
+    s3bdl, root_path, s3bdl_parent = get_s3_obj(float_timeout=10)
+    s3bdl.mkdir("level1")
+    content = bytes(12*1048576)
+    with deadline(0.0):
+        with raises(ValueError):
+            s3bdl.exists("level1")
+        with raises(ValueError):
+            s3bdl.upload_from_memory(content, "level1/v", bool_bin=True)
+    with deadline(60):
+        s3bdl.upload_from_memory(content, "level1/v", bool_bin=True)
+        assert s3bdl.exists("level1/v")
+    s3bdl_short, _, _ = get_s3_obj(float_deadline=0.0)
+    with raises(ValueError):
+        s3bdl_short.exists("level1")
+    remove_s3_folder(s3bdl_parent, root_path)
+
+
+def test_s3bdl_metrics():
+    s3bdl, root_path, s3bdl_parent = get_s3_obj()
+    s3bdl.upload_from_memory(b"abc", "v", bool_bin=True)
+    assert s3bdl.download_to_memory("v", bool_bin=True) == b"abc"
+    with raises(ValueError):
+        s3bdl.cd("w")
+    assert list(s3bdl.walk()) == ["/v"]
+    snapshot = s3bdl.metrics().snapshot()
+    assert "walk/" in snapshot["methods"]["walk"]["requests"]
+    requests = snapshot["methods"]["upload_from_memory"]["requests"]
+    assert requests["upload/"] == 1
+    assert "download/" in snapshot["methods"]["download_to_memory"]["requests"]
+    assert snapshot["methods"]["upload_from_memory"]["bytes_written"] == 3
+    assert snapshot["methods"]["download_to_memory"]["bytes_read"] == 3
+    assert snapshot["methods"]["cd"]["errors"] == 1
+    assert snapshot["methods"]["cd"]["latency"]["count"] == 1
+    remove_s3_folder(s3bdl_parent, root_path)
+
+
+def test_s3bdl_request_budget(request_budget):
+    # Round trips of each method, without retries.
+    path_tmp = generate_folder_path()
+    s3bdl, root_path, s3bdl_parent = get_s3_obj(
+        retry_policy=RetryPolicy(int_max_attempts=1))
+    with open(path_tmp / "f", "wb") as f:
+        f.write(bytes(randint(0, 256, 1048576).astype("uint8")))
+    with request_budget(3, {"mkdir/": 1}):
+        s3bdl.mkdir("a")
+    with request_budget(2):
+        assert s3bdl.exists("a")
+    with request_budget(4, {"upload/": 1}):
+        s3bdl.upload(path_tmp / "f", "a/f")
+    with request_budget(2, {"download/": 1}):
+        s3bdl.download("a/f", path_tmp / "g")
+    with request_budget(3, {"upload/": 1}):
+        s3bdl.upload_from_memory(b"abc", "a/v", bool_bin=True)
+    with request_budget(2, {"download/": 1}):
+        s3bdl.download_to_memory("a/v", bool_bin=True)
+    with request_budget(1):
+        s3bdl.size("a/f")
+    with request_budget(1):
+        s3bdl.ls("a")
+    with request_budget(1):
+        s3bdl.cd("a")
+    with request_budget(1):
+        s3bdl.cp("f", "h")
+    with request_budget(1):
+        s3bdl.rename("h", "i")
+    with request_budget(1):
+        s3bdl.mv("i", "j")
+    with request_budget(1):
+        s3bdl.rm("j")
+    remove_s3_folder(s3bdl_parent, root_path)
+    remove_folder(path_tmp)
+
+
+def test_s3bdl_server_streaming():
+    path_root = generate_folder_path()
+    path_tmp = generate_folder_path()
+    content = bytes(randint(0, 256, 3*1048576).astype("uint8"))
+    # Delimiter-like bytes across the chunks of the multipart parser.
+    content = content[:1048570] + b"\r\n--\r\n--" + content[1048580:]
+    with BDLServer(path_root) as server:
+        s3bdl = StorageS3BDL(url=server.url(), secret_key="testing")
+        s3bdl.mkdir("a")
+        s3bdl.upload_from_memory(content, "a/v", bool_bin=True)
+        assert s3bdl.download_to_memory("a/v", bool_bin=True) == content
+        s3bdl.download("a/v", path_tmp / "v")
+        with open(path_tmp / "v", "rb") as f:
+            assert f.read() == content
+        assert s3bdl.size("a") == len(content)
+        assert list(s3bdl.ls("a")) == ["v"]
+        with raises(ValueError):
+            s3bdl.download("a/w", path_tmp / "w")
+        assert not isfile(path_tmp / "w")
+        s3bdl_wrong = StorageS3BDL(url=server.url(), secret_key="wrong")
+        assert not s3bdl_wrong.exists("a")
+        with raises(ValueError):
+            s3bdl_wrong.mkdir("b")
+        assert not isdir(path_root / "b")
+    remove_folder(path_root)
+    remove_folder(path_tmp)
+
+
+def test_s3bdl_server_faults():
+    path_root = generate_folder_path()
+    with BDLServer(
+        path_root, 
+        float_failure_rate=0.3, 
+        float_truncate_rate=0.3, 
+        int_seed=0
+    ) as server:
+        s3bdl = StorageS3BDL(
+            url=server.url(), 
+            secret_key="testing", 
+            retry_policy=RetryPolicy(
+                int_max_attempts=20, float_base_delay=0.001)
+        )
+        content = bytes(randint(0, 256, 65536).astype("uint8"))
+        for i in range(10):
+            s3bdl.upload_from_memory(content, "v" + str(i), bool_bin=True)
+            assert s3bdl.download_to_memory("v" + str(i), bool_bin=True) \
+                == content
+        snapshot = s3bdl.metrics().snapshot()
+        assert snapshot["requests"]["upload/"] > 10
+        assert snapshot["requests"]["download/"] > 10
+        assert sorted(s3bdl.ls()) == sorted(["v" + str(i) for i in range(10)])
+        server.settings().float_failure_rate = 0.0
+        server.settings().float_latency = 0.5
+        with deadline(0.1):
+            with raises(ValueError):
+                s3bdl.exists("v0")
+        server.settings().float_latency = 0.0
+        assert s3bdl.exists("v0")
+        # The moves are not sent again after a 5xx: the server may have
+        # done them.
+        server.settings().float_failure_rate = 1.0
+        for method in ("rename", "mv", "cp"):
+            with raises(ValueError):
+                getattr(s3bdl, method)("v0", "w0")
+            assert s3bdl.metrics().snapshot()["requests"][method + "/"] == 1
+    remove_folder(path_root)
+
+
+def test_s3bdl_write_behind():
+    path_root = generate_folder_path()
+    with BDLServer(path_root, float_latency=0.2) as server:
+        s3bdl = StorageS3BDL(
+            url=server.url(),
+            secret_key="testing",
+            int_write_behind=1048576,
+            int_write_behind_workers=2
+        )
+        s3bdl.mkdir("level1")
+        s3bdl.cd("level1")
+        futures = [s3bdl.upload_from_memory(i, "v" + str(i)) \
+            for i in range(4)]
+        # Queued: the reads return the queued content.
+        assert not all([x.done() for x in futures])
+        assert s3bdl.exists("v0")
+        assert s3bdl.download_to_memory("v3") == 3
+        s3bdl.download("v2", path_root / "v2")
+        with open(path_root / "v2", "rb") as f:
+            assert pickle.loads(f.read()) == 2
+        with raises(ValueError):
+            s3bdl.upload_from_memory(0, "v0")
+        with raises(ValueError):
+            s3bdl.upload(path_root / "v2", "v1")
+        assert s3bdl.download_to_memory("v1") == 1
+        # The listings wait for the writes.
+        assert sorted(s3bdl.ls()) == ["v0", "v1", "v2", "v3"]
+        assert all([x.done() for x in futures])
+        server.settings().float_latency = 0.0
+        # The errors end in the future and in flush.
+        future = s3bdl.upload_from_memory(1, "/level1/v0")
+        with raises(ValueError):
+            future.result()
+        with raises(ValueError):
+            s3bdl.flush()
+        s3bdl.flush()
+        s3bdl.upload_from_memory(4, "v4")
+        s3bdl.close()
+        assert isfile(path_root / "level1" / "v4")
+        with raises(ValueError):
+            s3bdl.upload_from_memory(5, "v5")
+    remove_folder(path_root)
+
+
+def test_s3bdl_prefetch():
+    s3bdl, root_path, s3boto_parent = get_s3_obj(int_prefetch_depth=4)
+    s3bdl.mkdir("data")
+    for i in range(12):
+        s3bdl.upload_from_memory(i, "data/v" + str(i).zfill(2))
+    s3bdl.cd("data")
+    # Sequential reads: the following files are read ahead.
+    for i in range(12):
+        assert s3bdl.download_to_memory("v" + str(i).zfill(2)) == i
+    stats = s3bdl.prefetch_stats()
+    assert stats["hits"] >= 8
+    assert stats["pending"] == 0
+    s3bdl.warm("/data")
+    s3bdl.rm("v11")
+    with raises(ValueError):
+        s3bdl.download_to_memory("v11")
+    s3bdl.prefetch(["v05", "v06"])
+    assert s3bdl.download_to_memory("v06") == 6
+    s3bdl.cancel_prefetch()
+    assert s3bdl.prefetch_stats()["pending"] == 0
+    assert s3bdl.download_to_memory("v00") == 0
+    s3bdl.close()
+    s3bdl_plain, _, _ = get_s3_obj()
+    assert s3bdl_plain.prefetch_stats() is None
+    with raises(ValueError):
+        s3bdl_plain.warm()
+    remove_s3_folder(s3boto_parent, root_path)
+
+
+def test_s3bdl_negative_cache():
+    s3bdl, root_path, s3boto_parent = get_s3_obj()
+    s3bdl.mkdir("data")
+    s3bdl.mkdir("data/empty")
+    for i in range(5):
+        s3bdl.upload_from_memory(i, "data/v" + str(i))
+    s3bdl.build_negative_cache("data", float_ttl=None)
+    requests = s3bdl.metrics().snapshot()["requests"]["exists/"]
+    # The misses are answered without requests.
+    for i in range(100):
+        assert not s3bdl.exists("data/w" + str(i))
+    assert s3bdl.exists("data/v0")
+    assert s3bdl.exists("data/empty")
+    assert s3bdl.metrics().snapshot()["requests"]["exists/"] - requests < 10
+    assert s3bdl.negative_cache_stats()["absent"] > 90
+    # The writes of the instance are seen.
+    s3bdl.upload_from_memory(5, "data/v5")
+    s3bdl.mkdir("data/new")
+    s3bdl.mv("data/empty", "data/moved")
+    assert s3bdl.exists("data/v5")
+    assert s3bdl.exists("data/new")
+    assert s3bdl.exists("data/moved")
+    s3bdl.rm("data/v0")
+    assert not s3bdl.exists("data/v0")
+    # The writes of others after the rebuild.
+    s3boto_parent.upload_from_memory(6, root_path + "data/v6")
+    assert not s3bdl.exists("data/v6")
+    s3bdl.build_negative_cache("data")
+    assert s3bdl.exists("data/v6")
+    with raises(ValueError):
+        s3bdl.build_negative_cache("missing")
+    remove_s3_folder(s3boto_parent, root_path)
+
+
+def test_s3bdl_inventory():
+    path_tmp = generate_folder_path()
+    s3bdl, root_path, s3boto_parent = get_s3_obj(
+        path_inventory=path_tmp / "inventory.db")
+    s3bdl.mkdir("data")
+    s3bdl.mkdir("data/sub")
+    s3bdl.mkdir("data/empty")
+    for i in range(5):
+        s3bdl.upload_from_memory(i, "data/sub/v" + str(i))
+    s3bdl.upload_from_memory("ciao", "data/w")
+    ls = sorted(s3bdl.ls("data"))
+    size = s3bdl.size("data/sub")
+    size_w = s3bdl.size("data/w")
+    files = sorted(s3bdl.walk("data"))
+    s3bdl.refresh_inventory("data")
+    requests = sum(s3bdl.metrics().snapshot()["requests"].values())
+    # Answered by the index, without requests.
+    assert sorted(s3bdl.ls("data")) == ls
+    assert len(s3bdl.ls("data/empty")) == 0
+    assert s3bdl.size("data/sub") == size
+    assert s3bdl.size("data/w") == size_w
+    assert sorted(s3bdl.walk("data")) == files
+    assert sorted(s3bdl.glob("/data/sub/v[0-1]")) == \
+        ["/data/sub/v0", "/data/sub/v1"]
+    assert s3bdl.exists("data/sub")
+    assert not s3bdl.exists("data/x")
+    details = list(s3bdl.ls_iter("data", bool_details=True))
+    assert ("sub", None, None) in details
+    with raises(ValueError):
+        s3bdl.ls("data/x")
+    assert sum(s3bdl.metrics().snapshot()["requests"].values()) == requests
+    assert s3bdl.inventory_stats()["hits"] > 0
+    # The writes of the instance are recorded.
+    s3bdl.mv("data/sub", "data/moved")
+    s3bdl.rm("data/w")
+    s3bdl.upload_from_memory(5, "data/v5")
+    assert sorted(s3bdl.ls("data")) == ["empty", "moved", "v5"]
+    assert s3bdl.exists("data/moved/v0")
+    # The writes of others: seen with a lower staleness bound, or after
+    # the refresh.
+    s3boto_parent.upload_from_memory(6, root_path + "data/v6")
+    assert not s3bdl.exists("data/v6")
+    with staleness(0):
+        assert s3bdl.exists("data/v6")
+    s3bdl.refresh_inventory("data")
+    assert s3bdl.exists("data/v6")
+    s3bdl.close()
+    remove_folder(path_tmp)
+    remove_s3_folder(s3boto_parent, root_path)
+    s3bdl, root_path, s3boto_parent = get_s3_obj()
+    assert s3bdl.inventory_stats() is None
+    with raises(ValueError):
+        s3bdl.refresh_inventory()
+    remove_s3_folder(s3boto_parent, root_path)
+
+
 def test_s3bdl_get_type():
     s3bdl, root_path, s3boto_parent = get_s3_obj()
     assert s3bdl.get_type() == "S3BDL"
@@ -121,6 +519,23 @@ def test_s3bdl_mkdir_cd_pwd():
     remove_s3_folder(s3boto_parent, root_path)
 
 
+def test_s3bdl_cwd():
+    s3bdl, root_path, s3boto_parent = get_s3_obj()
+    for i in range(4):
+        s3bdl.mkdir("level" + str(i))
+
+    def job(i):
+        with s3bdl.cwd("level" + str(i)):
+            assert s3bdl.pwd() == "/level" + str(i)
+            s3bdl.upload_from_memory(i, "v")
+        return s3bdl.download_to_memory("/level" + str(i) + "/v")
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert list(executor.map(job, range(4))) == list(range(4))
+    assert s3bdl.pwd() == "/"
+    remove_s3_folder(s3boto_parent, root_path)
+
+
 def test_s3bdl_cd_ls_exists():
     s3bdl, root_path, s3boto_parent = get_s3_obj()
     s3bdl.mkdir("level1")
@@ -138,6 +553,42 @@ def test_s3bdl_cd_ls_exists():
     remove_s3_folder(s3boto_parent, root_path)
 
 
+def test_s3bdl_ls_iter():
+    s3bdl, root_path, s3boto_parent = get_s3_obj()
+    s3bdl.mkdir("level1")
+    s3bdl.mkdir("level1/level2")
+    s3bdl.upload_from_memory("ciao", "level1/level2/level2.txt")
+    for i in range(5):
+        s3bdl.upload_from_memory("ciao", "level1/file" + str(i))
+    assert sorted(s3bdl.ls_iter("level1", page_size=2)) == \
+        ["file0", "file1", "file2", "file3", "file4", "level2"]
+    assert sorted(s3bdl.ls("level1")) == sorted(s3bdl.ls_iter("level1"))
+    listing = s3bdl.ls_compact("level1", page_size=3)
+    assert len(listing) == 6
+    assert "level2" in listing
+    remove_s3_folder(s3boto_parent, root_path)
+
+
+def test_s3bdl_walk_glob():
+    s3bdl, root_path, s3boto_parent = get_s3_obj()
+    s3bdl.mkdir("level1")
+    s3bdl.mkdir("level1/level2")
+    s3bdl.upload_from_memory("ciao", "level0.txt")
+    s3bdl.upload_from_memory("ciao", "level1/level1.txt")
+    s3bdl.upload_from_memory("ciao", "level1/level1.csv")
+    s3bdl.upload_from_memory("ciao", "level1/level2/level2.txt")
+    assert sorted(s3bdl.walk()) == ["/level0.txt", "/level1/level1.csv", \
+        "/level1/level1.txt", "/level1/level2/level2.txt"]
+    assert sorted(s3bdl.walk("level1/level2")) == ["/level1/level2/level2.txt"]
+    assert sorted(s3bdl.glob("*.txt")) == ["/level0.txt"]
+    assert sorted(s3bdl.glob("**/*.txt")) == ["/level0.txt", \
+        "/level1/level1.txt", "/level1/level2/level2.txt"]
+    s3bdl.cd("level1")
+    assert sorted(s3bdl.glob("level?.*")) == \
+        ["/level1/level1.csv", "/level1/level1.txt"]
+    remove_s3_folder(s3boto_parent, root_path)
+
+
 def test_s3bdl_upload():
     s3bdl, root_path, s3boto_parent = get_s3_obj()
     root_path_local = generate_folder_path()
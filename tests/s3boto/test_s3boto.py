@@ -1,12 +1,22 @@
-from os import rmdir, makedirs, remove
+import pickle
+from os import rmdir, makedirs, remove, listdir
 from os.path import isdir, isfile, getmtime, getsize
 from shutil import rmtree
 from pathlib import Path 
+from io import BytesIO
 from datetime import datetime
 from numpy.random import randint
 from pytest import raises
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from boto.s3.key import Key
 from sdaab.s3boto.storage_s3_boto import StorageS3boto
+from sdaab.s3boto.storage_s3_boto import merge_ranges, missing_ranges
+from sdaab.s3boto.connection_pool import get_connection_pool
 from sdaab.utils.get_config import dict_config
+from sdaab.utils.retry import RetryPolicy
+from sdaab.utils.deadline import deadline
+from sdaab.utils.inventory import staleness
 
 
 def generate_folder_path(dict_config=dict_config):
@@ -24,7 +34,7 @@ def remove_folder(path):
     rmtree(path)
 
 
-def get_s3_obj(dict_config=dict_config):
+def get_s3_obj(dict_config=dict_config, **kwargs):
     assert dict_config["ENV"] == "TESTING"
     root_path = "sdaab-" \
         + datetime.now().strftime("%Y-%m-%d-%H-%M-%S-%f-") \
@@ -49,7 +59,8 @@ def get_s3_obj(dict_config=dict_config):
         bucket=dict_config["S3"]["BUCKET"],
         calling_format=dict_config["S3"]["CALLING_FORMAT"],
         secure=dict_config["S3"]["SECURE"],
-        root_path=dict_config["S3"]["ROOT_PATH"] + root_path
+        root_path=dict_config["S3"]["ROOT_PATH"] + root_path,
+        **kwargs
     )
     return s3boto, root_path, s3boto_parent
 
@@ -72,6 +83,48 @@ def test_s3boto_init():
 
 
 
+def test_s3boto_lazy():
+    s3boto, root_path, s3boto_parent = get_s3_obj(bool_lazy=True)
+    assert s3boto.initialized()
+    s3boto.mkdir("level1")
+    assert s3boto.exists("level1")
+    s3boto_lazy = StorageS3boto(
+        host=dict_config["S3"]["HOST"],
+        port=dict_config["S3"]["PORT"],
+        access_key=dict_config["S3"]["ACCESS_KEY"],
+        secret_key=dict_config["S3"]["SECRET_KEY"], 
+        bucket=dict_config["S3"]["BUCKET"],
+        calling_format=dict_config["S3"]["CALLING_FORMAT"],
+        secure=dict_config["S3"]["SECURE"],
+        root_path="/this/folder/does/not/exist/",
+        bool_lazy=True
+    )
+    assert s3boto_lazy.initialized()
+    with raises(ValueError):
+        s3boto_lazy.ls()
+    with raises(ValueError):
+        s3boto_lazy.glob("*")
+    remove_s3_folder(s3boto_parent, root_path)
+
+
+def test_s3boto_connection_pool_shared():
+    kwargs = {
+        "host": "localhost",
+        "port": 1234,
+        "access_key": "access",
+        "secret_key": "secret",
+        "bucket": "bucket",
+        "calling_format": "boto.s3.connection.OrdinaryCallingFormat",
+        "secure": False
+    }
+    pool = get_connection_pool(**kwargs)
+    assert pool is get_connection_pool(**kwargs)
+    assert pool.size() == 0
+    assert pool is not get_connection_pool(**kwargs, int_max_connections=4)
+    kwargs["bucket"] = "another-bucket"
+    assert pool is not get_connection_pool(**kwargs)
+
+
 def test_s3boto_mkdir_ls_exists():
     s3boto, root_path, s3boto_parent = get_s3_obj()
     s3boto.mkdir("/tmp1")
@@ -92,6 +145,453 @@ def test_s3boto_mkdir_ls_exists():
     remove_s3_folder(s3boto_parent, root_path)
 
 
+def test_s3boto_implicit_dirs():
+    s3boto, root_path, s3boto_parent = get_s3_obj(bool_implicit_dirs=True)
+    s3boto.mkdir("level1/level2/level3")
+    s3boto.mkdir("level1/level2/level3")
+    assert s3boto.exists("level1/level2")
+    assert s3boto.exists("/level1/level2/level3/")
+    s3boto.upload_from_memory("ciao", "/level1/level2/level3/v")
+    s3boto.cd("/level1/level2")
+    assert sorted(s3boto.ls()) == ["level3"]
+    s3boto.cd("/")
+    s3boto.rm("level1")
+    assert not s3boto.exists("level1")
+    s3boto_parent.upload_from_memory("ciao", root_path + "a/b/v")
+    assert s3boto.exists("a/b")
+    assert s3boto.size("a") == s3boto.size("a/b/v")
+    assert s3boto.download_to_memory("a/b/v") == "ciao"
+    remove_s3_folder(s3boto_parent, root_path)
+
+
+def test_s3boto_threads():
+    s3boto, root_path, s3boto_parent = get_s3_obj(int_max_connections=4)
+    s3boto.mkdir("threads")
+
+    def job(i):
+        s3boto.upload_from_memory(i, "threads/v" + str(i))
+        assert s3boto.exists("threads/v" + str(i))
+        return s3boto.download_to_memory("threads/v" + str(i))
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        output = list(executor.map(job, range(32)))
+    assert output == list(range(32))
+    assert len(s3boto.ls("threads")) == 32
+    remove_s3_folder(s3boto_parent, root_path)
+
+
+def test_s3boto_single_connection():
+    # The multipart workers and the hedged reads lease the only connection
+    # while the operation waits for them.
+    s3boto, root_path, s3boto_parent = get_s3_obj(int_max_connections=1, 
+        float_hedge_percentile=50.0, float_timeout=10.0)
+    content = bytes(randint(0, 256, 12*1048576).astype("uint8"))
+    s3boto.upload_from_memory(content, "v", bool_bin=True)
+    assert s3boto.download_to_memory("v", bool_bin=True) == content
+    pool = get_connection_pool(
+        host=dict_config["S3"]["HOST"],
+        port=dict_config["S3"]["PORT"],
+        access_key=dict_config["S3"]["ACCESS_KEY"],
+        secret_key=dict_config["S3"]["SECRET_KEY"], 
+        bucket=dict_config["S3"]["BUCKET"],
+        calling_format=dict_config["S3"]["CALLING_FORMAT"],
+        secure=dict_config["S3"]["SECURE"] in (True, "True"),
+        int_max_connections=1
+    )
+    assert pool.size() == 1
+
+    # The wait for a connection follows the timeout and the deadline.
+    def lease(float_timeout):
+        with pool.lease(float_timeout):
+            pass
+
+    with pool.lease():
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            with raises(AssertionError):
+                executor.submit(lease, 0.1).result()
+            with deadline(0.1):
+                with raises(AssertionError):
+                    executor.submit(copy_context().run, lease, None)\
+                        .result()
+    lease(0.1)
+    remove_s3_folder(s3boto_parent, root_path)
+
+
+def test_s3boto_write_behind():
+    s3boto, root_path, s3boto_parent = get_s3_obj(
+        int_max_connections=2, int_write_behind=4096, 
+        int_write_behind_workers=2)
+    s3boto.mkdir("wb")
+    s3boto.cd("wb")
+    content = bytes(1024)
+    futures = [s3boto.upload_from_memory(content, "v" + str(i), bool_bin=True) 
+        for i in range(16)]
+    assert s3boto.exists("v15")
+    assert s3boto.download_to_memory("v15", bool_bin=True) == content
+    with raises(ValueError):
+        s3boto.upload_from_memory(content, "v15", bool_bin=True)
+
+    # The other methods wait for the writes below their path, before 
+    # leasing one of the two connections.
+    def job(i):
+        return s3boto.size("v" + str(i))
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert list(executor.map(job, range(16))) == [1024] * 16
+    assert len(s3boto.ls()) == 16
+    assert all([x.done() for x in futures])
+    future = s3boto.upload_from_memory(content, "/wb/v0", bool_bin=True)
+    with raises(ValueError):
+        future.result()
+    with raises(ValueError):
+        s3boto.flush()
+    s3boto.upload_from_memory("ciao", "w")
+    s3boto_copy = pickle.loads(pickle.dumps(s3boto))
+    s3boto.close()
+    assert s3boto_copy.download_to_memory("w") == "ciao"
+    s3boto_copy.close()
+    remove_s3_folder(s3boto_parent, root_path)
+
+
+def test_s3boto_prefetch():
+    path_tmp = generate_folder_path()
+    s3boto, root_path, s3boto_parent = get_s3_obj(
+        int_max_connections=2, int_prefetch_depth=4, 
+        path_prefetch=path_tmp / "prefetch")
+    s3boto.mkdir("data")
+    for i in range(12):
+        s3boto.upload_from_memory(i, "data/v" + str(i).zfill(2))
+
+    # Concurrent readers wait for the reads ahead without holding one of 
+    # the two connections.
+    def job(i):
+        return s3boto.download_to_memory("data/v" + str(i).zfill(2))
+
+    s3boto.warm("data")
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert list(executor.map(job, range(12))) == list(range(12))
+    assert s3boto.prefetch_stats()["hits"] > 0
+    s3boto.prefetch(["data/v00"])
+    s3boto.rm("data/v00")
+    with raises(ValueError):
+        s3boto.download_to_memory("data/v00")
+    s3boto.close()
+    assert listdir(path_tmp / "prefetch") == []
+    remove_folder(path_tmp)
+    remove_s3_folder(s3boto_parent, root_path)
+
+
+def test_s3boto_negative_cache():
+    s3boto, root_path, s3boto_parent = get_s3_obj(bool_implicit_dirs=True)
+    s3boto.mkdir("data/empty")
+    for i in range(5):
+        s3boto.upload_from_memory(i, "data/sub/v" + str(i))
+    s3boto.build_negative_cache("data", float_ttl=None)
+    requests = sum(s3boto.metrics().snapshot()["requests"].values())
+    # The misses are answered without requests.
+    for i in range(100):
+        assert not s3boto.exists("data/w" + str(i))
+    assert s3boto.exists("data/sub")
+    assert s3boto.exists("data/empty")
+    assert sum(s3boto.metrics().snapshot()["requests"].values()) \
+        - requests < 10
+    assert s3boto.negative_cache_stats()["absent"] > 90
+    # The writes of the instance are seen, folder copies included.
+    s3boto.cp("data/sub", "data/copy")
+    s3boto.upload_from_memory(5, "data/v5")
+    assert s3boto.exists("data/copy/v3")
+    assert s3boto.exists("data/v5")
+    # The writes of others after the rebuild.
+    s3boto_parent.upload_from_memory(6, root_path + "data/empty/v6")
+    assert not s3boto.exists("data/empty/v6")
+    s3boto.build_negative_cache("data")
+    assert s3boto.exists("data/empty/v6")
+    remove_s3_folder(s3boto_parent, root_path)
+
+
+def test_s3boto_inventory():
+    path_tmp = generate_folder_path()
+    s3boto, root_path, s3boto_parent = get_s3_obj(
+        path_inventory=path_tmp / "inventory.db")
+    s3boto.mkdir("data")
+    s3boto.mkdir("data/sub")
+    s3boto.mkdir("data/empty")
+    for i in range(5):
+        s3boto.upload_from_memory(i, "data/sub/v" + str(i))
+    s3boto.upload_from_memory("ciao", "data/w")
+    ls = sorted(s3boto.ls("data"))
+    details = sorted(s3boto.ls_iter("data", bool_details=True))
+    size = s3boto.size("data/sub")
+    files = sorted(s3boto.walk("data"))
+    s3boto.refresh_inventory("data")
+    requests = sum(s3boto.metrics().snapshot()["requests"].values())
+    # Answered by the index, without requests.
+    assert sorted(s3boto.ls("data")) == ls
+    assert sorted(s3boto.ls_iter("data", bool_details=True)) == details
+    assert len(s3boto.ls("data/empty")) == 0
+    assert s3boto.size("data/sub") == size
+    assert sorted(s3boto.walk("data")) == files
+    assert sorted(s3boto.glob("/data/sub/v[0-1]")) == \
+        ["/data/sub/v0", "/data/sub/v1"]
+    assert s3boto.exists("data/empty")
+    assert not s3boto.exists("data/x")
+    with raises(ValueError):
+        s3boto.size("data/x")
+    assert sum(s3boto.metrics().snapshot()["requests"].values()) == requests
+    # The writes of the instance are recorded.
+    s3boto.cp("data/sub", "data/copy")
+    s3boto.rm("data/w")
+    assert sorted(s3boto.ls("data")) == ["copy", "empty", "sub"]
+    assert s3boto.size("data/copy") == size
+    # The writes of others: seen with a lower staleness bound, or after
+    # the refresh.
+    s3boto_parent.upload_from_memory(6, root_path + "data/v6")
+    assert not s3boto.exists("data/v6")
+    with staleness(0):
+        assert s3boto.exists("data/v6")
+    s3boto.refresh_inventory("data")
+    assert s3boto.exists("data/v6")
+    assert s3boto.inventory_stats()["hits"] > 0
+    s3boto.close()
+    remove_folder(path_tmp)
+    remove_s3_folder(s3boto_parent, root_path)
+
+
+def test_s3boto_pickle():
+    s3boto, root_path, s3boto_parent = get_s3_obj()
+    s3boto.mkdir("level1")
+    s3boto.cd("level1")
+    s3boto.upload_from_memory("ciao", "v")
+    s3boto_copy = pickle.loads(pickle.dumps(s3boto))
+    assert s3boto_copy.pwd() == "/level1"
+    assert s3boto_copy.download_to_memory("v") == "ciao"
+    remove_s3_folder(s3boto_parent, root_path)
+
+
+def test_s3boto_retry_hedged():
+    s3boto, root_path, s3boto_parent = get_s3_obj(
+        retry_policy=RetryPolicy(int_max_attempts=3, float_base_delay=0.01),
+        float_hedge_percentile=50
+    )
+    s3boto.upload_from_memory("ciao", "v")
+    for _ in range(30):
+        assert s3boto.exists("v")
+        assert s3boto.download_to_memory("v") == "ciao"
+    assert not s3boto.exists("w")
+    s3boto_copy = pickle.loads(pickle.dumps(s3boto))
+    assert s3boto_copy.download_to_memory("v") == "ciao"
+    remove_s3_folder(s3boto_parent, root_path)
+
+
+def test_s3boto_multipart_tuning():
+    s3boto, root_path, s3boto_parent = get_s3_obj(
+        dict_tuning={"concurrency": 3, "rate": 1.0})
+    content = bytes(randint(0, 256, 12*1048576).astype("uint8"))
+    s3boto.upload_from_memory(content, "v", bool_bin=True)
+    assert s3boto.download_to_memory("v", bool_bin=True) == content
+    tuning = s3boto.get_tuning()
+    assert tuning["rate"] > 1.0
+    assert tuning["concurrency"] >= 3
+    s3boto.set_tuning({"concurrency": 1, "rate": None})
+    assert s3boto.get_tuning() == {"concurrency": 1, "rate": None}
+    s3boto_copy = pickle.loads(pickle.dumps(s3boto))
+    assert s3boto_copy.get_tuning() == {"concurrency": 1, "rate": None}
+    remove_s3_folder(s3boto_parent, root_path)
+
+
+def test_s3boto_deadline():
+    s3boto, root_path, s3boto_parent = get_s3_obj(float_timeout=10)
+    s3boto.mkdir("level1")
+    content = bytes(12*1048576)
+    with deadline(0.0):
+        with raises(ValueError):
+            s3boto.exists("level1")
+        with raises(ValueError):
+            s3boto.upload_from_memory(content, "level1/v", bool_bin=True)
+    with deadline(60):
+        s3boto.upload_from_memory(content, "level1/v", bool_bin=True)
+        assert s3boto.exists("level1/v")
+    s3boto_short, _, _ = get_s3_obj(float_deadline=0.0)
+    with raises(ValueError):
+        s3boto_short.exists("level1")
+    remove_s3_folder(s3boto_parent, root_path)
+
+
+def test_s3boto_ranges():
+    assert merge_ranges([[5, 8], [0, 2], [2, 4]]) == [[0, 4], [5, 8]]
+    assert missing_ranges([], 10, 4) == [[0, 4], [4, 8], [8, 10]]
+    assert missing_ranges([[0, 3], [5, 6]], 10, 4) \
+        == [[3, 5], [6, 10]]
+    assert missing_ranges([[0, 10]], 10, 4) == []
+    assert missing_ranges([], 0, 4) == []
+
+
+def test_s3boto_resumable():
+    path_tmp = generate_folder_path()
+    path_checkpoints = path_tmp / "checkpoints"
+    s3boto, root_path, s3boto_parent = get_s3_obj(
+        path_checkpoints=path_checkpoints,
+        dict_tuning={"concurrency": 1, "rate": 1.0}
+    )
+    content = bytes(randint(0, 256, 16*1048576).astype("uint8"))
+    with open(path_tmp / "f", "wb") as f:
+        f.write(content)
+
+    # Interrupted by growing deadlines, each attempt resumes the last one. 
+    # If only the response of the completion is lost the object exists 
+    # and the checkpoint is left behind.
+    bool_resumed = False
+    for i in range(1, 500):
+        bool_resumed = bool_resumed or len(listdir(path_checkpoints)) > 0
+        try:
+            with deadline(0.01 * i):
+                s3boto.upload(path_tmp / "f", "v")
+            assert listdir(path_checkpoints) == []
+            break
+        except ValueError:
+            if s3boto.exists("v"):
+                break
+    assert bool_resumed
+    assert s3boto.download_to_memory("v", bool_bin=True) == content
+
+    checkpoints = set(listdir(path_checkpoints))
+    bool_resumed = False
+    for i in range(1, 500):
+        bool_resumed = bool_resumed \
+            or len(set(listdir(path_checkpoints)) - checkpoints) > 0
+        try:
+            with deadline(0.005 * i):
+                s3boto.download("v", path_tmp / "g")
+            break
+        except ValueError:
+            pass
+    assert bool_resumed
+    assert set(listdir(path_checkpoints)) == checkpoints
+    assert not isfile(str(path_tmp / "g") + ".part")
+    with open(path_tmp / "g", "rb") as f:
+        assert f.read() == content
+
+    s3boto.sweep_uploads(float_age=0)
+    with get_connection_pool(
+        host=dict_config["S3"]["HOST"],
+        port=dict_config["S3"]["PORT"],
+        access_key=dict_config["S3"]["ACCESS_KEY"],
+        secret_key=dict_config["S3"]["SECRET_KEY"], 
+        bucket=dict_config["S3"]["BUCKET"],
+        calling_format=dict_config["S3"]["CALLING_FORMAT"],
+        secure=dict_config["S3"]["SECURE"] in (True, "True")
+    ).lease() as bucket:
+        bucket.initiate_multipart_upload(
+            dict_config["S3"]["ROOT_PATH"][1:] + root_path + "w")
+    assert s3boto.sweep_uploads(float_age=1e12) == []
+    assert s3boto.sweep_uploads(float_age=0) == ["/w"]
+    assert s3boto.sweep_uploads(float_age=0) == []
+    remove_s3_folder(s3boto_parent, root_path)
+    remove_folder(path_tmp)
+
+
+def test_s3boto_checksum():
+    path_tmp = generate_folder_path()
+    s3boto, root_path, s3boto_parent = get_s3_obj(
+        retry_policy=RetryPolicy(int_max_attempts=1), bool_verify_etag=True)
+    content = bytes(randint(0, 256, 12*1048576).astype("uint8"))
+    s3boto.upload_from_memory(content, "v", bool_bin=True)
+    key = dict_config["S3"]["ROOT_PATH"][1:] + root_path
+    with get_connection_pool(
+        host=dict_config["S3"]["HOST"],
+        port=dict_config["S3"]["PORT"],
+        access_key=dict_config["S3"]["ACCESS_KEY"],
+        secret_key=dict_config["S3"]["SECRET_KEY"], 
+        bucket=dict_config["S3"]["BUCKET"],
+        calling_format=dict_config["S3"]["CALLING_FORMAT"],
+        secure=dict_config["S3"]["SECURE"] in (True, "True")
+    ).lease() as bucket:
+        k = bucket.get_key(key + "v")
+        assert "-" in k.etag
+        assert k.get_metadata("sdaab-part-size") is not None
+        # A multipart object whose ETag does not match its part size.
+        mp = bucket.initiate_multipart_upload(
+            key + "w", metadata={"sdaab-part-size": "1048576"})
+        mp.upload_part_from_file(BytesIO(content), part_num=1)
+        mp.complete_upload()
+    assert s3boto.download_to_memory("v", bool_bin=True) == content
+    s3boto.download("v", path_tmp / "v")
+    with open(path_tmp / "v", "rb") as f:
+        assert f.read() == content
+    with raises(ValueError):
+        s3boto.download_to_memory("w", bool_bin=True)
+    with raises(ValueError):
+        s3boto.download("w", path_tmp / "w")
+    # By default only the server checks the Content-MD5 of the writes.
+    assert s3boto_parent.download_to_memory(root_path + "w", 
+        bool_bin=True) == content
+    remove_s3_folder(s3boto_parent, root_path)
+    remove_folder(path_tmp)
+
+
+def test_s3boto_metrics():
+    s3boto, root_path, s3boto_parent = get_s3_obj()
+    s3boto.upload_from_memory(b"abc", "v", bool_bin=True)
+    assert s3boto.download_to_memory("v", bool_bin=True) == b"abc"
+    with raises(ValueError):
+        s3boto.cd("w")
+    assert list(s3boto.walk()) == ["/v"]
+    snapshot = s3boto.metrics().snapshot()
+    assert "LIST" in snapshot["methods"]["walk"]["requests"]
+    requests = snapshot["methods"]["upload_from_memory"]["requests"]
+    assert requests["PUT"] == 1
+    assert requests["POST"] == 2
+    assert "GET" in snapshot["methods"]["download_to_memory"]["requests"]
+    assert snapshot["methods"]["upload_from_memory"]["bytes_written"] == 3
+    assert snapshot["methods"]["download_to_memory"]["bytes_read"] == 3
+    assert snapshot["methods"]["cd"]["errors"] == 1
+    assert snapshot["methods"]["cd"]["latency"]["count"] == 1
+    remove_s3_folder(s3boto_parent, root_path)
+
+
+def test_s3boto_request_budget(request_budget):
+    # Round trips of each method, without retries.
+    path_tmp = generate_folder_path()
+    s3boto, root_path, s3boto_parent = get_s3_obj(
+        retry_policy=RetryPolicy(int_max_attempts=1))
+    with open(path_tmp / "f", "wb") as f:
+        f.write(bytes(randint(0, 256, 1048576).astype("uint8")))
+    with request_budget(3, {"PUT": 1}):
+        s3boto.mkdir("a")
+    with request_budget(2):
+        assert s3boto.exists("a")
+    with request_budget(6, {"HEAD": 3, "PUT": 1}):
+        s3boto.upload(path_tmp / "f", "a/f")
+    with request_budget(2, {"HEAD": 1, "GET": 1}):
+        s3boto.download("a/f", path_tmp / "g")
+    with request_budget(5, {"HEAD": 2, "PUT": 1}):
+        s3boto.upload_from_memory(b"abc", "a/v", bool_bin=True)
+    with request_budget(2, {"HEAD": 1, "GET": 1}):
+        s3boto.download_to_memory("a/v", bool_bin=True)
+    with request_budget(1):
+        s3boto.size("a/f")
+    with request_budget(2, {"LIST": 1}):
+        s3boto.ls("a")
+    with request_budget(1):
+        s3boto.cd("a")
+    with request_budget(3, {"COPY": 1}):
+        s3boto.cp("f", "h")
+    with request_budget(4, {"COPY": 1, "DELETE": 1}):
+        s3boto.rename("h", "i")
+    with request_budget(4, {"COPY": 1, "DELETE": 1}):
+        s3boto.mv("i", "j")
+    with request_budget(3, {"DELETE": 1}):
+        s3boto.rm("j")
+    s3boto.cd("/")
+    with request_budget(3, {"LIST": 1}):
+        s3boto.size("a")
+    with request_budget(5, {"LIST": 1}) as counter:
+        s3boto.rm("a")
+    assert counter.counts()["DELETE"] == 3
+    remove_s3_folder(s3boto_parent, root_path)
+    remove_folder(path_tmp)
+
+
 def test_s3boto_get_type():
     s3boto, root_path, s3boto_parent = get_s3_obj()
     assert s3boto.get_type() == "S3boto"
@@ -126,6 +626,23 @@ def test_s3boto_mkdir_cd_pwd():
     remove_s3_folder(s3boto_parent, root_path)
 
 
+def test_s3boto_cwd():
+    s3boto, root_path, s3boto_parent = get_s3_obj()
+    for i in range(4):
+        s3boto.mkdir("level" + str(i))
+
+    def job(i):
+        with s3boto.cwd("level" + str(i)):
+            assert s3boto.pwd() == "/level" + str(i)
+            s3boto.upload_from_memory(i, "v")
+        return s3boto.download_to_memory("/level" + str(i) + "/v")
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert list(executor.map(job, range(4))) == list(range(4))
+    assert s3boto.pwd() == "/"
+    remove_s3_folder(s3boto_parent, root_path)
+
+
 def test_s3boto_cd_ls_exists():
     s3boto, root_path, s3boto_parent = get_s3_obj()
     s3boto.mkdir("level1")
@@ -143,6 +660,59 @@ def test_s3boto_cd_ls_exists():
     remove_s3_folder(s3boto_parent, root_path)
 
 
+def test_s3boto_ls_iter():
+    s3boto, root_path, s3boto_parent = get_s3_obj()
+    s3boto.mkdir("level1")
+    s3boto.mkdir("level1/level2")
+    s3boto.upload_from_memory("ciao", "level1/level2/level2.txt")
+    for i in range(5):
+        s3boto.upload_from_memory("ciao", "level1/file" + str(i))
+    assert sorted(s3boto.ls_iter("level1", page_size=2)) == \
+        ["file0", "file1", "file2", "file3", "file4", "level2"]
+    assert sorted(s3boto.ls("level1")) == sorted(s3boto.ls_iter("level1"))
+    listing = s3boto.ls_compact("level1", page_size=3)
+    assert len(listing) == 6
+    assert "level2" in listing
+    # A file and a folder with the same name, apart in key order.
+    s3boto.upload_from_memory("ciao", "level1/level2-a")
+    pool = get_connection_pool(
+        host=dict_config["S3"]["HOST"],
+        port=dict_config["S3"]["PORT"],
+        access_key=dict_config["S3"]["ACCESS_KEY"],
+        secret_key=dict_config["S3"]["SECRET_KEY"],
+        bucket=dict_config["S3"]["BUCKET"],
+        calling_format=dict_config["S3"]["CALLING_FORMAT"],
+        secure=str(dict_config["S3"]["SECURE"]) == "True"
+    )
+    with pool.lease() as bucket:
+        Key(bucket, (dict_config["S3"]["ROOT_PATH"] + root_path \
+            + "level1/level2").lstrip("/")).set_contents_from_string("ciao")
+    for page_size in (1, 2, 1000):
+        assert list(s3boto.ls_iter("level1", page_size=page_size)) == \
+            ["file0", "file1", "file2", "file3", "file4", "level2", "level2-a"]
+    remove_s3_folder(s3boto_parent, root_path)
+
+
+def test_s3boto_walk_glob():
+    s3boto, root_path, s3boto_parent = get_s3_obj()
+    s3boto.mkdir("level1")
+    s3boto.mkdir("level1/level2")
+    s3boto.upload_from_memory("ciao", "level0.txt")
+    s3boto.upload_from_memory("ciao", "level1/level1.txt")
+    s3boto.upload_from_memory("ciao", "level1/level1.csv")
+    s3boto.upload_from_memory("ciao", "level1/level2/level2.txt")
+    assert sorted(s3boto.walk()) == ["/level0.txt", "/level1/level1.csv", \
+        "/level1/level1.txt", "/level1/level2/level2.txt"]
+    assert sorted(s3boto.walk("level1/level2")) == ["/level1/level2/level2.txt"]
+    assert sorted(s3boto.glob("*.txt")) == ["/level0.txt"]
+    assert sorted(s3boto.glob("**/*.txt")) == ["/level0.txt", \
+        "/level1/level1.txt", "/level1/level2/level2.txt"]
+    s3boto.cd("level1")
+    assert sorted(s3boto.glob("level?.*")) == \
+        ["/level1/level1.csv", "/level1/level1.txt"]
+    remove_s3_folder(s3boto_parent, root_path)
+
+
 def test_s3boto_upload():
     s3boto, root_path, s3boto_parent = get_s3_obj()
     root_path_local = generate_folder_path()
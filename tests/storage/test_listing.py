@@ -0,0 +1,29 @@
+from math import isnan
+from pytest import raises
+from sdaab.storage.listing import Listing
+
+
+def test_listing():
+
+    listing = Listing.from_iter(["a", "bb", "ccc", "àè"])
+    assert len(listing) == 4
+    assert listing[0] == "a"
+    assert listing[-1] == "àè"
+    assert listing.names() == ["a", "bb", "ccc", "àè"]
+    assert "bb" in listing
+    assert "b" not in listing
+    with raises(IndexError):
+        listing[4]
+    with raises(AssertionError):
+        listing.sizes()
+
+    listing = Listing.from_iter(
+        [("a", 10, 1.5), ("folder", None, None)], bool_details=True)
+    assert list(listing) == ["a", "folder"]
+    assert list(listing.sizes()) == [10, -1]
+    assert listing.mtimes()[0] == 1.5
+    assert isnan(listing.mtimes()[1])
+    assert listing.nbytes() > 0
+
+    assert len(Listing()) == 0
+    assert list(Listing()) == []
@@ -18,6 +18,11 @@ def test_storage():
             pass
 
 
+        def metrics(self):
+            super.metrics()
+            pass
+
+
         def cd(self):
             super.cd()
             pass
@@ -33,6 +38,21 @@ def test_storage():
             pass
 
 
+        def ls_iter(self):
+            super.ls_iter()
+            pass
+
+
+        def walk(self):
+            super.walk()
+            pass
+
+
+        def glob(self):
+            super.glob()
+            pass
+
+
         def exists(self):
             super.exists()
             pass
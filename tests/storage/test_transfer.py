@@ -0,0 +1,65 @@
+import pickle
+from os import makedirs
+from os.path import isdir, isfile
+from shutil import rmtree
+from pathlib import Path
+from datetime import datetime
+from numpy.random import randint
+from pytest import raises
+from sdaab.disk.storage_disk import StorageDisk
+from sdaab.storage.transfer import TransferExecutor
+from sdaab.utils.get_config import dict_config
+
+
+def generate_folder_path(dict_config=dict_config):
+    assert dict_config["ENV"] == "TESTING"
+    root_path = Path(dict_config["DISK"]["ROOT_PATH"] + \
+        "/sdaab-" + datetime.now().strftime("%Y-%m-%d-%H-%M-%S-%f-") + \
+        str(randint(0, 1000)))
+    makedirs(root_path)
+    assert isdir(root_path)
+    return root_path
+
+
+def test_storage_pickle():
+
+    root_path = generate_folder_path()
+    makedirs(root_path / "storage/level1")
+    s = StorageDisk(root_path=root_path / "storage")
+    s.cd("level1")
+    s.upload_from_memory("ciao", "v")
+    s_copy = pickle.loads(pickle.dumps(s))
+    assert s_copy.pwd() == "/level1"
+    assert s_copy.download_to_memory("v") == "ciao"
+    rmtree(root_path)
+
+
+def test_transfer_executor():
+
+    root_path = generate_folder_path()
+    makedirs(root_path / "local")
+    makedirs(root_path / "storage/uploaded")
+    makedirs(root_path / "downloaded")
+    for i in range(20):
+        with open(root_path / "local" / str(i), "w") as f:
+            f.write(str(i))
+    s = StorageDisk(root_path=root_path / "storage")
+
+    with TransferExecutor(s, int_workers=2, int_chunk_size=4) as executor:
+        executor.upload_many(
+            [(root_path / "local" / str(i), "uploaded/" + str(i)) \
+            for i in range(20)])
+        executor.download_many(
+            [("uploaded/" + str(i), root_path / "downloaded" / str(i)) \
+            for i in range(20)])
+        with raises(ValueError):
+            executor.upload_many(
+                [(root_path / "local/0", "uploaded/0"), \
+                (root_path / "local/1", "uploaded/new")])
+
+    assert sorted(s.ls("uploaded")) == sorted([str(i) for i in range(20)] \
+        + ["new"])
+    for i in range(20):
+        with open(root_path / "downloaded" / str(i), "r") as f:
+            assert f.read() == str(i)
+    rmtree(root_path)
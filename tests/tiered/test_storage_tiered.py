@@ -0,0 +1,336 @@
+import pickle
+from os import makedirs
+from os.path import isdir
+from shutil import rmtree
+from pathlib import Path
+from datetime import datetime
+from numpy.random import randint
+from numpy import arange, save as np_save
+from io import BytesIO
+from pytest import raises
+from time import sleep
+from threading import active_count
+from concurrent.futures import ThreadPoolExecutor
+from sdaab.tiered.storage_tiered import StorageTiered
+from sdaab.tiered.journal import FlushJournal
+from sdaab.memory.storage_memory import StorageMemory
+from sdaab.disk.storage_disk import StorageDisk
+from sdaab.utils.get_config import dict_config
+
+
+def generate_folder_path(dict_config=dict_config):
+    assert dict_config["ENV"] == "TESTING"
+    root_path = Path(dict_config["DISK"]["ROOT_PATH"] + \
+        "/sdaab-" + datetime.now().strftime("%Y-%m-%d-%H-%M-%S-%f-") + \
+        str(randint(0, 1000)))
+    makedirs(root_path)
+    assert isdir(root_path)
+    return root_path
+
+
+def remove_folder(path):
+    assert isdir(path)
+    rmtree(path)
+
+
+def new_tiered(path_tmp, **kwargs):
+    makedirs(path_tmp / "slow")
+    slow = StorageDisk(root_path=path_tmp / "slow")
+    return StorageTiered(StorageMemory(), slow, **kwargs), slow
+
+
+def test_storage_tiered_init():
+    path_tmp = generate_folder_path()
+    s, slow = new_tiered(path_tmp)
+    assert s.initialized()
+    assert s.get_type() == "TIERED"
+    assert s.pwd() == "/"
+    assert s.ls() == []
+    with raises(ValueError):
+        StorageTiered(StorageMemory(), slow, str_policy="other")
+    with raises(ValueError):
+        StorageTiered(StorageMemory(), slow, int_capacity=0)
+    with raises(TypeError):
+        pickle.dumps(s)
+    remove_folder(path_tmp)
+
+
+def test_storage_tiered_write_through():
+    path_tmp = generate_folder_path()
+    s, slow = new_tiered(path_tmp)
+    s.mkdir("level1/level2")
+    assert slow.exists("level1/level2")
+    s.cd("level1")
+    s.upload_from_memory({"a": 1}, "v")
+    assert slow.download_to_memory("/level1/v") == {"a": 1}
+    with raises(ValueError):
+        s.upload_from_memory(1, "v")
+    with raises(ValueError):
+        s.upload_from_memory(1, "/no_folder/v")
+    assert s.download_to_memory("v") == {"a": 1}
+    assert s.usage()["hits"] == 1
+    with open(path_tmp / "f", "wb") as f:
+        f.write(b"abc")
+    s.upload(path_tmp / "f", "level2/f")
+    s.download("level2/f", path_tmp / "g")
+    with open(path_tmp / "g", "rb") as f:
+        assert f.read() == b"abc"
+    assert slow.size("/level1/level2/f") == 3
+    assert s.usage()["hot_files"] == 2
+    remove_folder(path_tmp)
+
+
+def test_storage_tiered_promote_demote():
+    path_tmp = generate_folder_path()
+    makedirs(path_tmp / "slow")
+    slow = StorageDisk(root_path=path_tmp / "slow")
+    for name in ["a", "b", "c"]:
+        slow.upload_from_memory(name.encode() * 4, name, bool_bin=True)
+    slow.upload_from_memory(b"d" * 8, "d", bool_bin=True)
+    fast = StorageMemory()
+    s = StorageTiered(fast, slow, int_capacity=10)
+    assert s.download_to_memory("a", bool_bin=True) == b"aaaa"
+    assert s.download_to_memory("b", bool_bin=True) == b"bbbb"
+    assert s.usage()["promotions"] == 2
+    assert s.download_to_memory("a", bool_bin=True) == b"aaaa"
+    # c in, b (least recently used) out.
+    assert s.download_to_memory("c", bool_bin=True) == b"cccc"
+    assert sorted(fast.ls()) == ["a", "c"]
+    usage = s.usage()
+    assert (usage["hits"], usage["misses"], usage["demotions"]) == (1, 3, 1)
+    assert usage["hot_bytes"] == 8
+    assert s.download_to_memory("b", mmap_mode="bytes") == b"bbbb"
+
+    # By size: the largest out first.
+    s = StorageTiered(StorageMemory(), slow, int_capacity=12,
+        str_demotion="size")
+    s.download_to_memory("d", bool_bin=True)
+    s.download_to_memory("a", bool_bin=True)
+    s.download_to_memory("b", bool_bin=True)
+    assert s.usage()["hot_bytes"] == 8
+    assert s.download_to_memory("d", bool_bin=True) == b"d" * 8
+    assert s.usage()["hot_files"] == 2
+    assert s.usage()["hot_bytes"] == 8
+
+    # Too large for the fast tier, served by the slow one.
+    s = StorageTiered(StorageMemory(), slow, int_capacity=6)
+    assert s.download_to_memory("d", bool_bin=True) == b"d" * 8
+    assert s.usage()["hot_files"] == 0
+    f = BytesIO()
+    np_save(f, arange(6))
+    s.upload_from_memory(f.getvalue(), "n.npy", bool_bin=True)
+    assert (s.download_to_memory("n.npy", mmap_mode="numpy") == \
+        arange(6)).all()
+    s = StorageTiered(StorageMemory(), slow, bool_promote=False)
+    s.download_to_memory("a", bool_bin=True)
+    assert s.usage()["hot_files"] == 0
+    remove_folder(path_tmp)
+
+
+def test_storage_tiered_write_back():
+    path_tmp = generate_folder_path()
+    s, slow = new_tiered(path_tmp, str_policy="write_back",
+        int_flush_workers=2)
+    s.mkdir("folder/sub")
+    for i in range(20):
+        s.upload_from_memory(bytes([i]) * 10, "folder/sub/v" + str(i),
+            bool_bin=True)
+    with raises(ValueError):
+        s.upload_from_memory(b"", "folder/sub/v0", bool_bin=True)
+    with raises(ValueError):
+        s.upload_from_memory(b"", "no_folder/v0", bool_bin=True)
+    s.flush()
+    assert len(s.ls("folder/sub")) == 20
+    assert s.usage()["dirty"] == 0
+    assert s.usage()["flushes"] == 20
+    assert slow.size("folder") == 200
+    assert slow.download_to_memory("/folder/sub/v3", bool_bin=True) == \
+        bytes([3]) * 10
+    s.close()
+    remove_folder(path_tmp)
+
+
+def test_storage_tiered_directory_ops():
+    path_tmp = generate_folder_path()
+    s, slow = new_tiered(path_tmp, str_policy="write_back",
+        int_flush_workers=0)
+    s.mkdir("folder1")
+    s.mkdir("folder2")
+    s.upload_from_memory(b"ciao", "folder1/file0", bool_bin=True)
+    s.upload_from_memory(b"x", "folder1/file1", bool_bin=True)
+    # Visible before the flush.
+    assert not slow.exists("folder1/file0")
+    assert s.ls("folder1") == ["file0", "file1"]
+    assert s.size("folder1") == 5
+    assert sorted(s.walk()) == ["/folder1/file0", "/folder1/file1"]
+    assert list(s.glob("*/*0")) == ["/folder1/file0"]
+    assert [x[:2] for x in s.ls_iter("folder1", bool_details=True)] == \
+        [("file0", 4), ("file1", 1)]
+    # The moves flush the source first.
+    s.rename("folder1/file0", "folder1/file2")
+    assert slow.exists("folder1/file2")
+    assert s.download_to_memory("folder1/file2", bool_bin=True) == b"ciao"
+    s.mv("folder1", "folder2/folder1")
+    assert sorted(slow.walk()) == \
+        ["/folder2/folder1/file1", "/folder2/folder1/file2"]
+    assert s.usage()["hot_files"] == 2
+    assert s.download_to_memory("folder2/folder1/file1", bool_bin=True) \
+        == b"x"
+    s.cp("folder2/folder1/file1", "folder2/file3")
+    assert slow.exists("folder2/file3")
+    s.append("folder2/folder1/file1", "yz")
+    assert s.download_to_memory("folder2/folder1/file1", bool_bin=True) \
+        == b"xyz"
+    # rm drops the files not yet flushed too.
+    s.upload_from_memory(b"abc", "folder2/file4", bool_bin=True)
+    s.rm("folder2")
+    assert s.ls() == []
+    assert s.usage()["dirty"] == 0
+    assert s.usage()["hot_files"] == 0
+    with raises(ValueError):
+        s.rm("folder2")
+    with raises(ValueError):
+        s.rm("/")
+    remove_folder(path_tmp)
+
+
+def test_storage_tiered_recovery():
+    path_tmp = generate_folder_path()
+    makedirs(path_tmp / "fast")
+    makedirs(path_tmp / "slow")
+    fast = StorageDisk(root_path=path_tmp / "fast")
+    slow = StorageDisk(root_path=path_tmp / "slow")
+    s = StorageTiered(fast, slow, str_policy="write_back",
+        int_flush_workers=0, path_journal=path_tmp / "journal")
+    s.mkdir("folder")
+    s.upload_from_memory(b"abc", "folder/a", bool_bin=True)
+    s.upload_from_memory(b"def", "folder/b", bool_bin=True)
+    # A crash after a partial flush of a: the next instance uploads both.
+    slow.upload_from_memory(b"ab", "folder/a", bool_bin=True)
+    del s
+    s = StorageTiered(fast, slow, str_policy="write_back",
+        int_flush_workers=1, path_journal=path_tmp / "journal")
+    s.flush()
+    assert slow.download_to_memory("folder/a", bool_bin=True) == b"abc"
+    assert slow.download_to_memory("folder/b", bool_bin=True) == b"def"
+    assert s.usage()["dirty"] == 0
+    s.close()
+    journal = FlushJournal(path_tmp / "journal" / "tiered-journal.db")
+    assert journal.paths() == []
+    journal.close()
+    remove_folder(path_tmp)
+
+
+def test_storage_tiered_flush_failure():
+    path_tmp = generate_folder_path()
+    s, slow = new_tiered(path_tmp, str_policy="write_back",
+        int_flush_workers=0)
+    s.mkdir("folder")
+    s.upload_from_memory(b"abc", "folder/a", bool_bin=True)
+    # The folder is gone from the slow tier: the flush fails, the file
+    # stays dirty and readable.
+    slow.rm("folder")
+    with raises(ValueError):
+        s.flush()
+    assert s.usage()["dirty"] == 1
+    assert s.download_to_memory("folder/a", bool_bin=True) == b"abc"
+    slow.mkdir("folder")
+    s.flush()
+    assert slow.download_to_memory("folder/a", bool_bin=True) == b"abc"
+    s.close()
+    remove_folder(path_tmp)
+
+
+def test_storage_tiered_flush_retries():
+    path_tmp = generate_folder_path()
+    s, slow = new_tiered(path_tmp, str_policy="write_back",
+        int_flush_workers=1, float_retry_delay=0.01, int_flush_retries=3)
+    s.mkdir("folder")
+    slow.rm("folder")
+    s.upload_from_memory(b"abc", "folder/a", bool_bin=True)
+    # The flush threads give up the file after 3 failures.
+    for _ in range(500):
+        if s.usage()["failed"] == 1:
+            break
+        sleep(0.01)
+    assert s.usage()["failed"] == 1
+    assert s.usage()["dirty"] == 1
+    assert s.exists("folder/a")
+    slow.mkdir("folder")
+    sleep(0.1)
+    assert s.usage()["failed"] == 1
+    # flush tries it again.
+    s.flush()
+    assert s.usage()["dirty"] == 0
+    assert slow.download_to_memory("folder/a", bool_bin=True) == b"abc"
+    s.close()
+    remove_folder(path_tmp)
+
+
+def test_storage_tiered_rm_failure():
+    path_tmp = generate_folder_path()
+    s, slow = new_tiered(path_tmp, str_policy="write_back",
+        int_flush_workers=0)
+    s.mkdir("folder")
+    s.upload_from_memory(b"abc", "folder/a", bool_bin=True)
+    fn_rm = slow.rm
+
+    def fn_fail(path):
+        raise ValueError("rm failed!")
+
+    # The slow tier fails: the file not yet flushed is kept.
+    slow.rm = fn_fail
+    with raises(ValueError):
+        s.rm("folder")
+    assert s.usage()["dirty"] == 1
+    slow.rm = fn_rm
+    s.flush()
+    assert slow.download_to_memory("folder/a", bool_bin=True) == b"abc"
+    s.rm("folder")
+    assert s.usage()["dirty"] == 0
+    assert not s.exists("folder")
+    s.close()
+    remove_folder(path_tmp)
+
+
+def test_storage_tiered_close_failure():
+    path_tmp = generate_folder_path()
+    int_threads = active_count()
+    s, slow = new_tiered(path_tmp, str_policy="write_back",
+        int_flush_workers=2, float_retry_delay=0.01)
+    assert active_count() == int_threads + 2
+    s.mkdir("folder")
+    slow.rm("folder")
+    s.upload_from_memory(b"abc", "folder/a", bool_bin=True)
+    # The flush fails, the flush threads stop anyway.
+    with raises(ValueError):
+        s.close()
+    assert active_count() == int_threads
+    remove_folder(path_tmp)
+
+
+def test_storage_tiered_threads():
+    path_tmp = generate_folder_path()
+    s, slow = new_tiered(path_tmp, str_policy="write_back",
+        int_capacity=16*1024, int_flush_workers=4)
+    for i in range(8):
+        s.mkdir("level" + str(i))
+
+    def job(i):
+        with s.cwd("level" + str(i)):
+            for j in range(20):
+                s.upload_from_memory(bytes(1024), "v" + str(j), bool_bin=True)
+            for j in range(20):
+                assert len(s.download_to_memory("v" + str(j),
+                    bool_bin=True)) == 1024
+        return i
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(job, range(8)))
+    s.close()
+    assert [len(s.ls("level" + str(i))) for i in range(8)] == [20] * 8
+    usage = s.usage()
+    assert usage["dirty"] == 0
+    assert usage["hot_bytes"] <= 16*1024
+    assert slow.size("/") == 8 * 20 * 1024
+    remove_folder(path_tmp)
@@ -0,0 +1,47 @@
+from sdaab.utils.autotune import TransferTuner, int_mib
+
+
+def test_utils_autotune_concurrency():
+
+    tuner = TransferTuner(int_concurrency=2, int_max_concurrency=4)
+    assert tuner.concurrency() == 2
+    tuner.record(int_mib, 1.0)
+    tuner.record(int_mib, 1.0)
+    assert tuner.concurrency() == 3
+    for _ in range(3):
+        tuner.record(int_mib, 0.5)
+    assert tuner.concurrency() == 4
+    for _ in range(8):
+        tuner.record(int_mib, 0.5)
+    assert tuner.concurrency() == 4
+    tuner.record_throttle()
+    assert tuner.concurrency() == 2
+    tuner.record_throttle()
+    tuner.record_throttle()
+    assert tuner.concurrency() == 1
+
+
+def test_utils_autotune_part_size():
+
+    tuner = TransferTuner(int_part_size=8*int_mib, float_part_seconds=2.0)
+    assert tuner.part_size(100) == 8*int_mib
+    tuner.record(10*int_mib, 1.0)
+    assert tuner.part_size(100) == 20*int_mib
+    tuner.record(1, 1.0)
+    tuner.set_state({"concurrency": 1, "rate": 1.0})
+    assert tuner.part_size(100) == 5*int_mib
+    assert tuner.part_size(100000*int_mib) == 10*int_mib
+    tuner.set_state({"concurrency": 1, "rate": 1e12})
+    assert tuner.part_size(100) == 256*int_mib
+
+
+def test_utils_autotune_state():
+
+    tuner = TransferTuner()
+    tuner.record(int_mib, 1.0)
+    state = tuner.get_state()
+    tuner_copy = TransferTuner()
+    tuner_copy.set_state(state)
+    assert tuner_copy.get_state() == state
+    tuner_copy.set_state({"concurrency": 1000, "rate": None})
+    assert tuner_copy.concurrency() == tuner_copy.max_concurrency()
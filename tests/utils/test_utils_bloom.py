@@ -0,0 +1,88 @@
+from time import sleep
+from pytest import raises
+from sdaab.utils.bloom import BloomFilter, ScalableBloomFilter, \
+    NegativeCache, key_and_parents
+
+
+def test_utils_bloom_filter():
+
+    with raises(AssertionError):
+        BloomFilter(0)
+    f = BloomFilter(1000, 0.01)
+    for i in range(1000):
+        f.add("k" + str(i))
+    # No false negatives, about 1% of false positives.
+    assert all([("k" + str(i)) in f for i in range(1000)])
+    false_positives = sum([("x" + str(i)) in f for i in range(10000)])
+    assert false_positives < 300
+
+
+def test_utils_bloom_scalable_filter():
+
+    f = ScalableBloomFilter(100, 0.01)
+    for i in range(10000):
+        f.add("k" + str(i))
+    # The chain grows with the strings, the rate stays about the same.
+    assert f.int_filters > 1
+    assert f.int_items == 10000
+    assert all([("k" + str(i)) in f for i in range(10000)])
+    false_positives = sum([("x" + str(i)) in f for i in range(10000)])
+    assert false_positives < 300
+
+
+def test_utils_bloom_key_and_parents():
+
+    assert key_and_parents("a/b/c") == ["a/b/c", "a/b", "a"]
+    assert key_and_parents("a/b/") == ["a/b", "a"]
+    assert key_and_parents("") == []
+
+
+def test_utils_bloom_negative_cache():
+
+    store = set(["r/a/x", "r/a/y", "r/b/", "r/c/d/e"])
+    listed = []
+
+    def fn_keys(prefix):
+        listed.append(prefix)
+        for x in sorted(store):
+            if x.startswith(prefix):
+                yield x
+
+    cache = NegativeCache(fn_keys)
+    assert not cache.is_absent("r/z")
+    cache.build("r/")
+    # The keys are listed once.
+    assert listed == ["r/"]
+    for key in ["r/a", "r/a/x", "r/b", "r/c", "r/c/d", "r/c/d/e"]:
+        assert not cache.is_absent(key)
+    assert cache.is_absent("r/z")
+    assert cache.is_absent("r/a/z")
+    # Outside the prefix the backend is asked.
+    assert not cache.is_absent("s/z")
+    assert not cache.is_absent("r")
+    cache.add("r/n/m")
+    assert not cache.is_absent("r/n")
+    cache.add("r/f", bool_below=True)
+    assert not cache.is_absent("r/f/g")
+    stats = cache.stats()
+    assert stats["prefix"] == "r/"
+    assert stats["absent"] == 2
+    assert stats["builds"] == 1
+
+    # Written by others: seen after the rebuild.
+    cache.build("r/", float_ttl=0.0)
+    assert listed == ["r/", "r/"]
+    store.add("r/o")
+    assert cache.is_absent("r/o")
+    sleep(0.1)
+    assert not cache.is_absent("r/o")
+    assert cache.stats()["builds"] >= 3
+
+    # A failed build leaves no filter.
+    def fn_fail(prefix):
+        raise ValueError("listing failed!")
+
+    cache = NegativeCache(fn_fail)
+    with raises(ValueError):
+        cache.build("r/")
+    assert cache.stats()["prefix"] is None
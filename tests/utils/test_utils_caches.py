@@ -0,0 +1,103 @@
+from threading import Event
+from pytest import raises
+from sdaab.utils.caches import RemoteCaches
+
+
+def test_utils_caches_write_behind():
+
+    written = {}
+    gate = Event()
+
+    def fn_put(key, content):
+        gate.wait()
+        if key == "bad":
+            raise ValueError("upload failed!")
+        written[key] = content
+
+    # Without write-behind the caller uploads.
+    caches = RemoteCaches(fn_put, None, None, None)
+    assert caches.submit("a/x", b"x") is None
+    assert caches.queued("a/x") is None
+    caches.settle("a/")
+    caches.flush()
+    caches.close()
+
+    caches = RemoteCaches(fn_put, None, None, None, int_write_behind=100)
+    future = caches.submit("a/x", b"x")
+    caches.submit("bad", b"")
+    assert caches.queued("a/x") == b"x"
+    gate.set()
+    caches.settle("a/")
+    assert future.done()
+    assert written == {"a/x": b"x"}
+    with raises(AssertionError):
+        caches.flush()
+    caches.flush()
+    caches.close()
+
+
+def test_utils_caches_prefetch():
+
+    store = {"a/x": b"x", "a/y": b"y", "b/z": b"z"}
+    fn_get = lambda key: store[key]
+
+    caches = RemoteCaches(None, fn_get, None, None)
+    assert caches.take("a/x") is None
+
+    caches = RemoteCaches(None, fn_get, None, None, int_prefetch_depth=4)
+    caches.prefetcher.prefetch(["a/x", "a/y", "b/z"])
+    assert caches.take("a/x") == b"x"
+    # The writes of the instance drop the reads done ahead.
+    caches.put("a/y", 1)
+    caches.copy("b", "a", bool_remove=True)
+    assert caches.take("a/y") is None
+    assert caches.take("b/z") is None
+    assert caches.prefetcher.stats()["hits"] == 1
+    caches.close()
+
+
+def test_utils_caches_negative():
+
+    store = ["r/a/x", "r/b/y"]
+    fn_scan = lambda prefix: [x for x in store if x.startswith(prefix)]
+
+    caches = RemoteCaches(None, None, None, fn_scan)
+    caches.negative.build("r/")
+    assert caches.negative.is_absent("r/c")
+    # The writes of the instance are added, the keys below a copy of
+    # unknown content are checked.
+    caches.put("r/c", 1)
+    caches.copy("r/a", "r/d", keys=["r/d/x"])
+    caches.copy("r/b", "r/e", bool_remove=True)
+    for key in ["r/c", "r/d/x", "r/e/y", "r/e/z"]:
+        assert not caches.negative.is_absent(key)
+    assert caches.negative.is_absent("r/d/z")
+    caches.close()
+
+
+def test_utils_caches_inventory(tmp_path):
+
+    store = {"r/a": 1, "r/b/c": 2}
+
+    def fn_scan(prefix, bool_details=False):
+        for key in sorted(store):
+            if key.startswith(prefix):
+                yield (key, store[key], 100, None) if bool_details else key
+
+    caches = RemoteCaches(None, None, None, fn_scan)
+    assert caches.inventory is None
+    assert not caches.indexed("r/a")
+
+    caches = RemoteCaches(None, None, None, fn_scan,
+        path_inventory=tmp_path / "inventory.db")
+    caches.inventory.refresh("r/")
+    assert caches.indexed("r/a")
+    # The writes of the instance are recorded.
+    caches.put("r/d", 4)
+    caches.copy("r/b", "r/e", bool_remove=True)
+    caches.remove("r/a")
+    assert caches.inventory.get("r/d")[0] == 4
+    assert caches.inventory.get("r/e/c")[0] == 2
+    assert caches.inventory.get("r/b/c") is None
+    assert caches.inventory.get("r/a") is None
+    caches.close()
@@ -0,0 +1,27 @@
+from os import listdir
+from sdaab.utils.checkpoint import Checkpoint, checkpoint_id
+
+
+def test_utils_checkpoint_id():
+
+    assert checkpoint_id("upload", "a", 1) == checkpoint_id("upload", "a", 1)
+    assert checkpoint_id("upload", "a", 1) != checkpoint_id("upload", "a", 2)
+
+
+def test_utils_checkpoint(tmp_path):
+
+    c = Checkpoint(tmp_path / "checkpoints", "abc", float_interval=3600)
+    assert c.state == {}
+    c.state = {"upload_id": "x", "etags": {"1": "e1"}}
+    c.save()
+    assert Checkpoint(tmp_path / "checkpoints", "abc").state == c.state
+    c.state["etags"]["2"] = "e2"
+    c.save()
+    assert Checkpoint(tmp_path / "checkpoints", "abc").state["etags"] \
+        == {"1": "e1"}
+    c.save(bool_force=True)
+    assert Checkpoint(tmp_path / "checkpoints", "abc").state == c.state
+    assert listdir(tmp_path / "checkpoints") == ["abc.json"]
+    c.remove()
+    assert listdir(tmp_path / "checkpoints") == []
+    assert Checkpoint(tmp_path / "checkpoints", "abc").state == {}
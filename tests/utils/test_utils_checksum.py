@@ -0,0 +1,49 @@
+from io import BytesIO
+from hashlib import md5
+from sdaab.utils.checksum import md5_pair, etag_strip, composite_etag
+from sdaab.utils.checksum import etag_is_md5
+from sdaab.utils.checksum import ETagHasher, HashingWriter
+
+
+def test_utils_checksum_md5():
+
+    assert md5_pair(b"") == \
+        ("d41d8cd98f00b204e9800998ecf8427e", "1B2M2Y8AsgTpgAmY7PhCfg==")
+    assert etag_strip('"abc-2"') == "abc-2"
+    parts = [md5(b"a" * 4).hexdigest(), md5(b"b").hexdigest()]
+    assert composite_etag(parts) == \
+        md5(bytes.fromhex(parts[0]) + bytes.fromhex(parts[1])).hexdigest() \
+        + "-2"
+    assert etag_is_md5([("ETag", '"abc"'), 
+        ("x-amz-server-side-encryption", "AES256")])
+    assert not etag_is_md5([("X-Amz-Server-Side-Encryption", "aws:kms")])
+    assert not etag_is_md5(
+        [("x-amz-server-side-encryption-customer-algorithm", "AES256")])
+
+
+def test_utils_checksum_hasher():
+
+    h = ETagHasher()
+    h.update(b"ab")
+    h.update(b"c")
+    assert h.hexdigest() == md5(b"abc").hexdigest()
+    h = ETagHasher(4)
+    for chunk in (b"aa", b"aabb", b"b"):
+        h.update(chunk)
+    assert h.hexdigest() == composite_etag(
+        [md5(b"aaaa").hexdigest(), md5(b"bbb").hexdigest()])
+    h = ETagHasher(4)
+    h.update(b"aaaa")
+    assert h.hexdigest() == composite_etag([md5(b"aaaa").hexdigest()])
+
+
+def test_utils_checksum_writer():
+
+    h = ETagHasher()
+    with BytesIO() as b:
+        w = HashingWriter(b, [h])
+        w.write(b"abc")
+        w.write(b"def")
+        assert w.tell() == 6
+        assert b.getvalue() == b"abcdef"
+    assert h.hexdigest() == md5(b"abcdef").hexdigest()
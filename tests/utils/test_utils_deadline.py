@@ -0,0 +1,44 @@
+from time import sleep
+from pytest import raises
+from sdaab.utils.deadline import deadline, remaining, check, request_timeout
+from sdaab.utils.deadline import DeadlineExceeded
+from sdaab.utils.retry import RetryPolicy, RetryableError
+
+
+def test_utils_deadline():
+
+    assert remaining() is None
+    assert request_timeout(10) == 10
+    assert request_timeout(None) is None
+    with deadline(5):
+        assert 4 < remaining() <= 5
+        assert request_timeout(1) == 1
+        assert request_timeout(10) <= 5
+        with deadline(10):
+            assert remaining() <= 5
+        with deadline(1):
+            assert remaining() <= 1
+        with deadline(None):
+            assert remaining() > 1
+    assert remaining() is None
+    with deadline(0.01):
+        sleep(0.02)
+        with raises(DeadlineExceeded):
+            check()
+        with raises(DeadlineExceeded):
+            request_timeout(10)
+
+
+def test_utils_deadline_retry():
+
+    policy = RetryPolicy(int_max_attempts=100, float_base_delay=0.05)
+    calls = []
+
+    def broken():
+        calls.append(1)
+        raise RetryableError("503", 503)
+
+    with deadline(0.2):
+        with raises(DeadlineExceeded):
+            policy.call(broken)
+    assert 1 < len(calls) < 100
@@ -0,0 +1,27 @@
+from sdaab.utils.glob_pattern import glob_to_regex, glob_literal_prefix
+
+
+def test_utils_glob_to_regex():
+
+    assert glob_to_regex("/a/*.txt").match("/a/b.txt")
+    assert not glob_to_regex("/a/*.txt").match("/a/b/c.txt")
+    assert glob_to_regex("/a/**/*.txt").match("/a/b.txt")
+    assert glob_to_regex("/a/**/*.txt").match("/a/b/c/d.txt")
+    assert glob_to_regex("/a/**").match("/a/b/c")
+    assert glob_to_regex("/a/?.txt").match("/a/b.txt")
+    assert not glob_to_regex("/a/?.txt").match("/a/bb.txt")
+    assert glob_to_regex("/a/[bc].txt").match("/a/c.txt")
+    assert not glob_to_regex("/a/[!bc].txt").match("/a/c.txt")
+    assert glob_to_regex("/a/f[!x]g").match("/a/fyg")
+    assert not glob_to_regex("/a/f[!x]g").match("/a/f/g")
+    assert not glob_to_regex("/a/f[.-0]g").match("/a/f/g")
+    assert glob_to_regex("/a/[b.txt").match("/a/[b.txt")
+    assert not glob_to_regex("/a.txt").match("/a.txt.bak")
+
+
+def test_utils_glob_literal_prefix():
+
+    assert glob_literal_prefix("/a/b*.txt") == "/a/b"
+    assert glob_literal_prefix("/a/**") == "/a/"
+    assert glob_literal_prefix("/a/b.txt") == "/a/b.txt"
+    assert glob_literal_prefix("*") == ""
@@ -0,0 +1,88 @@
+from time import sleep
+from sdaab.utils.inventory import Inventory, staleness, successor
+
+
+def test_utils_inventory_successor():
+
+    assert successor("a/") == "a0"
+    assert successor("") is None
+    assert "a/z" < successor("a/") < "a0/b"
+
+
+def test_utils_inventory(tmp_path):
+
+    store = {"r/": 0, "r/a": 1, "r/b/": 0, "r/b/c": 2, "r/b/d/e": 3, "s/x": 4}
+    scans = []
+
+    def fn_scan(prefix):
+        scans.append(prefix)
+        return [(x, store[x], 100, "etag") for x in sorted(store) \
+            if x.startswith(prefix)]
+
+    inventory = Inventory(tmp_path / "db" / "inventory.db", fn_scan,
+        float_max_age=60.0)
+    assert not inventory.fresh("r/a")
+    inventory.refresh("r/")
+    assert inventory.fresh("r/a")
+    assert not inventory.fresh("s/x")
+    assert inventory.get("r/a") == (1, 100, "etag")
+    assert inventory.get("s/x") is None
+    assert list(inventory.children("r/")) == \
+        [("a", 1, 100), ("b", None, None)]
+    assert list(inventory.children("r/b/")) == \
+        [("c", 2, 100), ("d", None, None)]
+    assert list(inventory.keys("r/b/", int_page_size=2)) == \
+        ["r/b/", "r/b/c", "r/b/d/e"]
+    assert inventory.total_size("r/b/") == 5
+    assert inventory.any_below("r/b/d/")
+    assert not inventory.any_below("r/c/")
+
+    # The writes of the instance.
+    inventory.put("r/f", 7)
+    inventory.copy("r/b", "r/g")
+    assert inventory.get("r/g/d/e")[0] == 3
+    inventory.move("r/g", "r/h")
+    assert not inventory.any_below("r/g/")
+    assert inventory.get("r/h/c")[0] == 2
+    inventory.remove("r/h")
+    assert not inventory.any_below("r/h")
+    assert inventory.get("r/f")[0] == 7
+
+    # The refresh drops the keys not seen, the staleness bound is set by
+    # the caller.
+    del store["r/a"]
+    inventory.refresh("r/")
+    assert inventory.get("r/a") is None
+    assert inventory.get("r/f") is None
+    sleep(0.1)
+    with staleness(0.05):
+        assert not inventory.fresh("r/a")
+    with staleness(0):
+        assert not inventory.fresh("r/a")
+    assert inventory.fresh("r/a")
+    stats = inventory.stats()
+    assert stats["keys"] == 4
+    assert list(stats["scans"]) == ["r/"]
+    inventory.close()
+
+    # The index outlives the instance.
+    inventory = Inventory(tmp_path / "db" / "inventory.db", fn_scan)
+    assert inventory.fresh("r/b/c")
+    assert inventory.get("r/b/c")[0] == 2
+    assert scans == ["r/", "r/"]
+    inventory.close()
+
+
+def test_utils_inventory_children(tmp_path):
+
+    # A file and a folder with the same name, apart in key order.
+    store = ["r/a", "r/a-b", "r/a/x", "r/a/y", "r/a0/z", "r/b", "r/c/d/e"]
+    fn_scan = lambda prefix: [(x, 1, 100, None) for x in store \
+        if x.startswith(prefix)]
+    inventory = Inventory(tmp_path / "inventory.db", fn_scan)
+    inventory.refresh("r/")
+    expected = [("a", 1, 100), ("a-b", 1, 100), ("a0", None, None),
+        ("b", 1, 100), ("c", None, None)]
+    for int_page_size in (1, 2, 1000):
+        assert list(inventory.children("r/", int_page_size)) == expected
+    inventory.close()
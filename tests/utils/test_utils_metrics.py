@@ -0,0 +1,130 @@
+from pytest import raises
+from sdaab.utils.metrics import Histogram, Metrics, measured
+from sdaab.utils.metrics import count_requests, request_budget
+
+
+def test_utils_metrics_histogram():
+
+    h = Histogram()
+    assert h.percentile(50) is None
+    for x in [0.001] * 98 + [1.0, 2.0]:
+        h.add(x)
+    assert h.count == 100
+    assert 0.001 <= h.percentile(50) < 0.002
+    assert 1.0 <= h.percentile(99) <= 2.0
+    assert h.percentile(100) == 2.0
+    assert h.snapshot()["max"] == 2.0
+    h.add(1e6)
+    assert h.percentile(100) == 1e6
+
+
+def test_utils_metrics():
+
+    class Fake():
+
+        def __init__(self):
+            self.__metrics = Metrics()
+
+        def metrics(self):
+            return self.__metrics
+
+        @measured
+        def read(self, n):
+            self.__metrics.request("GET")
+            self.__metrics.add_bytes(int_read=n)
+            return n
+
+        @measured
+        def twice(self):
+            self.__metrics.request("HEAD")
+            return self.read(1) + self.read(2)
+
+        @measured
+        def fail(self):
+            raise ValueError("fail failed!")
+
+    s = Fake()
+    assert s.twice() == 3
+    with raises(ValueError):
+        s.fail()
+    s.metrics().request("LIST")
+    snapshot = s.metrics().snapshot()
+    assert snapshot["requests"] == {"HEAD": 1, "GET": 2, "LIST": 1}
+    assert snapshot["bytes_read"] == 3
+    assert snapshot["errors"] == 1
+    assert snapshot["methods"]["twice"]["requests"] == {"HEAD": 1, "GET": 2}
+    assert snapshot["methods"]["twice"]["bytes_read"] == 3
+    assert snapshot["methods"]["read"]["calls"] == 2
+    assert snapshot["methods"]["read"]["requests"] == {}
+    assert snapshot["methods"]["fail"]["errors"] == 1
+    assert snapshot["methods"]["twice"]["latency"]["count"] == 1
+
+    exported = []
+    s.metrics().add_exporter(exported.append)
+    s.metrics().add_exporter(lambda x: 1 / 0)
+    assert s.metrics().export(bool_reset=True) == snapshot
+    assert exported == [snapshot]
+    assert s.metrics().snapshot()["requests"] == {}
+    assert Fake().metrics().snapshot()["methods"] == {}
+
+
+def test_utils_metrics_generator():
+
+    class Fake():
+
+        def __init__(self):
+            self.__metrics = Metrics()
+
+        def metrics(self):
+            return self.__metrics
+
+        @measured
+        def read(self, n):
+            self.__metrics.request("GET")
+            return n
+
+        def __pages(self, n):
+            for i in range(n):
+                self.__metrics.request("LIST")
+                yield i
+
+        @measured
+        def walk(self, n):
+            return self.__pages(n)
+
+    # Measured while iterated, also by another method.
+    s = Fake()
+    with count_requests() as counter:
+        walk = s.walk(3)
+    assert s.metrics().snapshot()["methods"] == {}
+    assert s.read(next(walk)) == 0
+    assert list(walk) == [1, 2]
+    walk = s.walk(3)
+    next(walk)
+    walk.close()
+    snapshot = s.metrics().snapshot()["methods"]
+    assert counter.total() == 0
+    assert snapshot["walk"]["requests"] == {"LIST": 4}
+    assert snapshot["walk"]["calls"] == 2
+    assert snapshot["walk"]["errors"] == 0
+    assert snapshot["read"]["requests"] == {"GET": 1}
+
+
+def test_utils_metrics_request_budget():
+
+    m = Metrics()
+    with count_requests() as outer:
+        m.request("HEAD")
+        with request_budget(2, {"PUT": 1}) as inner:
+            m.request("PUT")
+            m.request("HEAD")
+        with raises(AssertionError):
+            with request_budget(dict_max={"PUT": 0}):
+                m.request("PUT")
+        with raises(AssertionError):
+            with request_budget(0):
+                m.request("GET")
+    m.request("HEAD")
+    assert inner.counts() == {"PUT": 1, "HEAD": 1}
+    assert outer.counts() == {"HEAD": 2, "PUT": 2, "GET": 1}
+    assert outer.total() == 5
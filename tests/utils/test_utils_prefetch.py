@@ -0,0 +1,110 @@
+from os import listdir
+from time import sleep
+from threading import Lock, Event
+from pytest import raises
+from sdaab.utils.prefetch import Prefetcher, parent_key
+
+
+def new_store():
+    store = dict([("f/" + str(i).zfill(2), bytes([i]) * 10) \
+        for i in range(20)])
+    reads = []
+    lock = Lock()
+
+    def fn_read(key):
+        with lock:
+            reads.append(key)
+        return store[key]
+
+    def fn_list(folder):
+        return [x for x in store if parent_key(x) == folder]
+
+    return store, reads, fn_read, fn_list
+
+
+def test_utils_prefetch_parent_key():
+
+    assert parent_key("a/b/c") == "a/b/"
+    assert parent_key("c") == ""
+
+
+def test_utils_prefetch_explicit(tmp_path):
+
+    store, reads, fn_read, fn_list = new_store()
+    p = Prefetcher(fn_read, int_depth=4, int_max_bytes=1000,
+        path_buffer=tmp_path / "buffer")
+    keys = sorted(store)
+    p.prefetch(keys[:6])
+    sleep(0.1)
+    # At most int_depth reads ahead.
+    assert sorted(reads) == keys[:4]
+    assert len(listdir(tmp_path / "buffer")) == 4
+    for key in keys[:6]:
+        assert p.take(key) == store[key]
+    assert p.take("f/unknown") is None
+    stats = p.stats()
+    assert (stats["hits"], stats["misses"], stats["pending"]) == (6, 1, 0)
+    assert listdir(tmp_path / "buffer") == []
+
+    # The byte limit stops the reads ahead.
+    p = Prefetcher(fn_read, int_depth=8, int_max_bytes=15, int_workers=1)
+    del reads[:]
+    p.prefetch(keys[:4])
+    sleep(0.1)
+    assert reads == keys[:2]
+    p.cancel(keys[:1])
+    assert p.take(keys[0]) is None
+    sleep(0.1)
+    assert reads == keys[:3]
+    p.invalidate("f")
+    assert p.stats()["pending"] == 0
+    p.close()
+    with raises(AssertionError):
+        p.prefetch(keys)
+
+
+def test_utils_prefetch_sequential():
+
+    store, reads, fn_read, fn_list = new_store()
+    p = Prefetcher(fn_read, fn_list=fn_list, int_depth=3)
+    keys = sorted(store)
+    assert p.take(keys[0]) is None
+    assert p.take(keys[1]) is None
+    # Sequential: the next 3 are read ahead, the window slides.
+    sleep(0.1)
+    assert sorted(reads) == keys[2:5]
+    for key in keys[2:10]:
+        assert p.take(key) == store[key]
+    assert p.stats()["hits"] == 8
+    # A jump cancels the reads ahead left behind.
+    assert p.take(keys[15]) is None
+    sleep(0.1)
+    stats = p.stats()
+    assert stats["pending"] == 0
+    assert stats["cancelled"] == 3
+    # Skipped reads ahead are cancelled too.
+    p.take(keys[16])
+    sleep(0.1)
+    assert p.take(keys[18]) == store[keys[18]]
+    stats = p.stats()
+    assert stats["pending"] == 0
+    assert stats["cancelled"] == 5
+    p.close()
+
+
+def test_utils_prefetch_errors():
+
+    gate = Event()
+
+    def fn_read(key):
+        gate.wait()
+        raise ValueError("read failed!")
+
+    p = Prefetcher(fn_read, int_depth=2)
+    p.prefetch(["a", "b", "c"])
+    gate.set()
+    # Failed and queued reads are left to the caller.
+    assert p.take("a") is None
+    assert p.take("c") is None
+    assert p.stats()["misses"] == 2
+    p.close()
@@ -0,0 +1,89 @@
+from time import sleep
+from pytest import raises
+from sdaab.utils.retry import RetryPolicy, RetryableError, Hedger
+from sdaab.utils.retry import LatencyTracker, is_retryable
+
+
+class StatusError(Exception):
+
+    def __init__(self, status):
+        self.status = status
+
+
+def test_utils_is_retryable():
+
+    assert is_retryable(RetryableError("503", 503))
+    assert is_retryable(ConnectionResetError())
+    assert is_retryable(TimeoutError())
+    assert is_retryable(StatusError(503))
+    assert is_retryable(StatusError("429"))
+    assert not is_retryable(StatusError(404))
+    assert not is_retryable(ValueError())
+    assert not is_retryable(AssertionError())
+
+
+def test_utils_retry_policy():
+
+    policy = RetryPolicy(int_max_attempts=4, float_base_delay=0.001)
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise RetryableError("503", 503)
+        return "ok"
+
+    assert policy.call(flaky) == "ok"
+    assert len(calls) == 3
+
+    calls.clear()
+    def broken():
+        calls.append(1)
+        raise RetryableError("503", 503)
+
+    with raises(RetryableError):
+        policy.call(broken)
+    assert len(calls) == 4
+
+    calls.clear()
+    def missing():
+        calls.append(1)
+        raise StatusError(404)
+
+    with raises(StatusError):
+        policy.call(missing)
+    assert len(calls) == 1
+
+    policy = RetryPolicy(float_base_delay=1.0, float_max_delay=2.0)
+    assert all([0 <= policy.delay(i) <= 2.0 for i in range(20)])
+
+
+def test_utils_latency_tracker():
+
+    tracker = LatencyTracker(int_window=10)
+    assert tracker.percentile(50) is None
+    for i in range(20):
+        tracker.add(i)
+    assert len(tracker) == 10
+    assert tracker.percentile(0) == 10
+    assert tracker.percentile(100) == 19
+
+
+def test_utils_hedger():
+
+    hedger = Hedger(float_percentile=50, int_min_samples=5)
+    assert hedger.delay("GET") is None
+    for _ in range(5):
+        assert hedger.call(lambda: 1, "GET") == 1
+    assert hedger.delay("GET") is not None
+
+    calls = []
+    def slow_first():
+        calls.append(1)
+        if len(calls) == 1:
+            sleep(1.0)
+            return "slow"
+        return "fast"
+
+    assert hedger.call(slow_first, "GET") == "fast"
+    assert len(calls) == 2
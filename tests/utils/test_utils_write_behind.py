@@ -0,0 +1,78 @@
+from time import sleep
+from threading import Event, Thread
+from pytest import raises
+from sdaab.utils.write_behind import WriteBehind, is_below, path_argument
+
+
+def test_utils_write_behind_is_below():
+
+    assert is_below("a/b", "a")
+    assert is_below("a/b", "a/")
+    assert is_below("a/b", "a/b")
+    assert is_below("a/b", "")
+    assert not is_below("ab/c", "a")
+    assert not is_below("a", "a/b")
+
+
+def test_utils_write_behind_path_argument():
+
+    class C():
+        def rm(self, path=""):
+            pass
+
+    fn = path_argument(C.rm)
+    assert fn(C(), "x") == "x"
+    assert fn(C(), path="y") == "y"
+    assert fn(C()) == ""
+    assert fn(C(), 1, 2) == ""
+
+
+def test_utils_write_behind():
+
+    written = {}
+    gate = Event()
+
+    def fn_write(key, data):
+        gate.wait()
+        if key == "bad":
+            raise ValueError("write failed!")
+        written[key] = data
+
+    q = WriteBehind(fn_write, int_max_bytes=10, int_workers=2)
+    buffer = bytearray(b"abc")
+    future = q.submit("a/x", buffer)
+    buffer[0] = ord("z")
+    assert q.get("a/x") == b"abc"
+    assert q.get("a/y") is None
+    with raises(AssertionError):
+        q.submit("a/x", b"")
+    q.submit("bad", b"")
+    assert q.keys() == ["a/x", "bad"]
+    assert q.keys("a") == ["a/x"]
+    assert q.pending_bytes() == 3
+    # Nothing queued starts with these.
+    q.wait("a/xy", bool_literal=True)
+    q.wait("c")
+
+    # Over budget: the submit waits for the running writes.
+    done = []
+    thread = Thread(target=lambda: done.append(q.submit("b", b"x" * 8)))
+    thread.start()
+    sleep(0.1)
+    assert done == []
+    gate.set()
+    thread.join()
+    assert future.result() is None
+    q.wait()
+    assert written == {"a/x": b"abc", "b": b"x" * 8}
+    assert q.keys() == []
+    assert q.pending_bytes() == 0
+    assert [x[0] for x in q.pop_errors("a")] == []
+    assert [x[0] for x in q.pop_errors()] == ["bad"]
+    assert q.pop_errors() == []
+
+    # A single write larger than the budget is accepted alone.
+    q.submit("c", b"x" * 20).result()
+    assert q.close() == []
+    with raises(AssertionError):
+        q.submit("d", b"")